@@ -0,0 +1,222 @@
+"""
+In-process request-pipeline benchmark: drive the falcon application built by `APITest.router()` through
+`falcon.testing`, with the in-memory storage backend instead of the database, and report per route:
+    - ns_per_op: mean wall time per request
+    - alloc_peak_bytes: mean tracemalloc peak per request
+    - alloc_retained_bytes: mean traced memory still allocated after each request
+    - middleware_ns_per_op: cost of the middleware stack (message routes only, compared to a bare falcon app)
+
+Usage:
+    python -m benchmarks.pipeline run [--iterations 2000] [--output bench.json]
+    python -m benchmarks.pipeline compare baseline.json bench.json [--threshold 10]
+"""
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Tuple
+
+import click
+
+# prometheus_client picks its multiprocess mode at import time
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', tempfile.mkdtemp(prefix='api-test-bench-'))
+os.environ.setdefault('API_DB_USER_PASSWORD', 'in-memory')
+os.environ.setdefault('API_DEBUG_MODE', 'false')
+
+import falcon  # noqa: E402
+from falcon import testing  # noqa: E402
+
+from api_test import APITest  # noqa: E402
+from api_test.adapters.memory import ShardedMemoryStore  # noqa: E402
+from api_test.handlers.message import MERGE_PATCH_MEDIA_TYPE  # noqa: E402
+from api_test.repositories.backends.memory import MemoryMessageBackend  # noqa: E402
+
+DEFAULT_CONFIG_FILE: str = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config.toml')
+ATTRIBUTES: dict = {f'property_{index}': 'x' * (5 + index * 5) for index in range(1, 6)}
+
+# (method, path, json body)
+Request = Tuple[str, str, dict | None]
+
+
+@dataclass
+class Scenario:
+    name: str
+    # builds the request of the n-th iteration
+    request: Callable[[int], Request]
+    # prepares the data needed by the n-th iteration
+    setup: Callable[[MemoryMessageBackend, int], None] = lambda backend, index: None
+    message_route: bool = False
+
+
+def _insert(backend: MemoryMessageBackend, key: str) -> None:
+    if backend.select(key) is None:
+        backend.create(key, ATTRIBUTES)
+
+
+def _body(key: str) -> dict:
+    return {'data': {'key': key, 'attributes': ATTRIBUTES}}
+
+
+SCENARIOS: List[Scenario] = [
+        Scenario('GET /message/{key}', lambda index: ('GET', '/message/bench_key', None),
+                 setup=lambda backend, index: _insert(backend, 'bench_key'), message_route=True),
+        Scenario('GET /message/{key} (404)', lambda index: ('GET', '/message/bench_absent', None),
+                 message_route=True),
+        Scenario('PUT /message/{key}', lambda index: ('PUT', '/message/bench_key', _body('bench_key')),
+                 setup=lambda backend, index: _insert(backend, 'bench_key'), message_route=True),
+        Scenario('POST /message', lambda index: ('POST', '/message', _body(f'bench_post_{index}')),
+                 message_route=True),
+        Scenario('DELETE /message/{key}', lambda index: ('DELETE', f'/message/bench_delete_{index}', None),
+                 setup=lambda backend, index: _insert(backend, f'bench_delete_{index}'), message_route=True),
+        Scenario('GET /_health', lambda index: ('GET', '/_health', None)),
+        Scenario('GET /_private/_readiness', lambda index: ('GET', '/_private/_readiness', None)),
+        Scenario('GET /_private/_liveness', lambda index: ('GET', '/_private/_liveness', None)),
+        Scenario('GET /_private/_metrics', lambda index: ('GET', '/_private/_metrics', None)),
+]
+
+
+def bare_router(api: APITest) -> falcon.App:
+    """
+    :return the message routes of the api (same services and options) without any middleware, to isolate the
+        middleware cost
+    """
+    router = falcon.App(middleware=[], media_type=falcon.MEDIA_JSON)
+    router.req_options.media_handlers[MERGE_PATCH_MEDIA_TYPE] = falcon.media.JSONHandler()
+    return api.add_message_routes(router)
+
+
+def time_requests(client: testing.TestClient, scenario: Scenario, backend: MemoryMessageBackend,
+                  indexes: range) -> float:
+    """ :return mean nanoseconds per request over the given iterations """
+    requests = []
+    for index in indexes:
+        scenario.setup(backend, index)
+        requests.append(scenario.request(index))
+
+    start = time.perf_counter_ns()
+    for method, path, body in requests:
+        client.simulate_request(method, path, json=body)
+    return (time.perf_counter_ns() - start) / len(requests)
+
+
+def trace_allocations(client: testing.TestClient, scenario: Scenario, backend: MemoryMessageBackend,
+                      indexes: range) -> Tuple[float, float]:
+    """ :return mean (peak, retained) traced bytes per request over the given iterations """
+    requests = []
+    for index in indexes:
+        scenario.setup(backend, index)
+        requests.append(scenario.request(index))
+
+    peaks, retained = 0, 0
+    tracemalloc.start()
+    try:
+        for method, path, body in requests:
+            before, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            client.simulate_request(method, path, json=body)
+            current, peak = tracemalloc.get_traced_memory()
+            peaks += peak - before
+            retained += current - before
+    finally:
+        tracemalloc.stop()
+    return peaks / len(requests), retained / len(requests)
+
+
+def run_scenarios(iterations: int, config_file: str, log_level: str) -> Dict[str, dict]:
+    backend = MemoryMessageBackend(ShardedMemoryStore())
+    api = APITest(log_level, config_file, storage_backend=backend)
+    client = testing.TestClient(api.router())
+    bare_client = testing.TestClient(bare_router(api))
+
+    # each pass gets its own iteration indexes, so keys created / deleted by a pass are never reused
+    counter = itertools.count(step=iterations)
+    results: Dict[str, dict] = dict()
+    for scenario in SCENARIOS:
+        start = next(counter)
+        time_requests(client, scenario, backend, range(start, start + max(iterations // 10, 1)))
+        start = next(counter)
+        ns_per_op = time_requests(client, scenario, backend, range(start, start + iterations))
+        start = next(counter)
+        alloc_peak, alloc_retained = trace_allocations(client, scenario, backend,
+                                                       range(start, start + max(iterations // 10, 1)))
+        result = {
+                'ns_per_op'           : round(ns_per_op),
+                'alloc_peak_bytes'    : round(alloc_peak),
+                'alloc_retained_bytes': round(alloc_retained),
+        }
+        if scenario.message_route:
+            start = next(counter)
+            bare_ns_per_op = time_requests(bare_client, scenario, backend, range(start, start + iterations))
+            result['middleware_ns_per_op'] = round(ns_per_op - bare_ns_per_op)
+        results[scenario.name] = result
+    return results
+
+
+@click.group()
+def pipeline():
+    """ In-process request-pipeline benchmark """
+
+
+@pipeline.command('run')
+@click.option('--iterations', default=2000, help='number of timed requests per route (default = 2000)')
+@click.option('--output', default=None, help='write the results as json in this file')
+@click.option('--config_file', default=DEFAULT_CONFIG_FILE, help='application configuration file path')
+@click.option('--log_level', default='WARNING', help='application logger level (default = WARNING)')
+def run(iterations: int, output: str, config_file: str, log_level: str):
+    """ Run the benchmark and print (or save) the results """
+    results = {
+            'meta'  : {
+                    'python'    : platform.python_version(),
+                    'falcon'    : falcon.__version__,
+                    'iterations': iterations,
+                    'timestamp' : int(time.time()),
+            },
+            'routes': run_scenarios(iterations, config_file, log_level),
+    }
+
+    click.echo(f'{"route":<32} {"ns/op":>10} {"peak B/op":>10} {"kept B/op":>10} {"mw ns/op":>10}')
+    for name, result in results['routes'].items():
+        click.echo(f'{name:<32} {result["ns_per_op"]:>10} {result["alloc_peak_bytes"]:>10} '
+                   f'{result["alloc_retained_bytes"]:>10} {result.get("middleware_ns_per_op", "-"):>10}')
+    if output:
+        with open(output, 'w') as file:
+            json.dump(results, file, indent=2)
+        click.echo(f'results written in {output}')
+
+
+@pipeline.command('compare')
+@click.argument('baseline')
+@click.argument('current')
+@click.option('--threshold', default=10.0, help='regression threshold in percent (default = 10)')
+def compare(baseline: str, current: str, threshold: float):
+    """ Compare two result files and exit in error on regression above the threshold """
+    with open(baseline) as file:
+        baseline_routes = json.load(file)['routes']
+    with open(current) as file:
+        current_routes = json.load(file)['routes']
+
+    regressions = 0
+    for name, result in current_routes.items():
+        if name not in baseline_routes:
+            click.echo(f'{name:<32} new route, no baseline')
+            continue
+        for measure in ('ns_per_op', 'alloc_peak_bytes'):
+            before, after = baseline_routes[name][measure], result[measure]
+            delta = (after - before) * 100 / before if before else 0.0
+            flag = ''
+            if delta > threshold:
+                flag = '  << REGRESSION'
+                regressions += 1
+            click.echo(f'{name:<32} {measure:<18} {before:>10} -> {after:>10} ({delta:+.1f}%){flag}')
+
+    click.echo(f'{regressions} regression(s) above {threshold}%')
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    pipeline()
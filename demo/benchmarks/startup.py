@@ -0,0 +1,76 @@
+"""
+Startup benchmark: measure the import time of the application package with `python -X importtime`
+and check it against a regression budget.
+
+Usage:
+    python -m benchmarks.startup [--runs 5] [--budget benchmarks/startup_budget.json]
+"""
+import json
+import os
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+import click
+
+DEFAULT_BUDGET_FILE: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'startup_budget.json')
+
+
+def measure_imports(module: str) -> Dict[str, Tuple[int, int]]:
+    """
+    import the module in a fresh interpreter with `-X importtime`
+    :param module: module to import
+    :return: dict of imported module name -> (self time, cumulative time) in microseconds
+    """
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                               capture_output=True, text=True, check=True)
+    imports: Dict[str, Tuple[int, int]] = dict()
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        imports[name.strip()] = (int(self_us), int(cumulative_us))
+    return imports
+
+
+def best_of(module: str, runs: int) -> Dict[str, Tuple[int, int]]:
+    """ :return the import measures of the fastest run (the first run also pays the bytecode compilation) """
+    measures: List[Dict[str, Tuple[int, int]]] = [measure_imports(module) for _ in range(runs)]
+    return min(measures, key=lambda imports: imports.get(module, (0, 0))[1])
+
+
+@click.command()
+@click.option('--runs', default=5, help='number of fresh interpreters to measure (default = 5)')
+@click.option('--budget', 'budget_file', default=DEFAULT_BUDGET_FILE,
+              help='regression budget file (default = benchmarks/startup_budget.json)')
+@click.option('--top', default=15, help='number of slowest imports to display (default = 15)')
+def startup(runs: int, budget_file: str, top: int):
+    """ Measure the application import time and check it against the regression budget """
+    with open(budget_file) as file:
+        budget = json.load(file)
+    module = budget['module']
+
+    imports = best_of(module, runs)
+    cumulative_us = imports[module][1]
+
+    click.echo(f'slowest imports (cumulative) for `{module}`:')
+    for name, (self_us, cumul_us) in sorted(imports.items(), key=lambda item: item[1][1], reverse=True)[:top]:
+        click.echo(f'  {cumul_us / 1000:>9.2f} ms  (self {self_us / 1000:>7.2f} ms)  {name}')
+
+    failures: List[str] = []
+    if cumulative_us > budget['cumulative_import_us']:
+        failures.append(f'`{module}` import takes {cumulative_us / 1000:.2f} ms, '
+                        f'budget is {budget["cumulative_import_us"] / 1000:.2f} ms')
+    for lazy_module in budget.get('lazy_modules', []):
+        if lazy_module in imports:
+            failures.append(f'`{lazy_module}` must be lazily imported but is loaded on `import {module}`')
+
+    click.echo(f'`{module}` import time: {cumulative_us / 1000:.2f} ms '
+               f'(budget {budget["cumulative_import_us"] / 1000:.2f} ms, best of {runs})')
+    for failure in failures:
+        click.echo(f'REGRESSION: {failure}', err=True)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    startup()
@@ -1,44 +1,276 @@
+import gc
+import io
 import logging
+import math
 import multiprocessing
 import os
+import sys
+import textwrap
+from typing import BinaryIO, Callable, Dict, List, TextIO, Tuple
 
 import click
 import falcon
 import gunicorn.app.base
-import pkg_resources
+import gunicorn.arbiter
+import gunicorn.workers.base
 import structlog as structlog
 from dynaconf import Dynaconf, LazySettings
 from falcon import App
+from prometheus_client import multiprocess
 from structlog.typing import FilteringBoundLogger
 
+from .adapters.errors.postgres_errors import PostgresConnectionError
+from .adapters.explain import ExplainSampler
+from .adapters.memory import ShardedMemoryStore
+from .adapters.migrations import MigrationPolicy
 from .adapters.postgres import Postgres
-from .commons.metrics import Metrics
+from .adapters.sharded_postgres import ShardedPostgres, parse_shard_host
+from .adapters.sqlite import Sqlite
+from .commons.bloom_filter import CountingBloomFilter
+from .commons.circuit_breaker import CircuitBreaker
+from .commons.default_group import DefaultGroup
+from .commons.latency_sketch import LatencySketch, remove_sketch_file
+from .commons.metrics import DEFAULT_LATENCY_BUCKETS, Metrics
+from .commons.slow_requests import SlowRequestLog, remove_slow_requests_file
+from .commons.version import get_version
+from .handlers.changes import ChangesHandler
+from .handlers.configuration import ReloadHandler
+from .handlers.dataset import ExportHandler, ImportHandler
 from .handlers.health import HealthHandler, LivenessHandler, ReadinessHandler
-from .handlers.message import MessageHandler, MessageKeyHandler
-from .handlers.monitoring import MonitoringHandler
+from .handlers.message import (
+    MERGE_PATCH_MEDIA_TYPE,
+    MessageHandler,
+    MessageKeyHandler,
+    MessagesHandler,
+)
+from .handlers.monitoring import (
+    LatencyHandler,
+    MonitoringHandler,
+    SlowQueryHandler,
+    SlowRequestHandler,
+)
+from .loadgen.command import loadgen
+from .loadgen.seeder import (
+    BINARY_FORMAT,
+    NDJSON_FORMAT,
+    TEXT_FORMAT,
+    Seeder,
+    SeedSpec,
+    parse_size_distribution,
+)
+from .middlewares.circuit_breaker import CircuitBreakerGuard
 from .middlewares.prometheus import Prometheus
 from .middlewares.telemetry import Telemetry
 from .middlewares.tracking_id import TrackingId
+from .repositories.backends import MessageBackend
+from .repositories.backends.memory import MemoryMessageBackend
+from .repositories.backends.postgres import (
+    PostgresMessageBackend,
+    ShardedPostgresMessageBackend,
+)
+from .repositories.backends.sqlite import SqliteMessageBackend
+from .repositories.errors.repositories_errors import StorageBackendError
 from .repositories.message import MessageRepository
+from .services.changes import ChangeFeedService
+from .services.dataset import DatasetService, TransferProgress
+from .services.drain import DrainService
+from .services.expiry import ExpiryReaper
 from .services.health import HealthService
+from .services.idempotency import IdempotencyService
+from .services.key_filter import KeyFilterBuilder
 from .services.message import MessageService
+from .services.runtime_config import (
+    RuntimeConfigService,
+    Tunable,
+    boolean,
+    log_level,
+    non_negative_float,
+    non_negative_int,
+    positive_int,
+    rate,
+    text,
+)
+from .services.worker_memory import WorkerMemoryService
 
 
 class APITest:
     _message_service: MessageService
+    _dataset_service: DatasetService
+    _change_feed_service: ChangeFeedService
     _health_service: HealthService
+    _expiry_reaper: ExpiryReaper
+    _key_filter_builder: KeyFilterBuilder | None
+    _backend: MessageBackend
+    _circuit_breakers: List[CircuitBreaker]
+    _databases: List[Postgres]
+    _explain_sampler: ExplainSampler
+    _runtime_config: RuntimeConfigService
+    _worker_memory: WorkerMemoryService
+    _drain: DrainService
+    _worker: gunicorn.workers.base.Worker | None
     _log: FilteringBoundLogger
     _settings: LazySettings
 
-    def __init__(self, log_level: str, config_file: str):
+    def __init__(self, log_level: str, config_file: str, migrate: bool = True, storage_backend: MessageBackend = None):
+        """
+        :param log_level: logger level
+        :param config_file: application configuration file path
+        :param migrate: apply the pending storage migrations (default = True)
+        :param storage_backend: storage backend to use instead of the configured one (e.g. shared with a benchmark)
+        """
         self.__init_logger(log_level)
+        self._log_level = log_level.upper()
         self._log = structlog.get_logger()
 
         self._settings = self.__init_configuration(config_file)
-        dal = self.__init_database(self._settings)
+        self._circuit_breakers = []
+        self._databases = []
+        # always there: the sampling can be turned on by a configuration reload
+        self._explain_sampler = ExplainSampler(sample_rate=self._settings.db_slow_query_explain_rate,
+                                               capacity=self._settings.db_slow_query_explain_capacity)
+        self._backend = storage_backend or self.__init_storage(self._settings)
+        if migrate:
+            # run once, in the master process, before any worker is forked
+            self.migrate()
+
+        self._health_service = HealthService(self._backend, self._settings)
+        self._expiry_reaper = ExpiryReaper(self._backend,
+                                           batch_size=self._settings.expiry_reaper_batch_size,
+                                           batch_pause=self._settings.expiry_reaper_batch_pause,
+                                           idle_interval=self._settings.expiry_reaper_idle_interval,
+                                           change_retention=self._settings.changes_retention)
+        # created before the workers are forked: they all share its memory
+        key_filter = None
+        self._key_filter_builder = None
+        if self._settings.as_bool('key_filter_enabled'):
+            if self._backend.name == MemoryMessageBackend.name:
+                # each worker has its own store: the build of a worker would answer for the keys of the others
+                raise ValueError('key_filter_enabled needs a storage shared by the workers, not the memory one')
+            key_filter = CountingBloomFilter(self._settings.key_filter_capacity,
+                                             error_rate=self._settings.key_filter_error_rate)
+            self._key_filter_builder = KeyFilterBuilder(self._backend, key_filter,
+                                                        rebuild_interval=self._settings.key_filter_rebuild_interval,
+                                                        batch_size=self._settings.key_filter_scan_batch_size)
+        repository = MessageRepository(self._backend,
+                                       coalesce_reads=self._settings.as_bool('message_read_coalescing'),
+                                       key_filter=key_filter)
+        self._message_service = MessageService(repository,
+                                               default_ttl=self._settings.message_default_ttl or None)
+        self._idempotency_service = None
+        if self._settings.as_bool('idempotency_enabled'):
+            self._idempotency_service = IdempotencyService(self._backend,
+                                                           ttl=self._settings.idempotency_key_ttl,
+                                                           cache_size=self._settings.idempotency_cache_size,
+                                                           wait=self._settings.idempotency_wait)
+        self._dataset_service = DatasetService(self._backend,
+                                               progress_interval=self._settings.dataset_progress_interval,
+                                               key_filter=key_filter)
+        self._change_feed_service = ChangeFeedService(self._backend,
+                                                      queue_size=self._settings.changes_queue_size,
+                                                      max_subscribers=self._settings.changes_max_subscribers,
+                                                      heartbeat_interval=self._settings.changes_heartbeat_interval,
+                                                      resume_margin=self._settings.changes_resume_margin)
+        self._worker = None
+        self._worker_memory = WorkerMemoryService(self.__recycle_worker,
+                                                  rss_limit=self._settings.worker_max_rss_mb << 20,
+                                                  recycle_jitter=self._settings.worker_recycle_jitter,
+                                                  check_interval=self._settings.worker_memory_check_interval)
+        self._drain = DrainService(self.__start_draining, self._backend.close,
+                                   grace_period=self._settings.drain_grace_period,
+                                   timeout=self._settings.drain_timeout)
+        self._runtime_config = self.__init_runtime_config(self._settings, config_file)
+
+    def migrate(self) -> None:
+        """ Apply the pending storage migrations """
+        self._log.info(f'Applying {self._backend.name} storage migrations - Start')
+        self._backend.migrate()
+        self._log.info(f'Applying {self._backend.name} storage migrations - Done')
+
+    def migration_plan(self) -> list:
+        """ :return the pending storage migrations (see `MessageBackend.migration_plan`), nothing is applied """
+        return self._backend.migration_plan()
+
+    def post_fork(self, _: gunicorn.arbiter.Arbiter, worker: gunicorn.workers.base.Worker) -> None:
+        """
+        Gunicorn `post_fork` hook: open and warm up the storage resources (database pool) of the new worker,
+        then start its health probes, its expiry reaper and its memory watcher. A database out of reach does not stop
+        the worker: it stays not ready and its pool is opened on first use.
+        """
+        self._log.debug(f'Initialize worker {worker.pid} - Start')
+        self._worker = worker
+        try:
+            self._backend.open()
+            self._backend.warm_up()
+        except PostgresConnectionError as err:
+            self._log.error(f'Worker {worker.pid} storage warm-up failed, not ready until it is reachable : {err}')
+        if self._health_enabled():
+            self._health_service.start()
+        if self._settings.as_bool('expiry_reaper_enabled'):
+            self._expiry_reaper.start()
+        if self._key_filter_builder is not None:
+            self._key_filter_builder.start()
+        self._runtime_config.start()
+        self._worker_memory.start()
+        self._log.debug(f'Initialize worker {worker.pid} - Done')
+
+    def post_worker_init(self, worker: gunicorn.workers.base.Worker) -> None:
+        """ Gunicorn `post_worker_init` hook: a SIGTERM drains the worker (see `DrainService`) """
+        self._drain.install(worker)
+
+    def worker_exit(self, _: gunicorn.arbiter.Arbiter, worker: gunicorn.workers.base.Worker) -> None:
+        """ Gunicorn `worker_exit` hook: close the storage pools of the worker once its requests are done """
+        # also called by the master for a worker it could not signal
+        if worker.pid == os.getpid():
+            self._drain.exit()
+
+    @property
+    def shutdown_timeout(self) -> float:
+        """ :return seconds the gunicorn master waits for the workers to drain before killing them """
+        return self._drain.shutdown_timeout
+
+    def child_exit(self, _: gunicorn.arbiter.Arbiter, worker: gunicorn.workers.base.Worker) -> None:
+        """
+        Gunicorn `child_exit` hook (master): drop the `live*` gauges, the latency sketch and the slow requests of the
+        worker gone (recycled or dead), the files of its counters and histograms are kept
+        """
+        if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+            multiprocess.mark_process_dead(worker.pid)
+            remove_sketch_file(worker.pid)
+            remove_slow_requests_file(worker.pid)
+
+    def request_reload(self) -> None:
+        """ Gunicorn master `HUP`: every worker reloads its runtime configuration (see `RuntimeConfigService`) """
+        generation = self._runtime_config.request_reload()
+        self._log.info(f'Runtime configuration reload requested, generation {generation}')
 
-        self._health_service = HealthService(dal, self._settings)
-        self._message_service = MessageService(MessageRepository(dal))
+    def __recycle_worker(self) -> None:
+        # like gunicorn `max_requests`: the worker stops accepting, finishes its requests and is replaced
+        self._worker.alive = False
+
+    def __start_draining(self) -> None:
+        self._health_service.start_draining()
+        # the change feed clients would hold the worker until the drain timeout: they resume on another one
+        self._change_feed_service.close_all()
+
+    def _health_enabled(self) -> bool:
+        return not self._settings.as_bool('debug_mode')
+
+    def __init_storage(self, settings: LazySettings) -> MessageBackend:
+        storage_backend = settings.get('storage_backend', PostgresMessageBackend.name)
+        self._log.debug(f'Initialize {storage_backend} storage component - Start')
+        if storage_backend == MemoryMessageBackend.name:
+            backend = MemoryMessageBackend(ShardedMemoryStore(settings.storage_memory_shards))
+        elif storage_backend == SqliteMessageBackend.name:
+            backend = SqliteMessageBackend(Sqlite(settings.storage_sqlite_path))
+        elif storage_backend == PostgresMessageBackend.name and settings.get('db_shard_hosts'):
+            backend = ShardedPostgresMessageBackend(self.__init_sharded_database(settings, settings.db_shard_hosts))
+        elif storage_backend == PostgresMessageBackend.name:
+            backend = PostgresMessageBackend(self.__init_database(settings))
+        else:
+            raise ValueError(f'unknown storage backend `{storage_backend}` '
+                             f'(choose between postgres / sqlite / memory)')
+        self._log.debug(f'Initialize {storage_backend} storage component - Done')
+        return backend
 
     def __init_database(self, settings: LazySettings) -> Postgres:
         self._log.debug(f'Initialize Database component on {settings.db_host_name} - Start')
@@ -48,10 +280,212 @@ class APITest:
                                  settings.db_user_name,
                                  settings.db_user_password,
                                  pool_min_connection=settings.db_pool_min_connection,
-                                 pool_max_connection=settings.db_pool_max_connection)
+                                 pool_max_connection=settings.db_pool_max_connection,
+                                 connect_timeout=settings.db_connect_timeout or None,
+                                 statement_timeout=settings.db_statement_timeout or None,
+                                 circuit_breaker=self.__init_circuit_breaker(settings, settings.db_host_name,
+                                                                             settings.db_port_number),
+                                 slow_query_threshold=settings.db_slow_query_threshold or None,
+                                 log_query_params=settings.as_bool('db_slow_query_log_params'),
+                                 explain_sampler=self._explain_sampler,
+                                 migration_policy=self.__migration_policy(settings))
+        self._databases.append(dal)
         self._log.debug(f'Initialize Database component on {settings.db_host_name} - Done')
         return dal
 
+    def __init_sharded_database(self, settings: LazySettings, shard_hosts: List[str]) -> ShardedPostgres:
+        self._log.debug(f'Initialize Database component on shards {", ".join(shard_hosts)} - Start')
+        shards = []
+        for shard_host in shard_hosts:
+            host_name, port_number = parse_shard_host(shard_host, settings.db_port_number)
+            shards.append(Postgres(host_name,
+                                   port_number,
+                                   settings.db_database_name,
+                                   settings.db_user_name,
+                                   settings.db_user_password,
+                                   pool_min_connection=settings.db_pool_min_connection,
+                                   pool_max_connection=settings.db_pool_max_connection,
+                                   connect_timeout=settings.db_connect_timeout or None,
+                                   statement_timeout=settings.db_statement_timeout or None,
+                                   circuit_breaker=self.__init_circuit_breaker(settings, host_name, port_number),
+                                   slow_query_threshold=settings.db_slow_query_threshold or None,
+                                   log_query_params=settings.as_bool('db_slow_query_log_params'),
+                                   explain_sampler=self._explain_sampler,
+                                   migration_policy=self.__migration_policy(settings)))
+        self._databases.extend(shards)
+        self._log.debug(f'Initialize Database component on shards {", ".join(shard_hosts)} - Done')
+        return ShardedPostgres(shards)
+
+    @staticmethod
+    def __migration_policy(settings: LazySettings) -> MigrationPolicy:
+        return MigrationPolicy(lock_timeout=settings.db_migration_lock_timeout,
+                               statement_timeout=settings.db_migration_statement_timeout,
+                               retries=settings.db_migration_retries,
+                               retry_delay=settings.db_migration_retry_delay)
+
+    def __init_circuit_breaker(self, settings: LazySettings, host_name: str, port_number: int) -> CircuitBreaker | None:
+        if not settings.as_bool('circuit_breaker_enabled'):
+            return None
+        circuit_breaker = CircuitBreaker(f'{host_name}:{port_number}',
+                                         window_size=settings.circuit_breaker_window_size,
+                                         minimum_calls=settings.circuit_breaker_minimum_calls,
+                                         failure_rate_threshold=settings.circuit_breaker_failure_rate,
+                                         slow_call_duration=settings.circuit_breaker_slow_call_duration,
+                                         slow_call_rate_threshold=settings.circuit_breaker_slow_call_rate,
+                                         open_duration=settings.circuit_breaker_open_duration,
+                                         half_open_probes=settings.circuit_breaker_half_open_probes)
+        self._circuit_breakers.append(circuit_breaker)
+        return circuit_breaker
+
+    def reshard(self, previous_hosts: List[str], batch_size: int, dry_run: bool) -> Dict[Tuple[str, str], int]:
+        """
+        Move the messages to the shard owning them in the configured layout
+        :param previous_hosts: shard hosts of the previous layout, in their order (empty = the configured layout)
+        :param batch_size: number of messages scanned per round trip
+        :param dry_run: only count the messages to move
+        :return: number of messages moved by (source, destination) shard
+        :raise ValueError: if the storage is not a sharded postgres
+        """
+        if not isinstance(self._backend, ShardedPostgresMessageBackend):
+            raise ValueError('resharding needs a sharded postgres storage (see `db_shard_hosts`)')
+        previous = self._backend.dal
+        if previous_hosts:
+            previous = self.__init_sharded_database(self._settings, previous_hosts)
+        try:
+            return self._backend.reshard(previous, batch_size=batch_size, dry_run=dry_run)
+        finally:
+            if previous is not self._backend.dal:
+                previous.close()
+            self._backend.close()
+
+    def export_messages(self, out: BinaryIO) -> Dict[str, float]:
+        """
+        Write every live message to the stream as NDJSON
+        :param out: stream receiving the messages
+        :return: transfer report (messages, bytes, seconds, throughput)
+        """
+        try:
+            return self._dataset_service.export_messages(out)
+        finally:
+            self._backend.close()
+
+    def import_messages(self, source: BinaryIO, upsert: bool) -> Dict[str, float]:
+        """
+        Store the messages of a NDJSON stream
+        :param source: stream of the messages
+        :param upsert: replace the existing messages
+        :return: transfer report (messages, bytes, seconds, throughput)
+        """
+        try:
+            return self._dataset_service.import_messages(source, upsert)
+        finally:
+            self._backend.close()
+
+    def seed(self, count: int, seed: int, size_distribution: str, properties: int, copy_format: str,
+             processes: int, loaders: int, chunk_size: int, keys_file: TextIO | None) -> Dict[str, float]:
+        """
+        Generate a reproducible load test dataset and store it (postgres: `COPY` of the generated rows)
+        :param count: number of messages
+        :param seed: random seed, the same seed gives the same messages
+        :param size_distribution: distribution of the attribute sizes (see `parse_size_distribution`)
+        :param properties: number of attributes of a message
+        :param copy_format: `binary` or `text` COPY format (the other storages load NDJSON)
+        :param processes: number of generating processes
+        :param loaders: number of chunks stored at once
+        :param chunk_size: number of messages generated and stored together
+        :param keys_file: receives the keys of the messages, one per line (None = no key list)
+        :return: transfer report (messages, bytes, seconds, throughput)
+        """
+        backend = self._backend
+        if isinstance(backend, (PostgresMessageBackend, ShardedPostgresMessageBackend)):
+            shards, load = backend.shard_count, lambda rows: backend.copy_messages(rows, copy_format)
+        else:
+            shards, copy_format = 1, NDJSON_FORMAT
+            load = lambda rows: backend.import_ndjson(io.BytesIO(rows[0]))  # noqa: E731
+        spec = SeedSpec(count=count, seed=seed, size_distribution=size_distribution, properties=properties,
+                        chunk_size=chunk_size, shards=shards, data_format=copy_format)
+        progress = TransferProgress('seed', self._settings.dataset_progress_interval)
+        try:
+            loaded = Seeder(spec, load, processes, loaders).run(keys_file, progress)
+        finally:
+            self._backend.close()
+        return progress.report(loaded)
+
+    def __init_metrics(self, settings: LazySettings) -> Metrics:
+        latency_sketch = None
+        if settings.as_bool('metrics_latency_sketch'):
+            latency_sketch = LatencySketch(flush_interval=settings.metrics_latency_sketch_flush_interval)
+        return Metrics(latency_buckets=settings.get('metrics_latency_buckets') or DEFAULT_LATENCY_BUCKETS,
+                       route_latency_buckets=settings.get('metrics_route_latency_buckets'),
+                       latency_sketch=latency_sketch)
+
+    @staticmethod
+    def __init_slow_requests(settings: LazySettings) -> SlowRequestLog | None:
+        if not settings.as_bool('slow_requests_enabled'):
+            return None
+        return SlowRequestLog(per_route=settings.slow_requests_per_route,
+                              window=settings.slow_requests_window,
+                              min_duration=settings.slow_requests_min_duration,
+                              flush_interval=settings.slow_requests_flush_interval)
+
+    def __init_runtime_config(self, settings: LazySettings, config_file: str) -> RuntimeConfigService:
+        pool_bounds = [settings.db_pool_min_connection, settings.db_pool_max_connection]
+        health = self._health_service
+
+        def set_log_level(level: str) -> None:
+            self.__init_logger(level)
+            self._log_level = level
+
+        def resize_pool(index: int, size: int) -> None:
+            pool_bounds[index] = size
+            health.postgres_pool_max = pool_bounds[1]
+            self._backend.resize_pool(*pool_bounds)
+
+        def set_on_databases(name: str, value) -> None:
+            for database in self._databases:
+                setattr(database, name, value)
+
+        def set_on(component, name: str) -> Callable[[object], None]:
+            return lambda value: setattr(component, name, value)
+
+        def set_worker_max_rss(megabytes: int) -> None:
+            self._worker_memory.rss_limit = megabytes << 20
+
+        def check_pool_bounds(values: dict) -> None:
+            if values['db_pool_min_connection'] > values['db_pool_max_connection']:
+                raise ValueError('db_pool_min_connection is above db_pool_max_connection')
+
+        tunables = {
+                'log_level'                 : Tunable(log_level, set_log_level, lambda: self._log_level),
+                'db_pool_min_connection'    : Tunable(non_negative_int, lambda size: resize_pool(0, size),
+                                                      lambda: pool_bounds[0]),
+                'db_pool_max_connection'    : Tunable(positive_int, lambda size: resize_pool(1, size),
+                                                      lambda: pool_bounds[1]),
+                'db_slow_query_threshold'   : Tunable(non_negative_float,
+                                                      lambda value: set_on_databases('slow_query_threshold',
+                                                                                     value or None),
+                                                      lambda: float(settings.db_slow_query_threshold or 0)),
+                'db_slow_query_log_params'  : Tunable(boolean,
+                                                      lambda value: set_on_databases('log_query_params', value),
+                                                      lambda: settings.as_bool('db_slow_query_log_params')),
+                'db_slow_query_explain_rate': Tunable(rate, set_on(self._explain_sampler, 'sample_rate'),
+                                                      lambda: self._explain_sampler.sample_rate),
+                'monitoring_cpu_limit'      : Tunable(non_negative_float, set_on(health, 'cpu_limit'),
+                                                      lambda: health.cpu_limit),
+                'monitoring_memory_limit'   : Tunable(non_negative_float, set_on(health, 'memory_limit'),
+                                                      lambda: health.memory_limit),
+                'monitoring_db_pool_limit'  : Tunable(non_negative_float, set_on(health, 'postgres_pool_limit'),
+                                                      lambda: health.postgres_pool_limit),
+                'monitoring_dns_lookup'     : Tunable(text, set_on(health, 'dns_host'), lambda: health.dns_host),
+                'worker_max_rss_mb'         : Tunable(non_negative_int, set_worker_max_rss,
+                                                      lambda: self._worker_memory.rss_limit >> 20),
+        }
+        if self._idempotency_service is not None:
+            tunables['idempotency_cache_size'] = Tunable(non_negative_int, self._idempotency_service.resize_cache,
+                                                         lambda: settings.idempotency_cache_size)
+        return RuntimeConfigService(settings, lambda: self.__init_configuration(config_file), tunables,
+                                    validate=check_pool_bounds)
+
     def __init_configuration(self, config_file: str) -> LazySettings:
         self._log.debug('Initialize Configuration component - Start')
         settings = Dynaconf(settings_file=config_file,
@@ -75,24 +509,55 @@ class APITest:
         :return: App managed by Falcon
         """
         # router with middleware (for metrics and request tracking)
-        metrics = Metrics()
-        router = falcon.App(middleware=[Prometheus(metrics), Telemetry(), TrackingId()],
+        metrics = self.__init_metrics(self._settings)
+        slow_requests = self.__init_slow_requests(self._settings)
+        # the circuit breaker guard comes last: its 503 are seen by the metrics and the logs
+        router = falcon.App(middleware=[Prometheus(metrics), Telemetry(), TrackingId(slow_requests),
+                                        CircuitBreakerGuard(self._circuit_breakers)],
                             media_type=falcon.MEDIA_JSON)
+        router.req_options.media_handlers[MERGE_PATCH_MEDIA_TYPE] = falcon.media.JSONHandler()
 
-        if not self._settings.debug_mode:
-            self._health_service.start()
-            # health routes
+        if self._health_enabled():
+            # health routes (probes are started in each worker, see `post_fork`)
             router.add_route('/_health', HealthHandler(self._health_service))
             router.add_route('/_private/_readiness', ReadinessHandler(self._health_service))
             router.add_route('/_private/_liveness', LivenessHandler(self._health_service))
-            router.add_route('/_private/_metrics', MonitoringHandler())
+            router.add_route('/_private/_metrics', MonitoringHandler(metrics.latency_sketch, slow_requests))
+            if metrics.latency_sketch is not None:
+                router.add_route('/_private/_latency', LatencyHandler(metrics.latency_sketch))
+            if slow_requests is not None:
+                router.add_route('/_private/_slow', SlowRequestHandler(slow_requests))
+            router.add_route('/_private/_slow_queries', SlowQueryHandler(self._explain_sampler))
+
+        # runtime configuration reload (every worker, like a gunicorn master `HUP`)
+        router.add_route('/_private/_reload', ReloadHandler(self._runtime_config))
 
+        # dataset snapshot / restore (NDJSON)
+        router.add_route('/_private/_export', ExportHandler(self._dataset_service))
+        router.add_route('/_private/_import', ImportHandler(self._dataset_service))
+
+        return self.add_message_routes(router)
+
+    def add_message_routes(self, router: App) -> App:
+        """
+        Add the message routes, served by the services of the api
+        :param router: App managed by Falcon (the api one, or a bare one to measure the middleware cost)
+        :return: the router
+        """
         # Message
-        # GET, PUT, DELETE
+        # GET, PUT, PATCH, DELETE
         router.add_route('/message/{key}', MessageKeyHandler(self._message_service))
-        router.add_route('/message', MessageHandler(self._message_service))
-        # GET TODO: implement handler
-        # router.add_route('/messages', MessageKeyHandler(self._message_service))
+        router.add_route('/message', MessageHandler(self._message_service, self._idempotency_service))
+        # GET (search by attributes, or read by keys), POST /messages/_mget (read by keys),
+        # POST /messages/_bulk (create / update / delete in a single transaction)
+        messages_handler = MessagesHandler(self._message_service,
+                                           max_keys=self._settings.message_multi_get_max_keys,
+                                           max_operations=self._settings.message_bulk_max_operations)
+        router.add_route('/messages', messages_handler)
+        router.add_route('/messages/_mget', messages_handler, suffix='mget')
+        router.add_route('/messages/_bulk', messages_handler, suffix='bulk')
+        # GET (change feed, server-sent events or NDJSON long poll)
+        router.add_route('/messages/_changes', ChangesHandler(self._change_feed_service))
 
         return router
 
@@ -101,24 +566,83 @@ def number_of_workers():
     return (multiprocessing.cpu_count() * 2) + 1
 
 
+class ReloadingArbiter(gunicorn.arbiter.Arbiter):
+    """
+    Gunicorn master whose `HUP` reloads the runtime configuration of the running workers, instead of replacing them
+    (cold pools and caches)
+    """
+
+    def handle_hup(self):
+        self.log.info('Hang up: %s, reloading the runtime configuration', self.master_name)
+        self.app.on_hup()
+
+
 class StandaloneApplication(gunicorn.app.base.BaseApplication):
+    """
+    Gunicorn application serving an app built by the master.
+
+    In preload mode the objects of the master (imported modules, app, shared memory) are frozen out of the garbage
+    collector before each fork: a collection in a worker no longer writes their headers, so their pages stay shared
+    instead of being copied in every worker. The collector must be disabled before the app is built (no freed holes
+    in the frozen pages), it runs again in the master once its objects are frozen, the workers open their own
+    connections (`post_fork`).
+    """
 
-    def __init__(self, app: App, options: dict = None):
+    def __init__(self, app: App, options: dict = None, on_hup: Callable[[], None] = None, preload: bool = False):
         self.options = options or {}
         self.application = app
+        self.on_hup = on_hup
+        self.preload = preload
         super().__init__()
 
+    def run(self):
+        if self.on_hup is None:
+            super().run()
+            return
+        try:
+            ReloadingArbiter(self).run()
+        except RuntimeError as e:
+            print('\nError: %s\n' % e, file=sys.stderr)
+            sys.stderr.flush()
+            sys.exit(1)
+
     def load_config(self):
         config = {key: value for key, value in self.options.items()
                   if key in self.cfg.settings and value is not None}
         for key, value in config.items():
             self.cfg.set(key.lower(), value)
+        if self.preload:
+            self.cfg.set('preload_app', True)
+            self.cfg.set('pre_fork', self.pre_fork)
+            self.cfg.set('post_fork', self.post_fork)
+
+    def pre_fork(self, _: gunicorn.arbiter.Arbiter, __: gunicorn.workers.base.Worker) -> None:
+        # the objects created since the previous fork are frozen too, the collector then runs on the new ones only
+        gc.freeze()
+        gc.enable()
+
+    def post_fork(self, server: gunicorn.arbiter.Arbiter, worker: gunicorn.workers.base.Worker) -> None:
+        gc.enable()
+        post_fork = self.options.get('post_fork')
+        if post_fork is not None:
+            post_fork(server, worker)
 
     def load(self) -> App:
         return self.application
 
 
-@click.command()
+@click.group(cls=DefaultGroup, default_command='serve')
+def command_line():
+    """\b
+    api-test application commands
+    \b
+    Usage:
+    api-test [Options] hostname port
+    api-test <command> [Options] [Arguments]
+    """
+
+
+@command_line.command('serve', short_help='Start the api-test application')
 @click.argument('hostname')
 @click.argument('port')
 @click.option('--config_file', default='./config.toml',
@@ -127,30 +651,199 @@ class StandaloneApplication(gunicorn.app.base.BaseApplication):
               help='set the logger level, choose between [CRITICAL / ERROR / WARNING / INFO / DEBUG] (default = INFO)')
 @click.option('--worker_nb', default=number_of_workers(),
               help='set the number of worker for the web application (default = cpu core count x 2 + 1)')
-def command_line(hostname: str,
-                 port: str,
-                 config_file: str,
-                 log_level: str,
-                 worker_nb: int):
+@click.option('--no_migration', is_flag=True, default=False,
+              help='start the application without applying the storage migrations (see `api-test migrate`)')
+@click.option('--no_preload', is_flag=True, default=False,
+              help='do not freeze the objects of the master before forking the workers (the app is still built by the '
+                   'master, but a collection in a worker copies the pages it touches: less memory is shared)')
+def serve(hostname: str,
+          port: str,
+          config_file: str,
+          log_level: str,
+          worker_nb: int,
+          no_migration: bool,
+          no_preload: bool):
     """\b
     Start the api-test application
     \b
     Usage:
-    api-test [Options] hostname port
+    api-test [serve] [Options] hostname port
     """
 
-    print(f'=== {APITest.__name__} - {pkg_resources.get_distribution("api_test").version} ===')
+    print(f'=== {APITest.__name__} - {get_version()} ===')
+
+    if not no_preload:
+        # frozen before each fork (see `StandaloneApplication`)
+        gc.disable()
+    app: APITest = APITest(log_level, config_file, migrate=not no_migration)
 
     options = {
-            'bind'        : '%s:%s' % (hostname, port),
-            'workers'     : worker_nb,
-            'threads'     : '30',
-            'keepalive'   : '2',
-            'timeout'     : '120',
-            'worker_class': 'gthread',
-            'logger_class': 'api_test.commons.gunicorn_logger.GunicornLogger'
+            'bind'            : '%s:%s' % (hostname, port),
+            'workers'         : worker_nb,
+            'threads'         : '30',
+            'keepalive'       : '2',
+            'timeout'         : '120',
+            'worker_class'    : 'gthread',
+            'logger_class'    : 'api_test.commons.gunicorn_logger.GunicornLogger',
+            'post_fork'       : app.post_fork,
+            'post_worker_init': app.post_worker_init,
+            'worker_exit'     : app.worker_exit,
+            'child_exit'      : app.child_exit,
+            'graceful_timeout': math.ceil(app.shutdown_timeout),
     }
 
-    app: APITest = APITest(log_level, config_file)
-    std_app = StandaloneApplication(app.router(), options)
+    std_app = StandaloneApplication(app.router(), options, on_hup=app.request_reload, preload=not no_preload)
     std_app.run()
+
+
+@command_line.command('migrate', short_help='Apply the pending storage migrations')
+@click.option('--config_file', default='./config.toml',
+              help='set the application configuration file path (default = ./config.toml')
+@click.option('--log_level', default='INFO',
+              help='set the logger level, choose between [CRITICAL / ERROR / WARNING / INFO / DEBUG] (default = INFO)')
+@click.option('--dry_run', is_flag=True, default=False, help='only list the pending migrations and their steps')
+def migrate(config_file: str, log_level: str, dry_run: bool):
+    """\b
+    Apply the pending storage migrations and exit, each step under the `db_migration_*` lock / statement timeouts
+    (retried when it waits too long for a lock). Run it before a deployment, then start with `--no_migration`.
+    \b
+    Usage:
+    api-test migrate [Options]
+    """
+    try:
+        app: APITest = APITest(log_level, config_file, migrate=not dry_run)
+        if not dry_run:
+            return
+        plan = app.migration_plan()
+    except PostgresConnectionError as err:
+        raise click.ClickException(str(err))
+    for migration in plan:
+        click.echo(f'{migration.target} {migration.migration_id} '
+                   f'({"transactional" if migration.transactional else "non transactional"}, '
+                   f'{len(migration.steps)} step(s))')
+        for sql in migration.steps:
+            click.echo(textwrap.indent(sql, '    '))
+    click.echo(f'{len(plan)} migration(s) to apply')
+
+
+@command_line.command('reshard', short_help='Move the messages to the shard owning their key')
+@click.option('--config_file', default='./config.toml',
+              help='set the application configuration file path (default = ./config.toml')
+@click.option('--log_level', default='INFO',
+              help='set the logger level, choose between [CRITICAL / ERROR / WARNING / INFO / DEBUG] (default = INFO)')
+@click.option('--previous_host', 'previous_hosts', multiple=True,
+              help='shard host (`host` or `host:port`) of the previous layout, repeated in the previous order '
+                   '(default = the configured shards, to only move misplaced messages)')
+@click.option('--batch_size', default=1000, help='number of messages scanned per round trip (default = 1000)')
+@click.option('--dry_run', is_flag=True, default=False, help='only count the messages to move')
+def reshard(config_file: str, log_level: str, previous_hosts: Tuple[str, ...], batch_size: int, dry_run: bool):
+    """\b
+    Move the messages to the shard owning their key in the configured `db_shard_hosts` layout.
+    New shards must be appended at the end of the list, the migrations are applied on every shard first.
+    \b
+    Usage:
+    api-test reshard [Options]
+    """
+    app: APITest = APITest(log_level, config_file, migrate=True)
+    moved = app.reshard(list(previous_hosts), batch_size, dry_run)
+    for (source, destination), count in sorted(moved.items()):
+        click.echo(f'{source} -> {destination}: {count} message(s) {"to move" if dry_run else "moved"}')
+    click.echo(f'{sum(moved.values())} message(s) {"to move" if dry_run else "moved"}')
+
+
+@command_line.command('export', short_help='Export the messages as NDJSON')
+@click.option('--config_file', default='./config.toml',
+              help='set the application configuration file path (default = ./config.toml')
+@click.option('--log_level', default='INFO',
+              help='set the logger level, choose between [CRITICAL / ERROR / WARNING / INFO / DEBUG] (default = INFO)')
+@click.option('--output', type=click.File('wb'), default='-', help='NDJSON file to write (default = stdout)')
+def export(config_file: str, log_level: str, output: BinaryIO):
+    """\b
+    Export every live message, one json document per line (`COPY ... TO STDOUT` on postgres)
+    \b
+    Usage:
+    api-test export [Options] > messages.ndjson
+    """
+    app: APITest = APITest(log_level, config_file, migrate=False)
+    # the logs must not be mixed with the exported data
+    structlog.configure(logger_factory=structlog.PrintLoggerFactory(sys.stderr))
+    try:
+        report = app.export_messages(output)
+    except StorageBackendError as err:
+        raise click.ClickException(f'export failed, the output is incomplete : {err}')
+    output.flush()
+    click.echo(f'{report["messages"]} message(s) exported in {report["seconds"]:.1f}s '
+               f'({report["messages_per_second"]:.0f} message(s)/s, '
+               f'{report["bytes_per_second"] / 2 ** 20:.1f} MiB/s)', err=True)
+
+
+@command_line.command('import', short_help='Import messages from NDJSON')
+@click.option('--config_file', default='./config.toml',
+              help='set the application configuration file path (default = ./config.toml')
+@click.option('--log_level', default='INFO',
+              help='set the logger level, choose between [CRITICAL / ERROR / WARNING / INFO / DEBUG] (default = INFO)')
+@click.option('--input', 'source', type=click.File('rb'), default='-', help='NDJSON file to read (default = stdin)')
+@click.option('--upsert', is_flag=True, default=False,
+              help='replace the existing messages (default: an existing message fails the import)')
+def import_(config_file: str, log_level: str, source: BinaryIO, upsert: bool):
+    """\b
+    Import messages, one json document per line (`COPY ... FROM STDIN` into a staging table on postgres)
+    \b
+    Usage:
+    api-test import [Options] < messages.ndjson
+    """
+    app: APITest = APITest(log_level, config_file, migrate=True)
+    try:
+        report = app.import_messages(source, upsert)
+    except StorageBackendError as err:
+        raise click.ClickException(f'import failed : {err}')
+    click.echo(f'{report["messages"]} message(s) imported in {report["seconds"]:.1f}s '
+               f'({report["messages_per_second"]:.0f} message(s)/s, '
+               f'{report["bytes_per_second"] / 2 ** 20:.1f} MiB/s)', err=True)
+
+
+@command_line.command('seed', short_help='Generate and store a load test dataset')
+@click.option('--config_file', default='./config.toml',
+              help='set the application configuration file path (default = ./config.toml')
+@click.option('--log_level', default='INFO',
+              help='set the logger level, choose between [CRITICAL / ERROR / WARNING / INFO / DEBUG] (default = INFO)')
+@click.option('--count', default=1_000_000, help='number of messages (default = 1000000)')
+@click.option('--seed', default=0, help='random seed, the same seed gives the same messages (default = 0)')
+@click.option('--attr_size_dist', default='uniform:10:30',
+              help='size distribution of the attribute values: fixed:SIZE / uniform:MIN:MAX / normal:MEAN:STDDEV / '
+                   'lognormal:MEDIAN:SIGMA / choice:SIZE=WEIGHT,... (default = uniform:10:30)')
+@click.option('--properties', default=5, help='number of attributes of a message (default = 5)')
+@click.option('--format', 'copy_format', type=click.Choice([BINARY_FORMAT, TEXT_FORMAT]), default=BINARY_FORMAT,
+              help='postgres COPY format (default = binary)')
+@click.option('--processes', default=multiprocessing.cpu_count(),
+              help='number of generating processes (default = cpu core count)')
+@click.option('--loaders', default=2, help='number of chunks stored at once (default = 2)')
+@click.option('--chunk_size', default=10_000,
+              help='number of messages generated and stored together, part of the reproducibility (default = 10000)')
+@click.option('--keys_file', type=click.File('w'), default='seed-keys.csv',
+              help='file receiving the keys, one per line, for the load scenarios (default = seed-keys.csv)')
+def seed(config_file: str, log_level: str, count: int, seed: int, attr_size_dist: str, properties: int,
+         copy_format: str, processes: int, loaders: int, chunk_size: int, keys_file: TextIO):
+    """\b
+    Generate messages in parallel processes and store them (`COPY` on postgres), reproducibly for a seed.
+    The keys are `seed-<seed>-<index>`: seeding again with the same seed needs the previous messages deleted.
+    \b
+    Usage:
+    api-test seed [Options]
+    """
+    try:
+        parse_size_distribution(attr_size_dist)
+    except ValueError as error:
+        raise click.BadParameter(str(error), param_hint='--attr_size_dist')
+    app: APITest = APITest(log_level, config_file, migrate=True)
+    try:
+        report = app.seed(count, seed, attr_size_dist, properties, copy_format, processes, loaders, chunk_size,
+                          keys_file)
+    except StorageBackendError as err:
+        raise click.ClickException(f'seed failed, the messages stored so far are kept : {err}')
+    click.echo(f'{report["messages"]} message(s) seeded in {report["seconds"]:.1f}s '
+               f'({report["messages_per_second"]:.0f} message(s)/s, '
+               f'{report["bytes_per_second"] / 2 ** 20:.1f} MiB/s), keys in {keys_file.name}')
+
+
+command_line.add_command(loadgen)
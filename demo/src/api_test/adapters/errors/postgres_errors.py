@@ -2,9 +2,21 @@ class PostgresConnectionError(Exception):
     pass
 
 
+class PostgresUnavailableError(PostgresConnectionError):
+    """ The call failed fast, the circuit breaker of the database is open """
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
 class PostgresCursorError(Exception):
     pass
 
 
 class PostgresQueryError(Exception):
     pass
+
+
+class PostgresMigrationError(PostgresConnectionError):
+    """ A migration could not be applied (the migrations applied before it stay applied) """
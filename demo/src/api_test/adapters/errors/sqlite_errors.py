@@ -0,0 +1,6 @@
+class SqliteConnectionError(Exception):
+    pass
+
+
+class SqliteQueryError(Exception):
+    pass
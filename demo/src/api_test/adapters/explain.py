@@ -0,0 +1,182 @@
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List
+
+import psycopg2
+import structlog
+from prometheus_client import Counter
+from structlog.typing import FilteringBoundLogger
+
+EXPLAINED = Counter(
+        'db_query_explained_total',
+        'Number of slow statements sampled for an EXPLAIN, by outcome (captured / skipped: queue full / failed)',
+        ['outcome'],
+)
+# fields of the plan nodes holding expressions, where the values of the parameters show up
+PLAN_CONDITIONS = ('Index Cond', 'Recheck Cond', 'Filter', 'Join Filter', 'Hash Cond', 'Merge Cond', 'TID Cond',
+                   'One-Time Filter', 'Order By', 'Cache Key')
+
+
+def redact_plan(plan: Any) -> Any:
+    """ :return the plan (EXPLAIN in json) with the conditions of its nodes replaced by `?` """
+    if isinstance(plan, list):
+        return [redact_plan(item) for item in plan]
+    if isinstance(plan, dict):
+        return {name: '?' if name in PLAN_CONDITIONS else redact_plan(value) for name, value in plan.items()}
+    return plan
+
+
+class SlowQuery:
+    """ a slow statement waiting for its plan """
+
+    def __init__(self, connection_kwargs: dict, target: str, entity: str, statement: str, query: str,
+                 params: dict | None, logged_params: dict | str | None, seconds: float, tracking_id: str | None,
+                 redacted: bool = False):
+        self.connection_kwargs = connection_kwargs
+        self.target = target
+        self.entity = entity
+        self.statement = statement
+        self.query = query
+        self.params = params
+        self.logged_params = logged_params
+        self.seconds = seconds
+        self.tracking_id = tracking_id
+        # the parameter values are not logged: the plan must not show them either
+        self.redacted = redacted
+        self.at = time.time()
+
+
+class ExplainSampler:
+    """
+    Plans of a sample of the slow reads, captured by `EXPLAIN (ANALYZE, BUFFERS)` on a side connection.
+
+    The statement is run again by the explain: only reads are sampled, the explain runs in a transaction rolled back
+    at once, under its own statement timeout, from a single thread of the worker (a side connection per database,
+    out of the pool) so a slow database never gets more than one explain at a time from a worker. A statement is
+    explained at most once every `min_interval` seconds. The last `capacity` plans are kept, by worker. The plan of a
+    statement whose parameters are not logged has its conditions redacted (they embed the parameter values).
+    """
+    _queue: queue.Queue
+    _captured: Deque[dict]
+    _connections: Dict[str, psycopg2.extensions.connection]
+    _log: FilteringBoundLogger
+
+    def __init__(self, sample_rate: float = 0.1, capacity: int = 20, timeout: float = 10.0,
+                 min_interval: float = 60.0, queue_size: int = 10):
+        """
+        :param sample_rate: share of the slow reads explained (default = 0.1)
+        :param capacity: number of plans kept (default = 20)
+        :param timeout: seconds an explain may run (default = 10)
+        :param min_interval: minimum seconds between two explains of a statement (default = 60)
+        :param queue_size: number of slow reads waiting for their explain, the others are skipped (default = 10)
+        """
+        self._log = structlog.get_logger()
+        self._sample_rate = sample_rate
+        self._timeout = timeout
+        self._min_interval = min_interval
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._captured = deque(maxlen=capacity)
+        self._last_explained: Dict[str, float] = dict()
+        self._connections = dict()
+        self._lock = threading.Lock()
+        # pid of the process running the explain thread: started in each worker, on its first sample
+        self._explainer_pid = None
+
+    @property
+    def sample_rate(self) -> float:
+        return self._sample_rate
+
+    @sample_rate.setter
+    def sample_rate(self, value: float):
+        self._sample_rate = value
+
+    def sample(self, slow_query: SlowQuery) -> bool:
+        """
+        :param slow_query: a slow read
+        :return: True if the read is queued for an explain
+        """
+        if random.random() >= self._sample_rate:
+            return False
+        name = f'{slow_query.target}/{slow_query.entity}/{slow_query.statement}'
+        with self._lock:
+            if time.monotonic() - self._last_explained.get(name, -self._min_interval) < self._min_interval:
+                return False
+            self._last_explained[name] = time.monotonic()
+            if self._explainer_pid != os.getpid():
+                self._explainer_pid = os.getpid()
+                # connections inherited from the parent process belong to it
+                self._connections = dict()
+                self._queue = queue.Queue(maxsize=self._queue.maxsize)
+                threading.Thread(target=self.__explain_loop, name='explain', daemon=True).start()
+        try:
+            self._queue.put_nowait(slow_query)
+        except queue.Full:
+            EXPLAINED.labels('skipped').inc()
+            return False
+        return True
+
+    def captured(self) -> List[dict]:
+        """ :return the plans kept by this worker, the latest first """
+        with self._lock:
+            return list(reversed(self._captured))
+
+    def __explain_loop(self) -> None:
+        self._log.debug('Starting slow query explainer')
+        try:
+            while True:
+                slow_query = self._queue.get()
+                try:
+                    plan, seconds = self.__explain(slow_query)
+                except (psycopg2.Error, OSError) as error:
+                    self._log.warn(f'explain of {slow_query.statement} on {slow_query.entity} failed : {error}')
+                    EXPLAINED.labels('failed').inc()
+                    self.__disconnect(slow_query.target)
+                    continue
+                except Exception as error:
+                    # e.g. a parameter the driver can't adapt: the next reads are still explained
+                    self._log.exception(f'explain of {slow_query.statement} on {slow_query.entity} error : {error}')
+                    EXPLAINED.labels('failed').inc()
+                    self.__disconnect(slow_query.target)
+                    continue
+                EXPLAINED.labels('captured').inc()
+                with self._lock:
+                    self._captured.append({
+                            'at'         : slow_query.at,
+                            'target'     : slow_query.target,
+                            'entity'     : slow_query.entity,
+                            'statement'  : slow_query.statement,
+                            'tracking_id': slow_query.tracking_id,
+                            'duration_ms': round(slow_query.seconds * 1000, 3),
+                            'explain_ms' : round(seconds * 1000, 3),
+                            'query'      : slow_query.query,
+                            'params'     : slow_query.logged_params,
+                            'plan'       : redact_plan(plan) if slow_query.redacted else plan,
+                    })
+        finally:
+            # the next sample starts it again
+            with self._lock:
+                self._explainer_pid = None
+
+    def __explain(self, slow_query: SlowQuery) -> tuple:
+        conn = self._connections.get(slow_query.target)
+        if conn is None or conn.closed:
+            conn = self._connections[slow_query.target] = psycopg2.connect(**slow_query.connection_kwargs)
+        started = time.perf_counter()
+        try:
+            with conn.cursor() as curs:
+                curs.execute(f'SET LOCAL statement_timeout = {int(self._timeout * 1000)}')
+                curs.execute(f'EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {slow_query.query}', slow_query.params)
+                plan = curs.fetchone()[0]
+        finally:
+            if not conn.closed:
+                conn.rollback()
+        return plan, time.perf_counter() - started
+
+    def __disconnect(self, target: str) -> None:
+        conn = self._connections.pop(target, None)
+        if conn is not None and not conn.closed:
+            conn.close()
@@ -0,0 +1,81 @@
+import threading
+from contextlib import ExitStack, contextmanager
+from typing import Any, Dict, Iterable, Iterator, List
+
+
+class ShardedMemoryStore:
+    """
+    In-memory key / value store split in shards, each one guarded by its own lock (lock striping), so writers on
+    different keys rarely wait for each other. Reads are lock free (a dict lookup is atomic).
+
+    The store is local to the process: each gunicorn worker has its own data.
+    """
+
+    def __init__(self, shards: int = 64):
+        """
+        :param shards: number of shards / locks (default = 64)
+        """
+        self._shards: List[Dict[str, Any]] = [dict() for _ in range(shards)]
+        self._locks: List[threading.Lock] = [threading.Lock() for _ in range(shards)]
+
+    def __index(self, key: str) -> int:
+        return hash(key) % len(self._shards)
+
+    def get(self, key: str) -> Any:
+        """ :return the value of the key, None if it is absent """
+        return self._shards[self.__index(key)].get(key)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """ :return the values of the present keys """
+        values = dict()
+        for key in keys:
+            value = self._shards[self.__index(key)].get(key)
+            if value is not None:
+                values[key] = value
+        return values
+
+    @contextmanager
+    def locked(self, keys: Iterable[str]) -> Iterator[None]:
+        """ hold the locks of the shards of the keys (acquired in shard order, so it can't deadlock) """
+        with ExitStack() as stack:
+            for index in sorted({self.__index(key) for key in keys}):
+                stack.enter_context(self._locks[index])
+            yield
+
+    def put_if_absent(self, key: str, value: Any) -> bool:
+        """ :return True if the value was stored, False if the key already exists """
+        index = self.__index(key)
+        with self._locks[index]:
+            if key in self._shards[index]:
+                return False
+            self._shards[index][key] = value
+            return True
+
+    def replace(self, key: str, value: Any) -> bool:
+        """ :return True if the value was replaced, False if the key is absent """
+        index = self.__index(key)
+        with self._locks[index]:
+            if key not in self._shards[index]:
+                return False
+            self._shards[index][key] = value
+            return True
+
+    def pop(self, key: str) -> Any:
+        """ remove the key, :return its value (None if it was absent) """
+        index = self.__index(key)
+        with self._locks[index]:
+            return self._shards[index].pop(key, None)
+
+    def unsafe_shard(self, key: str) -> Dict[str, Any]:
+        """ :return the shard of the key, to be modified only while holding its lock (see `locked`) """
+        return self._shards[self.__index(key)]
+
+    def keys(self) -> Iterator[str]:
+        """ :return the keys of the store (a point in time copy of each shard) """
+        for index, shard in enumerate(self._shards):
+            with self._locks[index]:
+                keys = list(shard)
+            yield from keys
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self._shards)
@@ -0,0 +1,150 @@
+import random
+import textwrap
+import time
+from typing import List, NamedTuple
+from urllib.parse import quote, urlencode
+
+import psycopg2
+import structlog
+from structlog.typing import FilteringBoundLogger
+
+from .errors.postgres_errors import PostgresMigrationError
+
+# SQLSTATE of a step that gave up waiting for a lock (`lock_timeout`) or was chosen as a deadlock victim: the step
+# is retried, the other errors are not
+LOCK_NOT_AVAILABLE: str = '55P03'
+DEADLOCK_DETECTED: str = '40P01'
+RETRIED_SQLSTATES: tuple = (LOCK_NOT_AVAILABLE, DEADLOCK_DETECTED)
+
+
+class MigrationPolicy(NamedTuple):
+    """ how the steps of a migration are run """
+    # seconds a step waits for a lock before giving up (0 = forever): a step queued behind a long transaction holds
+    # back every query on its table, it gives up and is retried instead
+    lock_timeout: float = 5.0
+    # seconds a step may run (0 = no limit, e.g. to build an index concurrently)
+    statement_timeout: float = 0.0
+    # attempts of a migration after the first one, when a step gives up waiting for a lock
+    retries: int = 5
+    # seconds before the first retry, doubled on each one (with jitter)
+    retry_delay: float = 1.0
+
+
+class PlannedMigration(NamedTuple):
+    """ a pending migration of a database """
+    target: str
+    migration_id: str
+    transactional: bool
+    # apply SQL of each step (`<python: name>` for a python step)
+    steps: List[str]
+
+
+class MigrationRunner:
+    """
+    Yoyo migrations of a postgres database, applied one migration at a time under the yoyo lock.
+
+    Each step runs on a connection opened with the `lock_timeout` / `statement_timeout` of the policy. A transactional
+    migration that gives up waiting for a lock is rolled back whole and retried after a delay. In a non transactional
+    migration (`__transactional__ = False`, e.g. to `CREATE INDEX CONCURRENTLY`) the steps before the failed one are
+    committed already: yoyo runs their rollback SQL, then the migration is retried. Its steps must be idempotent
+    (`IF NOT EXISTS`, drop of an invalid index first), and a step whose work must survive a retry (e.g. a column of a
+    live table) has no rollback SQL.
+    """
+    _log: FilteringBoundLogger
+
+    def __init__(self, connection_kwargs: dict, migration_folder: str, policy: MigrationPolicy = MigrationPolicy()):
+        """
+        :param connection_kwargs: database, user, password, host and port of the database
+        :param migration_folder: yoyo migration scripts folder
+        :param policy: timeouts and retries of the steps (default = 5s lock timeout, 5 retries)
+        """
+        self._log = structlog.get_logger()
+        self._connection_kwargs = connection_kwargs
+        self._migration_folder = migration_folder
+        self._policy = policy
+
+    @property
+    def target(self) -> str:
+        return (f'{self._connection_kwargs["host"]}:{self._connection_kwargs["port"]}'
+                f'/{self._connection_kwargs["database"]}')
+
+    def plan(self) -> List[PlannedMigration]:
+        """
+        :return: the migrations not applied yet, in their application order (nothing is applied)
+        """
+        from yoyo import get_backend, read_migrations
+
+        backend = get_backend(self.__uri())
+        try:
+            return [PlannedMigration(self.target, migration.id, migration.use_transactions,
+                                     [sql for wrapper in migration.steps for sql in self.__step_sql(wrapper.step)])
+                    for migration in self.__loaded(backend.to_apply(read_migrations(self._migration_folder)))]
+        finally:
+            backend.connection.close()
+
+    def apply(self) -> List[str]:
+        """
+        apply the pending migrations
+        :return: the ids of the applied migrations
+        :raise PostgresMigrationError: if a migration fails, or still waits for a lock after its retries (the
+            migrations applied before it stay applied)
+        """
+        # yoyo is only needed by the process applying the migrations, keep it out of the import path
+        from yoyo import get_backend, read_migrations
+        from yoyo.exceptions import LockTimeout
+
+        applied = []
+        backend = get_backend(self.__uri())
+        try:
+            with backend.lock():
+                migrations = backend.to_apply(read_migrations(self._migration_folder))
+                for migration in migrations:
+                    self.__apply_one(backend, migration)
+                    applied.append(migration.id)
+                if applied:
+                    backend.run_post_apply(migrations)
+        except LockTimeout as err:
+            raise PostgresMigrationError(f'{self.target} : {err}')
+        finally:
+            backend.connection.close()
+        return applied
+
+    def __apply_one(self, backend, migration) -> None:
+        for attempt in range(self._policy.retries + 1):
+            started = time.perf_counter()
+            try:
+                backend.apply_one(migration)
+            except psycopg2.Error as err:
+                if err.pgcode not in RETRIED_SQLSTATES or attempt == self._policy.retries:
+                    raise PostgresMigrationError(f'{self.target} : {migration.id} failed after {attempt + 1} '
+                                                 f'attempt(s) : {str(err).strip()}')
+                delay = self._policy.retry_delay * 2 ** attempt * random.uniform(0.5, 1.0)
+                self._log.warn(f'{self.target} : {migration.id} waited too long for a lock, '
+                               f'retried in {delay:.1f}s ({attempt + 1}/{self._policy.retries})')
+                time.sleep(delay)
+                continue
+            self._log.info(f'{self.target} : {migration.id} applied in {time.perf_counter() - started:.1f}s')
+            return
+
+    def __uri(self) -> str:
+        options = [f'-c lock_timeout={int(self._policy.lock_timeout * 1000)}',
+                   f'-c statement_timeout={int(self._policy.statement_timeout * 1000)}']
+        kwargs = self._connection_kwargs
+        return (f'postgresql://{quote(str(kwargs["user"]), safe="")}:{quote(str(kwargs["password"]), safe="")}'
+                f'@{kwargs["host"]}:{kwargs["port"]}/{quote(str(kwargs["database"]), safe="")}'
+                f'?{urlencode({"options": " ".join(options), "application_name": "api-test-migrate"})}')
+
+    @staticmethod
+    def __loaded(migrations) -> list:
+        for migration in migrations:
+            migration.load()
+        return list(migrations)
+
+    @classmethod
+    def __step_sql(cls, step) -> List[str]:
+        if hasattr(step, 'steps'):
+            # group of steps
+            return [sql for item in step.steps for sql in cls.__step_sql(getattr(item, 'step', item))]
+        if callable(step._apply):
+            return [f'<python: {step._apply.__name__}>']
+        return [textwrap.dedent(step._apply).strip()]
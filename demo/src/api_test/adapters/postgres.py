@@ -1,31 +1,182 @@
 import os
+import select
+import threading
+import time
 from contextlib import contextmanager
-from typing import List
+from typing import BinaryIO, Callable, Iterator, List, Tuple
 
 import psycopg2
 import structlog
-from psycopg2.extras import DictConnection, DictCursor, DictRow
-from psycopg2.pool import ThreadedConnectionPool
+from prometheus_client import Histogram
+from psycopg2.extras import (
+    DictConnection,
+    DictCursor,
+    DictRow,
+    execute_batch,
+    execute_values,
+)
+from psycopg2.pool import PoolError, ThreadedConnectionPool
 from structlog.typing import FilteringBoundLogger
-from yoyo import get_backend, read_migrations
 
 from .. import db
+from ..commons.circuit_breaker import CircuitBreaker, CircuitOpenError
+from ..commons.metrics import DEFAULT_LATENCY_BUCKETS
+from ..commons.tracking import get_tracking_id, record_pool_wait, record_statement
 from .errors.postgres_errors import (
     PostgresConnectionError,
     PostgresCursorError,
+    PostgresMigrationError,
     PostgresQueryError,
+    PostgresUnavailableError,
+)
+from .explain import ExplainSampler, SlowQuery
+from .migrations import MigrationPolicy, MigrationRunner, PlannedMigration
+
+# SQLSTATE classes of an unavailable database: connection exception, insufficient resources, operator intervention
+# (shutdown, statement timeout), system error
+OUTAGE_SQLSTATE_CLASSES = ('08', '53', '57', '58')
+# SQLSTATE classes of the data rejected by the database: data exception, integrity constraint violation
+DATA_SQLSTATE_CLASSES = ('22', '23')
+READ: str = 'read'
+WRITE: str = 'write'
+
+QUERY_SECONDS = Histogram(
+        'db_query_duration_seconds',
+        'Execution time of the statements (rows fetched included, pool wait excluded)',
+        ['entity', 'operation', 'statement'],
+        buckets=DEFAULT_LATENCY_BUCKETS,
+)
+QUERY_ROWS = Histogram(
+        'db_query_rows',
+        'Number of rows returned by the statements',
+        ['entity', 'operation', 'statement'],
+        buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000),
+)
+POOL_WAIT_SECONDS = Histogram(
+        'db_pool_wait_seconds',
+        'Time to check a connection out of the pool for the statements (connection opening included)',
+        ['entity', 'operation', 'statement'],
+        buckets=DEFAULT_LATENCY_BUCKETS,
 )
+# (entity, operation, statement) of an instrumented statement
+Labels = Tuple[str, str, str]
+
+
+class _UnusableConnection(Exception):
+    """
+    Raised by a user of a connection left in the middle of an operation (e.g. a copy whose stream failed): the
+    connection is closed instead of being rolled back and put back in the pool, then the error is raised
+    """
+
+    def __init__(self, error: BaseException):
+        Exception.__init__(self, str(error))
+        self.error = error
 
 
 class Queries:
     PING_SELECT: str = "SELECT 1"
+    NO_STATEMENT_TIMEOUT: str = "SET LOCAL statement_timeout = 0"
+
+
+def statement_name(query: str) -> str:
+    """ :return the default name of a statement: its leading keyword (`select`, `insert`, `with`...) """
+    return query.split(None, 1)[0].lower() if query.strip() else 'empty'
+
+
+def is_outage(error: BaseException) -> bool:
+    """
+    :param error: error of a database call, or one raised while handling it
+    :return: True if it tells the database is unreachable, overloaded or too slow, False for an error of the call
+        itself (invalid query, constraint violation, deadlock...) or an exhausted pool (the process is overloaded)
+    """
+    while error is not None and not isinstance(error, psycopg2.Error):
+        error = error.__cause__ or error.__context__
+    if error is None or isinstance(error, PoolError):
+        return False
+    if isinstance(error, psycopg2.InterfaceError):
+        return True
+    # no SQLSTATE: the client side failed (connection refused, lost, timed out)
+    return isinstance(error, psycopg2.OperationalError) and (error.pgcode is None
+                                                             or error.pgcode[:2] in OUTAGE_SQLSTATE_CLASSES)
+
+
+def is_data_error(error: BaseException) -> bool:
+    """
+    :param error: error of a database call, or one raised while handling it
+    :return: True if the database rejected the data of the call (invalid value, duplicate key...)
+    """
+    while error is not None and not isinstance(error, psycopg2.Error):
+        error = error.__cause__ or error.__context__
+    return error is not None and error.pgcode is not None and error.pgcode[:2] in DATA_SQLSTATE_CLASSES
+
+
+class ResizablePool(ThreadedConnectionPool):
+    """
+    Thread safe connection pool whose bounds can change while its connections are in use: psycopg2 only refuses a
+    connection when exactly `maxconn` are used, a lowered maximum would never be reached again
+    """
+
+    def _getconn(self, key=None):
+        if not self._pool and len(self._used) >= self.maxconn and key not in self._used:
+            raise PoolError('connection pool exhausted')
+        return super()._getconn(key)
+
+    def resize(self, min_connections: int, max_connections: int) -> None:
+        """ new bounds, the idle connections above the minimum are closed (the used ones once put back) """
+        with self._lock:
+            self.minconn, self.maxconn = min_connections, max_connections
+            while len(self._pool) > min_connections:
+                self._pool.pop().close()
+
+
+class Transaction:
+    """
+    Statements of a transaction opened by `Postgres.transaction`, run on its connection
+    """
+
+    def __init__(self, cursor: DictCursor, entity: str, observe: Callable[..., None]):
+        self._cursor = cursor
+        self._entity = entity
+        self._observe = observe
+
+    def execute(self, query: str, params: dict = None, statement: str = None) -> List[DictRow]:
+        """
+        :param statement: name of the statement in the metrics (default = its leading keyword)
+        :return: list of DictRow (the returned rows, empty for a statement returning nothing)
+        """
+        started = time.perf_counter()
+        self._cursor.execute(query, params)
+        rows = self._cursor.fetchall() if self._cursor.description is not None else []
+        self._observe((self._entity, WRITE, statement or statement_name(query)), query, params,
+                      time.perf_counter() - started, len(rows))
+        return rows
+
+    def execute_values(self, query: str, values: List[tuple], template: str = None, fetch: bool = False,
+                       page_size: int = 100, statement: str = None) -> List[DictRow]:
+        """
+        execute a query whose single `VALUES %s` placeholder is expanded with all the values (`execute_values`)
+        :param statement: name of the statement in the metrics (default = its leading keyword)
+        :return: list of DictRow (the rows of the `RETURNING` clause of every page, empty when not fetched)
+        """
+        if not values:
+            return []
+        started = time.perf_counter()
+        rows = execute_values(self._cursor, query, values, template=template, page_size=page_size, fetch=fetch) or []
+        self._observe((self._entity, WRITE, statement or statement_name(query)), query, values,
+                      time.perf_counter() - started, len(rows) if fetch else None)
+        return rows
 
 
 class Postgres:
     """
     Postgres Data Access Repository.
+
+    The connection pool is bound to the process that opened it: libpq sockets must never be shared between
+    a gunicorn master and its forked workers, so each worker opens (and warms) its own pool after the fork.
     """
-    _connection_pool: ThreadedConnectionPool
+    _connection_pool: ResizablePool | None
+    _pool_pid: int | None
+    _pool_lock: threading.Lock
     _log: FilteringBoundLogger
 
     def __init__(self,
@@ -35,8 +186,15 @@ class Postgres:
                  user_name: str,
                  password: str,
                  migration_folder: str = os.path.dirname(os.path.abspath(db.__file__)),
+                 migration_policy: MigrationPolicy = MigrationPolicy(),
                  pool_min_connection: int = 2,
-                 pool_max_connection: int = 4):
+                 pool_max_connection: int = 4,
+                 connect_timeout: float = None,
+                 statement_timeout: float = None,
+                 circuit_breaker: CircuitBreaker = None,
+                 slow_query_threshold: float = None,
+                 log_query_params: bool = False,
+                 explain_sampler: ExplainSampler = None):
         """
         init a connection repository to postgres with a connection pool
 
@@ -46,8 +204,18 @@ class Postgres:
         :param user_name: target database user
         :param password: user's password
         :param migration_folder: database migration script folder (default = db package file path)
+        :param migration_policy: lock / statement timeouts and retries of the migration steps (default = 5s lock
+            timeout, 5 retries)
         :param pool_min_connection: minimum connections kept alive in the pool (default = 2)
         :param pool_max_connection: maximum connections kept alive in the pool (default = 4)
+        :param connect_timeout: seconds to establish a connection (default = None, no limit)
+        :param statement_timeout: seconds a statement may run, except the copies and scans (default = None, no limit)
+        :param circuit_breaker: breaker of the short statements, failing fast while the database is down
+            (default = None, every call waits for the database)
+        :param slow_query_threshold: seconds from which a statement is logged as slow (default = None, never)
+        :param log_query_params: log the parameter values of the slow statements, their names only otherwise
+            (default = False, they may hold personal data)
+        :param explain_sampler: captures the plan of a sample of the slow reads (default = None, no plan)
         :raise PostgresConnectionError: on init of the class if the connection can't be established
         """
         self._log = structlog.get_logger()
@@ -61,42 +229,149 @@ class Postgres:
         #     - *password*: password used to authenticate
         #     - *host*: database host address (defaults to UNIX socket if not provided)
         #     - *port*: connection port number (defaults to 5432 if not provided)
+        self._connection_kwargs = {
+                'database': database_name,
+                'user'    : user_name,
+                'password': password,
+                'host'    : host_name,
+                'port'    : port_number,
+        }
+        if connect_timeout:
+            self._connection_kwargs['connect_timeout'] = max(int(connect_timeout), 1)
+        if statement_timeout:
+            self._connection_kwargs['options'] = f'-c statement_timeout={int(statement_timeout * 1000)}'
+        self._statement_timeout = statement_timeout
+        self._circuit_breaker = circuit_breaker
+        self._slow_query_threshold = slow_query_threshold
+        self._log_query_params = log_query_params
+        self._explain_sampler = explain_sampler
+        self._migration_runner = MigrationRunner(self._connection_kwargs, migration_folder, migration_policy)
+        self._pool_min_connection = pool_min_connection
+        self._pool_max_connection = pool_max_connection
+
+        self._connection_pool = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+
+    @property
+    def target(self) -> str:
+        """ :return the `host:port/database` this repository connects to """
+        return (f'{self._connection_kwargs["host"]}:{self._connection_kwargs["port"]}'
+                f'/{self._connection_kwargs["database"]}')
+
+    @property
+    def circuit_breaker(self) -> CircuitBreaker | None:
+        return self._circuit_breaker
+
+    @property
+    def slow_query_threshold(self) -> float | None:
+        return self._slow_query_threshold
 
-        self._connection_pool = ThreadedConnectionPool(pool_min_connection,
-                                                       pool_max_connection,
-                                                       database=database_name,
-                                                       user=user_name,
-                                                       password=password,
-                                                       host=host_name,
-                                                       port=port_number)
-
-        self.ping_select()
-        self.__apply_migration(host_name,
-                               port_number,
-                               database_name,
-                               user_name,
-                               password,
-                               migration_folder)
-
-    def __apply_migration(self,
-                          db_host: str,
-                          db_port: int,
-                          db_name: str,
-                          db_user: str,
-                          db_password: str,
-                          migration_folder: str):
+    @slow_query_threshold.setter
+    def slow_query_threshold(self, value: float | None):
+        self._slow_query_threshold = value
+
+    @property
+    def log_query_params(self) -> bool:
+        return self._log_query_params
+
+    @log_query_params.setter
+    def log_query_params(self, value: bool):
+        self._log_query_params = value
+
+    def open(self) -> None:
+        """
+        open the connection pool for the current process (no-op if it is already opened by this process).
+        A pool inherited from a parent process is dropped without being closed, its sockets belong to the parent.
+        :raise PostgresConnectionError: if the pool can't be established
+        """
+        with self._pool_lock:
+            if self._connection_pool is not None and self._pool_pid == os.getpid():
+                return
+
+            self._log.debug(f'opening connection pool in process {os.getpid()}')
+            try:
+                self._connection_pool = ResizablePool(self._pool_min_connection,
+                                                      self._pool_max_connection,
+                                                      **self._connection_kwargs)
+            except psycopg2.Error as pg_error:
+                self._log.critical(f'cannot open connection pool: {pg_error}')
+                raise PostgresConnectionError(f'opening connection pool : {pg_error}')
+            self._pool_pid = os.getpid()
+
+    def resize_pool(self, min_connections: int, max_connections: int) -> None:
+        """
+        change the bounds of the connection pool, live: the connections in use are left alone, the idle ones above
+        the minimum are closed, new ones are opened on demand up to the maximum
+        :param min_connections: connections kept alive in the pool
+        :param max_connections: connections opened at most
+        """
+        with self._pool_lock:
+            self._pool_min_connection, self._pool_max_connection = min_connections, max_connections
+            if self._connection_pool is not None and self._pool_pid == os.getpid():
+                self._connection_pool.resize(min_connections, max_connections)
+
+    def warm_up(self) -> None:
+        """
+        check out `pool_min_connection` connections at once and ping the database on each of them,
+        so the first requests served by the process do not pay the connection latency.
+        :raise PostgresConnectionError: if a connection can't be established
+        """
+        pool = self.__pool()
+        connections = []
+        try:
+            for index in range(self._pool_min_connection):
+                connections.append(pool.getconn(f'warm-up-{index}'))
+            for conn in connections:
+                with conn.cursor() as curs:
+                    curs.execute(Queries.PING_SELECT)
+                conn.rollback()
+        except psycopg2.Error as pg_error:
+            self._log.critical(f'error happen on warming up the connection pool : {pg_error}')
+            raise PostgresConnectionError(f'warming up the connection pool : {pg_error}')
+        finally:
+            for index, conn in enumerate(connections):
+                pool.putconn(conn, f'warm-up-{index}')
+        self._log.debug(f'connection pool warmed up with {len(connections)} connection(s)')
+
+    def close(self) -> None:
+        """
+        close all the connections of the pool owned by the current process.
+        """
+        with self._pool_lock:
+            if self._connection_pool is not None and self._pool_pid == os.getpid():
+                self._connection_pool.closeall()
+            self._connection_pool = None
+            self._pool_pid = None
+
+    def apply_migration(self) -> List[str]:
+        """
+        apply the pending yoyo migrations on the database, through a dedicated connection that is closed at the end.
+        Meant to be called once (from the gunicorn master before forking the workers, or from `api-test migrate`).
+        :return: the ids of the applied migrations
+        :raise PostgresMigrationError: if a migration fails or still waits for a lock after its retries
+        :raise PostgresConnectionError: if the database can't be reached
+        """
+        self._log.debug(f'applying yoyo migrations of {self._migration_runner.target}')
         try:
-            self._log.debug('applying yoyo migration')
-            connection_string: str = f'postgresql://{db_user}:{db_password}@{db_host}:{db_port}/{db_name}'
-            backend = get_backend(connection_string)
-            self._log.debug(f'applying migration files in {migration_folder}')
-            self._log.debug(f'on connection {connection_string}')
-            migrations = read_migrations(migration_folder)
-            backend.apply_migrations(backend.to_apply(migrations))
+            return self._migration_runner.apply()
+        except PostgresMigrationError as error:
+            self._log.critical(f'cannot apply the database migrations : {error}')
+            raise
         except Exception as error:
             self._log.critical(f'cannot connect to database at start-up: {error}')
             raise PostgresConnectionError('connection error on postgres repository init')
 
+    def migration_plan(self) -> List[PlannedMigration]:
+        """
+        :return: the pending yoyo migrations of the database, nothing is applied
+        :raise PostgresConnectionError: if the database can't be reached
+        """
+        try:
+            return self._migration_runner.plan()
+        except psycopg2.Error as error:
+            raise PostgresConnectionError(f'cannot read the migrations of {self.target} : {error}')
+
     def ping_select(self):
         """
         emit a simple select query against the database
@@ -105,58 +380,377 @@ class Postgres:
 
         self.exec_read('ping', Queries.PING_SELECT)
 
-    def exec_read(self, entity: str, query: str, params: dict = None) -> List[DictRow]:
+    def exec_read(self, entity: str, query: str, params: dict = None, statement: str = None) -> List[DictRow]:
         """
         execute a read query on postgres database
         :param entity: entity that will be queried ((or a scope, if there are more than one)
         :param query: query to be executed
         :param params: optional parameter to fulfill the query
+        :param statement: name of the statement in the metrics and the logs (default = its leading keyword)
         :return: list of DictRow
+        :raise PostgresQueryError: on error during the reading process
+        :raise PostgresUnavailableError: if the circuit breaker is open
         """
         log_query = query.replace('\n', '')
-        with self.__connection(f'read-{entity}') as conn:
+        labels = (entity, READ, statement or statement_name(query))
+        with self.__guard(), self.__connection(f'read-{entity}', labels) as conn:
             try:
                 with self.__cursor(conn) as curs:
+                    started = time.perf_counter()
                     curs.execute(query, params)
                     self._log.debug(f'executing query [{log_query}]')
                     self._log.debug(f'with param [{params}]')
-                    return curs.fetchall()
+                    rows = curs.fetchall()
+                self.__observe(labels, query, params, time.perf_counter() - started, len(rows))
+                return rows
             except psycopg2.Error as error:
                 self._log.warn(f'Error occur on read of {log_query} - {error}')
-            finally:
-                self._connection_pool.putconn(conn)
+                raise PostgresQueryError(f'Error occur on read of {log_query} - {error}')
 
-    def exec_write(self, entity: str, query: str, params: dict) -> None:
+    def iter_read(self, entity: str, query: str, params: dict = None,
+                  batch_size: int = 1000) -> Iterator[List[DictRow]]:
+        """
+        execute a read query through a server side cursor and yield its rows by batches, so a whole table can be
+        scanned without loading it in memory. The connection is held until the iteration ends.
+        :param entity: entity that will be queried (or a scope, if there are more than one)
+        :param query: query to be executed
+        :param params: optional parameter to fulfill the query
+        :param batch_size: number of rows fetched per round trip (default = 1000)
+        :return: iterator of lists of DictRow
+        :raise PostgresQueryError: on error during the reading process
+        """
+        log_query = query.replace('\n', '')
+        with self.__connection(f'scan-{entity}') as conn:
+            try:
+                self.__disable_statement_timeout(conn)
+                with conn.cursor(name=f'scan_{entity}') as curs:
+                    curs.itersize = batch_size
+                    curs.execute(query, params)
+                    self._log.debug(f'scanning query [{log_query}]')
+                    while rows := curs.fetchmany(batch_size):
+                        yield rows
+                conn.rollback()
+            except psycopg2.Error as error:
+                self._log.error(f'Error occur on scan of {log_query} - {error}')
+                conn.rollback()
+                raise PostgresQueryError(f'Error occur on scan of {log_query} - {error}')
+
+    def exec_write(self, entity: str, query: str, params: dict, statement: str = None) -> None:
         """
         execute a writing query on postgres database
         :param entity: entity that will be queried (or a scope, if there are more than one)
         :param query: query to be executed
         :param params: optional parameter to fulfill the query
+        :param statement: name of the statement in the metrics and the logs (default = its leading keyword)
         :raise PostgresQueryError: on error during writing process
+        :raise PostgresUnavailableError: if the circuit breaker is open
         """
         log_query = query.replace('\n', '')
-        with self.__connection(f'write-{entity}') as conn:
+        labels = (entity, WRITE, statement or statement_name(query))
+        with self.__guard(), self.__connection(f'write-{entity}', labels) as conn:
             try:
                 with self.__cursor(conn) as curs:
+                    started = time.perf_counter()
                     curs.execute(query, params)
                     self._log.debug(f'executing query [{log_query}]')
                 conn.commit()
+                self.__observe(labels, query, params, time.perf_counter() - started)
             except psycopg2.Error as error:
                 self._log.error(f'Error occur on write of {log_query} - {error}')
                 conn.rollback()
                 raise PostgresQueryError(f'Error occur on write of {log_query} - {error}')
-            finally:
-                self._connection_pool.putconn(conn)
+
+    def exec_write_returning(self, entity: str, query: str, params: dict, statement: str = None) -> List[DictRow]:
+        """
+        execute a writing query with a `RETURNING` clause on postgres database
+        :param entity: entity that will be queried (or a scope, if there are more than one)
+        :param query: query to be executed
+        :param params: optional parameter to fulfill the query
+        :param statement: name of the statement in the metrics and the logs (default = its leading keyword)
+        :return: list of DictRow (the returned rows)
+        :raise PostgresQueryError: on error during writing process
+        :raise PostgresUnavailableError: if the circuit breaker is open
+        """
+        log_query = query.replace('\n', '')
+        labels = (entity, WRITE, statement or statement_name(query))
+        with self.__guard(), self.__connection(f'write-{entity}', labels) as conn:
+            try:
+                with self.__cursor(conn) as curs:
+                    started = time.perf_counter()
+                    curs.execute(query, params)
+                    self._log.debug(f'executing query [{log_query}]')
+                    rows = curs.fetchall()
+                conn.commit()
+                self.__observe(labels, query, params, time.perf_counter() - started, len(rows))
+                return rows
+            except psycopg2.Error as error:
+                self._log.error(f'Error occur on write of {log_query} - {error}')
+                conn.rollback()
+                raise PostgresQueryError(f'Error occur on write of {log_query} - {error}')
+
+    def exec_batch(self, entity: str, query: str, params_list: List[dict], page_size: int = 100,
+                   statement: str = None) -> None:
+        """
+        execute a writing query once per parameters, sent by pages (`execute_batch`) in a single transaction
+        :param entity: entity that will be queried (or a scope, if there are more than one)
+        :param query: query to be executed
+        :param params_list: parameters of each execution
+        :param page_size: number of executions sent in one round trip (default = 100)
+        :param statement: name of the statement in the metrics and the logs (default = its leading keyword)
+        :raise PostgresQueryError: on error during writing process
+        :raise PostgresUnavailableError: if the circuit breaker is open
+        """
+        log_query = query.replace('\n', '')
+        labels = (entity, WRITE, statement or statement_name(query))
+        with self.__guard(), self.__connection(f'write-{entity}', labels) as conn:
+            try:
+                with self.__cursor(conn) as curs:
+                    started = time.perf_counter()
+                    execute_batch(curs, query, params_list, page_size=page_size)
+                    self._log.debug(f'executing batch query [{log_query}] x {len(params_list)}')
+                conn.commit()
+                self.__observe(labels, query, params_list, time.perf_counter() - started)
+            except psycopg2.Error as error:
+                self._log.error(f'Error occur on batch write of {log_query} - {error}')
+                conn.rollback()
+                raise PostgresQueryError(f'Error occur on batch write of {log_query} - {error}')
+
+    def exec_values(self, entity: str, query: str, values: List[tuple], template: str = None,
+                    fetch: bool = False, page_size: int = 100, statement: str = None) -> List[DictRow]:
+        """
+        execute a writing query whose single `VALUES %s` placeholder is expanded with all the values
+        (`execute_values`), in a single transaction
+        :param entity: entity that will be queried (or a scope, if there are more than one)
+        :param query: query to be executed
+        :param values: tuples of values
+        :param template: optional template of one tuple (e.g. `(%s, %s::jsonb)`)
+        :param fetch: return the rows of the `RETURNING` clause (default = False)
+        :param page_size: number of tuples sent in one statement (default = 100)
+        :param statement: name of the statement in the metrics and the logs (default = its leading keyword)
+        :return: list of DictRow (empty when not fetched)
+        :raise PostgresQueryError: on error during writing process
+        :raise PostgresUnavailableError: if the circuit breaker is open
+        """
+        log_query = query.replace('\n', '')
+        labels = (entity, WRITE, statement or statement_name(query))
+        with self.__guard(), self.__connection(f'write-{entity}', labels) as conn:
+            try:
+                with self.__cursor(conn) as curs:
+                    started = time.perf_counter()
+                    rows = execute_values(curs, query, values, template=template, page_size=page_size, fetch=fetch)
+                    self._log.debug(f'executing values query [{log_query}] x {len(values)}')
+                conn.commit()
+                self.__observe(labels, query, values, time.perf_counter() - started, len(rows or []) if fetch else None)
+                return rows or []
+            except psycopg2.Error as error:
+                self._log.error(f'Error occur on values write of {log_query} - {error}')
+                conn.rollback()
+                raise PostgresQueryError(f'Error occur on values write of {log_query} - {error}')
 
     @contextmanager
-    def __connection(self, key: str) -> DictConnection:
+    def transaction(self, entity: str) -> Iterator[Transaction]:
+        """
+        run several statements in a single transaction, paying a single commit: committed at the end of the block,
+        rolled back when the block raises
+        :param entity: entity that will be queried (or a scope, if there are more than one)
+        :return: the statements runner of the transaction
+        :raise PostgresQueryError: on error during a statement, nothing is written
+        :raise PostgresUnavailableError: if the circuit breaker is open
+        """
+        # the block runs the caller's work too: its duration is not the database's
+        with self.__guard(timed=False), self.__connection(f'write-{entity}', (entity, WRITE, 'transaction')) as conn:
+            try:
+                with conn.cursor() as curs:
+                    yield Transaction(curs, entity, self.__observe)
+                conn.commit()
+            except psycopg2.Error as error:
+                self._log.error(f'Error occur on transaction of {entity} - {error}')
+                conn.rollback()
+                raise PostgresQueryError(f'Error occur on transaction of {entity} - {error}')
+            except BaseException:
+                conn.rollback()
+                raise
+
+    def copy_out(self, entity: str, query: str, out: BinaryIO, buffer_size: int = 65536) -> int:
+        """
+        execute a `COPY ... TO STDOUT` query, the data is written to the stream as it comes (constant memory)
+        :param entity: entity that will be queried (or a scope, if there are more than one)
+        :param query: copy query to be executed
+        :param out: stream receiving the data
+        :param buffer_size: size of the blocks written to the stream (default = 64 KiB)
+        :return: number of copied rows
+        :raise PostgresQueryError: on error during the copy
+        """
+        log_query = query.replace('\n', '')
+        with self.__connection(f'copy-{entity}') as conn:
+            try:
+                self.__disable_statement_timeout(conn)
+                with self.__cursor(conn) as curs:
+                    self._log.debug(f'copying out [{log_query}]')
+                    curs.copy_expert(query, out, size=buffer_size)
+                    rows = curs.rowcount
+                conn.rollback()
+                return rows
+            except (psycopg2.Error, PostgresCursorError) as error:
+                # the copy failed on the server: the connection is back out of the copy
+                self._log.error(f'Error occur on copy of {log_query} - {error}')
+                conn.rollback()
+                raise PostgresQueryError(f'Error occur on copy of {log_query} - {error}')
+            except Exception as error:
+                # the stream failed (e.g. client gone) while the copy was flowing: the connection is left in the
+                # middle of the copy, it is closed so that it never goes back to the pool
+                raise _UnusableConnection(error)
+
+    def copy_in(self, entity: str, query: str, source: BinaryIO, before: List[str] = (), after: str = None,
+                buffer_size: int = 65536) -> int:
+        """
+        execute a `COPY ... FROM STDIN` query fed by the stream as it is read (constant memory), between optional
+        statements (e.g. create a staging table, then merge it), all in a single transaction
+        :param entity: entity that will be queried (or a scope, if there are more than one)
+        :param query: copy query to be executed
+        :param source: stream of the data
+        :param before: statements executed before the copy
+        :param after: statement executed after the copy
+        :param buffer_size: size of the blocks read from the stream (default = 64 KiB)
+        :return: number of rows modified by the `after` statement (copied rows without it)
+        :raise PostgresQueryError: on error during the copy, nothing is written
+        """
+        log_query = query.replace('\n', '')
+        with self.__connection(f'copy-{entity}') as conn:
+            try:
+                self.__disable_statement_timeout(conn)
+                with self.__cursor(conn) as curs:
+                    for statement in before:
+                        curs.execute(statement)
+                    self._log.debug(f'copying in [{log_query}]')
+                    curs.copy_expert(query, source, size=buffer_size)
+                    rows = curs.rowcount
+                    if after is not None:
+                        curs.execute(after)
+                        rows = curs.rowcount
+                conn.commit()
+                return rows
+            except psycopg2.Error as error:
+                self._log.error(f'Error occur on copy of {log_query} - {error}')
+                conn.rollback()
+                raise PostgresQueryError(f'Error occur on copy of {log_query} - {error}')
+
+    def listen(self, channel: str, timeout: float = 1.0) -> Iterator[List[str]]:
+        """
+        listen to a notification channel on a dedicated connection (out of the pool, closed when the iteration ends)
+        :param channel: notification channel
+        :param timeout: seconds waited for notifications before yielding an empty list (default = 1)
+        :return: iterator of the payloads of the notifications received at once, in commit order, an empty list
+            first as soon as the connection listens
+        :raise PostgresConnectionError: if the connection can't be established or is lost
+        """
         try:
-            conn: DictConnection
-            with self._connection_pool.getconn(key) as conn:
-                yield conn
+            conn = psycopg2.connect(**self._connection_kwargs)
+        except psycopg2.Error as pg_error:
+            self._log.critical(f'cannot open listen connection : {pg_error}')
+            raise PostgresConnectionError(f'opening listen connection : {pg_error}')
+        try:
+            conn.set_session(autocommit=True)
+            with conn.cursor() as curs:
+                curs.execute(f'LISTEN {channel}')
+            self._log.debug(f'listening to {channel} in process {os.getpid()}')
+            yield []
+            while True:
+                if select.select([conn], [], [], timeout) != ([], [], []):
+                    conn.poll()
+                payloads = [notify.payload for notify in conn.notifies]
+                conn.notifies.clear()
+                yield payloads
+        except (psycopg2.Error, OSError) as pg_error:
+            self._log.error(f'error happen on listen connection : {pg_error}')
+            raise PostgresConnectionError(f'listen connection : {pg_error}')
+        finally:
+            conn.close()
+
+    @contextmanager
+    def __guard(self, timed: bool = True) -> Iterator[None]:
+        if self._circuit_breaker is None:
+            yield
+            return
+        try:
+            with self._circuit_breaker.call(is_outage, timed=timed):
+                yield
+        except CircuitOpenError as rejection:
+            raise PostgresUnavailableError(str(rejection), rejection.retry_after)
+
+    def __observe(self, labels: Labels, query: str, params: dict | List | None, seconds: float,
+                  rows: int = None) -> None:
+        QUERY_SECONDS.labels(*labels).observe(seconds)
+        if rows is not None:
+            QUERY_ROWS.labels(*labels).observe(rows)
+        record_statement(labels[0], labels[2], seconds, rows)
+        if self._slow_query_threshold is None or seconds < self._slow_query_threshold:
+            return
+        entity, operation, statement = labels
+        tracking_id = get_tracking_id()
+        logged_params = self.__loggable(params)
+        self._log.warn(f'slow query {statement} on {entity} ({operation}) : {seconds * 1000:.1f}ms '
+                       f'[tracking id {tracking_id}] [{query.replace(chr(10), " ")}] with param [{logged_params}]')
+        # explaining a write would run it again
+        if self._explain_sampler is not None and operation == READ:
+            self._explain_sampler.sample(SlowQuery(self._connection_kwargs, self.target, entity, statement, query,
+                                                   params, logged_params, seconds, tracking_id,
+                                                   redacted=not self._log_query_params))
+
+    def __loggable(self, params: dict | List | None) -> dict | str | None:
+        # parameter values may hold personal data: their names only, unless asked for
+        if params is None or self._log_query_params:
+            return params
+        if isinstance(params, dict):
+            return {name: '?' for name in params}
+        return f'{len(params)} row(s)'
+
+    def __disable_statement_timeout(self, conn: DictConnection) -> None:
+        # copies and scans run as long as their data needs, for their transaction only
+        if self._statement_timeout:
+            with conn.cursor() as curs:
+                curs.execute(Queries.NO_STATEMENT_TIMEOUT)
+
+    def __pool(self) -> ResizablePool:
+        if self._connection_pool is None or self._pool_pid != os.getpid():
+            # lazily open the pool on first use in this process (e.g. a freshly forked worker)
+            self.open()
+        return self._connection_pool
+
+    @contextmanager
+    def __connection(self, key: str, labels: Labels = None) -> DictConnection:
+        # connections are checked out without pool key: a keyed `getconn` hands the very same connection
+        # to every thread asking with that key, the key is only used for logging
+        pool = self.__pool()
+        started = time.perf_counter()
+        try:
+            conn: DictConnection = pool.getconn()
+            if labels is not None:
+                waited = time.perf_counter() - started
+                POOL_WAIT_SECONDS.labels(*labels).observe(waited)
+                record_pool_wait(waited)
         except psycopg2.Error as pg_error:
             self._log.critical(f'error happen on getting db connection with key {key} : {pg_error}')
             raise PostgresConnectionError(f'getting db connection with key {key} : {pg_error}')
+        unusable = None
+        try:
+            # the transaction handling of `with conn`, except for an unusable connection: closed as is
+            try:
+                yield conn
+            except _UnusableConnection as error:
+                unusable = error.error
+            except BaseException:
+                conn.rollback()
+                raise
+            else:
+                conn.commit()
+        except psycopg2.Error as pg_error:
+            self._log.critical(f'error happen on db connection with key {key} : {pg_error}')
+            raise PostgresConnectionError(f'db connection with key {key} : {pg_error}')
+        finally:
+            pool.putconn(conn, close=unusable is not None)
+        if unusable is not None:
+            raise unusable
 
     @contextmanager
     def __cursor(self, conn: DictConnection) -> DictCursor:
@@ -170,4 +764,4 @@ class Postgres:
 
     def get_used_connections(self) -> int:
         """ Returns the current database connections used."""
-        return len(self._connection_pool._pool)
+        return len(self.__pool()._pool)
@@ -0,0 +1,173 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Tuple, TypeVar
+
+import structlog
+from structlog.typing import FilteringBoundLogger
+
+from ..commons.jump_hash import jump_hash, stable_hash
+from ..commons.tracking import (
+    RequestTrace,
+    get_trace,
+    get_tracking_id,
+    set_trace,
+    set_tracking_id,
+)
+from .migrations import PlannedMigration
+from .postgres import Postgres
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+
+def parse_shard_host(shard_host: str, default_port: int) -> Tuple[str, int]:
+    """
+    :param shard_host: `host`, `host:port` (`[address]:port` for an IPv6 address)
+    :param default_port: port used when the shard host doesn't set one
+    :return: (host, port)
+    """
+    host, _, port = shard_host.rpartition(':')
+    if not host or not port.isdigit() or (':' in host and not host.startswith('[')):
+        return shard_host.strip('[]'), int(default_port)
+    return host.strip('[]'), int(port)
+
+
+class ShardedPostgres:
+    """
+    Postgres nodes sharing the key space: each key is owned by a single shard, chosen by a jump consistent hash
+    of the key over the ordered list of shards.
+
+    The order of the shards is part of the layout: new nodes must be appended at the end of the list, then only the
+    keys moving to the new nodes have to be relocated (see `api-test reshard`).
+    Operations on several keys are split by shard and run in parallel, on a thread pool owned by the process.
+    """
+    _shards: List[Postgres]
+    _executor: ThreadPoolExecutor | None
+    _executor_pid: int | None
+    _executor_lock: threading.Lock
+    _log: FilteringBoundLogger
+
+    def __init__(self, shards: List[Postgres]):
+        """
+        :param shards: postgres repository of each shard, in the layout order
+        """
+        if not shards:
+            raise ValueError('a sharded postgres needs at least one shard')
+        self._log = structlog.get_logger()
+        self._shards = shards
+        self._executor = None
+        self._executor_pid = None
+        self._executor_lock = threading.Lock()
+
+    @property
+    def shards(self) -> List[Postgres]:
+        return self._shards
+
+    def shard_index(self, key: str) -> int:
+        """ :return the index of the shard owning the key """
+        return jump_hash(stable_hash(key), len(self._shards))
+
+    def shard(self, key: str) -> Postgres:
+        """ :return the shard owning the key """
+        return self._shards[self.shard_index(key)]
+
+    def group_by_shard(self, keys: Iterable[str]) -> Dict[int, List[str]]:
+        """ :return the keys by index of the shard owning them """
+        groups: Dict[int, List[str]] = dict()
+        for key in keys:
+            groups.setdefault(self.shard_index(key), []).append(key)
+        return groups
+
+    def scatter(self, call: Callable[[int, T], R], groups: Dict[int, T]) -> Dict[int, R]:
+        """
+        run the call on each shard of the groups in parallel, and gather the results.
+        Every call runs to its end, the first error (in shard order) is raised afterwards.
+        :param call: function of (shard index, group)
+        :param groups: part of the work by shard index
+        :return: results by shard index
+        """
+        if len(groups) <= 1:
+            return {index: call(index, group) for index, group in groups.items()}
+
+        tracking_id, trace = get_tracking_id(), get_trace()
+        futures = {index: self.__executor().submit(self.__tracked, tracking_id, trace, call, index, group)
+                   for index, group in groups.items()}
+        results: Dict[int, R] = dict()
+        error: Exception | None = None
+        for index in sorted(futures):
+            try:
+                results[index] = futures[index].result()
+            except Exception as shard_error:
+                self._log.error(f'error on shard {self._shards[index].target} : {shard_error}')
+                error = error or shard_error
+        if error is not None:
+            raise error
+        return results
+
+    def open(self) -> None:
+        for shard in self._shards:
+            shard.open()
+
+    def warm_up(self) -> None:
+        self.scatter(lambda index, shard: shard.warm_up(), dict(enumerate(self._shards)))
+
+    def close(self) -> None:
+        with self._executor_lock:
+            if self._executor is not None and self._executor_pid == os.getpid():
+                self._executor.shutdown(wait=True)
+            self._executor = None
+            self._executor_pid = None
+        for shard in self._shards:
+            shard.close()
+
+    def resize_pool(self, min_connections: int, max_connections: int) -> None:
+        """ change the bounds of the connection pool of every shard (see `Postgres.resize_pool`) """
+        for shard in self._shards:
+            shard.resize_pool(min_connections, max_connections)
+
+    def apply_migration(self) -> List[str]:
+        """
+        apply the pending yoyo migrations on every shard, one after the other
+        :return: the ids of the migrations applied on the shards
+        """
+        applied = []
+        for shard in self._shards:
+            self._log.debug(f'applying migration on shard {shard.target}')
+            applied.extend(shard.apply_migration())
+        return applied
+
+    def migration_plan(self) -> List[PlannedMigration]:
+        """ :return: the pending yoyo migrations of every shard, nothing is applied """
+        return [migration for shard in self._shards for migration in shard.migration_plan()]
+
+    def ping_select(self) -> None:
+        """
+        emit a simple select query against every shard
+        :raise PostgresConnectionError: if a shard can't be reached
+        """
+        self.scatter(lambda index, shard: shard.ping_select(), dict(enumerate(self._shards)))
+
+    def get_used_connections(self) -> int:
+        """ Returns the current database connections used, all shards together."""
+        return sum(shard.get_used_connections() for shard in self._shards)
+
+    @staticmethod
+    def __tracked(tracking_id: str | None, trace: RequestTrace | None, call: Callable[[int, T], R], index: int,
+                  group: T) -> R:
+        # the statements run for a request on the pool threads are logged with its tracking id, and traced
+        set_tracking_id(tracking_id)
+        set_trace(trace)
+        try:
+            return call(index, group)
+        finally:
+            set_tracking_id()
+            set_trace()
+
+    def __executor(self) -> ThreadPoolExecutor:
+        # threads don't survive a fork: each worker builds its own pool on first use
+        with self._executor_lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=len(self._shards), thread_name_prefix='shard')
+                self._executor_pid = os.getpid()
+            return self._executor
@@ -0,0 +1,183 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator, List
+
+import structlog
+from structlog.typing import FilteringBoundLogger
+
+from .errors.sqlite_errors import SqliteConnectionError, SqliteQueryError
+
+
+class Queries:
+    PING_SELECT: str = "SELECT 1"
+
+
+def is_data_error(error: BaseException) -> bool:
+    """
+    :param error: error of a database call, or one raised while handling it
+    :return: True if the database rejected the data of the call (constraint violation, e.g. a duplicate key)
+    """
+    while error is not None and not isinstance(error, sqlite3.Error):
+        error = error.__cause__ or error.__context__
+    return isinstance(error, (sqlite3.IntegrityError, sqlite3.DataError))
+
+
+class Sqlite:
+    """
+    Embedded SQLite Data Access Repository.
+
+    The database is opened in WAL mode (readers never block the writer), each thread of each process keeps its own
+    connection (sqlite connections must not be shared between threads, nor inherited through a fork).
+    """
+    _local_thread: threading.local
+    _log: FilteringBoundLogger
+
+    def __init__(self, path: str, busy_timeout: float = 5.0):
+        """
+        :param path: database file path
+        :param busy_timeout: seconds a writer waits for the database lock before failing (default = 5)
+        """
+        self._log = structlog.get_logger()
+        self._path = path
+        self._busy_timeout = busy_timeout
+        self._local_thread = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+
+    def __get_connection(self) -> sqlite3.Connection:
+        connection: sqlite3.Connection | None = getattr(self._local_thread, 'connection', None)
+        if connection is not None and self._local_thread.pid == os.getpid():
+            return connection
+
+        try:
+            # autocommit mode, transactions are explicitly opened by `exec_write` / `exec_many`
+            connection = sqlite3.connect(self._path, timeout=self._busy_timeout, isolation_level=None,
+                                         check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+        except sqlite3.Error as error:
+            self._log.critical(f'cannot open sqlite database {self._path} : {error}')
+            raise SqliteConnectionError(f'opening sqlite database {self._path} : {error}')
+        self._local_thread.connection = connection
+        self._local_thread.pid = os.getpid()
+        with self._connections_lock:
+            self._connections.append(connection)
+        return connection
+
+    def close(self) -> None:
+        """ close the connections opened by the threads of the current process """
+        with self._connections_lock:
+            for connection in self._connections:
+                try:
+                    connection.close()
+                except sqlite3.Error:
+                    pass  # closed anyway
+            self._connections.clear()
+        self._local_thread = threading.local()
+
+    def ping_select(self) -> bool:
+        """ :return True if the database answers a simple select """
+        try:
+            self.exec_read('ping', Queries.PING_SELECT)
+            return True
+        except (SqliteConnectionError, SqliteQueryError):
+            return False
+
+    def exec_read(self, entity: str, query: str, params: dict | tuple = ()) -> List[tuple]:
+        """
+        execute a read query on the database
+        :param entity: entity that will be queried (or a scope, if there are more than one)
+        :param query: query to be executed
+        :param params: optional parameter to fulfill the query
+        :return: list of rows
+        :raise SqliteQueryError: on error during the read
+        """
+        try:
+            return self.__get_connection().execute(query, params).fetchall()
+        except sqlite3.Error as error:
+            self._log.warn(f'Error occur on read of {entity} - {error}')
+            raise SqliteQueryError(f'Error occur on read of {entity} - {error}')
+
+    def iter_read(self, entity: str, query: str, params: dict | tuple = (),
+                  batch_size: int = 1000) -> Iterator[List[tuple]]:
+        """
+        execute a read query and yield its rows by batches, so a whole table can be scanned without loading it in
+        memory (WAL mode: the scan reads a snapshot, writers go on meanwhile)
+        :param entity: entity that will be queried (or a scope, if there are more than one)
+        :param query: query to be executed
+        :param params: optional parameter to fulfill the query
+        :param batch_size: number of rows fetched at once (default = 1000)
+        :return: iterator of lists of rows
+        :raise SqliteQueryError: on error during the read
+        """
+        try:
+            cursor = self.__get_connection().execute(query, params)
+            try:
+                while rows := cursor.fetchmany(batch_size):
+                    yield rows
+            finally:
+                cursor.close()
+        except sqlite3.Error as error:
+            self._log.warn(f'Error occur on scan of {entity} - {error}')
+            raise SqliteQueryError(f'Error occur on scan of {entity} - {error}')
+
+    def exec_write(self, entity: str, query: str, params: dict | tuple = ()) -> int:
+        """
+        execute a writing query in its own transaction
+        :return: number of modified rows
+        :raise SqliteQueryError: on error during writing process
+        """
+        with self.transaction(entity) as connection:
+            return connection.execute(query, params).rowcount
+
+    def exec_write_returning(self, entity: str, query: str, params: dict | tuple = ()) -> List[tuple]:
+        """
+        execute a writing query with a `RETURNING` clause in its own transaction
+        :return: list of the returned rows
+        :raise SqliteQueryError: on error during writing process
+        """
+        with self.transaction(entity) as connection:
+            return connection.execute(query, params).fetchall()
+
+    def exec_many(self, entity: str, query: str, params_list: List[dict | tuple]) -> int:
+        """
+        execute a writing query once per parameters, in a single transaction
+        :return: number of modified rows
+        :raise SqliteQueryError: on error during writing process
+        """
+        with self.transaction(entity) as connection:
+            return connection.executemany(query, params_list).rowcount
+
+    def exec_script(self, entity: str, script: str) -> None:
+        """
+        execute a sql script (e.g. schema creation)
+        :raise SqliteQueryError: on error during the script
+        """
+        try:
+            self.__get_connection().executescript(script)
+        except sqlite3.Error as error:
+            self._log.error(f'Error occur on script of {entity} - {error}')
+            raise SqliteQueryError(f'Error occur on script of {entity} - {error}')
+
+    @contextmanager
+    def transaction(self, entity: str) -> Iterator[sqlite3.Connection]:
+        """
+        open an immediate (write locked) transaction, committed at the end or rolled back on error
+        :raise SqliteQueryError: on error during the transaction
+        """
+        connection = self.__get_connection()
+        try:
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield connection
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+        except sqlite3.Error as error:
+            self._log.error(f'Error occur on write of {entity} - {error}')
+            if connection.in_transaction:
+                connection.execute('ROLLBACK')
+            raise SqliteQueryError(f'Error occur on write of {entity} - {error}')
@@ -0,0 +1,225 @@
+import fcntl
+import hashlib
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from typing import Iterable, Iterator, List, Tuple
+
+# shared header: active buffer, ready, building, builder pid, generation, keys, invalidations, builds started,
+# lock holder pid (0 = free), built_at (epoch)
+HEADER = struct.Struct('<qqqqqqqqqd')
+ACTIVE, READY, BUILDING, BUILDER, GENERATION, KEYS, INVALIDATIONS, STARTS, HOLDER, BUILT_AT = range(10)
+MAX_COUNT: int = 255
+
+
+class CountingBloomFilter:
+    """
+    Counting Bloom filter of keys, in memory shared by the processes forked after its creation (gunicorn workers).
+
+    A key that was added (and not removed as many times) is always reported as possibly present, a key never added
+    is reported absent, except for a false positive rate close to `error_rate` while the filter holds at most
+    `capacity` keys. Each position is a byte counter, so a key can be removed: the counters of a key are only
+    decremented when all of them are set (a key never added is left alone), a saturated counter is never decremented.
+
+    Two buffers: the active one answers the lookups while the other is rebuilt from a scan of the keys, the writes
+    happening meanwhile go to both, then the buffers are swapped. A key is added before its write commits: when a
+    build starts in between, its scan may miss the key, so the key is added again (`confirm`) once written. Until its
+    first build, the filter reports every key as possibly present.
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        """
+        :param capacity: expected number of keys
+        :param error_rate: false positive rate at `capacity` keys (default = 1%)
+        """
+        self.size = max(int(-capacity * math.log(error_rate) / math.log(2) ** 2), 64)
+        self.hashes = max(round(self.size / capacity * math.log(2)), 1)
+        # anonymous shared mapping: the same pages in every forked process
+        self._memory = mmap.mmap(-1, HEADER.size + 2 * self.size)
+        # inherited by the forked processes, each one locks it on its own (fcntl locks belong to a process)
+        self._lock_file = tempfile.TemporaryFile()
+        # the threads of a process share its fcntl lock: they take this one first
+        self._threads_lock = threading.Lock()
+        reference = weakref.ref(self)
+        os.register_at_fork(after_in_child=lambda: _reset_threads_lock(reference))
+
+    @property
+    def memory_bytes(self) -> int:
+        return len(self._memory)
+
+    @property
+    def ready(self) -> bool:
+        return bool(self.__header()[READY])
+
+    @property
+    def keys(self) -> int:
+        """ :return the approximate number of keys (removed keys included until the next build) """
+        return self.__header()[KEYS]
+
+    @property
+    def built_at(self) -> float:
+        """ :return the epoch of the last build, 0 before the first one """
+        return self.__header()[BUILT_AT]
+
+    def false_positive_rate(self) -> float:
+        """ :return the false positive rate expected for the number of keys """
+        return (1.0 - math.exp(-self.hashes * self.keys / self.size)) ** self.hashes
+
+    def might_contain(self, key: str) -> bool:
+        """ :return False if the key was never added (or was removed), True if it may have been """
+        header = self.__header()
+        if not header[READY]:
+            return True
+        offset = HEADER.size + header[ACTIVE] * self.size
+        memory = self._memory
+        return all(memory[offset + position] for position in self.__positions(key))
+
+    def add(self, key: str) -> Tuple[int, int]:
+        """
+        add a key, before its write
+        :return: the ticket to `confirm` the key with once its write committed
+        """
+        positions = self.__positions(key)
+        with self.__locked():
+            header = self.__header()
+            self.__increment(header[ACTIVE], positions)
+            if header[BUILDING]:
+                self.__increment(1 - header[ACTIVE], positions)
+            self.__set(KEYS, header[KEYS] + 1)
+            return header[STARTS], header[GENERATION]
+
+    def confirm(self, key: str, ticket: Tuple[int, int]) -> None:
+        """
+        add the key again to the buffers built by a scan started after `add`, the scan may have missed its write
+        :param key: key added
+        :param ticket: returned by `add`
+        """
+        starts, generation = ticket
+        with self.__locked():
+            header = self.__header()
+            if header[STARTS] == starts:
+                return
+            positions = self.__positions(key)
+            if header[BUILDING]:
+                self.__increment(1 - header[ACTIVE], positions)
+            if header[GENERATION] != generation:
+                # swapped since: the active buffer may come from that scan
+                self.__increment(header[ACTIVE], positions)
+
+    def remove(self, key: str) -> None:
+        positions = self.__positions(key)
+        with self.__locked():
+            header = self.__header()
+            offset = HEADER.size + header[ACTIVE] * self.size
+            memory = self._memory
+            if not all(memory[offset + position] for position in positions):
+                return
+            for position in positions:
+                if memory[offset + position] < MAX_COUNT:
+                    memory[offset + position] -= 1
+            # the buffer being rebuilt keeps the key: the scan may have read it already, or not yet
+            self.__set(KEYS, max(header[KEYS] - 1, 0))
+
+    def invalidate(self) -> None:
+        """ report every key as possibly present until the next build (e.g. keys written behind the filter) """
+        with self.__locked():
+            self.__set(READY, 0)
+            self.__set(INVALIDATIONS, self.__header()[INVALIDATIONS] + 1)
+
+    def rebuild(self, batches: Iterable[List[str]]) -> bool:
+        """
+        build the filter from a scan of the keys, in the standby buffer, then make it the active one
+        :param batches: iterator of the batches of keys
+        :return: False if another process is building the filter already
+        :raise: the errors of the scan, the active buffer is then left as is
+        """
+        with self.__locked():
+            header = self.__header()
+            if header[BUILDING] and header[BUILDER] != os.getpid() and _alive(header[BUILDER]):
+                return False
+            active, invalidations = header[ACTIVE], header[INVALIDATIONS]
+            standby = HEADER.size + (1 - active) * self.size
+            self._memory[standby:standby + self.size] = bytes(self.size)
+            self.__set(BUILDING, 1)
+            self.__set(BUILDER, os.getpid())
+            self.__set(STARTS, header[STARTS] + 1)
+        keys = 0
+        try:
+            for batch in batches:
+                # a lock per batch: the writes are never held for the whole scan
+                positions = [self.__positions(key) for key in batch]
+                with self.__locked():
+                    for key_positions in positions:
+                        self.__increment(1 - active, key_positions)
+                keys += len(batch)
+        except BaseException:
+            with self.__locked():
+                self.__set(BUILDING, 0)
+            raise
+        with self.__locked():
+            header = self.__header()
+            # invalidated during the scan: keys written behind the filter may have been missed, the next build tells
+            ready = int(header[INVALIDATIONS] == invalidations)
+            HEADER.pack_into(self._memory, 0, 1 - active, ready, 0, 0, header[GENERATION] + 1, keys,
+                             header[INVALIDATIONS], header[STARTS], header[HOLDER], time.time())
+        return True
+
+    @contextmanager
+    def __locked(self) -> Iterator[None]:
+        with self._threads_lock:
+            fcntl.lockf(self._lock_file, fcntl.LOCK_EX)
+            try:
+                header = self.__header()
+                if header[HOLDER]:
+                    # released by the system: its holder died in the middle of an update
+                    self.__set(READY, 0)
+                    self.__set(INVALIDATIONS, header[INVALIDATIONS] + 1)
+                self.__set(HOLDER, os.getpid())
+                yield
+                self.__set(HOLDER, 0)
+            finally:
+                fcntl.lockf(self._lock_file, fcntl.LOCK_UN)
+
+    def __positions(self, key: str) -> List[int]:
+        # double hashing (Kirsch-Mitzenmacher): k positions from two 64 bits hashes
+        first, second = struct.unpack('<QQ', hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest())
+        second |= 1
+        return [(first + index * second) % self.size for index in range(self.hashes)]
+
+    def __increment(self, buffer: int, positions: List[int]) -> None:
+        offset = HEADER.size + buffer * self.size
+        memory = self._memory
+        for position in positions:
+            if memory[offset + position] < MAX_COUNT:
+                memory[offset + position] += 1
+
+    def __header(self) -> tuple:
+        return HEADER.unpack_from(self._memory, 0)
+
+    def __set(self, field: int, value: float) -> None:
+        values = list(self.__header())
+        values[field] = value
+        HEADER.pack_into(self._memory, 0, *values)
+
+
+def _reset_threads_lock(reference: weakref.ref) -> None:
+    """ a forked process has only the thread that forked: the lock may have been held by another one """
+    bloom = reference()
+    if bloom is not None:
+        bloom._threads_lock = threading.Lock()
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
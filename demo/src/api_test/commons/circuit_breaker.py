@@ -0,0 +1,202 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Deque, Iterator, Tuple
+
+import structlog
+from prometheus_client import Counter, Gauge
+from structlog.typing import FilteringBoundLogger
+
+CLOSED: str = 'closed'
+HALF_OPEN: str = 'half_open'
+OPEN: str = 'open'
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+STATE = Gauge(
+        'circuit_breaker_state',
+        'State of the circuit breaker of a storage target (0 = closed, 1 = half open, 2 = open)',
+        ['target'],
+        multiprocess_mode='livemax',
+)
+TRANSITIONS = Counter(
+        'circuit_breaker_transitions_total',
+        'Number of state changes of the circuit breaker of a storage target, by new state',
+        ['target', 'state'],
+)
+REJECTED = Counter(
+        'circuit_breaker_rejected_total',
+        'Number of storage calls failed fast by the circuit breaker of a storage target',
+        ['target'],
+)
+
+
+class CircuitOpenError(Exception):
+    """ A call is rejected by an open circuit breaker """
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of the calls to a remote resource (e.g. a database), per process.
+
+    Closed: calls go through, the outcome of the last `window_size` ones is kept. Once `minimum_calls` are known, the
+    breaker opens when the rate of failed calls reaches `failure_rate_threshold`, or the rate of calls slower than
+    `slow_call_duration` reaches `slow_call_rate_threshold`.
+    Open: calls fail at once (`CircuitOpenError`) for `open_duration` seconds, then the breaker is half open.
+    Half open: only `half_open_probes` trial calls go through at a time. As many successful (and fast) trials close
+    the breaker, a failed or slow one opens it again.
+
+    The last rejection of the current thread is kept (see `rejection`), so a request can tell its storage error came
+    from an open breaker. A thread raising the error of a call made by another one records it with `record_rejection`.
+    """
+    _local = threading.local()
+    _outcomes: Deque[Tuple[bool, bool]]
+    _log: FilteringBoundLogger
+
+    def __init__(self, name: str, window_size: int = 50, minimum_calls: int = 20,
+                 failure_rate_threshold: float = 0.5, slow_call_duration: float = 2.0,
+                 slow_call_rate_threshold: float = 0.8, open_duration: float = 10.0, half_open_probes: int = 3):
+        """
+        :param name: name of the guarded resource, for the metrics and the errors
+        :param window_size: number of the last calls whose outcome is kept (default = 50)
+        :param minimum_calls: number of calls known before the breaker can open (default = 20)
+        :param failure_rate_threshold: rate of failed calls opening the breaker (default = 0.5)
+        :param slow_call_duration: seconds from which a call is slow (default = 2)
+        :param slow_call_rate_threshold: rate of slow calls opening the breaker (default = 0.8)
+        :param open_duration: seconds the breaker stays open before trying calls again (default = 10)
+        :param half_open_probes: number of trial calls of the half open breaker (default = 3)
+        """
+        self._log = structlog.get_logger()
+        self.name = name
+        self._minimum_calls = min(minimum_calls, window_size)
+        self._failure_rate_threshold = failure_rate_threshold
+        self._slow_call_duration = slow_call_duration
+        self._slow_call_rate_threshold = slow_call_rate_threshold
+        self._open_duration = open_duration
+        self._half_open_probes = half_open_probes
+        self._lock = threading.Lock()
+        # (failed, slow) of the last calls, while closed
+        self._outcomes = deque(maxlen=window_size)
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_successes = 0
+        STATE.labels(name).set(STATE_VALUES[CLOSED])
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self.__current_state()
+
+    def retry_after(self) -> float:
+        """ :return the seconds before the breaker tries calls again (0 unless open) """
+        with self._lock:
+            if self.__current_state() != OPEN:
+                return 0.0
+            return max(self._opened_at + self._open_duration - time.monotonic(), 0.0)
+
+    @contextmanager
+    def call(self, is_failure: Callable[[BaseException], bool], timed: bool = True) -> Iterator[None]:
+        """
+        guard a call: rejected at once while open, its outcome recorded otherwise
+        :param is_failure: tells whether an error of the call is a failure of the resource (not of the caller)
+        :param timed: the duration of the call counts (default = True, False when it includes the caller's work)
+        :raise CircuitOpenError: if the call is rejected
+        """
+        probe = self.__acquire()
+        started = time.monotonic()
+        try:
+            yield
+        except BaseException as error:
+            self.__record(probe, is_failure(error), time.monotonic() - started if timed else 0.0)
+            raise
+        self.__record(probe, False, time.monotonic() - started if timed else 0.0)
+
+    @classmethod
+    def rejection(cls) -> CircuitOpenError | None:
+        """ :return the last call rejection of the current thread, since `clear_rejection` """
+        return getattr(cls._local, 'rejection', None)
+
+    @classmethod
+    def clear_rejection(cls) -> None:
+        cls._local.rejection = None
+
+    @classmethod
+    def record_rejection(cls, error: BaseException) -> None:
+        """
+        keep the rejection an error comes from (its causes included) as the last one of the current thread, e.g. the
+        error of a rejected call shared with the threads waiting for it
+        :param error: error raised in the current thread
+        """
+        seen = set()
+        while error is not None and id(error) not in seen:
+            if isinstance(error, CircuitOpenError):
+                cls._local.rejection = error
+                return
+            seen.add(id(error))
+            error = error.__cause__ or error.__context__
+
+    def __acquire(self) -> bool:
+        """ :return True if the call is a trial call of the half open breaker """
+        with self._lock:
+            state = self.__current_state()
+            if state == CLOSED:
+                return False
+            if state == HALF_OPEN and self._probes < self._half_open_probes:
+                self._probes += 1
+                return True
+            retry_after = max(self._opened_at + self._open_duration - time.monotonic(), 1.0)
+        REJECTED.labels(self.name).inc()
+        rejection = CircuitOpenError(f'circuit breaker {state} on {self.name}', retry_after)
+        self._local.rejection = rejection
+        raise rejection
+
+    def __record(self, probe: bool, failed: bool, duration: float) -> None:
+        slow = duration >= self._slow_call_duration
+        with self._lock:
+            if probe:
+                self._probes -= 1
+                if self._state != HALF_OPEN:
+                    return
+                if failed or slow:
+                    self.__transition(OPEN)
+                    return
+                self._probe_successes += 1
+                if self._probe_successes >= self._half_open_probes:
+                    self.__transition(CLOSED)
+                return
+            if self._state != CLOSED:
+                # a call started before the breaker opened
+                return
+            self._outcomes.append((failed, slow))
+            if len(self._outcomes) < self._minimum_calls:
+                return
+            failures = sum(1 for call_failed, _ in self._outcomes if call_failed)
+            slow_calls = sum(1 for _, call_slow in self._outcomes if call_slow)
+            if (failures / len(self._outcomes) >= self._failure_rate_threshold
+                    or slow_calls / len(self._outcomes) >= self._slow_call_rate_threshold):
+                self.__transition(OPEN)
+
+    def __current_state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self._open_duration:
+            self.__transition(HALF_OPEN)
+        return self._state
+
+    def __transition(self, state: str) -> None:
+        self._state = state
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        elif state == HALF_OPEN:
+            self._probe_successes = 0
+        else:
+            self._outcomes.clear()
+        if state == OPEN:
+            self._log.warn(f'circuit breaker open on {self.name}, calls fail fast for {self._open_duration}s')
+        else:
+            self._log.info(f'circuit breaker {state} on {self.name}')
+        STATE.labels(self.name).set(STATE_VALUES[state])
+        TRANSITIONS.labels(self.name, state).inc()
@@ -0,0 +1,20 @@
+from typing import List
+
+import click
+
+
+class DefaultGroup(click.Group):
+    """
+    Click group that falls back on a default sub-command when the first argument is not a known command,
+    so `api-test [Options] hostname port` keeps working alongside `api-test <command> ...`
+    """
+
+    def __init__(self, *args, default_command: str = None, **kwargs):
+        click.Group.__init__(self, *args, **kwargs)
+        self.default_command = default_command
+
+    def parse_args(self, ctx: click.Context, args: List[str]) -> List[str]:
+        if self.default_command is not None and args and args[0] not in self.commands \
+                and args[0] not in self.get_help_option_names(ctx):
+            args.insert(0, self.default_command)
+        return click.Group.parse_args(self, ctx, args)
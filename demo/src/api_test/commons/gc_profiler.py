@@ -10,21 +10,34 @@ class GcProfiler:
                                       ['generation'],
                                       registry=core.REGISTRY)
         self.last_collection_start = None
+        # collection time not yet reported, by generation
+        self._pending = {0: 0.0, 1: 0.0, 2: 0.0}
 
     def now(self) -> float:
         """ :return Process time for profiling: sum of the kernel and user-space CPU time. """
         return time.process_time()
 
-    def update_metrics(self, interval: float):
-        """ update a metrics by interval"""
-        self.collection_total.labels(generation=interval).inc()
-
-    def callback(self, phase: str, _):
+    def update_metrics(self, generation: int, interval: float):
+        """ accumulate the interval spent in a collection of the generation (reported on next `flush`) """
+        self._pending[generation] += interval
+
+    def flush(self):
+        """
+        report the accumulated collection time in the metric.
+        Never called from the gc callback: a collection can start while a thread holds the (non reentrant)
+        lock of the multiprocess metric values, updating a metric from the callback would deadlock it.
+        """
+        for generation, interval in self._pending.items():
+            if interval:
+                self._pending[generation] = 0.0
+                self.collection_total.labels(generation=generation).inc(interval)
+
+    def callback(self, phase: str, info: dict):
         if phase == 'start':
             self.last_collection_start = self.now()
-        elif phase == 'stop':
+        elif phase == 'stop' and self.last_collection_start is not None:
             now = self.now()
-            self.update_metrics(now - self.last_collection_start)
+            self.update_metrics(info['generation'], now - self.last_collection_start)
 
 
 def set_function_on_map_gauge(gauge: Gauge, label_values: tuple, fn: any):
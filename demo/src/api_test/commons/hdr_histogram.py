@@ -0,0 +1,130 @@
+from typing import Dict, Iterable, Tuple
+
+
+class LogLinearHistogram:
+    """
+    HDR-like histogram of non-negative integer values (e.g. latencies in microseconds).
+
+    Values below `2 ** sub_bucket_bits` are counted exactly, above it every power of two is split in
+    `2 ** (sub_bucket_bits - 1)` linear sub-buckets, so the relative error stays below `2 ** (1 - sub_bucket_bits)`
+    (0.8% with the default 8 bits) whatever the magnitude. Counts are kept sparse, so histograms are cheap to
+    serialize and to merge (across workers, load generator tasks, ...).
+    """
+    __slots__ = ('_sub_bucket_bits', '_sub_bucket_count', '_sub_bucket_half', '_counts',
+                 'total_count', 'total_sum', 'min', 'max')
+
+    def __init__(self, sub_bucket_bits: int = 8):
+        self._sub_bucket_bits = sub_bucket_bits
+        self._sub_bucket_count = 1 << sub_bucket_bits
+        self._sub_bucket_half = self._sub_bucket_count >> 1
+        self._counts: Dict[int, int] = dict()
+        self.total_count = 0
+        self.total_sum = 0
+        self.min = 0
+        self.max = 0
+
+    def _index(self, value: int) -> int:
+        if value < self._sub_bucket_count:
+            return value
+        shift = value.bit_length() - self._sub_bucket_bits
+        return self._sub_bucket_count + (shift - 1) * self._sub_bucket_half + (value >> shift) - self._sub_bucket_half
+
+    def _bounds(self, index: int) -> Tuple[int, int]:
+        """ :return the [lowest, highest] values counted in the bucket at index """
+        if index < self._sub_bucket_count:
+            return index, index
+        shift, sub = divmod(index - self._sub_bucket_count, self._sub_bucket_half)
+        shift += 1
+        lowest = (sub + self._sub_bucket_half) << shift
+        return lowest, lowest + (1 << shift) - 1
+
+    def record(self, value: int, count: int = 1) -> None:
+        """ count the value (negative values are counted as 0) """
+        value = max(int(value), 0)
+        index = self._index(value)
+        self._counts[index] = self._counts.get(index, 0) + count
+        if self.total_count == 0 or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.total_count += count
+        self.total_sum += value * count
+
+    def merge(self, other: 'LogLinearHistogram') -> 'LogLinearHistogram':
+        """ add the counts of another histogram (with the same precision) to this one """
+        if other._sub_bucket_bits != self._sub_bucket_bits:
+            raise ValueError('cannot merge histograms with different precisions')
+        if other.total_count == 0:
+            return self
+        for index, count in other._counts.items():
+            self._counts[index] = self._counts.get(index, 0) + count
+        self.min = other.min if self.total_count == 0 else min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.total_count += other.total_count
+        self.total_sum += other.total_sum
+        return self
+
+    def reset(self) -> None:
+        self._counts.clear()
+        self.total_count = 0
+        self.total_sum = 0
+        self.min = 0
+        self.max = 0
+
+    @property
+    def mean(self) -> float:
+        return self.total_sum / self.total_count if self.total_count else 0.0
+
+    def percentile(self, percentile: float) -> int:
+        """
+        :param percentile: percentile to compute, between 0 and 100
+        :return: the highest value equivalent to the percentile (capped to the recorded max)
+        """
+        if self.total_count == 0:
+            return 0
+        rank = max(1, round(self.total_count * min(max(percentile, 0.0), 100.0) / 100))
+        seen = 0
+        for index in sorted(self._counts):
+            seen += self._counts[index]
+            if seen >= rank:
+                return min(self._bounds(index)[1], self.max)
+        return self.max
+
+    def percentiles(self, percentiles: Iterable[float]) -> Dict[float, int]:
+        """ :return the values of several percentiles, in a single walk of the buckets """
+        if self.total_count == 0:
+            return {percentile: 0 for percentile in percentiles}
+        ranks = sorted((max(1, round(self.total_count * min(max(percentile, 0.0), 100.0) / 100)), percentile)
+                       for percentile in percentiles)
+        values: Dict[float, int] = dict()
+        seen, position = 0, 0
+        for index in sorted(self._counts):
+            seen += self._counts[index]
+            while position < len(ranks) and seen >= ranks[position][0]:
+                values[ranks[position][1]] = min(self._bounds(index)[1], self.max)
+                position += 1
+        for _, percentile in ranks[position:]:
+            values[percentile] = self.max
+        return values
+
+    def to_dict(self) -> dict:
+        """ :return a json serializable representation of the histogram """
+        return {
+                'sub_bucket_bits': self._sub_bucket_bits,
+                'counts'         : {str(index): count for index, count in self._counts.items()},
+                'total_count'    : self.total_count,
+                'total_sum'      : self.total_sum,
+                'min'            : self.min,
+                'max'            : self.max,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'LogLinearHistogram':
+        """ :return the histogram serialized by `to_dict` """
+        histogram = cls(data['sub_bucket_bits'])
+        histogram._counts = {int(index): count for index, count in data['counts'].items()}
+        histogram.total_count = data['total_count']
+        histogram.total_sum = data['total_sum']
+        histogram.min = data['min']
+        histogram.max = data['max']
+        return histogram
@@ -0,0 +1,31 @@
+import hashlib
+
+_JUMP_MULTIPLIER: int = 2862933555777941757
+_UINT64_MASK: int = 0xFFFFFFFFFFFFFFFF
+
+
+def stable_hash(key: str) -> int:
+    """
+    :return a 64 bits hash of the key, identical in every process and python version (unlike `hash()`, which is
+        salted per process)
+    """
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def jump_hash(key_hash: int, buckets: int) -> int:
+    """
+    Jump consistent hash (Lamping & Veach): when the number of buckets grows from n to n + 1, only 1 / (n + 1) of
+    the keys move, all of them to the new bucket.
+
+    :param key_hash: 64 bits hash of the key (see `stable_hash`)
+    :param buckets: number of buckets (> 0)
+    :return: bucket of the key, between 0 and buckets - 1
+    """
+    if buckets <= 0:
+        raise ValueError('the number of buckets must be positive')
+    bucket, candidate = -1, 0
+    while candidate < buckets:
+        bucket = candidate
+        key_hash = (key_hash * _JUMP_MULTIPLIER + 1) & _UINT64_MASK
+        candidate = int((bucket + 1) * ((1 << 31) / ((key_hash >> 33) + 1)))
+    return bucket
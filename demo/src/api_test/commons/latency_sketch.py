@@ -0,0 +1,89 @@
+import glob
+import json
+import os
+import threading
+import time
+from typing import Dict
+
+from .hdr_histogram import LogLinearHistogram
+
+SKETCH_FILE_PREFIX: str = 'latency_sketch_'
+
+
+def remove_sketch_file(pid: int, directory: str = None) -> None:
+    """
+    remove the histograms of a worker gone (gunicorn `child_exit`, like `multiprocess.mark_process_dead`)
+    :param pid: pid of the worker
+    :param directory: directory shared by the workers (default = PROMETHEUS_MULTIPROC_DIR)
+    """
+    directory = directory or os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if directory is None:
+        return
+    path = os.path.join(directory, f'{SKETCH_FILE_PREFIX}{pid}.json')
+    for stale_path in (path, f'{path}.tmp'):
+        try:
+            os.remove(stale_path)
+        except FileNotFoundError:
+            pass
+
+
+class LatencySketch:
+    """
+    Per worker HDR-like latency histograms (in microseconds) by route.
+
+    Each worker periodically dumps its histograms in the prometheus multiprocess directory, any worker can then
+    merge the histograms of all of them to answer precise quantiles for the whole application.
+    """
+
+    def __init__(self, directory: str = None, flush_interval: float = 1.0):
+        """
+        :param directory: directory shared by the workers (default = PROMETHEUS_MULTIPROC_DIR, in process only
+            when it is not set)
+        :param flush_interval: minimum seconds between two dumps of the worker histograms (default = 1)
+        """
+        self._directory = directory or os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+        self._flush_interval = flush_interval
+        self._histograms: Dict[str, LogLinearHistogram] = dict()
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def observe(self, route: str, seconds: float) -> None:
+        """ record a request latency of the route, the histograms are dumped at most once per flush interval """
+        with self._lock:
+            histogram = self._histograms.get(route)
+            if histogram is None:
+                histogram = self._histograms[route] = LogLinearHistogram()
+            histogram.record(int(seconds * 1_000_000))
+        if self._directory is not None and time.monotonic() - self._last_flush > self._flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        """ dump the histograms of this worker in the shared directory """
+        if self._directory is None:
+            return
+        self._last_flush = time.monotonic()
+        with self._lock:
+            data = {route: histogram.to_dict() for route, histogram in self._histograms.items()}
+        path = os.path.join(self._directory, f'{SKETCH_FILE_PREFIX}{os.getpid()}.json')
+        temporary_path = f'{path}.tmp'
+        with open(temporary_path, 'w') as file:
+            json.dump(data, file)
+        os.replace(temporary_path, path)
+
+    def merged(self) -> Dict[str, LogLinearHistogram]:
+        """ :return the histograms of all the workers (this one included), merged by route """
+        if self._directory is None:
+            with self._lock:
+                return {route: LogLinearHistogram().merge(histogram) for route, histogram in self._histograms.items()}
+
+        self.flush()
+        merged: Dict[str, LogLinearHistogram] = dict()
+        for path in glob.glob(os.path.join(self._directory, f'{SKETCH_FILE_PREFIX}*.json')):
+            try:
+                with open(path) as file:
+                    data = json.load(file)
+            except (OSError, ValueError):
+                continue  # being replaced by its worker, or worker gone
+            for route, histogram in data.items():
+                merged.setdefault(route, LogLinearHistogram()).merge(LogLinearHistogram.from_dict(histogram))
+        return merged
@@ -1,9 +1,16 @@
 import gc
 import platform
+from typing import Dict, Iterable, List
 
 from prometheus_client import REGISTRY, Counter, Gauge, Histogram, core
 
 from .gc_profiler import GcProfiler, set_function_on_map_gauge
+from .latency_sketch import LatencySketch
+
+# from 0.5ms to 10s, dense between 1ms and 50ms where the api SLOs are
+DEFAULT_LATENCY_BUCKETS: tuple = (0.0005, 0.001, 0.002, 0.003, 0.004, 0.005, 0.0075, 0.01, 0.0125, 0.015, 0.02,
+                                  0.025, 0.03, 0.04, 0.05, 0.075, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+UNKNOWN_ROUTE: str = 'unknown'
 
 
 class Metrics:
@@ -20,10 +27,21 @@ class Metrics:
                 except KeyError:  # probably gone already
                     pass
 
-    def __init__(self):
+    def __init__(self,
+                 latency_buckets: Iterable[float] = DEFAULT_LATENCY_BUCKETS,
+                 route_latency_buckets: Dict[str, List[float]] = None,
+                 latency_sketch: LatencySketch = None):
+        """
+        :param latency_buckets: buckets (in seconds) of the request latency histogram
+        :param route_latency_buckets: buckets overriding `latency_buckets` by route template (e.g. `/message/{key}`)
+        :param latency_sketch: optional per worker HDR-like latency sketch, for precise quantiles
+        """
+        self._latency_buckets = tuple(latency_buckets)
+        self._route_latency_buckets = route_latency_buckets or dict()
+        self.latency_sketch = latency_sketch
         self.burninate_gc_collector()
-        profiler = GcProfiler()
-        gc.callbacks.append(profiler.callback)
+        self._gc_profiler = GcProfiler()
+        gc.callbacks.append(self._gc_profiler.callback)
 
         # Setup metrics
         # Python info
@@ -77,13 +95,45 @@ class Metrics:
         self._set_http_total_request()
         self._set_request_latency_historygram()
 
+    def flush_gc_profiler(self):
+        """ report the garbage collection time accumulated since the last call """
+        self._gc_profiler.flush()
+
+    def observe_request(self, method: str, route: str | None, status: str, seconds: float):
+        """
+        count a served request and observe its latency
+        :param route: route template of the request (None when no route matched)
+        """
+        route = route or UNKNOWN_ROUTE
+        self.requests.labels(method=method, path=route, status=status).inc()
+        self.route_historygrams.get(route, self.request_historygram).labels(
+                method=method,
+                path=route,
+                status=status,
+        ).observe(seconds)
+        if self.latency_sketch is not None:
+            self.latency_sketch.observe(route, seconds)
+
     def _set_request_latency_historygram(self):
         self.request_historygram = Histogram(
                 'request_latency_seconds',
                 'Histogram of request latency',
                 ['method', 'path', 'status'],
                 registry=core.REGISTRY,
+                buckets=self._latency_buckets,
         )
+        # a registry holds a single bucket layout by metric, the route specific histograms share the metric name
+        # but stay out of the registry: their samples are written in (and collected from) the multiprocess files
+        self.route_historygrams = {
+                route: Histogram(
+                        'request_latency_seconds',
+                        'Histogram of request latency',
+                        ['method', 'path', 'status'],
+                        registry=None,
+                        buckets=tuple(buckets),
+                )
+                for route, buckets in self._route_latency_buckets.items()
+        }
 
     def _set_http_total_request(self):
         self.requests = Counter(
@@ -0,0 +1,75 @@
+import threading
+from typing import Callable, Dict, Generic, TypeVar
+
+R = TypeVar('R')
+
+
+class _Flight(Generic[R]):
+    """ call in progress for a key """
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: R | None = None
+        self.error: BaseException | None = None
+
+
+class SingleFlight(Generic[R]):
+    """
+    Call coalescing (Go's `singleflight`): while a call for a key is in progress, the other threads asking for the
+    same key don't run it again, they wait for it and share its result, or its error.
+
+    Nothing is kept once the call returns: a caller arriving afterwards runs a new call, a result is never older than
+    the call in progress when the caller arrived (a cache, if any, goes in front). The shared result must not be
+    modified by the callers.
+    """
+    _flights: Dict[str, _Flight[R]]
+    _lock: threading.Lock
+    _on_coalesced: Callable[[], None] | None
+    _on_shared_error: Callable[[BaseException], None] | None
+
+    def __init__(self, on_coalesced: Callable[[], None] | None = None,
+                 on_shared_error: Callable[[BaseException], None] | None = None):
+        """
+        :param on_coalesced: called each time a caller waits for the call of another one instead of running it
+        :param on_shared_error: called in each waiting caller with the error of the call, before it is raised there
+            (e.g. to keep the thread local state the call left in the thread that ran it)
+        """
+        self._flights = dict()
+        self._lock = threading.Lock()
+        self._on_coalesced = on_coalesced
+        self._on_shared_error = on_shared_error
+
+    def do(self, key: str, call: Callable[[], R]) -> R:
+        """
+        run the call, or wait for the call already in progress for the key
+        :param key: key of the call, calls of the same key must give the same result
+        :param call: function producing the result
+        :return: result of the call
+        :raise: the error of the call, raised in every caller sharing it
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+        if not leader:
+            if self._on_coalesced is not None:
+                self._on_coalesced()
+            flight.done.wait()
+            if flight.error is not None:
+                if self._on_shared_error is not None:
+                    self._on_shared_error(flight.error)
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = call()
+        except BaseException as err:
+            flight.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result
@@ -0,0 +1,195 @@
+import gc
+import glob
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Tuple
+
+from .tracking import RequestTrace
+
+SLOW_REQUESTS_FILE_PREFIX: str = 'slow_requests_'
+# recent collections kept to find the ones overlapping a slow request
+GC_PAUSES_KEPT: int = 512
+
+
+def remove_slow_requests_file(pid: int, directory: str = None) -> None:
+    """
+    remove the slow requests of a worker gone (gunicorn `child_exit`, like `multiprocess.mark_process_dead`)
+    :param pid: pid of the worker
+    :param directory: directory shared by the workers (default = PROMETHEUS_MULTIPROC_DIR)
+    """
+    directory = directory or os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if directory is None:
+        return
+    path = os.path.join(directory, f'{SLOW_REQUESTS_FILE_PREFIX}{pid}.json')
+    for stale_path in (path, f'{path}.tmp'):
+        try:
+            os.remove(stale_path)
+        except FileNotFoundError:
+            pass
+
+
+class SlowRequestLog:
+    """
+    Slowest requests of each route, with what they spent their time on (storage statements, pool wait, garbage
+    collections), by worker.
+
+    Each route keeps its `per_route` slowest requests of the current window (a min heap: a request faster than the
+    fastest kept one is turned down by a single comparison, nothing else is built for it) and of the previous one, so
+    an old outlier leaves after two windows. Like the latency sketch, each worker dumps its records in the prometheus
+    multiprocess directory (at most once per flush interval), so any worker can answer for all of them. Each window is
+    dumped with the epoch its records leave at: the records of an idle worker, which dumps nothing more, leave the
+    merge in time too.
+    """
+    _windows: Tuple[Dict[str, list], Dict[str, list]]
+    _gc_pauses: Deque[Tuple[float, float, int]]
+
+    def __init__(self, per_route: int = 10, window: float = 300.0, min_duration: float = 0.0, directory: str = None,
+                 flush_interval: float = 1.0):
+        """
+        :param per_route: number of requests kept by route and window (default = 10)
+        :param window: seconds of a window (default = 5 minutes)
+        :param min_duration: seconds below which a request is never kept (default = 0)
+        :param directory: directory shared by the workers (default = PROMETHEUS_MULTIPROC_DIR, in process only
+            when it is not set)
+        :param flush_interval: minimum seconds between two dumps of the worker records (default = 1)
+        """
+        self._per_route = per_route
+        self._window = window
+        self._min_duration = min_duration
+        self._directory = directory or os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+        self._flush_interval = flush_interval
+        self._lock = threading.Lock()
+        # (current, previous) windows: heap of (seconds, sequence, record) by route
+        self._windows = (dict(), dict())
+        self._window_end = time.monotonic() + window
+        self._sequence = itertools.count()
+        self._last_flush = time.monotonic()
+        self._dirty = False
+        # (start, end, generation) of the last collections, in perf_counter time
+        self._gc_pauses = deque(maxlen=GC_PAUSES_KEPT)
+        self._gc_started = None
+        gc.callbacks.append(self.__gc_callback)
+
+    def admits(self, route: str, seconds: float) -> bool:
+        """ :return True if a request of the route lasting `seconds` would be kept (no lock, may be stale) """
+        if seconds < self._min_duration:
+            return False
+        kept = self._windows[0].get(route)
+        return kept is None or len(kept) < self._per_route or seconds > kept[0][0]
+
+    def record(self, route: str, method: str, path: str, status: str, trace: RequestTrace, seconds: float,
+               request_bytes: int | None, response_bytes: int | None) -> None:
+        """ keep a request among the slowest of its route, if it still is one of them """
+        ended = trace.started + seconds
+        pauses = [(generation, end - start) for start, end, generation in list(self._gc_pauses)
+                  if start < ended and end > trace.started]
+        record = {
+                'tracking_id'       : trace.tracking_id,
+                'method'            : method,
+                'route'             : route,
+                'path'              : path,
+                'status'            : status,
+                'pid'               : os.getpid(),
+                'started_at'        : trace.started_at,
+                'ended_at'          : trace.started_at + seconds,
+                'duration_ms'       : round(seconds * 1000, 3),
+                'request_bytes'     : request_bytes,
+                'response_bytes'    : response_bytes,
+                'db_ms'             : round(sum(statement[2] for statement in trace.statements) * 1000, 3),
+                'pool_wait_ms'      : round(trace.pool_wait * 1000, 3),
+                'statements'        : [{'entity': entity, 'statement': statement, 'ms': round(took * 1000, 3),
+                                        'rows': rows} for entity, statement, took, rows in trace.statements],
+                'dropped_statements': trace.dropped_statements,
+                'gc_ms'             : round(sum(pause for _, pause in pauses) * 1000, 3),
+                'gc_pauses'         : [{'generation': generation, 'ms': round(pause * 1000, 3)}
+                                       for generation, pause in pauses],
+        }
+        with self._lock:
+            self.__rotate()
+            kept = self._windows[0].setdefault(route, [])
+            entry = (seconds, next(self._sequence), record)
+            if len(kept) < self._per_route:
+                heapq.heappush(kept, entry)
+            elif seconds > kept[0][0]:
+                heapq.heapreplace(kept, entry)
+            else:
+                return
+            self._dirty = True
+        if self._directory is not None and time.monotonic() - self._last_flush > self._flush_interval:
+            self.flush()
+
+    def records(self) -> Dict[str, List[dict]]:
+        """ :return the slowest requests of this worker by route, the slowest first """
+        with self._lock:
+            self.__rotate()
+            return self.__slowest(*self._windows)
+
+    def flush(self) -> None:
+        """ dump the records of this worker in the shared directory, each window with the epoch it expires at """
+        if self._directory is None or not self._dirty:
+            return
+        self._last_flush = time.monotonic()
+        self._dirty = False
+        with self._lock:
+            self.__rotate()
+            window_end = time.time() + self._window_end - time.monotonic()
+            # the current window becomes the previous one at its end, its records leave a window later
+            windows = [{'expires_at': window_end + self._window, 'routes': self.__slowest(self._windows[0])},
+                       {'expires_at': window_end, 'routes': self.__slowest(self._windows[1])}]
+        path = os.path.join(self._directory, f'{SLOW_REQUESTS_FILE_PREFIX}{os.getpid()}.json')
+        temporary_path = f'{path}.tmp'
+        with open(temporary_path, 'w') as file:
+            json.dump({'windows': windows}, file)
+        os.replace(temporary_path, path)
+
+    def merged(self) -> Dict[str, List[dict]]:
+        """ :return the slowest requests of all the workers (this one included) by route, the slowest first """
+        if self._directory is None:
+            return self.records()
+
+        self.flush()
+        now = time.time()
+        merged: Dict[str, List[dict]] = dict()
+        for path in glob.glob(os.path.join(self._directory, f'{SLOW_REQUESTS_FILE_PREFIX}*.json')):
+            try:
+                with open(path) as file:
+                    data = json.load(file)
+            except (OSError, ValueError):
+                continue  # being replaced by its worker, or worker gone
+            for window in data.get('windows', []):
+                # expired since its worker dumped it (an idle worker dumps nothing more)
+                if window['expires_at'] <= now:
+                    continue
+                for route, records in window['routes'].items():
+                    merged.setdefault(route, []).extend(records)
+        return {route: sorted(records, key=lambda record: record['duration_ms'], reverse=True)[:self._per_route]
+                for route, records in merged.items()}
+
+    def __slowest(self, *windows: Dict[str, list]) -> Dict[str, List[dict]]:
+        kept_by_route: Dict[str, List[Tuple[float, int, dict]]] = dict()
+        for window in windows:
+            for route, kept in window.items():
+                kept_by_route.setdefault(route, []).extend(kept)
+        return {route: [record for _, _, record in heapq.nlargest(self._per_route, kept)]
+                for route, kept in kept_by_route.items()}
+
+    def __rotate(self) -> None:
+        now = time.monotonic()
+        if now >= self._window_end:
+            # no request for more than a window: the current window is over too
+            previous = self._windows[0] if now < self._window_end + self._window else dict()
+            self._windows = (dict(), previous)
+            self._window_end = now + self._window
+            self._dirty = True
+
+    def __gc_callback(self, phase: str, info: dict) -> None:
+        # wall clock (a pause stops every thread), no lock: a collection can start while a thread holds one
+        if phase == 'start':
+            self._gc_started = time.perf_counter()
+        elif phase == 'stop' and self._gc_started is not None:
+            self._gc_pauses.append((self._gc_started, time.perf_counter(), info['generation']))
@@ -0,0 +1,61 @@
+import threading
+import time
+from typing import List, Tuple
+
+# tracking id and trace of the request served by the current thread
+_local_thread = threading.local()
+# statements kept by trace: a request looping over the storage doesn't grow its trace without limit
+MAX_TRACED_STATEMENTS: int = 200
+
+
+class RequestTrace:
+    """
+    What a request spends its time on, filled while it runs by cheap appends (see `record_statement`), only read
+    once the request is known to be slow
+    """
+    __slots__ = ('tracking_id', 'started_at', 'started', 'statements', 'dropped_statements', 'pool_wait')
+
+    def __init__(self, tracking_id: str | None):
+        self.tracking_id = tracking_id
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        # (entity, statement, seconds, rows)
+        self.statements: List[Tuple[str, str, float, int | None]] = []
+        self.dropped_statements = 0
+        self.pool_wait = 0.0
+
+
+def get_tracking_id() -> str | None:
+    """ :return the tracking id (`x-request-id`) of the request served by the current thread, None out of a request """
+    return getattr(_local_thread, 'tracking_id', None)
+
+
+def set_tracking_id(tracking_id: str = None) -> None:
+    _local_thread.tracking_id = tracking_id
+
+
+def get_trace() -> RequestTrace | None:
+    """ :return the trace of the request served by the current thread, None out of a traced request """
+    return getattr(_local_thread, 'trace', None)
+
+
+def set_trace(trace: RequestTrace = None) -> None:
+    _local_thread.trace = trace
+
+
+def record_statement(entity: str, statement: str, seconds: float, rows: int = None) -> None:
+    """ add a storage statement to the trace of the current request (no-op out of a traced request) """
+    trace = getattr(_local_thread, 'trace', None)
+    if trace is None:
+        return
+    if len(trace.statements) < MAX_TRACED_STATEMENTS:
+        trace.statements.append((entity, statement, seconds, rows))
+    else:
+        trace.dropped_statements += 1
+
+
+def record_pool_wait(seconds: float) -> None:
+    """ add a connection pool wait to the trace of the current request (no-op out of a traced request) """
+    trace = getattr(_local_thread, 'trace', None)
+    if trace is not None:
+        trace.pool_wait += seconds
@@ -0,0 +1,13 @@
+from functools import lru_cache
+from importlib import metadata
+
+DISTRIBUTION_NAME: str = 'api_test'
+
+
+@lru_cache(maxsize=None)
+def get_version() -> str:
+    """ :return the installed distribution version, resolved once per process """
+    try:
+        return metadata.version(DISTRIBUTION_NAME)
+    except metadata.PackageNotFoundError:
+        return 'unknown'
@@ -0,0 +1,59 @@
+"""
+Split the message table in hash partitions on its key, so writes are spread over several heaps and indexes
+(less contention on the primary key index, smaller vacuums).
+
+Needs downtime: the steps run in one transaction, the table is renamed (ACCESS EXCLUSIVE lock) then copied whole
+before the commit, so every read and write of the messages waits for the copy. Stop the API before applying it on a
+large table, the lock timeout of the migration runner does not apply once the lock is taken.
+"""
+from yoyo import step
+
+__depends__ = {'001_initial_db_creation'}
+
+# changing the number of partitions needs a new migration (the rows are re-routed on copy)
+PARTITION_COUNT: int = 16
+
+PARTITIONS: str = '\n'.join(
+        f'CREATE TABLE message_p{remainder:02d} PARTITION OF message '
+        f'FOR VALUES WITH (MODULUS {PARTITION_COUNT}, REMAINDER {remainder});'
+        for remainder in range(PARTITION_COUNT))
+
+steps = [
+        step(
+                """
+                ALTER TABLE message RENAME TO message_unpartitioned;
+                ALTER TABLE message_unpartitioned RENAME CONSTRAINT message_pkey TO message_unpartitioned_pkey;
+                """,
+                """
+                ALTER TABLE message_unpartitioned RENAME CONSTRAINT message_unpartitioned_pkey TO message_pkey;
+                ALTER TABLE message_unpartitioned RENAME TO message;
+                """
+        ),
+        step(
+                f"""
+                CREATE TABLE message
+                (
+                    "key"        text PRIMARY KEY,
+                    "attributes" jsonb
+                ) PARTITION BY HASH ("key");
+                {PARTITIONS}
+                """,
+                """
+                DROP TABLE message;
+                """
+        ),
+        step(
+                """
+                INSERT INTO message (key, attributes) SELECT key, attributes FROM message_unpartitioned;
+                DROP TABLE message_unpartitioned;
+                """,
+                """
+                CREATE TABLE message_unpartitioned
+                (
+                    "key"        text CONSTRAINT message_unpartitioned_pkey PRIMARY KEY,
+                    "attributes" jsonb
+                );
+                INSERT INTO message_unpartitioned (key, attributes) SELECT key, attributes FROM message;
+                """
+        ),
+]
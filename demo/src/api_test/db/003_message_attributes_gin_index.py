@@ -0,0 +1,56 @@
+"""
+Index the message attributes for containment queries (`attributes @> '{...}'`, see `GET /messages`).
+
+An index can't be built concurrently on a partitioned table: each partition index is built concurrently (writes
+go on meanwhile), then attached to an index created on the parent table only, which becomes valid once every
+partition is attached.
+"""
+from yoyo import step
+
+__depends__ = {'002_message_hash_partitions'}
+# CREATE INDEX CONCURRENTLY can't run in a transaction
+__transactional__ = False
+
+# partitions created by 002_message_hash_partitions
+PARTITION_COUNT: int = 16
+INDEX_NAME: str = 'message_attributes_idx'
+
+
+# one statement per step: several statements sent at once run in an implicit transaction block.
+# A failed concurrent build leaves an invalid index behind: it alone is dropped (a plain drop, a DO block runs in a
+# transaction) so the migration can be applied again, the partition indexes already built are kept
+PARTITION_STEPS: list = [
+        partition_step
+        for remainder in range(PARTITION_COUNT)
+        for partition_step in (
+                step(
+                        f"""
+                        DO $$
+                        BEGIN
+                            IF EXISTS (SELECT FROM pg_index
+                                       WHERE indexrelid = to_regclass('{INDEX_NAME}_p{remainder:02d}')
+                                       AND NOT indisvalid) THEN
+                                DROP INDEX {INDEX_NAME}_p{remainder:02d};
+                            END IF;
+                        END $$;
+                        """
+                ),
+                step(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {INDEX_NAME}_p{remainder:02d} '
+                     f'ON message_p{remainder:02d} USING gin (attributes jsonb_path_ops)'),
+        )
+]
+
+steps = [
+        *PARTITION_STEPS,
+        step(
+                f"""
+                CREATE INDEX IF NOT EXISTS {INDEX_NAME} ON ONLY message USING gin (attributes jsonb_path_ops);
+                {' '.join(f'ALTER INDEX {INDEX_NAME} ATTACH PARTITION {INDEX_NAME}_p{remainder:02d};'
+                          for remainder in range(PARTITION_COUNT))}
+                """,
+                # dropping the parent index drops the attached partition indexes
+                f"""
+                DROP INDEX IF EXISTS {INDEX_NAME};
+                """
+        ),
+]
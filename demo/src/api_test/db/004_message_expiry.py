@@ -0,0 +1,59 @@
+"""
+Optional time to live of the messages: `expires_at` is null for messages that never expire.
+
+Expired messages are filtered out by the reads and deleted by small batches by the expiry reaper, which looks them up
+through a partial index (only the expiring messages are indexed). Like 003, the partition indexes are built
+concurrently then attached to an index created on the parent table only.
+"""
+from yoyo import step
+
+__depends__ = {'003_message_attributes_gin_index'}
+# CREATE INDEX CONCURRENTLY can't run in a transaction
+__transactional__ = False
+
+# partitions created by 002_message_hash_partitions
+PARTITION_COUNT: int = 16
+INDEX_NAME: str = 'message_expires_at_idx'
+
+# one statement per step: several statements sent at once run in an implicit transaction block.
+# A failed concurrent build leaves an invalid index behind: it alone is dropped (a plain drop, a DO block runs in a
+# transaction) so the migration can be applied again, the partition indexes already built are kept
+PARTITION_STEPS: list = [
+        partition_step
+        for remainder in range(PARTITION_COUNT)
+        for partition_step in (
+                step(
+                        f"""
+                        DO $$
+                        BEGIN
+                            IF EXISTS (SELECT FROM pg_index
+                                       WHERE indexrelid = to_regclass('{INDEX_NAME}_p{remainder:02d}')
+                                       AND NOT indisvalid) THEN
+                                DROP INDEX {INDEX_NAME}_p{remainder:02d};
+                            END IF;
+                        END $$;
+                        """
+                ),
+                step(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {INDEX_NAME}_p{remainder:02d} '
+                     f'ON message_p{remainder:02d} (expires_at) WHERE expires_at IS NOT NULL'),
+        )
+]
+
+steps = [
+        # a nullable column without default is added without rewriting the table. No rollback: when a later step
+        # fails, yoyo runs the rollback of the steps applied before it, the column (maybe filled since) must survive
+        # the retry of the migration
+        step('ALTER TABLE message ADD COLUMN IF NOT EXISTS expires_at timestamptz'),
+        *PARTITION_STEPS,
+        step(
+                f"""
+                CREATE INDEX IF NOT EXISTS {INDEX_NAME} ON ONLY message (expires_at) WHERE expires_at IS NOT NULL;
+                {' '.join(f'ALTER INDEX {INDEX_NAME} ATTACH PARTITION {INDEX_NAME}_p{remainder:02d};'
+                          for remainder in range(PARTITION_COUNT))}
+                """,
+                # dropping the parent index drops the attached partition indexes
+                f"""
+                DROP INDEX IF EXISTS {INDEX_NAME};
+                """
+        ),
+]
@@ -0,0 +1,30 @@
+"""
+Responses of the requests sent with an `Idempotency-Key` header, replayed when the key comes back (client retries).
+
+A row is inserted and committed by the first request of a key, without `status` until its response is stored: a
+concurrent request of the same key polls the row, then replays the stored response (a failed first request deletes
+its row, the next one runs again). A row left without `status` is claimed again once expired. Rows are deleted once
+expired.
+"""
+from yoyo import step
+
+__depends__ = {'004_message_expiry'}
+
+steps = [
+        step(
+                """
+                CREATE TABLE IF NOT EXISTS idempotency_key
+                (
+                    "key"         text PRIMARY KEY,
+                    "fingerprint" text        NOT NULL,
+                    "status"      text,
+                    "body"        text,
+                    "expires_at"  timestamptz NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idempotency_key_expires_at_idx ON idempotency_key (expires_at);
+                """,
+                """
+                DROP TABLE IF EXISTS idempotency_key;
+                """
+        ),
+]
@@ -0,0 +1,53 @@
+"""
+Change feed of the messages (see `GET /messages/_changes`): every insert / update / delete of a message appends a row
+to `message_change`, numbered by a sequence, and notifies its number on the `message_change` channel. Notifications
+are delivered at commit, in commit order, to the connections listening to the channel (one per api worker).
+
+Bulk loads (seeding, NDJSON import) skip the feed with `SET LOCAL api_test.change_feed = 'off'`. Old changes are
+deleted by the expiry reaper, after `changes_retention` seconds.
+"""
+from yoyo import step
+
+__depends__ = {'005_idempotency_key'}
+
+steps = [
+        step(
+                """
+                CREATE TABLE IF NOT EXISTS message_change
+                (
+                    "seq"        bigint      GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+                    "key"        text        NOT NULL,
+                    "operation"  text        NOT NULL,
+                    "changed_at" timestamptz NOT NULL DEFAULT now()
+                );
+                """,
+                """
+                DROP TABLE IF EXISTS message_change;
+                """
+        ),
+        step(
+                """
+                CREATE OR REPLACE FUNCTION message_change_notify() RETURNS trigger LANGUAGE plpgsql AS $$
+                DECLARE
+                    change_seq bigint;
+                BEGIN
+                    IF current_setting('api_test.change_feed', true) = 'off' THEN
+                        RETURN NULL;
+                    END IF;
+                    INSERT INTO message_change (key, operation)
+                    VALUES (CASE WHEN TG_OP = 'DELETE' THEN OLD.key ELSE NEW.key END, lower(TG_OP))
+                    RETURNING seq INTO change_seq;
+                    -- the payload is the number only (at most 8000 bytes, a key could be longer)
+                    PERFORM pg_notify('message_change', change_seq::text);
+                    RETURN NULL;
+                END;
+                $$;
+                CREATE TRIGGER message_change_notify AFTER INSERT OR UPDATE OR DELETE ON message
+                FOR EACH ROW EXECUTE FUNCTION message_change_notify();
+                """,
+                """
+                DROP TRIGGER IF EXISTS message_change_notify ON message;
+                DROP FUNCTION IF EXISTS message_change_notify();
+                """
+        ),
+]
@@ -0,0 +1,28 @@
+"""
+Transaction of each change of the feed, so a client resuming after a change also gets the changes committed after it
+with a lower number (numbers are taken at insert, not at commit).
+
+`txid` is the transaction writing the change, `snapshot` the snapshot of the statement writing it: a change numbered
+below the resumed one was still uncommitted then only if its transaction is not visible in the snapshot of the resumed
+one (`pg_visible_in_snapshot`). The columns have no value for the changes written before this migration (no table
+rewrite).
+"""
+from yoyo import step
+
+__depends__ = {'006_message_change_feed'}
+
+steps = [
+        step(
+                """
+                ALTER TABLE message_change
+                    ADD COLUMN IF NOT EXISTS "txid" xid8,
+                    ADD COLUMN IF NOT EXISTS "snapshot" pg_snapshot;
+                ALTER TABLE message_change
+                    ALTER COLUMN "txid" SET DEFAULT pg_current_xact_id(),
+                    ALTER COLUMN "snapshot" SET DEFAULT pg_current_snapshot();
+                """,
+                """
+                ALTER TABLE message_change DROP COLUMN IF EXISTS "txid", DROP COLUMN IF EXISTS "snapshot";
+                """
+        ),
+]
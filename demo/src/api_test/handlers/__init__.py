@@ -13,7 +13,9 @@ class Handler:
     _schemas: dict
 
     def __init__(self, schemas: dict = None):
+        # schemas are built once per handler and reused by every request
         self._schemas = schemas
+        self._error_schema = GenericErrorPayloadSchema()
         self._log = structlog.get_logger()
 
     def handle_generic_error(self, err: Exception) -> (any, str):
@@ -21,4 +23,4 @@ class Handler:
         error['message'] = str(err)
         error['error_status'] = HTTP_500
         self._log.exception('generic error handling')
-        return GenericErrorPayloadSchema().dumps(error), HTTP_500
+        return self._error_schema.dumps(error), HTTP_500
@@ -0,0 +1,157 @@
+import json
+from typing import Iterator, Tuple
+
+from falcon import HTTP_200, HTTP_204, HTTP_400, HTTP_501, HTTP_503, Request, Response
+from structlog.typing import FilteringBoundLogger
+
+from ..repositories.backends import Change
+from ..repositories.errors.repositories_errors import StorageBackendError
+from ..services.changes import (
+    ChangeFeedClosedError,
+    ChangeFeedService,
+    ChangeFeedUnavailableError,
+    SubscriberDroppedError,
+    TooManySubscribersError,
+)
+from . import Handler
+from .dataset import NDJSON_MEDIA_TYPE
+
+SSE_MEDIA_TYPE: str = 'text/event-stream'
+LAST_EVENT_ID_HEADER: str = 'Last-Event-ID'
+SSE_FORMAT: str = 'sse'
+NDJSON_FORMAT: str = 'ndjson'
+POLL_DEFAULT_TIMEOUT: float = 30.0
+POLL_MAX_TIMEOUT: float = 60.0
+POLL_DEFAULT_LIMIT: int = 100
+POLL_MAX_LIMIT: int = 1000
+# seconds a client waits before coming back when the worker serves too many clients
+RETRY_AFTER: int = 5
+
+
+def change_json(change: Change) -> str:
+    """ :return the json document of a change """
+    return json.dumps({'seq': change.seq, 'key': change.key, 'operation': change.operation,
+                       'changed_at': change.changed_at})
+
+
+def sse_events(changes: Iterator[Change | None]) -> Iterator[bytes]:
+    """ :return the server-sent events of the changes, a comment for each heartbeat (None) """
+    # the client reconnects with the `id` of its last event in the `Last-Event-ID` header
+    yield b'retry: 1000\n\n'
+    try:
+        for change in changes:
+            if change is None:
+                yield b': keep-alive\n\n'
+            else:
+                yield f'id: {change.seq}\nevent: change\ndata: {change_json(change)}\n\n'.encode('utf-8')
+    except SubscriberDroppedError as err:
+        yield f'event: dropped\ndata: {json.dumps(str(err))}\n\n'.encode('utf-8')
+    except StorageBackendError as err:
+        yield f'event: error\ndata: {json.dumps(str(err))}\n\n'.encode('utf-8')
+    finally:
+        changes.close()
+
+
+class ChangesHandler(Handler):
+    """
+    Change feed resource
+    """
+    _log: FilteringBoundLogger
+    _svc: ChangeFeedService
+
+    def __init__(self, change_feed_service: ChangeFeedService):
+        Handler.__init__(self, None)
+        self._svc = change_feed_service
+
+    def on_get(self, req: Request, res: Response):
+        """Handles change feed GET requests.
+        ---
+        description: Follow the inserts / updates / deletes of the messages, as server-sent events (stream) or as
+            NDJSON (long poll). Changes are numbered, a client resumes after the last number it received.
+        produces: ['text/event-stream', 'application/x-ndjson']
+        parameters:
+            - in: query
+              name: since
+              description: number of the last change received (default = the `Last-Event-ID` header, none = the
+                changes from now on only)
+            - in: query
+              name: format
+              description: sse or ndjson (default = sse when the client accepts `text/event-stream`)
+            - in: query
+              name: timeout
+              description: ndjson only, maximum seconds waited for a change (default = 30, at most 60)
+            - in: query
+              name: limit
+              description: ndjson only, maximum number of changes (default = 100, at most 1000)
+        responses:
+            200:
+                description: 'Stream of `change` events (sse), or one `{"seq", "key", "operation", "changed_at"}`
+                    json document per line (ndjson). A dropped sse client receives a `dropped` event and resumes (the
+                    clients of a draining worker too).'
+            204:
+                description: 'No change before the timeout (ndjson)'
+            400:
+                description: 'Invalid parameter'
+            501:
+                description: 'The storage has no change feed'
+            503:
+                description: 'Too many change feed clients, or the worker is draining, retry later'
+        """
+        try:
+            since, data_format, timeout, limit = self.__parse(req)
+        except ValueError as param_err:
+            self.__error(res, HTTP_400, str(param_err))
+            return
+
+        try:
+            if data_format == SSE_FORMAT:
+                changes = self._svc.stream(since)
+                res.status = HTTP_200
+                res.content_type = SSE_MEDIA_TYPE
+                res.set_header('Cache-Control', 'no-cache')
+                # no content length: the events go out by chunks as the changes come, until the client leaves
+                res.stream = sse_events(changes)
+                return
+            changes = self._svc.poll(since, timeout, limit)
+            if not changes:
+                res.status = HTTP_204
+                return
+            res.status = HTTP_200
+            res.content_type = NDJSON_MEDIA_TYPE
+            res.text = ''.join(f'{change_json(change)}\n' for change in changes)
+        except ChangeFeedUnavailableError as err:
+            self.__error(res, HTTP_501, str(err))
+        except (TooManySubscribersError, ChangeFeedClosedError) as err:
+            res.set_header('Retry-After', str(RETRY_AFTER))
+            self.__error(res, HTTP_503, str(err))
+        except Exception as exc:
+            res.text, res.status = self.handle_generic_error(exc)
+
+    @staticmethod
+    def __parse(req: Request) -> Tuple[int | None, str, float, int]:
+        """
+        :return: since, format, timeout and limit of the request
+        :raise ValueError: on an invalid parameter
+        """
+        since = req.params.get('since', req.get_header(LAST_EVENT_ID_HEADER))
+        since = int(since) if since is not None else None
+        if since is not None and since < 0:
+            raise ValueError('`since` must be a positive change number')
+        data_format = req.params.get('format')
+        if data_format is None:
+            accepts_sse = req.client_accepts(SSE_MEDIA_TYPE) and req.client_prefers(
+                    [SSE_MEDIA_TYPE, NDJSON_MEDIA_TYPE]) == SSE_MEDIA_TYPE
+            data_format = SSE_FORMAT if accepts_sse else NDJSON_FORMAT
+        if data_format not in (SSE_FORMAT, NDJSON_FORMAT):
+            raise ValueError(f'unknown format `{data_format}` (choose between sse / ndjson)')
+        timeout = float(req.params.get('timeout', POLL_DEFAULT_TIMEOUT))
+        if not 0 <= timeout <= POLL_MAX_TIMEOUT:
+            raise ValueError(f'`timeout` must be between 0 and {POLL_MAX_TIMEOUT:.0f}')
+        limit = int(req.params.get('limit', POLL_DEFAULT_LIMIT))
+        if not 1 <= limit <= POLL_MAX_LIMIT:
+            raise ValueError(f'`limit` must be between 1 and {POLL_MAX_LIMIT}')
+        return since, data_format, timeout, limit
+
+    def __error(self, res: Response, status: str, error: str) -> None:
+        res.status = status
+        res.text = self._error_schema.dumps({'message': error, 'error_status': status})
@@ -0,0 +1,45 @@
+from falcon import HTTP_200, HTTP_400, Request, Response
+from structlog.typing import FilteringBoundLogger
+
+from ..services.runtime_config import ConfigurationError, RuntimeConfigService
+from . import Handler
+
+
+class ReloadHandler(Handler):
+    """
+    Runtime configuration reload resource
+    """
+    _log: FilteringBoundLogger
+    _svc: RuntimeConfigService
+
+    def __init__(self, runtime_config_service: RuntimeConfigService):
+        Handler.__init__(self, None)
+        self._svc = runtime_config_service
+
+    def on_post(self, _: Request, res: Response):
+        """Handles reload POST requests.
+        ---
+        description: Reload the configuration file and apply its tunable settings to every worker, without restart
+        responses:
+            200:
+                description: 'Changes applied by the worker serving the request (the others follow within a second)'
+            400:
+                description: 'Invalid configuration, nothing is applied'
+                schema:
+                    $ref: '#/definitions/ErrorsPayload'
+        """
+        try:
+            self._svc.request_reload()
+            report = self._svc.reload()
+            res.status = HTTP_200
+            res.media = {
+                    'generation'      : report.generation,
+                    'changes'         : {name: {'previous': previous, 'current': current}
+                                         for name, (previous, current) in report.changes.items()},
+                    'restart_required': report.restart_required,
+            }
+        except ConfigurationError as err:
+            res.status = HTTP_400
+            res.text = self._error_schema.dumps({'message': str(err), 'error_status': HTTP_400})
+        except Exception as err:
+            res.text, res.status = self.handle_generic_error(err)
@@ -0,0 +1,89 @@
+from falcon import HTTP_200, HTTP_400, Request, Response
+from structlog.typing import FilteringBoundLogger
+
+from ..models.dataset import TransferSchema
+from ..repositories.errors.repositories_errors import InvalidDataError
+from ..services.dataset import DatasetService
+from . import Handler
+
+NDJSON_MEDIA_TYPE: str = 'application/x-ndjson'
+
+
+class ExportHandler(Handler):
+    """
+    Dataset export resource
+    """
+    _log: FilteringBoundLogger
+    _svc: DatasetService
+
+    def __init__(self, dataset_service: DatasetService):
+        Handler.__init__(self, None)
+        self._svc = dataset_service
+
+    def on_get(self, _: Request, res: Response):
+        """Handles export GET requests.
+        ---
+        description: Stream every message as NDJSON (chunked transfer, cut short on storage failure)
+        produces: ['application/x-ndjson']
+        responses:
+            200:
+                description: 'One `{"key", "attributes", "expires_at"}` json document per line'
+        """
+        res.status = HTTP_200
+        res.content_type = NDJSON_MEDIA_TYPE
+        # no content length: the body goes out by chunks as the storage produces it
+        res.stream = self._svc.export_chunks()
+
+
+class ImportHandler(Handler):
+    """
+    Dataset import resource
+    """
+    _log: FilteringBoundLogger
+    _svc: DatasetService
+
+    def __init__(self, dataset_service: DatasetService):
+        Handler.__init__(self, {'Transfer': TransferSchema()})
+        self._svc = dataset_service
+
+    def on_post(self, req: Request, res: Response):
+        """Handles import POST requests.
+        ---
+        description: Store the messages of a NDJSON body (streamed to the storage, one json document per line)
+        consumes: ['application/x-ndjson']
+        produces: ['application/json']
+        parameters:
+            - in: query
+              name: upsert
+              description: replace the existing messages (default = false, an existing message fails the import)
+        responses:
+            200:
+                description: 'Messages imported, with the transfer throughput'
+                schema:
+                    $ref: '#/definitions/Transfer'
+            400:
+                description: 'Invalid message or existing message, nothing is imported (except on sharded storage)'
+                schema:
+                    $ref: '#/definitions/Transfer'
+            500:
+                description: 'Internal Server Error'
+                schema:
+                    $ref: '#/definitions/ErrorsPayload'
+            503:
+                description: 'Storage unavailable (circuit breaker open), retry after `Retry-After` seconds'
+                schema:
+                    $ref: '#/definitions/ErrorsPayload'
+        """
+        try:
+            upsert = req.get_param_as_bool('upsert', default=False)
+            report = self._svc.import_messages(req.bounded_stream, upsert)
+            res.status = HTTP_200
+            res.text = self._schemas['Transfer'].dumps({'data': report})
+        except InvalidDataError as err:
+            # the storage rejects the data (invalid json, duplicate key...), its failures are server errors
+            res.status = HTTP_400
+            res.text = self._schemas['Transfer'].dumps(
+                    {'errors': [{'error_code': {'IMPORT': 'import error'}, 'error': str(err)}]}
+            )
+        except Exception as exc:
+            res.text, res.status = self.handle_generic_error(exc)
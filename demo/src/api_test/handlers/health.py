@@ -35,11 +35,11 @@ class HealthHandler(Handler):
             if self._check_health_probe():
                 self._log.debug('check ok')
                 res.status = HTTP_200
-                res.text = HealthSchema().dumps({'alive': True})
+                res.text = self._schemas['Health'].dumps({'alive': True})
             else:
                 self._log.debug('check ko')
                 res.status = HTTP_503
-                res.text = HealthSchema().dumps({'alive': False})
+                res.text = self._schemas['Health'].dumps({'alive': False})
         except Exception as err:
             res.text, res.status = self.handle_generic_error(err)
 
@@ -93,7 +93,7 @@ class ReadinessHandler(Handler):
         try:
             readiness_probes = self._health_service.get_readiness_checks()
             res.status = readiness_probes.pop('status')
-            res.text = ReadinessSchema().dumps(readiness_probes)
+            res.text = self._schemas['Readiness'].dumps(readiness_probes)
         except Exception as err:
             res.text, res.status = self.handle_generic_error(err)
 
@@ -126,6 +126,6 @@ class LivenessHandler(Handler):
         try:
             liveness_probes = self._svc.get_liveness_checks()
             res.status = liveness_probes.pop('status')
-            res.text = LivenessSchema().dumps(liveness_probes)
+            res.text = self._schemas['Liveness'].dumps(liveness_probes)
         except Exception as err:
             res.text, res.status = self.handle_generic_error(err)
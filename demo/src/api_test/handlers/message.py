@@ -1,3 +1,6 @@
+import json
+from typing import Any, Dict, List, Tuple
+
 from falcon import (
     HTTP_200,
     HTTP_201,
@@ -5,6 +8,7 @@ from falcon import (
     HTTP_400,
     HTTP_404,
     HTTP_409,
+    HTTP_422,
     HTTP_500,
     Request,
     Response,
@@ -12,10 +16,144 @@ from falcon import (
 from falcon.errors import MediaMalformedError
 from structlog.typing import FilteringBoundLogger
 
-from ..models.message import MessageSchema
-from ..services.message import ENTITY_ALREADY_EXIST, MessageService
+from ..models.message import (
+    MessageBatchSchema,
+    MessageBulkSchema,
+    MessagePageSchema,
+    MessageSchema,
+)
+from ..repositories.backends import IdempotencyKeyInProgressError
+from ..services.idempotency import (
+    IdempotencyKeyReusedError,
+    IdempotencyService,
+    request_fingerprint,
+)
+from ..services.message import ENTITY_ALREADY_EXIST, INVALID_CURSOR, MessageService
 from . import Handler
 
+ATTRIBUTE_PARAM_PREFIX: str = 'attr.'
+MERGE_PATCH_MEDIA_TYPE: str = 'application/merge-patch+json'
+TTL_HEADER: str = 'X-Message-TTL'
+IDEMPOTENCY_KEY_HEADER: str = 'Idempotency-Key'
+IDEMPOTENT_REPLAYED_HEADER: str = 'Idempotent-Replayed'
+IDEMPOTENCY_KEY_MAX_LENGTH: int = 255
+# seconds before a request repeating a key still in progress is retried
+IDEMPOTENCY_RETRY_AFTER: int = 1
+FIND_DEFAULT_LIMIT: int = 100
+FIND_MAX_LIMIT: int = 1000
+MULTI_GET_DEFAULT_MAX_KEYS: int = 1000
+BULK_DEFAULT_MAX_OPERATIONS: int = 1000
+BULK_ACTIONS: Tuple[str, ...] = ('create', 'update', 'delete')
+
+
+def parse_attribute_value(value: str) -> Any:
+    """ :return the json scalar written in the query string (`5`, `true`, `null`, `"5"`), the raw string otherwise """
+    try:
+        decoded = json.loads(value)
+    except ValueError:
+        return value
+    return value if isinstance(decoded, (dict, list)) else decoded
+
+
+class InvalidTtlError(ValueError):
+    """ Invalid time to live of a message """
+
+
+def parse_ttl(req: Request, data: dict = None) -> float | None:
+    """
+    :param req: request, whose `X-Message-TTL` header may give the time to live
+    :param data: optional `data` of the body, whose `ttl` field may give the time to live (it wins over the header)
+    :return: the seconds before the message expires, None when not given
+    :raise InvalidTtlError: if the time to live is not a positive number
+    """
+    ttl = data.get('ttl') if data else None
+    if ttl is None:
+        ttl = req.get_header(TTL_HEADER)
+    if ttl is None:
+        return None
+    try:
+        seconds = float(ttl)
+    except (TypeError, ValueError):
+        raise InvalidTtlError(f'the time to live must be a number of seconds, got `{ttl}`')
+    if not 0 < seconds < float('inf') or isinstance(ttl, bool):
+        raise InvalidTtlError(f'the time to live must be a positive number of seconds, got `{ttl}`')
+    return seconds
+
+
+def parse_keys_param(value: str | List[str]) -> List[str]:
+    """
+    :param value: `keys` query string parameter, comma separated keys (the parameter may be repeated)
+    :return: the keys, in the order given
+    """
+    values = value if isinstance(value, list) else [value]
+    return [key for keys in values for key in keys.split(',') if key]
+
+
+def parse_bulk_operations(req: Request, body: Any, max_operations: int) -> Tuple[List[dict], bool]:
+    """
+    :param req: request, whose `X-Message-TTL` header gives the time to live of the operations without `ttl`
+    :param body: `{"atomic": true, "operations": [{"action": "create", "key": ..., "attributes": {...}, "ttl": 60},
+        {"action": "delete", "key": ...}, ...]}`
+    :param max_operations: maximum number of operations
+    :return: the operations (`action`, `key`, `attributes` and `ttl` for create / update) and the atomic flag
+    :raise ValueError: on an invalid bulk (InvalidTtlError on an invalid time to live)
+    """
+    if not isinstance(body, dict) or not isinstance(body.get('operations'), list):
+        raise ValueError('`operations` must be a list of operations')
+    atomic = body.get('atomic', True)
+    if not isinstance(atomic, bool):
+        raise ValueError('`atomic` must be a boolean')
+    if not body['operations']:
+        raise ValueError('at least one operation is expected')
+    if len(body['operations']) > max_operations:
+        raise ValueError(f'at most {max_operations} operations can be run at once, got {len(body["operations"])}')
+
+    operations, keys = [], set()
+    for index, operation in enumerate(body['operations']):
+        if not isinstance(operation, dict) or operation.get('action') not in BULK_ACTIONS:
+            raise ValueError(f'operation {index} : `action` must be one of {", ".join(BULK_ACTIONS)}')
+        key = operation.get('key')
+        if not isinstance(key, str) or not key:
+            raise ValueError(f'operation {index} : `key` must be a non empty string')
+        if key in keys:
+            # the operations are grouped by action, several operations on a key would have no defined order
+            raise ValueError(f'operation {index} : the key {key} is already used by another operation')
+        keys.add(key)
+        if operation['action'] == 'delete':
+            operations.append({'action': 'delete', 'key': key})
+            continue
+        if not isinstance(operation.get('attributes'), dict):
+            raise ValueError(f'operation {index} : `attributes` must be an object')
+        operations.append({'action'    : operation['action'],
+                           'key'       : key,
+                           'attributes': operation['attributes'],
+                           'ttl'       : parse_ttl(req, operation)})
+    return operations, atomic
+
+
+def parse_attribute_params(params: Dict[str, str | List[str]]) -> Dict[str, Any]:
+    """
+    :param params: query string parameters
+    :return: the attributes pattern of the `attr.<name>=<value>` parameters (`attr.a.b=1` gives {'a': {'b': 1}})
+    :raise ValueError: on a repeated or conflicting attribute
+    """
+    pattern: Dict[str, Any] = dict()
+    for param, value in params.items():
+        if not param.startswith(ATTRIBUTE_PARAM_PREFIX):
+            continue
+        if isinstance(value, list):
+            raise ValueError(f'`{param}` is repeated')
+        *parents, name = param[len(ATTRIBUTE_PARAM_PREFIX):].split('.')
+        node = pattern
+        for parent in parents:
+            node = node.setdefault(parent, dict())
+            if not isinstance(node, dict):
+                raise ValueError(f'`{param}` conflicts with another attribute')
+        if name in node:
+            raise ValueError(f'`{param}` conflicts with another attribute')
+        node[name] = parse_attribute_value(value)
+    return pattern
+
 
 class MessageKeyHandler(Handler):
     """
@@ -57,10 +195,10 @@ class MessageKeyHandler(Handler):
 
             if len(err) > 0:
                 res.status = HTTP_404
-                res.text = MessageSchema().dumps({'errors': err})
+                res.text = self._schemas['Message'].dumps({'errors': err})
             else:
                 res.status = HTTP_200
-                res.text = MessageSchema().dumps({'data': data})
+                res.text = self._schemas['Message'].dumps({'data': data})
 
         except Exception as exc:
             res.text, res.status = self.handle_generic_error(exc)
@@ -75,6 +213,9 @@ class MessageKeyHandler(Handler):
             - in: path
               description: the key of message to update
               required: true
+            - in: header
+              name: X-Message-TTL
+              description: seconds before the message expires (or `data.ttl`, default = configured time to live)
         responses:
             204:
                 description: 'Message updated with success'
@@ -98,7 +239,7 @@ class MessageKeyHandler(Handler):
 
             if 'data' not in body:
                 res.status = HTTP_400
-                res.text = MessageSchema().dumps(
+                res.text = self._schemas['Message'].dumps(
                         {'errors': [{'error_code': {'HTTP_400': 'bad request'},
                                      'error'     : '`data` field is absent'}]}
                 )
@@ -107,22 +248,95 @@ class MessageKeyHandler(Handler):
 
                 if 'key' not in data or 'attributes' not in data:
                     res.status = HTTP_400
-                    res.text = MessageSchema().dumps(
+                    res.text = self._schemas['Message'].dumps(
                             {'errors': [{'error_code': {'HTTP_400': 'bad request'},
                                          'error'     : '`key` and/or `attributes` field(s) is(are) absent(s)'}]}
                     )
                 else:
-                    err = self._svc.update(data['attributes'], key)
+                    err = self._svc.update(data['attributes'], key, parse_ttl(req, data))
 
                     if len(err) > 0:
                         res.status = HTTP_404
-                        res.text = MessageSchema().dumps({'errors': err})
+                        res.text = self._schemas['Message'].dumps({'errors': err})
                     else:
                         res.status = HTTP_204
 
+        except InvalidTtlError as ttl_err:
+            res.status = HTTP_400
+            res.text = self._schemas['Message'].dumps(
+                    {'errors': [{'error_code': {'HTTP_400': 'bad request'},
+                                 'error'     : str(ttl_err)}]}
+            )
         except MediaMalformedError as json_err:
             res.status = json_err.status
-            res.text = MessageSchema().dumps(
+            res.text = self._schemas['Message'].dumps(
+                    {'errors': [{'error_code': {'HTTP_400': 'bad request'},
+                                 'error'     : json_err.description}]}
+            )
+        except Exception as exc:
+            res.text, res.status = self.handle_generic_error(exc)
+
+    def on_patch(self, req: Request, res: Response, key: str):
+        """ Handles messages PATCH requests.
+        ---
+        summary: 'Patch a message'
+        description: 'Apply a json merge patch (RFC 7396) to the attributes of a message, `null` removes an attribute'
+        consumes: ['application/merge-patch+json', 'application/json']
+        produces: ['application/json']
+        parameters:
+            - in: path
+              description: the key of message to patch
+              required: true
+            - in: header
+              name: X-Message-TTL
+              description: new seconds before the message expires (default = unchanged)
+        responses:
+            200:
+                description: 'Message patched with success, only the patched attributes are returned'
+                schema:
+                    $ref: '#/definitions/MessageReport'
+            400:
+                description: 'Bad Request'
+                schema:
+                    $ref: '#/definitions/MessageReport'
+            404:
+                description: 'No message found'
+                schema:
+                    $ref: '#/definitions/MessageReport'
+            500:
+                description: 'Internal Server Error'
+                schema:
+                    $ref: '#/definitions/ErrorsPayload'
+        """
+        try:
+            # noinspection PyArgumentList
+            patch = req.get_media(default_when_empty=None)
+
+            if not isinstance(patch, dict):
+                res.status = HTTP_400
+                res.text = self._schemas['Message'].dumps(
+                        {'errors': [{'error_code': {'HTTP_400': 'bad request'},
+                                     'error'     : 'the merge patch of the attributes must be a json object'}]}
+                )
+            else:
+                data, err = self._svc.patch(patch, key, parse_ttl(req))
+
+                if len(err) > 0:
+                    res.status = HTTP_404 if 'UNKNOWN' in err[0]['error_code'] else HTTP_500
+                    res.text = self._schemas['Message'].dumps({'errors': err})
+                else:
+                    res.status = HTTP_200
+                    res.text = self._schemas['Message'].dumps({'data': data})
+
+        except InvalidTtlError as ttl_err:
+            res.status = HTTP_400
+            res.text = self._schemas['Message'].dumps(
+                    {'errors': [{'error_code': {'HTTP_400': 'bad request'},
+                                 'error'     : str(ttl_err)}]}
+            )
+        except MediaMalformedError as json_err:
+            res.status = json_err.status
+            res.text = self._schemas['Message'].dumps(
                     {'errors': [{'error_code': {'HTTP_400': 'bad request'},
                                  'error'     : json_err.description}]}
             )
@@ -156,7 +370,7 @@ class MessageKeyHandler(Handler):
 
             if len(err) > 0:
                 res.status = HTTP_404
-                res.text = MessageSchema().dumps({'errors': err})
+                res.text = self._schemas['Message'].dumps({'errors': err})
             else:
                 res.status = HTTP_204
 
@@ -170,17 +384,31 @@ class MessageHandler(Handler):
     """
     _log: FilteringBoundLogger
     _svc: MessageService
+    _idempotency: IdempotencyService | None
 
-    def __init__(self, message_service: MessageService):
+    def __init__(self, message_service: MessageService, idempotency_service: IdempotencyService | None = None):
+        """
+        :param message_service: message service
+        :param idempotency_service: replays the responses of the repeated `Idempotency-Key` (None = header ignored)
+        """
         Handler.__init__(self, {'Message': MessageSchema()})
         self._svc = message_service
+        self._idempotency = idempotency_service
 
     def on_post(self, req: Request, res: Response):
         """ Handles message POST requests.
         ---
         summary: 'Create a new message'
-        description: 'Create a new message'
+        description: 'Create a new message. With an `Idempotency-Key`, the response of the first request of the key
+            is replayed to the requests repeating it (`Idempotent-Replayed: true`), which are not run again.'
         produces: ['application/json']
+        parameters:
+            - in: header
+              name: X-Message-TTL
+              description: seconds before the message expires (or `data.ttl`, default = configured time to live)
+            - in: header
+              name: Idempotency-Key
+              description: unique key of the request, retries send the same one (at most 255 characters)
         responses:
             201:
                 description: 'Message updated with success'
@@ -189,7 +417,12 @@ class MessageHandler(Handler):
                 schema:
                     $ref: '#/definitions/MessageReport'
             409:
-                description: 'Message already exist'
+                description: 'Message already exist, or first request of the idempotency key still in progress
+                    (`Retry-After`)'
+                schema:
+                    $ref: '#/definitions/MessageReport'
+            422:
+                description: 'Idempotency key already used by a different request'
                 schema:
                     $ref: '#/definitions/MessageReport'
             500:
@@ -197,14 +430,62 @@ class MessageHandler(Handler):
                 schema:
                     $ref: '#/definitions/ErrorsPayload'
         """
+        idempotency_key = req.get_header(IDEMPOTENCY_KEY_HEADER)
+        if idempotency_key is None or self._idempotency is None:
+            self.__create(req, res)
+            return
+
+        try:
+            if not 0 < len(idempotency_key) <= IDEMPOTENCY_KEY_MAX_LENGTH:
+                res.status = HTTP_400
+                res.text = self._schemas['Message'].dumps(
+                        {'errors': [{'error_code': {'HTTP_400': 'bad request'},
+                                     'error'     : f'`{IDEMPOTENCY_KEY_HEADER}` must have 1 to '
+                                                   f'{IDEMPOTENCY_KEY_MAX_LENGTH} characters'}]}
+                )
+                return
+            try:
+                # noinspection PyArgumentList
+                body = req.get_media(default_when_empty=dict())
+            except MediaMalformedError:
+                # the error of a malformed body is not kept
+                self.__create(req, res)
+                return
+            fingerprint = request_fingerprint(req.method, req.path, json.dumps(body, sort_keys=True),
+                                              req.get_header(TTL_HEADER) or '')
+
+            def create() -> Tuple[str, str | None]:
+                self.__create(req, res)
+                return res.status, res.text
+
+            res.status, res.text, replayed = self._idempotency.execute(idempotency_key, fingerprint, create)
+            if replayed:
+                res.set_header(IDEMPOTENT_REPLAYED_HEADER, 'true')
+
+        except IdempotencyKeyReusedError as reused:
+            res.status = HTTP_422
+            res.text = self._schemas['Message'].dumps(
+                    {'errors': [{'error_code': {'IDEMPOTENCY': 'idempotency key reused'},
+                                 'error'     : str(reused)}]}
+            )
+        except IdempotencyKeyInProgressError as in_progress:
+            res.status = HTTP_409
+            res.set_header('Retry-After', str(IDEMPOTENCY_RETRY_AFTER))
+            res.text = self._schemas['Message'].dumps(
+                    {'errors': [{'error_code': {'IDEMPOTENCY': 'request in progress'},
+                                 'error'     : str(in_progress)}]}
+            )
+        except Exception as exc:
+            res.text, res.status = self.handle_generic_error(exc)
 
+    def __create(self, req: Request, res: Response) -> None:
         try:
             # noinspection PyArgumentList
             body = req.get_media(default_when_empty=dict())
 
             if 'data' not in body:
                 res.status = HTTP_400
-                res.text = MessageSchema().dumps(
+                res.text = self._schemas['Message'].dumps(
                         {'errors': [{'error_code': {'HTTP_400': 'bad request'},
                                      'error'     : '`data` field is absent'}]}
                 )
@@ -213,29 +494,255 @@ class MessageHandler(Handler):
 
                 if 'key' not in data or 'attributes' not in data:
                     res.status = HTTP_400
-                    res.text = MessageSchema().dumps(
+                    res.text = self._schemas['Message'].dumps(
                             {'errors': [{'error_code': {'HTTP_400': 'bad request'},
                                          'error'     : '`key` and/or `attributes` field(s) is(are) absent(s)'}]}
                     )
                 else:
-                    err = self._svc.create(data['attributes'], data['key'])
+                    err = self._svc.create(data['attributes'], data['key'], parse_ttl(req, data))
 
                     if len(err) > 0:
                         if err[0]['error_code']['CREATE'] is ENTITY_ALREADY_EXIST:
                             res.status = HTTP_409
-                            res.text = MessageSchema().dumps({'errors': err})
+                            res.text = self._schemas['Message'].dumps({'errors': err})
                         else:
                             res.status = HTTP_500
-                            res.text = MessageSchema().dumps({'errors': err})
+                            res.text = self._schemas['Message'].dumps({'errors': err})
                     else:
                         res.status = HTTP_201
                         # TODO : return the created entity at the end
 
+        except InvalidTtlError as ttl_err:
+            res.status = HTTP_400
+            res.text = self._schemas['Message'].dumps(
+                    {'errors': [{'error_code': {'HTTP_400': 'bad request'},
+                                 'error'     : str(ttl_err)}]}
+            )
+        except MediaMalformedError as json_err:
+            res.status = json_err.status
+            res.text = self._schemas['Message'].dumps(
+                    {'errors': [{'error_code': {'HTTP_400': 'bad request'},
+                                 'error'     : json_err.description}]}
+            )
+        except Exception as exc:
+            res.text, res.status = self.handle_generic_error(exc)
+
+
+class MessagesHandler(Handler):
+    """
+    Message collection resource
+    """
+    _log: FilteringBoundLogger
+    _svc: MessageService
+
+    def __init__(self, message_service: MessageService, max_keys: int = MULTI_GET_DEFAULT_MAX_KEYS,
+                 max_operations: int = BULK_DEFAULT_MAX_OPERATIONS):
+        """
+        :param message_service: message service
+        :param max_keys: maximum number of keys read by a multi-get request (default = 1000)
+        :param max_operations: maximum number of operations of a bulk request (default = 1000)
+        """
+        Handler.__init__(self, {'Message'     : MessageSchema(),
+                                'MessagePage' : MessagePageSchema(),
+                                'MessageBatch': MessageBatchSchema(),
+                                'MessageBulk' : MessageBulkSchema()})
+        self._svc = message_service
+        self._max_keys = max_keys
+        self._max_operations = max_operations
+
+    def on_get(self, req: Request, res: Response):
+        """ Handles messages search and multi-get requests.
+        ---
+        summary: 'Find messages by attributes, or read messages by keys'
+        description: 'Find the messages containing all the `attr.<name>=<value>` attributes, by pages ordered by key.
+            With `keys`, read the messages of these keys in a single query instead.'
+        produces: ['application/json']
+        parameters:
+            - in: query
+              name: keys
+              description: comma separated keys of the messages to read (the other parameters are then ignored)
+            - in: query
+              name: attr.<name>
+              description: attribute value (json scalar, quote a string looking like one), nested with `attr.a.b`
+              required: true
+            - in: query
+              name: limit
+              description: maximum number of messages in the page (default = 100, max = 1000)
+            - in: query
+              name: cursor
+              description: `next_cursor` of the previous page
+        responses:
+            200:
+                description: 'Page of messages found, or messages read and missing keys'
+                schema:
+                    $ref: '#/definitions/MessagePage'
+            400:
+                description: 'Bad Request'
+                schema:
+                    $ref: '#/definitions/MessageReport'
+            500:
+                description: 'Internal Server Error'
+                schema:
+                    $ref: '#/definitions/ErrorsPayload'
+        """
+        if 'keys' in req.params:
+            self.__read_many(res, parse_keys_param(req.params['keys']))
+            return
+        try:
+            try:
+                attributes = parse_attribute_params(req.params)
+                limit = int(req.params.get('limit', FIND_DEFAULT_LIMIT))
+            except ValueError as param_err:
+                self.__bad_request(res, str(param_err))
+                return
+            if not attributes:
+                self.__bad_request(res, f'at least one `{ATTRIBUTE_PARAM_PREFIX}<name>` parameter is expected')
+                return
+            if not 1 <= limit <= FIND_MAX_LIMIT:
+                self.__bad_request(res, f'`limit` must be between 1 and {FIND_MAX_LIMIT}')
+                return
+
+            data, next_cursor, err = self._svc.find(attributes, limit, req.params.get('cursor'))
+
+            if len(err) > 0:
+                res.status = HTTP_400 if err[0]['error_code'].get('CURSOR') is INVALID_CURSOR else HTTP_500
+                res.text = self._schemas['MessagePage'].dumps({'errors': err})
+            else:
+                res.status = HTTP_200
+                res.text = self._schemas['MessagePage'].dumps({'data': data, 'next_cursor': next_cursor})
+
+        except Exception as exc:
+            res.text, res.status = self.handle_generic_error(exc)
+
+    def on_post_mget(self, req: Request, res: Response):
+        """ Handles messages multi-get requests, for key lists too long for a query string.
+        ---
+        summary: 'Read messages by keys'
+        description: 'Read the messages of the `keys` of the body in a single query'
+        consumes: ['application/json']
+        produces: ['application/json']
+        parameters:
+            - in: body
+              name: keys
+              description: list of the keys of the messages to read
+              required: true
+        responses:
+            200:
+                description: 'Messages read (in the order of the keys) and missing keys'
+                schema:
+                    $ref: '#/definitions/MessageBatch'
+            400:
+                description: 'Bad Request'
+                schema:
+                    $ref: '#/definitions/MessageReport'
+            500:
+                description: 'Internal Server Error'
+                schema:
+                    $ref: '#/definitions/ErrorsPayload'
+        """
+        try:
+            # noinspection PyArgumentList
+            body = req.get_media(default_when_empty=dict())
+        except MediaMalformedError as json_err:
+            res.status = json_err.status
+            res.text = self._schemas['Message'].dumps(
+                    {'errors': [{'error_code': {'HTTP_400': 'bad request'},
+                                 'error'     : json_err.description}]}
+            )
+            return
+        keys = body.get('keys') if isinstance(body, dict) else None
+        if not isinstance(keys, list) or not all(isinstance(key, str) for key in keys):
+            self.__bad_request(res, '`keys` must be a list of strings')
+            return
+        self.__read_many(res, keys)
+
+    def on_post_bulk(self, req: Request, res: Response):
+        """ Handles messages bulk requests.
+        ---
+        summary: 'Create, update and delete messages in a single transaction'
+        description: 'Run the create / update / delete `operations` of the body (one per key) in a single transaction,
+            a statement per action. Atomic by default: when an operation fails (created key already existing,
+            updated / deleted key unknown) none is applied, with `"atomic": false` the others are applied anyway.'
+        consumes: ['application/json']
+        produces: ['application/json']
+        parameters:
+            - in: body
+              name: operations
+              description: list of `{"action": "create" | "update" | "delete", "key", "attributes", "ttl"}`
+              required: true
+            - in: body
+              name: atomic
+              description: all or nothing (default = true), best effort otherwise
+            - in: header
+              name: X-Message-TTL
+              description: seconds before the created / updated messages without `ttl` expire
+        responses:
+            200:
+                description: 'Operations run, with the status of each one (created, updated, deleted, conflict,
+                    not_found)'
+                schema:
+                    $ref: '#/definitions/MessageBulk'
+            400:
+                description: 'Bad Request (an atomic bulk with keys on several shards of a sharded storage included)'
+                schema:
+                    $ref: '#/definitions/MessageReport'
+            409:
+                description: 'Atomic bulk aborted, the other operations have the `aborted` status'
+                schema:
+                    $ref: '#/definitions/MessageBulk'
+            500:
+                description: 'Internal Server Error'
+                schema:
+                    $ref: '#/definitions/ErrorsPayload'
+        """
+        try:
+            # noinspection PyArgumentList
+            body = req.get_media(default_when_empty=dict())
+            operations, atomic = parse_bulk_operations(req, body, self._max_operations)
+
+            data, aborted, err = self._svc.bulk(operations, atomic)
+
+            if len(err) > 0:
+                res.status = HTTP_500
+                res.text = self._schemas['MessageBulk'].dumps({'errors': err})
+            else:
+                res.status = HTTP_409 if aborted else HTTP_200
+                res.text = self._schemas['MessageBulk'].dumps({'data': data, 'aborted': aborted})
+
+        except ValueError as bulk_err:
+            # InvalidTtlError and CrossShardBulkError included
+            self.__bad_request(res, str(bulk_err))
         except MediaMalformedError as json_err:
             res.status = json_err.status
-            res.text = MessageSchema().dumps(
+            res.text = self._schemas['Message'].dumps(
                     {'errors': [{'error_code': {'HTTP_400': 'bad request'},
                                  'error'     : json_err.description}]}
             )
         except Exception as exc:
             res.text, res.status = self.handle_generic_error(exc)
+
+    def __read_many(self, res: Response, keys: List[str]) -> None:
+        try:
+            if not keys:
+                self.__bad_request(res, 'at least one key is expected')
+                return
+            if len(keys) > self._max_keys:
+                self.__bad_request(res, f'at most {self._max_keys} keys can be read at once, got {len(keys)}')
+                return
+
+            data, missing, err = self._svc.read_many(keys)
+
+            if len(err) > 0:
+                res.status = HTTP_500
+                res.text = self._schemas['MessageBatch'].dumps({'errors': err})
+            else:
+                res.status = HTTP_200
+                res.text = self._schemas['MessageBatch'].dumps({'data': data, 'missing': missing})
+
+        except Exception as exc:
+            res.text, res.status = self.handle_generic_error(exc)
+
+    def __bad_request(self, res: Response, error: str) -> None:
+        res.status = HTTP_400
+        res.text = self._schemas['Message'].dumps({'errors': [{'error_code': {'HTTP_400': 'bad request'},
+                                                               'error'     : error}]})
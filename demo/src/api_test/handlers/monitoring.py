@@ -1,25 +1,219 @@
+import math
+import os
+from typing import Dict, Iterator, List, Tuple
+
 import falcon
-import pkg_resources
 from prometheus_client import CollectorRegistry, generate_latest, multiprocess
+from prometheus_client.core import GaugeMetricFamily, Metric
+from prometheus_client.openmetrics import exposition as openmetrics
+from prometheus_client.samples import Exemplar, Sample
 
+from ..adapters.explain import ExplainSampler
+from ..commons.latency_sketch import LatencySketch
+from ..commons.slow_requests import SlowRequestLog
+from ..commons.version import get_version
 from . import Handler
 
+QUANTILES: tuple = (0.5, 0.9, 0.95, 0.99, 0.999)
+LATENCY_HISTOGRAM: str = 'request_latency_seconds'
+# OpenMetrics limits the labels of an exemplar to 128 characters
+EXEMPLAR_TRACE_ID_LENGTH: int = 100
+
+
+class LatencyQuantileCollector:
+    """
+    Expose the quantiles of the latency sketches merged across workers as gauges
+    """
+
+    def __init__(self, latency_sketch: LatencySketch):
+        self._latency_sketch = latency_sketch
+
+    def collect(self) -> Iterator[GaugeMetricFamily]:
+        gauge = GaugeMetricFamily('request_latency_quantile_seconds',
+                                  'Request latency quantiles from the per worker HDR-like sketches',
+                                  labels=['path', 'quantile'])
+        for route, histogram in sorted(self._latency_sketch.merged().items()):
+            values = histogram.percentiles([quantile * 100 for quantile in QUANTILES])
+            for quantile in QUANTILES:
+                gauge.add_metric([route, str(quantile)], values[quantile * 100] / 1_000_000)
+        yield gauge
+
+
+class ExemplarCollector:
+    """
+    Collect the multiprocess metrics, each bucket of the request latency histogram carrying the slowest kept request
+    of its range (above the previous bound) as exemplar: a latency spike on a dashboard leads to its tracking id.
+    The multiprocess files do not store exemplars, they are taken from the slow request log.
+    """
+
+    def __init__(self, collector, slow_requests: SlowRequestLog):
+        self._collector = collector
+        self._slow_requests = slow_requests
+
+    def collect(self) -> Iterator[Metric]:
+        metrics = list(self._collector.collect())
+        histogram = next((metric for metric in metrics if metric.name == LATENCY_HISTOGRAM), None)
+        if histogram is not None:
+            histogram.samples = self.__with_exemplars(histogram.samples)
+        yield from metrics
+
+    def __with_exemplars(self, samples: List[Sample]) -> List[Sample]:
+        # slowest request by (method, route, status) and bucket upper bound
+        records: Dict[tuple, List[dict]] = dict()
+        for route_records in self._slow_requests.merged().values():
+            for record in route_records:
+                records.setdefault((record['method'], record['route'], record['status']), []).append(record)
+        bounds: Dict[tuple, List[float]] = dict()
+        for sample in samples:
+            if sample.name.endswith('_bucket'):
+                bounds.setdefault(self.__series(sample.labels), []).append(float(sample.labels['le']))
+        exemplars: Dict[Tuple[tuple, float], dict] = dict()
+        for series, series_bounds in bounds.items():
+            series_bounds.sort()
+            for record in records.get(series, ()):
+                seconds = record['duration_ms'] / 1000
+                bound = next((bound for bound in series_bounds if seconds <= bound), math.inf)
+                kept = exemplars.get((series, bound))
+                if kept is None or kept['duration_ms'] < record['duration_ms']:
+                    exemplars[(series, bound)] = record
+
+        with_exemplars = []
+        for sample in samples:
+            record = None
+            if sample.name.endswith('_bucket'):
+                record = exemplars.get((self.__series(sample.labels), float(sample.labels['le'])))
+            if record is not None:
+                exemplar = Exemplar({'trace_id': record['tracking_id'][:EXEMPLAR_TRACE_ID_LENGTH]},
+                                    round(record['duration_ms'] / 1000, 6), record['ended_at'])
+                sample = sample._replace(exemplar=exemplar)
+            with_exemplars.append(sample)
+        return with_exemplars
+
+    @staticmethod
+    def __series(labels: Dict[str, str]) -> tuple:
+        return labels.get('method'), labels.get('path'), labels.get('status', '')[:3]
+
 
 class MonitoringHandler(Handler):
     """
     Probe handler
     """
 
-    def __init__(self):
+    def __init__(self, latency_sketch: LatencySketch = None, slow_requests: SlowRequestLog = None):
+        """
+        :param latency_sketch: exposes the merged latency quantiles (default = None)
+        :param slow_requests: exposes the slowest requests as exemplars of the latency histogram, in the OpenMetrics
+            format only (default = None)
+        """
         Handler.__init__(self, None)
+        self._latency_sketch = latency_sketch
+        self._slow_requests = slow_requests
+        self._content_type = f'text/plain; version = {get_version()}; charset = utf-8'
 
-    def on_get(self, _: falcon.Request, res: falcon.Response):
+    def on_get(self, req: falcon.Request, res: falcon.Response):
         try:
             registry = CollectorRegistry()
-            multiprocess.MultiProcessCollector(registry)
-            data = generate_latest(registry)
-            res.content_type = (f'text/plain; version = {pkg_resources.get_distribution("api_test").version}'
-                                f'; charset = utf-8')
+            # asked for explicitly (like the prometheus client does): the classic text format has no exemplar
+            open_metrics = 'application/openmetrics-text' in (req.accept or '')
+            if open_metrics and self._slow_requests is not None:
+                registry.register(ExemplarCollector(multiprocess.MultiProcessCollector(None), self._slow_requests))
+            else:
+                multiprocess.MultiProcessCollector(registry)
+            if self._latency_sketch is not None:
+                registry.register(LatencyQuantileCollector(self._latency_sketch))
+            if open_metrics:
+                data = openmetrics.generate_latest(registry)
+                res.content_type = openmetrics.CONTENT_TYPE_LATEST
+            else:
+                data = generate_latest(registry)
+                res.content_type = self._content_type
             res.text = str(data.decode('utf-8'))
         except Exception as err:
             res.text, res.status = self.handle_generic_error(err)
+
+
+class LatencyHandler(Handler):
+    """
+    Latency percentiles handler (merged across workers)
+    """
+
+    def __init__(self, latency_sketch: LatencySketch):
+        Handler.__init__(self, None)
+        self._latency_sketch = latency_sketch
+
+    def on_get(self, req: falcon.Request, res: falcon.Response):
+        """Handles latency GET requests.
+        ---
+        description: Get the request latency percentiles (in milliseconds) by route, merged across workers
+        parameters:
+            - in: query
+              name: histogram
+              description: also return the raw histograms (default = false)
+        responses:
+            200:
+                description: 'OK'
+        """
+        try:
+            with_histogram = req.get_param_as_bool('histogram', default=False)
+            routes = dict()
+            for route, histogram in sorted(self._latency_sketch.merged().items()):
+                values = histogram.percentiles([quantile * 100 for quantile in QUANTILES])
+                routes[route] = {
+                        'count': histogram.total_count,
+                        'min'  : histogram.min / 1000,
+                        'mean' : round(histogram.mean / 1000, 3),
+                        **{f'p{quantile * 100:g}': values[quantile * 100] / 1000 for quantile in QUANTILES},
+                        'max'  : histogram.max / 1000,
+                }
+                if with_histogram:
+                    routes[route]['histogram'] = histogram.to_dict()
+            res.media = {'routes': routes}
+        except Exception as err:
+            res.text, res.status = self.handle_generic_error(err)
+
+
+class SlowQueryHandler(Handler):
+    """
+    Slow query plans handler (of the worker serving the request)
+    """
+
+    def __init__(self, explain_sampler: ExplainSampler):
+        Handler.__init__(self, None)
+        self._explain_sampler = explain_sampler
+
+    def on_get(self, _: falcon.Request, res: falcon.Response):
+        """Handles slow query plans GET requests.
+        ---
+        description: Get the plans (`EXPLAIN (ANALYZE, BUFFERS)`) of the last slow reads sampled by the worker
+        responses:
+            200:
+                description: 'OK'
+        """
+        try:
+            res.media = {'worker': os.getpid(), 'queries': self._explain_sampler.captured()}
+        except Exception as err:
+            res.text, res.status = self.handle_generic_error(err)
+
+
+class SlowRequestHandler(Handler):
+    """
+    Slowest requests handler (merged across workers)
+    """
+
+    def __init__(self, slow_requests: SlowRequestLog):
+        Handler.__init__(self, None)
+        self._slow_requests = slow_requests
+
+    def on_get(self, _: falcon.Request, res: falcon.Response):
+        """Handles slow requests GET requests.
+        ---
+        description: Get the slowest requests of each route, with their storage statements, pool wait, payload sizes
+            and the garbage collections they overlapped, merged across workers
+        responses:
+            200:
+                description: 'OK'
+        """
+        try:
+            res.media = {'routes': self._slow_requests.merged()}
+        except Exception as err:
+            res.text, res.status = self.handle_generic_error(err)
@@ -0,0 +1,127 @@
+import asyncio
+import time
+from typing import List, NamedTuple, Tuple
+
+
+class HttpResponse(NamedTuple):
+    status: int
+    reason: str
+    body: bytes
+    # seconds spent to open the connection (0 when a kept-alive connection is reused)
+    connect_time: float
+    # event loop time of the first response byte
+    first_byte_at: float
+
+
+class HttpConnection:
+    """
+    Minimal HTTP/1.1 keep-alive client connection on asyncio streams (enough for the demo api:
+    `Content-Length` delimited bodies, no chunked transfer, no TLS).
+    """
+
+    def __init__(self, host: str, port: int):
+        self._host = host
+        self._port = port
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def request(self, method: str, path: str, body: bytes = None, headers: dict = None) -> HttpResponse:
+        """
+        send a request and read the whole response, (re)connecting when needed.
+        A kept-alive connection closed by the server before answering (idle timeout) is re-opened once.
+        :raise OSError / asyncio.IncompleteReadError: on connection error
+        """
+        reused = self.connected
+        try:
+            return await self.__request(method, path, body, headers)
+        except (ConnectionResetError, asyncio.IncompleteReadError) as error:
+            if not reused or (isinstance(error, asyncio.IncompleteReadError) and error.partial):
+                raise
+            return await self.__request(method, path, body, headers)
+
+    async def __request(self, method: str, path: str, body: bytes, headers: dict) -> HttpResponse:
+        connect_time = 0.0
+        if not self.connected:
+            start = time.perf_counter()
+            self._reader, self._writer = await asyncio.open_connection(self._host, self._port)
+            connect_time = time.perf_counter() - start
+
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {self._host}:{self._port}', 'Accept: application/json']
+        for name, value in (headers or dict()).items():
+            lines.append(f'{name}: {value}')
+        if body is not None:
+            lines.append('Content-Type: application/json')
+        lines.append(f'Content-Length: {len(body) if body is not None else 0}')
+        self._writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + (body or b''))
+        try:
+            await self._writer.drain()
+            status_line = await self._reader.readuntil(b'\r\n')
+            first_byte_at = asyncio.get_running_loop().time()
+            version, status, reason, response_headers = self.__parse_head(status_line, await self.__read_headers())
+            length = int(response_headers.get('content-length', 0))
+            response_body = await self._reader.readexactly(length) if length else b''
+        except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            await self.close()
+            raise
+
+        connection = response_headers.get('connection', '').lower()
+        if connection == 'close' or (version == 'HTTP/1.0' and connection != 'keep-alive'):
+            await self.close()
+        return HttpResponse(status, reason, response_body, connect_time, first_byte_at)
+
+    async def __read_headers(self) -> List[bytes]:
+        lines = []
+        while True:
+            line = await self._reader.readuntil(b'\r\n')
+            if line == b'\r\n':
+                return lines
+            lines.append(line)
+
+    @staticmethod
+    def __parse_head(status_line: bytes, header_lines: List[bytes]) -> Tuple[str, int, str, dict]:
+        version, status, *reason = status_line.decode('latin-1').strip().split(' ', 2)
+        headers = dict()
+        for line in header_lines:
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return version, int(status), reason[0] if reason else '', headers
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except OSError:
+                pass  # already broken, nothing to release
+        self._reader, self._writer = None, None
+
+
+class ConnectionPool:
+    """
+    Bounded pool of keep-alive connections: when every connection is busy, callers wait for one to be released
+    (the waiting time is part of the measured latency).
+    """
+
+    def __init__(self, host: str, port: int, max_connections: int):
+        self._host = host
+        self._port = port
+        self._max_connections = max_connections
+        self._created = 0
+        self._idle: asyncio.Queue = asyncio.Queue()
+
+    async def acquire(self) -> HttpConnection:
+        if self._idle.empty() and self._created < self._max_connections:
+            self._created += 1
+            return HttpConnection(self._host, self._port)
+        return await self._idle.get()
+
+    def release(self, connection: HttpConnection) -> None:
+        self._idle.put_nowait(connection)
+
+    async def close(self) -> None:
+        while not self._idle.empty():
+            await self._idle.get_nowait().close()
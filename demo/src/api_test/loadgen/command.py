@@ -0,0 +1,74 @@
+from typing import Tuple
+
+import click
+
+from .report import Report
+from .runner import (
+    CLOSED_MODEL,
+    OPEN_MODEL,
+    LoadGenerator,
+    Profile,
+    Stage,
+    parse_duration,
+    parse_stage,
+)
+from .scenario import CrudScenario
+
+
+@click.command('loadgen', short_help='Run a load test against the api')
+@click.argument('hostname')
+@click.argument('port', type=int)
+@click.option('--model', type=click.Choice([OPEN_MODEL, CLOSED_MODEL]), default=OPEN_MODEL,
+              help='open: scenario iterations arrive at a given rate / closed: a given number of looping users '
+                   '(default = open)')
+@click.option('--target', default=10.0,
+              help='iterations per second (open model) or virtual users (closed model) (default = 10)')
+@click.option('--duration', default='60s', help='duration of the test at the target load (default = 60s)')
+@click.option('--ramp_up', default='0s', help='duration to reach the target load from 0 (default = 0s)')
+@click.option('--stage', 'stages', multiple=True,
+              help='`duration:target` load stage, repeatable, overrides --target/--duration/--ramp_up '
+                   '(e.g. --stage 30s:50 --stage 2m:50 --stage 30s:0)')
+@click.option('--attr_size', default='10:30', help='`min:max` size of the generated attribute values (default = 10:30)')
+@click.option('--max_connections', default=100, help='maximum open connections (default = 100)')
+@click.option('--timeout', default=10.0, help='request timeout in seconds (default = 10)')
+@click.option('--constant_arrivals', is_flag=True, default=False,
+              help='open model: evenly spaced arrivals instead of a poisson process')
+@click.option('--think_time', default=0.0, help='closed model: pause between iterations in seconds (default = 0)')
+@click.option('--seed', default=None, type=int, help='random seed of the generated payloads')
+@click.option('--results', default='kpi.jtl', help='JTL results file, loadable by Taurus (default = kpi.jtl)')
+@click.option('--summary', default=None, help='write the summary (percentiles and histograms) as json in this file')
+def loadgen(hostname: str, port: int, model: str, target: float, duration: str, ramp_up: str,
+            stages: Tuple[str], attr_size: str, max_connections: int, timeout: float, constant_arrivals: bool,
+            think_time: float, seed: int, results: str, summary: str):
+    """\b
+    Run the create / read / update / delete message scenario against the api
+    \b
+    Usage:
+    api-test loadgen [Options] hostname port
+    \b
+    Latencies are recorded in HDR-like histograms and reported as percentiles, every sample is written in a JTL
+    file that Taurus can use as results (`external-results-loader` executor).
+    """
+    try:
+        if stages:
+            profile = Profile([parse_stage(stage) for stage in stages])
+        else:
+            ramp_up_duration = parse_duration(ramp_up)
+            profile = Profile(([Stage(ramp_up_duration, target)] if ramp_up_duration else [Stage(0, target)]) +
+                              [Stage(parse_duration(duration), target)])
+        min_size, _, max_size = attr_size.partition(':')
+        scenario = CrudScenario(min_size=int(min_size), max_size=int(max_size or min_size), seed=seed)
+    except ValueError as error:
+        raise click.BadParameter(str(error))
+
+    click.echo(f'=== loadgen - {model} model on {hostname}:{port} for {profile.duration:g}s ===')
+    with open(results, 'w', newline='') as jtl_file:
+        report = Report(jtl_file)
+        LoadGenerator(hostname, port, scenario, profile, report, model=model, max_connections=max_connections,
+                      timeout=timeout, poisson=not constant_arrivals, think_time=think_time).run()
+
+    report.print_summary(click.echo)
+    click.echo(f'results written in {results}')
+    if summary:
+        report.write_summary(summary)
+        click.echo(f'summary written in {summary}')
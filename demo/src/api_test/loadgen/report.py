@@ -0,0 +1,114 @@
+import csv
+import json
+import time
+from typing import Dict, TextIO
+
+from ..commons.hdr_histogram import LogLinearHistogram
+
+PERCENTILES = (50.0, 90.0, 95.0, 99.0, 99.9, 99.99)
+JTL_HEADER = ('timeStamp', 'elapsed', 'label', 'responseCode', 'responseMessage', 'threadName', 'success', 'bytes',
+              'grpThreads', 'allThreads', 'Latency', 'Connect')
+
+
+class LabelStats:
+    """ latencies (in microseconds) and counters of one request label """
+
+    def __init__(self):
+        # from the intended start (arrival schedule), so queueing delays are not omitted
+        self.response_time = LogLinearHistogram()
+        # from the moment the request is actually sent
+        self.service_time = LogLinearHistogram()
+        self.errors = 0
+        self.bytes = 0
+
+    def merge(self, other: 'LabelStats') -> 'LabelStats':
+        self.response_time.merge(other.response_time)
+        self.service_time.merge(other.service_time)
+        self.errors += other.errors
+        self.bytes += other.bytes
+        return self
+
+
+class Report:
+    """
+    Collect the samples of a load test: one histogram per label, and optionally a JTL (JMeter csv) results file
+    that Taurus can load with its `external-results-loader` executor.
+    """
+
+    def __init__(self, jtl_file: TextIO = None):
+        self._labels: Dict[str, LabelStats] = dict()
+        self._jtl = csv.writer(jtl_file) if jtl_file is not None else None
+        if self._jtl is not None:
+            self._jtl.writerow(JTL_HEADER)
+        self._started_at = time.time()
+        self._ended_at = None
+
+    def add_sample(self, label: str, intended_start: float, sent_at: float, first_byte_at: float, ended_at: float,
+                   connect_time: float, status: int, reason: str, success: bool, size: int, thread_name: str,
+                   in_flight: int) -> None:
+        """
+        :param intended_start: wall clock time the request should have been sent at (seconds since epoch)
+        :param sent_at: wall clock time the request was actually sent at
+        :param first_byte_at: wall clock time of the first response byte
+        :param ended_at: wall clock time of the last response byte
+        """
+        stats = self._labels.setdefault(label, LabelStats())
+        stats.response_time.record(int((ended_at - intended_start) * 1_000_000))
+        stats.service_time.record(int((ended_at - sent_at) * 1_000_000))
+        stats.bytes += size
+        if not success:
+            stats.errors += 1
+        if self._jtl is not None:
+            self._jtl.writerow((int(intended_start * 1000), int((ended_at - intended_start) * 1000), label, status,
+                                reason, thread_name, 'true' if success else 'false', size, in_flight, in_flight,
+                                int((first_byte_at - intended_start) * 1000), int(connect_time * 1000)))
+
+    def close(self) -> None:
+        self._ended_at = time.time()
+
+    def summary(self) -> dict:
+        """ :return the per label and overall statistics (latencies in milliseconds) """
+        duration = (self._ended_at or time.time()) - self._started_at
+        total = LabelStats()
+        labels = dict()
+        for label, stats in sorted(self._labels.items()):
+            total.merge(stats)
+            labels[label] = self.__stats_summary(stats, duration)
+        return {'duration_s': round(duration, 3), 'labels': labels, 'total': self.__stats_summary(total, duration)}
+
+    @staticmethod
+    def __stats_summary(stats: LabelStats, duration: float) -> dict:
+        count = stats.response_time.total_count
+
+        def histogram_summary(histogram: LogLinearHistogram) -> dict:
+            values = histogram.percentiles(PERCENTILES)
+            return {
+                    'min' : histogram.min / 1000,
+                    'mean': round(histogram.mean / 1000, 3),
+                    **{f'p{percentile:g}': values[percentile] / 1000 for percentile in PERCENTILES},
+                    'max' : histogram.max / 1000,
+            }
+
+        return {
+                'count'        : count,
+                'errors'       : stats.errors,
+                'throughput'   : round(count / duration, 2) if duration > 0 else 0.0,
+                'bytes'        : stats.bytes,
+                'response_time': histogram_summary(stats.response_time),
+                'service_time' : histogram_summary(stats.service_time),
+                'histogram'    : stats.response_time.to_dict(),
+        }
+
+    def print_summary(self, echo) -> None:
+        summary = self.summary()
+        columns = ['count', 'errors', 'rps', 'mean'] + [f'p{percentile:g}' for percentile in PERCENTILES] + ['max']
+        echo(f'{"label":<10}' + ''.join(f'{column:>10}' for column in columns) + '   (response time in ms)')
+        for label, stats in list(summary['labels'].items()) + [('TOTAL', summary['total'])]:
+            response_time = stats['response_time']
+            values = [stats['count'], stats['errors'], stats['throughput'], response_time['mean']] + \
+                     [response_time[f'p{percentile:g}'] for percentile in PERCENTILES] + [response_time['max']]
+            echo(f'{label:<10}' + ''.join(f'{value:>10}' for value in values))
+
+    def write_summary(self, path: str) -> None:
+        with open(path, 'w') as file:
+            json.dump(self.summary(), file, indent=2)
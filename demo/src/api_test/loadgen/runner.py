@@ -0,0 +1,193 @@
+import asyncio
+import random
+import re
+import time
+from typing import List, NamedTuple, Set
+
+from .client import ConnectionPool
+from .report import Report
+from .scenario import CrudScenario
+
+OPEN_MODEL: str = 'open'
+CLOSED_MODEL: str = 'closed'
+DURATION_PATTERN = re.compile(r'^(\d+(?:\.\d+)?)(ms|s|m|h)?$')
+DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600, None: 1}
+
+
+class Stage(NamedTuple):
+    # seconds
+    duration: float
+    # arrival rate (sessions per second) in the open model, number of virtual users in the closed model
+    target: float
+
+
+def parse_duration(text: str) -> float:
+    """ :return seconds of a duration like `500ms`, `30s`, `5m`, `1h` (or a plain number of seconds) """
+    match = DURATION_PATTERN.match(text.strip())
+    if match is None:
+        raise ValueError(f'invalid duration `{text}`')
+    return float(match.group(1)) * DURATION_UNITS[match.group(2)]
+
+
+def parse_stage(text: str) -> Stage:
+    """ :return the stage of a `duration:target` definition, e.g. `30s:100` """
+    duration, _, target = text.partition(':')
+    if not target:
+        raise ValueError(f'invalid stage `{text}`, expected `duration:target`')
+    return Stage(parse_duration(duration), float(target))
+
+
+class Profile:
+    """
+    Load profile made of stages: during each stage the target moves linearly from the previous stage target
+    (0 before the first stage) to the stage target, so `[10s:100, 60s:100, 10s:0]` ramps up, holds and ramps down.
+    """
+
+    def __init__(self, stages: List[Stage]):
+        if not stages:
+            raise ValueError('a load profile needs at least one stage')
+        self._stages = stages
+        self.duration = sum(stage.duration for stage in stages)
+
+    def target_at(self, elapsed: float) -> float:
+        previous = 0.0
+        for stage in self._stages:
+            if elapsed < stage.duration:
+                return previous + (stage.target - previous) * (elapsed / stage.duration if stage.duration else 1)
+            elapsed -= stage.duration
+            previous = stage.target
+        return previous
+
+
+class LoadGenerator:
+    """
+    Asyncio load generator running the CRUD scenario against the api.
+
+    In the open model, scenario iterations arrive at the profile rate whatever the api responsiveness; the response
+    time of the first request of an iteration is measured from its scheduled arrival, so a stalled api shows up in
+    the latencies instead of silently slowing the arrivals (coordinated omission).
+    In the closed model, a profile driven number of virtual users loop on the scenario.
+    """
+
+    def __init__(self, host: str, port: int, scenario: CrudScenario, profile: Profile, report: Report,
+                 model: str = OPEN_MODEL, max_connections: int = 100, timeout: float = 10.0,
+                 max_in_flight: int = 10000, poisson: bool = True, think_time: float = 0.0):
+        self._scenario = scenario
+        self._profile = profile
+        self._report = report
+        self._model = model
+        self._timeout = timeout
+        self._max_in_flight = max_in_flight
+        self._poisson = poisson
+        self._think_time = think_time
+        self._pool = ConnectionPool(host, port, max_connections)
+        self._in_flight = 0
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._wall_offset = 0.0
+
+    def run(self) -> Report:
+        asyncio.run(self.__run())
+        self._report.close()
+        return self._report
+
+    async def __run(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        # event loop time -> wall clock time (for the results file timestamps)
+        self._wall_offset = time.time() - self._loop.time()
+        try:
+            if self._model == OPEN_MODEL:
+                await self.__open_model()
+            else:
+                await self.__closed_model()
+        finally:
+            await self._pool.close()
+
+    async def __open_model(self) -> None:
+        tasks: Set[asyncio.Task] = set()
+        sequence = 0
+        start = self._loop.time()
+        next_arrival = start
+        while next_arrival - start < self._profile.duration:
+            rate = self._profile.target_at(next_arrival - start)
+            if rate <= 0:
+                next_arrival += 0.01
+                continue
+            delay = next_arrival - self._loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            sequence += 1
+            if len(tasks) >= self._max_in_flight:
+                # the generator itself is saturated, count the arrival as failed instead of delaying the others
+                self.__add_error('session', next_arrival, 'client saturated', f'open 1-{sequence}')
+            else:
+                task = asyncio.create_task(self.__session(next_arrival, f'open 1-{sequence}'))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            next_arrival += random.expovariate(rate) if self._poisson else 1 / rate
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    async def __closed_model(self) -> None:
+        users: List[asyncio.Event] = []
+        tasks: List[asyncio.Task] = []
+        start = self._loop.time()
+        while (elapsed := self._loop.time() - start) < self._profile.duration:
+            target = round(self._profile.target_at(elapsed))
+            while len(users) < target:
+                retire = asyncio.Event()
+                users.append(retire)
+                tasks.append(asyncio.create_task(self.__user(retire, f'user 1-{len(users)}')))
+            while len(users) > target:
+                users.pop().set()
+            await asyncio.sleep(0.1)
+        for retire in users:
+            retire.set()
+        if tasks:
+            await asyncio.gather(*tasks)
+
+    async def __user(self, retire: asyncio.Event, thread_name: str) -> None:
+        while not retire.is_set():
+            await self.__session(self._loop.time(), thread_name)
+            if self._think_time:
+                await asyncio.sleep(self._think_time)
+
+    async def __session(self, intended_start: float, thread_name: str) -> None:
+        self._in_flight += 1
+        try:
+            for step in self._scenario.steps():
+                connection = await self._pool.acquire()
+                sent_at = self._loop.time()
+                try:
+                    response = await asyncio.wait_for(connection.request(step.method, step.path, step.body),
+                                                      self._timeout)
+                except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as error:
+                    # the connection state is unknown after an error, never reuse it as is
+                    await connection.close()
+                    self.__add_error(step.label, intended_start, type(error).__name__, thread_name, sent_at)
+                    return
+                finally:
+                    self._pool.release(connection)
+
+                ended_at = self._loop.time()
+                success = response.status == step.expected_status
+                self._report.add_sample(step.label,
+                                        intended_start + self._wall_offset,
+                                        sent_at + self._wall_offset,
+                                        response.first_byte_at + self._wall_offset,
+                                        ended_at + self._wall_offset,
+                                        response.connect_time, response.status, response.reason, success,
+                                        len(response.body), thread_name, self._in_flight)
+                if not success:
+                    # the following steps depend on this one
+                    return
+                intended_start = ended_at
+        finally:
+            self._in_flight -= 1
+
+    def __add_error(self, label: str, intended_start: float, reason: str, thread_name: str,
+                    sent_at: float = None) -> None:
+        now = self._loop.time() + self._wall_offset
+        sent = (sent_at if sent_at is not None else self._loop.time()) + self._wall_offset
+        self._report.add_sample(label, intended_start + self._wall_offset, sent, now, now, 0.0, 0, reason, False, 0,
+                                thread_name, self._in_flight)
@@ -0,0 +1,43 @@
+import json
+import random
+import string
+from typing import Iterator, NamedTuple
+from uuid import uuid4
+
+
+class Step(NamedTuple):
+    label: str
+    method: str
+    path: str
+    body: bytes | None
+    expected_status: int
+
+
+class CrudScenario:
+    """
+    The `http/message.http` flow: create a message, read it, update it and delete it,
+    with attribute values of random sizes.
+    """
+
+    def __init__(self, properties: int = 5, min_size: int = 10, max_size: int = 30, seed: int = None):
+        self._properties = properties
+        self._min_size = min_size
+        self._max_size = max_size
+        self._random = random.Random(seed)
+
+    def _payload(self, key: str) -> bytes:
+        attributes = {
+                f'property_{index}': ''.join(self._random.choices(string.ascii_letters,
+                                                                  k=self._random.randint(self._min_size,
+                                                                                         self._max_size)))
+                for index in range(1, self._properties + 1)
+        }
+        return json.dumps({'data': {'key': key, 'attributes': attributes}}).encode('utf-8')
+
+    def steps(self) -> Iterator[Step]:
+        """ :return the requests of one iteration of the scenario, to be sent in order """
+        key = f'loadgen-{uuid4().hex}'
+        yield Step('create', 'POST', '/message', self._payload(key), 201)
+        yield Step('read', 'GET', f'/message/{key}', None, 200)
+        yield Step('update', 'PUT', f'/message/{key}', self._payload(key), 204)
+        yield Step('delete', 'DELETE', f'/message/{key}', None, 204)
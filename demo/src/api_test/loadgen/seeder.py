@@ -0,0 +1,211 @@
+import math
+import random
+import string
+import struct
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
+from multiprocessing import Pool
+from typing import Callable, Deque, Dict, Iterator, List, NamedTuple, TextIO, Tuple
+
+from ..commons.jump_hash import jump_hash, stable_hash
+from ..repositories.backends import ndjson_line
+from ..services.dataset import TransferProgress
+
+BINARY_FORMAT: str = 'binary'
+TEXT_FORMAT: str = 'text'
+NDJSON_FORMAT: str = 'ndjson'
+# 64 symbols, so a random byte maps to a symbol without bias (256 = 4 x 64). None of them needs an escape in json nor
+# in the COPY text format, the generated rows are written without escaping
+SYMBOLS: bytes = (string.ascii_letters + string.digits + '-_').encode('ascii')
+SYMBOL_TABLE: bytes = SYMBOLS * 4
+MAX_ATTRIBUTE_SIZE: int = 1 << 20
+# COPY binary format: signature, flags, header extension length / tuple of 3 fields / end of data
+COPY_BINARY_HEADER: bytes = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+COPY_BINARY_TRAILER: bytes = struct.pack('!h', -1)
+# jsonb binary input: version 1 then the json text, the expiry is always null
+JSONB_VERSION: bytes = b'\x01'
+NULL_FIELD: bytes = struct.pack('!i', -1)
+
+
+def parse_size_distribution(text: str) -> Callable[[random.Random, int], List[int]]:
+    """
+    :param text: distribution of the attribute sizes (characters):
+        `fixed:SIZE`, `uniform:MIN:MAX`, `normal:MEAN:STDDEV`, `lognormal:MEDIAN:SIGMA` (long tail) or
+        `choice:SIZE=WEIGHT,...` (e.g. `choice:16=0.7,256=0.25,4096=0.05`)
+    :return: sampler of n sizes from a random generator (sampled by batches: a call per size would cost more than
+        the rest of the generation)
+    :raise ValueError: on an invalid distribution
+    """
+    def clamp(size: float) -> int:
+        return min(max(round(size), 1), MAX_ATTRIBUTE_SIZE)
+
+    kind, _, arguments = text.strip().partition(':')
+    try:
+        if kind == 'fixed':
+            size = clamp(int(arguments))
+            return lambda rng, n: [size] * n
+        if kind == 'uniform':
+            low, _, high = arguments.partition(':')
+            low, high = clamp(int(low)), clamp(int(high or low))
+            if low > high:
+                raise ValueError('MIN > MAX')
+            span, draw = high - low + 1, random.Random.random
+            return lambda rng, n: [low + int(draw(rng) * span) for _ in range(n)]
+        if kind == 'normal':
+            mean, _, stddev = arguments.partition(':')
+            mean, stddev = float(mean), float(stddev)
+            return lambda rng, n: [clamp(rng.gauss(mean, stddev)) for _ in range(n)]
+        if kind == 'lognormal':
+            median, _, sigma = arguments.partition(':')
+            mu, sigma = math.log(float(median)), float(sigma)
+            return lambda rng, n: [clamp(math.exp(rng.gauss(mu, sigma))) for _ in range(n)]
+        if kind == 'choice':
+            pairs = [pair.split('=') for pair in arguments.split(',')]
+            sizes, weights = [clamp(int(size)) for size, _ in pairs], [float(weight) for _, weight in pairs]
+            return lambda rng, n: rng.choices(sizes, weights, k=n)
+        raise ValueError('unknown kind, choose between fixed / uniform / normal / lognormal / choice')
+    except (ValueError, IndexError) as error:
+        raise ValueError(f'invalid attribute size distribution `{text}` : {error}')
+
+
+class SeedSpec(NamedTuple):
+    count: int
+    seed: int
+    size_distribution: str
+    properties: int
+    chunk_size: int
+    # number of shards of the storage, the rows of a chunk are split by shard
+    shards: int
+    data_format: str
+
+
+class SeedChunk(NamedTuple):
+    keys: List[str]
+    # encoded rows by shard index
+    data: Dict[int, bytes]
+
+
+def seed_key(seed: int, index: int) -> str:
+    """ :return the key of the index-th seeded message """
+    return f'seed-{seed}-{index:010d}'
+
+
+def generate_chunk(spec: SeedSpec, chunk: int) -> SeedChunk:
+    """
+    generate the messages of a chunk, encoded for the storage. The generator is seeded by the seed and the chunk
+    number only: the same seed gives the same messages, whatever the number of worker processes.
+    :param spec: what to generate
+    :param chunk: chunk number (messages chunk x chunk_size to (chunk + 1) x chunk_size - 1)
+    :return: the keys and the encoded rows of the chunk
+    """
+    rng = random.Random(f'{spec.seed}:{chunk}')
+    sample_sizes = parse_size_distribution(spec.size_distribution)
+    first, last = chunk * spec.chunk_size, min((chunk + 1) * spec.chunk_size, spec.count)
+    keys = [seed_key(spec.seed, index) for index in range(first, last)]
+    sizes = sample_sizes(rng, len(keys) * spec.properties)
+    # every attribute value is a slice of one random block, mapped to the symbols
+    symbols = rng.randbytes(sum(sizes)).translate(SYMBOL_TABLE).decode('ascii')
+    names = [f'"property_{index}": "' for index in range(1, spec.properties + 1)]
+
+    rows: Dict[int, List[bytes]] = dict()
+    position = 0
+    for row, key in enumerate(keys):
+        values = []
+        for index, name in enumerate(names):
+            size = sizes[row * spec.properties + index]
+            values.append(f'{name}{symbols[position:position + size]}"')
+            position += size
+        attributes = f'{{{", ".join(values)}}}'
+        shard = jump_hash(stable_hash(key), spec.shards) if spec.shards > 1 else 0
+        rows.setdefault(shard, []).append(encode_row(key, attributes, spec.data_format))
+
+    if spec.data_format == BINARY_FORMAT:
+        return SeedChunk(keys, {shard: b''.join([COPY_BINARY_HEADER, *encoded, COPY_BINARY_TRAILER])
+                                for shard, encoded in rows.items()})
+    return SeedChunk(keys, {shard: b''.join(encoded) for shard, encoded in rows.items()})
+
+
+def encode_row(key: str, attributes: str, data_format: str) -> bytes:
+    """
+    :param key: message key (symbols only)
+    :param attributes: json attributes (symbols only in the names and values)
+    :param data_format: binary / text (postgres COPY) or ndjson
+    :return: the encoded row of a message that never expires
+    """
+    if data_format == BINARY_FORMAT:
+        key_bytes, attributes_bytes = key.encode('ascii'), attributes.encode('ascii')
+        return b''.join([struct.pack('!hi', 3, len(key_bytes)), key_bytes,
+                         struct.pack('!i', len(attributes_bytes) + 1), JSONB_VERSION, attributes_bytes, NULL_FIELD])
+    if data_format == TEXT_FORMAT:
+        return f'{key}\t{attributes}\t\\N\n'.encode('ascii')
+    return ndjson_line(key, attributes, None)
+
+
+def generate(spec: SeedSpec, processes: int) -> Iterator[SeedChunk]:
+    """
+    generate the chunks in worker processes, yielded in order. Only a few chunks are generated ahead of the
+    consumer, so the memory stays bounded whatever the number of messages.
+    :param spec: what to generate
+    :param processes: number of worker processes
+    :return: iterator of the chunks
+    """
+    chunks = iter(range(math.ceil(spec.count / spec.chunk_size)))
+    with Pool(processes) as pool:
+        pending = deque(pool.apply_async(generate_chunk, (spec, chunk))
+                        for chunk in islice(chunks, 2 * processes))
+        while pending:
+            result = pending.popleft().get()
+            for chunk in islice(chunks, 1):
+                pending.append(pool.apply_async(generate_chunk, (spec, chunk)))
+            yield result
+
+
+class Seeder:
+    """
+    Load test dataset seeder: generates the messages in worker processes and hands the encoded chunks to loader
+    threads (each one streaming its chunk to the storage, e.g. a postgres `COPY`), so generation and loading overlap.
+    """
+
+    def __init__(self, spec: SeedSpec, load: Callable[[Dict[int, bytes]], int], processes: int, loaders: int = 2):
+        """
+        :param spec: what to generate
+        :param load: stores the encoded rows of a chunk (by shard index), :return the number of stored messages
+        :param processes: number of generating processes
+        :param loaders: number of chunks loaded at once (default = 2)
+        """
+        self._spec = spec
+        self._load = load
+        self._processes = processes
+        self._loaders = loaders
+
+    def run(self, keys_file: TextIO | None, progress: TransferProgress) -> int:
+        """
+        generate and load every message
+        :param keys_file: receives the keys of the messages, one per line, in order (None = no key list)
+        :param progress: progress of the loaded messages
+        :return: the number of loaded messages
+        :raise StorageBackendError: on storage failure, the chunks already loaded stay in the storage
+        """
+        loaded = 0
+        with ThreadPoolExecutor(max_workers=self._loaders, thread_name_prefix='seed') as executor:
+            pending: Deque[Tuple[Future, int, int]] = deque()
+            for chunk in generate(self._spec, self._processes):
+                if keys_file is not None:
+                    keys_file.write('\n'.join(chunk.keys))
+                    keys_file.write('\n')
+                pending.append((executor.submit(self._load, chunk.data), len(chunk.keys),
+                                sum(len(data) for data in chunk.data.values())))
+                # the generation waits for the loaders: at most twice as many chunks in memory as loaders
+                while len(pending) > 2 * self._loaders:
+                    loaded += self.__wait(pending.popleft(), progress)
+            while pending:
+                loaded += self.__wait(pending.popleft(), progress)
+        return loaded
+
+    @staticmethod
+    def __wait(load: Tuple[Future, int, int], progress: TransferProgress) -> int:
+        future, messages, size = load
+        loaded = future.result()
+        progress.add(messages, size)
+        return loaded
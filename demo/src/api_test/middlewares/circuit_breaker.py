@@ -0,0 +1,62 @@
+import math
+from typing import List
+
+import falcon
+import structlog
+
+from ..commons.circuit_breaker import OPEN, CircuitBreaker
+from ..models.errors import GenericErrorPayloadSchema
+
+
+class CircuitBreakerGuard:
+    """
+    Typed `503 Service Unavailable` (with `Retry-After`) for the requests the storage circuit breakers turn down:
+    rejected before routing while every breaker is open, or answered with a server error after a storage call of the
+    request was failed fast (half open breaker busy with its trial calls, breaker of another shard...).
+    """
+
+    def __init__(self, circuit_breakers: List[CircuitBreaker]):
+        """
+        :param circuit_breakers: breakers of the storage targets (one per shard)
+        """
+        self._logger = structlog.get_logger('falcon')
+        self._circuit_breakers = circuit_breakers
+        self._error_schema = GenericErrorPayloadSchema()
+        # the probes and the metrics keep answering: they report the outage
+        self._excluded_resources = (
+                '/_health',
+                '/_private/_liveness',
+                '/_private/_readiness',
+                '/_private/_metrics',
+                '/_private/_latency',
+        )
+
+    def process_request(self, req: falcon.Request, resp: falcon.Response) -> None:
+        """
+        Reject the request at once while every breaker is open
+        :param req: Request object that will eventually be routed to an on_* responder method.
+        :param resp: Response object, completed when the request is rejected.
+        """
+        CircuitBreaker.clear_rejection()
+        if req.path in self._excluded_resources or not self._circuit_breakers:
+            return
+        if all(breaker.state == OPEN for breaker in self._circuit_breakers):
+            retry_after = min(breaker.retry_after() for breaker in self._circuit_breakers)
+            self.__unavailable(resp, f'storage unavailable, circuit breaker open on '
+                                     f'{", ".join(breaker.name for breaker in self._circuit_breakers)}', retry_after)
+            resp.complete = True
+
+    def process_response(self, _: falcon.Request, resp: falcon.Response, __, ___: bool) -> None:
+        """
+        Turn the server error of a request whose storage call was failed fast into a 503
+        """
+        rejection = CircuitBreaker.rejection()
+        if rejection is not None and resp.status[0] == '5' and resp.stream is None:
+            self.__unavailable(resp, f'storage unavailable, {rejection}', rejection.retry_after)
+        CircuitBreaker.clear_rejection()
+
+    def __unavailable(self, resp: falcon.Response, message: str, retry_after: float) -> None:
+        resp.status = falcon.HTTP_503
+        resp.set_header('Retry-After', str(max(math.ceil(retry_after), 1)))
+        resp.content_type = falcon.MEDIA_JSON
+        resp.text = self._error_schema.dumps({'message': message, 'error_status': falcon.HTTP_503})
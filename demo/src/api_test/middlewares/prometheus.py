@@ -43,10 +43,6 @@ class Prometheus:
         """
         resp_time = time.time() - req.start_time
 
-        self._prometheus.requests.labels(method=req.method, path=req.path,
-                                         status=resp.status).inc()
-        self._prometheus.request_historygram.labels(
-                method=req.method,
-                path=req.path,
-                status=resp.status,
-        ).observe(resp_time)
+        # labelled by route template (not by raw path), to keep the series count bounded
+        self._prometheus.observe_request(req.method, req.uri_template, resp.status, resp_time)
+        self._prometheus.flush_gc_profiler()
@@ -1,16 +1,28 @@
-import threading
+import time
 from uuid import uuid4
 
 import falcon
 import structlog
 
+from ..commons.metrics import UNKNOWN_ROUTE
+from ..commons.slow_requests import SlowRequestLog
+from ..commons.tracking import (
+    RequestTrace,
+    get_trace,
+    get_tracking_id,
+    set_trace,
+    set_tracking_id,
+)
+
 
 class TrackingId:
-    # local thread
-    _local_thread = threading.local()
 
-    def __init__(self):
+    def __init__(self, slow_requests: SlowRequestLog = None):
+        """
+        :param slow_requests: keeps the slowest requests with their trace (default = None, no trace)
+        """
         self._logger = structlog.get_logger('falcon')
+        self._slow_requests = slow_requests
 
         self._excluded_resources = (
                 '/_health',
@@ -20,12 +32,11 @@ class TrackingId:
         )
 
     def get_request_id(self) -> str | None:
-        if hasattr(self._local_thread, "tracking_id"):
-            return self._local_thread.tracking_id
-        return None
+        return get_tracking_id()
 
     def set_request_id(self, tracking_id: str = None) -> None:
-        self._local_thread.tracking_id = tracking_id
+        # kept out of the middleware: the storage adapters tag their slow queries with it
+        set_tracking_id(tracking_id)
 
     def process_request(self, req: falcon.Request, _: falcon.Response) -> None:
         """
@@ -34,10 +45,31 @@ class TrackingId:
         otherwise generate one.
         """
         self.set_request_id(req.get_header('x-request-id', default=str(uuid4())))
+        if self._slow_requests is not None and req.path not in self._excluded_resources:
+            set_trace(RequestTrace(self.get_request_id()))
 
-    def process_response(self, _: falcon.Request, __: falcon.Response, ___, ____: bool) -> None:
+    def process_response(self, req: falcon.Request, resp: falcon.Response, ___, ____: bool) -> None:
         """
-        Remove x-request-id from thread local storage in preparation for the next request
+        Remove x-request-id (and the trace) from thread local storage in preparation for the next request,
+        the trace of a request among the slowest of its route is kept
         """
-
+        trace = get_trace()
+        if trace is not None:
+            set_trace()
+            seconds = time.perf_counter() - trace.started
+            route = req.uri_template or UNKNOWN_ROUTE
+            # a fast request stops here
+            if self._slow_requests.admits(route, seconds):
+                status = falcon.code_to_http_status(resp.status)[:3]
+                self._slow_requests.record(route, req.method, req.path, status, trace, seconds, req.content_length,
+                                           self.__response_bytes(resp))
         self.set_request_id()
+
+    @staticmethod
+    def __response_bytes(resp: falcon.Response) -> int | None:
+        # the rendered body is cached by falcon, it is not serialized twice
+        body = resp.render_body()
+        if body is not None:
+            return len(body)
+        length = resp.get_header('Content-Length')
+        return int(length) if length is not None else None
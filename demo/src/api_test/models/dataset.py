@@ -0,0 +1,16 @@
+from marshmallow import Schema, fields
+
+from .message import MessageErrorSchema
+
+
+class TransferReportSchema(Schema):
+    messages: int = fields.Int(required=True)
+    bytes: int = fields.Int(required=True)
+    seconds: float = fields.Float(required=True)
+    messages_per_second: float = fields.Float(required=True)
+    bytes_per_second: float = fields.Float(required=True)
+
+
+class TransferSchema(Schema):
+    data: TransferReportSchema = fields.Nested(TransferReportSchema())
+    errors: MessageErrorSchema = fields.Nested(MessageErrorSchema(), many=True)
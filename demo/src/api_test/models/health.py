@@ -8,6 +8,7 @@ class HealthSchema(Schema):
 class ReadinessSchema(Schema):
     dns_lookup = fields.Str(required=True)
     postgres = fields.Str(required=True)
+    draining = fields.Str()
 
 
 class LivenessSchema(Schema):
@@ -1,4 +1,4 @@
-from typing import Dict
+from typing import Dict, List
 
 from marshmallow import Schema, fields
 
@@ -16,3 +16,27 @@ class MessageErrorSchema(Schema):
 class MessageSchema(Schema):
     data: MessageDataSchema = fields.Nested(MessageDataSchema(), many=True)
     errors: MessageErrorSchema = fields.Nested(MessageErrorSchema(), many=True)
+
+
+class MessagePageSchema(Schema):
+    data: MessageDataSchema = fields.Nested(MessageDataSchema(), many=True)
+    next_cursor: str = fields.Str(allow_none=True)
+    errors: MessageErrorSchema = fields.Nested(MessageErrorSchema(), many=True)
+
+
+class MessageBatchSchema(Schema):
+    data: MessageDataSchema = fields.Nested(MessageDataSchema(), many=True)
+    missing: List[str] = fields.List(fields.Str())
+    errors: MessageErrorSchema = fields.Nested(MessageErrorSchema(), many=True)
+
+
+class MessageBulkResultSchema(Schema):
+    action: str = fields.Str(required=True)
+    key: str = fields.Str(required=True)
+    status: str = fields.Str(required=True)
+
+
+class MessageBulkSchema(Schema):
+    data: MessageBulkResultSchema = fields.Nested(MessageBulkResultSchema(), many=True)
+    aborted: bool = fields.Bool()
+    errors: MessageErrorSchema = fields.Nested(MessageErrorSchema(), many=True)
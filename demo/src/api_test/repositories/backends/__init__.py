@@ -0,0 +1,393 @@
+import json
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Tuple,
+    TypeVar,
+)
+
+from ..errors.repositories_errors import InvalidDataError, StorageBackendError
+
+# actions of a bulk operation
+BULK_CREATE: str = 'create'
+BULK_UPDATE: str = 'update'
+BULK_DELETE: str = 'delete'
+BULK_ACTIONS: Tuple[str, ...] = (BULK_CREATE, BULK_UPDATE, BULK_DELETE)
+# statuses of a bulk operation
+BULK_CREATED: str = 'created'
+BULK_UPDATED: str = 'updated'
+BULK_DELETED: str = 'deleted'
+BULK_CONFLICT: str = 'conflict'
+BULK_NOT_FOUND: str = 'not_found'
+BULK_ABORTED: str = 'aborted'
+BULK_FAILURES: Tuple[str, ...] = (BULK_CONFLICT, BULK_NOT_FOUND)
+# seconds a claim of an idempotency key is kept without response before another request takes the key over (the
+# request is gone, e.g. its worker was killed)
+IDEMPOTENCY_LEASE: float = 60.0
+# seconds between two polls of a pending claim, doubled up to the maximum
+IDEMPOTENCY_POLL_INTERVAL: float = 0.01
+IDEMPOTENCY_MAX_POLL_INTERVAL: float = 0.5
+
+T = TypeVar('T')
+
+
+class BulkOperation(NamedTuple):
+    # create / update / delete
+    action: str
+    key: str
+    # create / update only
+    attributes: dict | None = None
+    # seconds to live of a created / updated message (None = never expires)
+    ttl: float | None = None
+
+
+def bulk_status(action: str, live: bool) -> str:
+    """ :return the status of a bulk operation whose key is (not) a live message before it runs """
+    if action == BULK_CREATE:
+        return BULK_CONFLICT if live else BULK_CREATED
+    if not live:
+        return BULK_NOT_FOUND
+    return BULK_UPDATED if action == BULK_UPDATE else BULK_DELETED
+
+
+def bulk_result(action: str, applied: bool) -> str:
+    """ :return the status of a bulk operation that was (not) applied by the storage """
+    if applied:
+        return {BULK_CREATE: BULK_CREATED, BULK_UPDATE: BULK_UPDATED, BULK_DELETE: BULK_DELETED}[action]
+    return BULK_CONFLICT if action == BULK_CREATE else BULK_NOT_FOUND
+
+
+def bulk_aborted(statuses: List[str]) -> List[str]:
+    """ :return the statuses of a rolled back atomic bulk: the failed operations keep theirs, the others are aborted """
+    return [status if status in BULK_FAILURES else BULK_ABORTED for status in statuses]
+
+
+class BulkAborted(Exception):
+    """ Raised inside the transaction of an atomic bulk to roll it back, carries the statuses of the operations """
+
+    def __init__(self, statuses: List[str]):
+        Exception.__init__(self, 'atomic bulk aborted')
+        self.statuses = bulk_aborted(statuses)
+
+
+class CrossShardBulkError(ValueError):
+    """ An atomic bulk has keys on several shards: each shard commits on its own, it could be partially applied """
+
+
+class Change(NamedTuple):
+    # number of the change, increasing
+    seq: int
+    key: str
+    # insert / update / delete
+    operation: str
+    # epoch of the change
+    changed_at: float
+
+
+class IdempotentResponse(NamedTuple):
+    # hash of the request that produced the response, a key reused by another request must not replay it
+    fingerprint: str
+    status: str
+    body: str | None
+
+
+class IdempotencyKeyInProgressError(Exception):
+    """ The first request of an idempotency key is still running once its duplicate waited as long as allowed """
+
+
+def wait_for_claim(attempt: Callable[[], T | None], wait: float, sleep: Callable[[float], Any] = time.sleep) -> T:
+    """
+    wait policy of the claims of the idempotency keys, shared by the storages: the claim is attempted again after a
+    delay doubled each time (see `IDEMPOTENCY_*_POLL_INTERVAL`), until `wait` seconds are spent
+    :param attempt: attempts the claim, :return None while the key is claimed by a request in progress
+    :param wait: maximum seconds spent waiting
+    :param sleep: waits the seconds given (default = `time.sleep`, or e.g. a `Condition.wait` woken up earlier)
+    :return: the result of the first attempt not returning None
+    :raise IdempotencyKeyInProgressError: if the key is still claimed once the wait is over
+    """
+    deadline = time.monotonic() + wait
+    delay = IDEMPOTENCY_POLL_INTERVAL
+    while True:
+        result = attempt()
+        if result is not None:
+            return result
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise IdempotencyKeyInProgressError(f'a request of the idempotency key is still in progress after '
+                                                f'{wait}s')
+        sleep(min(delay, remaining))
+        delay = min(delay * 2, IDEMPOTENCY_MAX_POLL_INTERVAL)
+
+
+class IdempotencyClaim:
+    """
+    Claim of an idempotency key (see `MessageBackend.claim_idempotency_key`): either the response stored by the
+    first request of the key, to be replayed, or the right to run the request and `store` its response
+    """
+    response: IdempotentResponse | None
+    stored: IdempotentResponse | None
+
+    def __init__(self, response: IdempotentResponse | None = None):
+        self.response = response
+        self.stored = None
+
+    def store(self, response: IdempotentResponse) -> None:
+        """ keep the response of the request, stored when the claim ends """
+        self.stored = response
+
+
+def changed_fields(attributes: dict, patch: dict) -> dict:
+    """ :return the new value of each top level attribute of the merge patch (None when removed) """
+    return {name: attributes.get(name) for name in patch}
+
+
+def ndjson_line(key: str, attributes: str, expires_at: float | None) -> bytes:
+    """
+    :param key: message key
+    :param attributes: attributes of the message, already serialized in json
+    :param expires_at: epoch of expiry (None = never)
+    :return: the NDJSON line of an exported message
+    """
+    line = f'{{"key": {json.dumps(key)}, "attributes": {attributes}, "expires_at": {json.dumps(expires_at)}}}\n'
+    return line.encode('utf-8')
+
+
+def parse_ndjson_line(line: bytes, number: int) -> Tuple[str, dict, float | None] | None:
+    """
+    :param line: NDJSON line of an imported message (`{"key": ..., "attributes": {...}, "expires_at": epoch}`)
+    :param number: line number, for the error message
+    :return: (key, attributes, expires_at), None for a blank line
+    :raise InvalidDataError: if the line is not a message
+    """
+    if not line.strip():
+        return None
+    try:
+        document = json.loads(line)
+        key, attributes, expiry = document['key'], document.get('attributes') or dict(), document.get('expires_at')
+        if not isinstance(key, str) or not isinstance(attributes, dict):
+            raise ValueError('`key` must be a string and `attributes` an object')
+        return key, attributes, None if expiry is None else float(expiry)
+    except (ValueError, TypeError, KeyError) as err:
+        raise InvalidDataError(f'invalid message on line {number} : {err!r}')
+
+
+class MessageBackend(ABC):
+    """
+    Storage backend of the message entities.
+
+    Implementations raise `StorageBackendError` when the storage fails, batch variants default to a loop over the
+    single entity operations and should be overridden when the storage can do better.
+    A message can expire (`ttl` in seconds, None = never): expired messages are invisible to every operation and
+    deleted afterwards by `reap`.
+    """
+    name: str
+    # the storage feeds the changes of the messages (see `listen_changes`)
+    change_feed: bool = False
+
+    def open(self) -> None:
+        """ open the storage resources of the current process (e.g. connection pool) """
+
+    def warm_up(self) -> None:
+        """ pre-open the resources the first requests would otherwise wait for """
+
+    def close(self) -> None:
+        """ release the storage resources of the current process """
+
+    def migrate(self) -> None:
+        """ create / upgrade the storage schema """
+
+    def migration_plan(self) -> list:
+        """ :return the pending schema migrations, nothing is applied (empty when the schema is not versioned) """
+        return []
+
+    def ping(self) -> bool:
+        """ :return True if the storage is reachable """
+        return True
+
+    def get_used_connections(self) -> int:
+        """ :return the number of storage connections in use (0 when not relevant) """
+        return 0
+
+    def resize_pool(self, min_connections: int, max_connections: int) -> None:
+        """ change the bounds of the storage connection pool of the current process (no-op when not relevant) """
+
+    def reap(self, batch_size: int) -> int:
+        """
+        delete a batch of expired messages
+        :return: the number of deleted messages
+        """
+        return 0
+
+    def expiry_lag(self) -> float:
+        """ :return the seconds since the oldest expired message (not deleted yet) expired, 0 if there is none """
+        return 0.0
+
+    @contextmanager
+    def claim_idempotency_key(self, key: str, fingerprint: str, ttl: float,
+                              wait: float) -> Iterator[IdempotencyClaim]:
+        """
+        claim an idempotency key for the duration of a request: a concurrent request of the same key waits until the
+        claim ends (see `wait_for_claim`), then gets the stored response. The response `store`d in the claim is kept
+        `ttl` seconds, a claim ending without response (or on error) releases the key for the next request.
+        Default: no storage, every request runs.
+        :param key: idempotency key
+        :param fingerprint: hash of the request
+        :param ttl: seconds the response is kept
+        :param wait: maximum seconds waited for a claim in progress
+        :return: the claim, whose `response` is set when a previous request already stored one
+        :raise IdempotencyKeyInProgressError: if the key is still claimed once the wait is over
+        """
+        yield IdempotencyClaim()
+
+    def reap_idempotency_keys(self, batch_size: int) -> int:
+        """
+        delete a batch of expired idempotency keys
+        :return: the number of deleted keys
+        """
+        return 0
+
+    def listen_changes(self, timeout: float = 1.0) -> Iterator[List[Change]]:
+        """
+        listen to the changes of the messages (storages having a `change_feed` only), on a connection of its own
+        :param timeout: seconds waited for changes before yielding an empty list
+        :return: iterator of the changes committed meanwhile, in commit order, an empty list first once listening
+        :raise StorageBackendError: on storage failure (changes may have been missed)
+        """
+        raise StorageBackendError(f'no change feed on the {self.name} storage')
+
+    def changes_since(self, seq: int, limit: int, margin: int = 0) -> List[Change]:
+        """
+        :param seq: number of the last change already known
+        :param limit: maximum number of changes
+        :param margin: number of changes numbered below `seq` looked at again, a change committed after this one may
+            have a lower number (default = 0)
+        :return: the changes kept by the storage after this one, and those of the margin committed after it, ordered
+            by number
+        """
+        raise StorageBackendError(f'no change feed on the {self.name} storage')
+
+    def reap_changes(self, batch_size: int, retention: float) -> int:
+        """
+        delete a batch of the changes older than the retention
+        :return: the number of deleted changes
+        """
+        return 0
+
+    @abstractmethod
+    def select(self, key: str) -> dict | None:
+        """ :return the attributes of the message, None if it doesn't exist """
+
+    @abstractmethod
+    def create(self, key: str, attributes: dict, ttl: float | None = None) -> None:
+        """ create a message (the key must not exist, or be expired) """
+
+    @abstractmethod
+    def update(self, key: str, attributes: dict, ttl: float | None = None) -> None:
+        """ replace the attributes and the time to live of a message """
+
+    @abstractmethod
+    def patch(self, key: str, patch: dict, ttl: float | None = None) -> dict | None:
+        """
+        apply a json merge patch (RFC 7396: `null` removes an attribute, objects are merged recursively) to the
+        attributes of a message, in a single atomic operation
+        :param ttl: new time to live of the message (None = unchanged)
+        :return: the new value of each top level attribute of the patch (None when removed), None if the message
+            doesn't exist
+        """
+
+    @abstractmethod
+    def delete(self, key: str) -> bool:
+        """
+        delete a message
+        :return: True if a message was deleted (expired or not), False if there was none
+        """
+
+    @abstractmethod
+    def scan_keys(self, batch_size: int = 1000) -> Iterator[List[str]]:
+        """
+        read every key (expired messages not reaped yet included), with constant memory
+        :param batch_size: number of keys read at once (default = 1000)
+        :return: iterator of the batches of keys
+        """
+
+    @abstractmethod
+    def export_ndjson(self, out: BinaryIO) -> int:
+        """
+        write every live message to the stream, one json document per line (see `ndjson_line`), with constant memory
+        :return: the number of exported messages
+        """
+
+    @abstractmethod
+    def import_ndjson(self, source: BinaryIO, upsert: bool = False) -> int:
+        """
+        store the messages read from a stream of json documents, one per line (see `parse_ndjson_line`)
+        :param upsert: replace the existing messages (default = False, an existing message fails the import)
+        :return: the number of imported messages
+        :raise InvalidDataError: on an invalid line or an existing message
+        """
+
+    @abstractmethod
+    def find(self, attributes: dict, limit: int, after: str | None = None) -> List[Tuple[str, dict]]:
+        """
+        :param attributes: attributes the messages must contain (json containment, nested objects allowed)
+        :param limit: maximum number of messages
+        :param after: only the messages whose key is greater (keyset pagination)
+        :return: (key, attributes) of the matching messages, ordered by key
+        """
+
+    def select_many(self, keys: List[str]) -> Dict[str, dict]:
+        """ :return the attributes of the existing messages, by key """
+        found = dict()
+        for key in keys:
+            attributes = self.select(key)
+            if attributes is not None:
+                found[key] = attributes
+        return found
+
+    def create_many(self, messages: Dict[str, dict], ttl: float | None = None) -> None:
+        """ create messages (attributes by key) """
+        for key, attributes in messages.items():
+            self.create(key, attributes, ttl)
+
+    def update_many(self, messages: Dict[str, dict], ttl: float | None = None) -> None:
+        """ replace the attributes of messages (attributes by key) """
+        for key, attributes in messages.items():
+            self.update(key, attributes, ttl)
+
+    def delete_many(self, keys: List[str]) -> None:
+        """ delete messages """
+        for key in keys:
+            self.delete(key)
+
+    def bulk(self, operations: List[BulkOperation], atomic: bool = True) -> List[str]:
+        """
+        run create / update / delete operations, each on a different key. A create fails on a live message
+        (`conflict`), an update / delete fails on a missing or expired one (`not_found`).
+        Default: existence checked by `select_many`, then a loop over the single entity operations (not isolated
+        from concurrent writes, should be overridden by a storage having transactions).
+        :param operations: operations, at most one per key
+        :param atomic: all or nothing (default = True): when an operation fails, none is applied (`aborted`),
+            otherwise the other operations are applied anyway (best effort)
+        :return: the status of each operation, in order (see `BULK_*`)
+        :raise CrossShardBulkError: if the storage can't run the atomic bulk in a single transaction
+        """
+        live = self.select_many([operation.key for operation in operations])
+        statuses = [bulk_status(operation.action, operation.key in live) for operation in operations]
+        if atomic and any(status in BULK_FAILURES for status in statuses):
+            return bulk_aborted(statuses)
+        for operation, status in zip(operations, statuses):
+            if status == BULK_CREATED:
+                self.create(operation.key, operation.attributes, operation.ttl)
+            elif status == BULK_UPDATED:
+                self.update(operation.key, operation.attributes, operation.ttl)
+            elif status == BULK_DELETED:
+                self.delete(operation.key)
+        return statuses
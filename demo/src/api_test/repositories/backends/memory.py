@@ -0,0 +1,273 @@
+import heapq
+import json
+import threading
+import time
+from contextlib import contextmanager
+from itertools import islice
+from typing import Any, BinaryIO, Dict, Iterator, List, NamedTuple, Tuple
+
+from ...adapters.memory import ShardedMemoryStore
+from ..errors.repositories_errors import InvalidDataError, StorageBackendError
+from . import (
+    BULK_DELETED,
+    BULK_FAILURES,
+    BulkOperation,
+    IdempotencyClaim,
+    IdempotentResponse,
+    MessageBackend,
+    bulk_aborted,
+    bulk_status,
+    changed_fields,
+    ndjson_line,
+    parse_ndjson_line,
+    wait_for_claim,
+)
+
+
+def contains(document: Any, pattern: Any) -> bool:
+    """ :return True if the json document contains the pattern (same rules as the postgres `@>` operator) """
+    if isinstance(pattern, dict):
+        return isinstance(document, dict) and all(name in document and contains(document[name], value)
+                                                  for name, value in pattern.items())
+    if isinstance(pattern, list):
+        return isinstance(document, list) and all(any(contains(item, value) for item in document)
+                                                  for value in pattern)
+    if isinstance(pattern, (int, float)) and not isinstance(pattern, bool):
+        # 1 and 1.0 are the same json number, but json booleans are not numbers
+        return isinstance(document, (int, float)) and not isinstance(document, bool) and document == pattern
+    return type(document) is type(pattern) and document == pattern
+
+
+def merge_patch(target: Any, patch: Any) -> Any:
+    """ :return the target with the json merge patch applied (RFC 7396), the target is left unchanged """
+    if not isinstance(patch, dict):
+        return patch
+    merged = dict(target) if isinstance(target, dict) else dict()
+    for name, value in patch.items():
+        if value is None:
+            merged.pop(name, None)
+        else:
+            merged[name] = merge_patch(merged.get(name), value)
+    return merged
+
+
+class _Entry(NamedTuple):
+    attributes: dict
+    # time.time() of expiry, None = never
+    expires_at: float | None
+
+    def live(self, now: float) -> bool:
+        return self.expires_at is None or self.expires_at > now
+
+
+def _expires_at(ttl: float | None) -> float | None:
+    return None if ttl is None else time.time() + ttl
+
+
+class MemoryMessageBackend(MessageBackend):
+    """
+    Messages stored in process memory (each worker has its own data): a local stand-in for benchmarks,
+    to measure the framework overhead without any database cost.
+
+    Expiring messages are also pushed in a heap ordered by expiry, so `reap` only visits expired messages.
+    """
+    name = 'memory'
+    _store: ShardedMemoryStore
+    _expiries: List[Tuple[float, str]]
+    _expiries_lock: threading.Lock
+    _idempotency: Dict[str, Tuple[IdempotentResponse | None, float]]
+    _idempotency_changed: threading.Condition
+
+    def __init__(self, store: ShardedMemoryStore):
+        self._store = store
+        self._expiries = []
+        # taken after a shard lock, never before
+        self._expiries_lock = threading.Lock()
+        # (stored response, time.time() of expiry) by idempotency key, no response while the claim is in progress
+        self._idempotency = dict()
+        self._idempotency_changed = threading.Condition()
+
+    def select(self, key: str) -> dict | None:
+        entry: _Entry | None = self._store.get(key)
+        return entry.attributes if entry is not None and entry.live(time.time()) else None
+
+    def create(self, key: str, attributes: dict, ttl: float | None = None) -> None:
+        with self._store.locked([key]):
+            shard = self._store.unsafe_shard(key)
+            entry: _Entry | None = shard.get(key)
+            if entry is not None and entry.live(time.time()):
+                raise StorageBackendError(f'duplicate key {key}')
+            self.__put(shard, key, attributes, _expires_at(ttl))
+
+    def update(self, key: str, attributes: dict, ttl: float | None = None) -> None:
+        with self._store.locked([key]):
+            shard = self._store.unsafe_shard(key)
+            entry: _Entry | None = shard.get(key)
+            if entry is not None and entry.live(time.time()):
+                self.__put(shard, key, attributes, _expires_at(ttl))
+
+    def patch(self, key: str, patch: dict, ttl: float | None = None) -> dict | None:
+        with self._store.locked([key]):
+            shard = self._store.unsafe_shard(key)
+            entry: _Entry | None = shard.get(key)
+            if entry is None or not entry.live(time.time()):
+                return None
+            # stored documents are never modified in place, readers may hold the previous one
+            attributes = merge_patch(entry.attributes, patch)
+            self.__put(shard, key, attributes, entry.expires_at if ttl is None else _expires_at(ttl))
+        return changed_fields(attributes, patch)
+
+    def delete(self, key: str) -> bool:
+        return self._store.pop(key) is not None
+
+    def scan_keys(self, batch_size: int = 1000) -> Iterator[List[str]]:
+        keys = self._store.keys()
+        while batch := list(islice(keys, batch_size)):
+            yield batch
+
+    def reap(self, batch_size: int) -> int:
+        now, reaped = time.time(), 0
+        while reaped < batch_size:
+            with self._expiries_lock:
+                if not self._expiries or self._expiries[0][0] > now:
+                    break
+                expires_at, key = heapq.heappop(self._expiries)
+            with self._store.locked([key]):
+                shard = self._store.unsafe_shard(key)
+                entry: _Entry | None = shard.get(key)
+                # the message may have been deleted, or written again since this expiry was pushed
+                if entry is not None and entry.expires_at == expires_at:
+                    del shard[key]
+                    reaped += 1
+        return reaped
+
+    def expiry_lag(self) -> float:
+        with self._expiries_lock:
+            oldest = self._expiries[0][0] if self._expiries else None
+        # may be an outdated expiry of a message written again since, until it is popped by `reap`
+        return max(time.time() - oldest, 0.0) if oldest is not None else 0.0
+
+    @contextmanager
+    def claim_idempotency_key(self, key: str, fingerprint: str, ttl: float,
+                              wait: float) -> Iterator[IdempotencyClaim]:
+
+        def attempt() -> IdempotencyClaim | None:
+            response, expires_at = self._idempotency.get(key, (None, 0.0))
+            if response is None and key in self._idempotency:
+                # claimed by a request in progress: woken up when its claim ends
+                return None
+            if response is not None and expires_at > time.time():
+                return IdempotencyClaim(response)
+            self._idempotency[key] = (None, float('inf'))
+            return IdempotencyClaim()
+
+        with self._idempotency_changed:
+            claim = wait_for_claim(attempt, wait, self._idempotency_changed.wait)
+        if claim.response is not None:
+            yield claim
+            return
+        try:
+            yield claim
+        finally:
+            with self._idempotency_changed:
+                if claim.stored is not None:
+                    self._idempotency[key] = (claim.stored, time.time() + ttl)
+                else:
+                    del self._idempotency[key]
+                self._idempotency_changed.notify_all()
+
+    def reap_idempotency_keys(self, batch_size: int) -> int:
+        now = time.time()
+        with self._idempotency_changed:
+            expired = [key for key, (response, expires_at) in self._idempotency.items()
+                       if response is not None and expires_at <= now][:batch_size]
+            for key in expired:
+                del self._idempotency[key]
+        return len(expired)
+
+    def export_ndjson(self, out: BinaryIO) -> int:
+        now, exported = time.time(), 0
+        for key in self._store.keys():
+            entry: _Entry | None = self._store.get(key)
+            if entry is not None and entry.live(now):
+                out.write(ndjson_line(key, json.dumps(entry.attributes), entry.expires_at))
+                exported += 1
+        return exported
+
+    def import_ndjson(self, source: BinaryIO, upsert: bool = False) -> int:
+        # message by message: a failed import keeps the messages of the previous lines
+        imported = 0
+        for number, line in enumerate(source, start=1):
+            message = parse_ndjson_line(line, number)
+            if message is None:
+                continue
+            key, attributes, expiry = message
+            with self._store.locked([key]):
+                shard = self._store.unsafe_shard(key)
+                entry: _Entry | None = shard.get(key)
+                if not upsert and entry is not None and entry.live(time.time()):
+                    raise InvalidDataError(f'duplicate key {key} on line {number}')
+                self.__put(shard, key, attributes, expiry)
+            imported += 1
+        return imported
+
+    def find(self, attributes: dict, limit: int, after: str | None = None) -> List[Tuple[str, dict]]:
+        # full scan: the memory backend has no index, it is meant for small data sets
+        now = time.time()
+        entries = ((key, self._store.get(key)) for key in self._store.keys() if after is None or key > after)
+        matches = ((key, entry.attributes) for key, entry in entries
+                   if entry is not None and entry.live(now) and contains(entry.attributes, attributes))
+        return heapq.nsmallest(limit, matches, key=lambda match: match[0])
+
+    def select_many(self, keys: List[str]) -> Dict[str, dict]:
+        now = time.time()
+        return {key: entry.attributes for key, entry in self._store.get_many(keys).items() if entry.live(now)}
+
+    def create_many(self, messages: Dict[str, dict], ttl: float | None = None) -> None:
+        # all or nothing, like the single statement of the sql backends
+        now, expires_at = time.time(), _expires_at(ttl)
+        with self._store.locked(messages):
+            duplicates = [key for key in messages
+                          if key in self._store.unsafe_shard(key) and self._store.unsafe_shard(key)[key].live(now)]
+            if duplicates:
+                raise StorageBackendError(f'duplicate keys {duplicates}')
+            for key, attributes in messages.items():
+                self.__put(self._store.unsafe_shard(key), key, attributes, expires_at)
+
+    def update_many(self, messages: Dict[str, dict], ttl: float | None = None) -> None:
+        now, expires_at = time.time(), _expires_at(ttl)
+        with self._store.locked(messages):
+            for key, attributes in messages.items():
+                shard = self._store.unsafe_shard(key)
+                if key in shard and shard[key].live(now):
+                    self.__put(shard, key, attributes, expires_at)
+
+    def delete_many(self, keys: List[str]) -> None:
+        with self._store.locked(keys):
+            for key in keys:
+                self._store.unsafe_shard(key).pop(key, None)
+
+    def bulk(self, operations: List[BulkOperation], atomic: bool = True) -> List[str]:
+        # every key locked at once: the checks and the writes are isolated from the other requests
+        now = time.time()
+        with self._store.locked([operation.key for operation in operations]):
+            statuses = []
+            for operation in operations:
+                entry: _Entry | None = self._store.unsafe_shard(operation.key).get(operation.key)
+                statuses.append(bulk_status(operation.action, entry is not None and entry.live(now)))
+            if atomic and any(status in BULK_FAILURES for status in statuses):
+                return bulk_aborted(statuses)
+            for operation, status in zip(operations, statuses):
+                shard = self._store.unsafe_shard(operation.key)
+                if status == BULK_DELETED:
+                    del shard[operation.key]
+                elif status not in BULK_FAILURES:
+                    self.__put(shard, operation.key, operation.attributes, _expires_at(operation.ttl))
+        return statuses
+
+    def __put(self, shard: Dict[str, _Entry], key: str, attributes: dict, expires_at: float | None) -> None:
+        # the shard lock of the key is held by the caller
+        shard[key] = _Entry(attributes, expires_at)
+        if expires_at is not None:
+            with self._expiries_lock:
+                heapq.heappush(self._expiries, (expires_at, key))
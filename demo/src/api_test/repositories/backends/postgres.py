@@ -0,0 +1,701 @@
+import heapq
+import io
+import json
+from contextlib import contextmanager
+from typing import Any, BinaryIO, ContextManager, Dict, Iterator, List, Tuple
+
+from ...adapters.errors.postgres_errors import (
+    PostgresConnectionError,
+    PostgresCursorError,
+    PostgresQueryError,
+)
+from ...adapters.migrations import PlannedMigration
+from ...adapters.postgres import Postgres, is_data_error
+from ...adapters.sharded_postgres import ShardedPostgres
+from ..errors.repositories_errors import InvalidDataError, StorageBackendError
+from . import (
+    BULK_CREATE,
+    BULK_DELETE,
+    BULK_FAILURES,
+    BULK_UPDATE,
+    IDEMPOTENCY_LEASE,
+    BulkAborted,
+    BulkOperation,
+    Change,
+    CrossShardBulkError,
+    IdempotencyClaim,
+    IdempotentResponse,
+    MessageBackend,
+    bulk_result,
+    parse_ndjson_line,
+    wait_for_claim,
+)
+
+ENTITY_NAME: str = 'message'
+# expired messages (`expires_at` in the past) are invisible until the reaper deletes them
+LIVE: str = '''(expires_at IS NULL OR expires_at > now())'''
+# seconds to live (null = never expires) to expiry timestamp
+EXPIRES_AT: str = "now() + %(ttl)s::float8 * interval '1 second'"
+SELECT_FROM_KEY: str = f'''SELECT key, attributes FROM message WHERE key = %(key)s AND {LIVE}'''
+SELECT_ALL: str = '''SELECT key, attributes, expires_at FROM message'''
+SELECT_FROM_KEYS: str = f'''SELECT key, attributes FROM message WHERE key = ANY(%(keys)s) AND {LIVE}'''
+# containment (`@>`) is served by the `jsonb_path_ops` GIN index of migration 003, keys are ordered byte wise
+# (like python strings and sqlite) so pages of several shards can be merged and keyset cursors work everywhere
+FIND_BY_ATTRIBUTES: str = f'''SELECT key, attributes FROM message WHERE attributes @> %(attributes)s::jsonb
+AND {LIVE} ORDER BY key COLLATE "C" LIMIT %(limit)s'''
+FIND_BY_ATTRIBUTES_AFTER: str = f'''SELECT key, attributes FROM message WHERE attributes @> %(attributes)s::jsonb
+AND {LIVE} AND key COLLATE "C" > %(after)s ORDER BY key COLLATE "C" LIMIT %(limit)s'''
+DELETE_FROM_KEY: str = '''DELETE FROM message WHERE key = %(key)s RETURNING 1'''
+SELECT_KEYS: str = '''SELECT key FROM message'''
+DELETE_FROM_KEYS: str = '''DELETE FROM message WHERE key = ANY(%(keys)s)'''
+DELETE_EXPIRED_FROM_KEYS: str = '''DELETE FROM message WHERE key = ANY(%(keys)s) AND expires_at <= now()'''
+UPDATE_FROM_KEY: str = f'''UPDATE message SET attributes = %(attributes)s, expires_at = {EXPIRES_AT}
+WHERE key = %(key)s AND {LIVE}'''
+UPDATE_FROM_VALUES: str = f'''UPDATE message SET attributes = data.attributes,
+expires_at = now() + data.ttl * interval '1 second'
+FROM (VALUES %s) AS data (key, attributes, ttl) WHERE message.key = data.key AND {LIVE}'''
+# the merge patch expression is built by `merge_patch_expression`, only the top level attributes of the patch are
+# sent back (a removed attribute comes back as null)
+PATCH_FROM_KEY: str = f'''UPDATE message SET attributes = {{expression}},
+expires_at = coalesce({EXPIRES_AT}, expires_at) WHERE key = %(key)s AND {LIVE}
+RETURNING (SELECT jsonb_object_agg(name, attributes -> name) FROM unnest(%(names)s::text[]) AS name)'''
+# an expired message not reaped yet is replaced, a live one is left untouched (no row returned)
+INSERT: str = f'''INSERT INTO message (key, attributes, expires_at) VALUES (%(key)s, %(attributes)s, {EXPIRES_AT})
+ON CONFLICT (key) DO UPDATE SET attributes = EXCLUDED.attributes, expires_at = EXCLUDED.expires_at
+WHERE message.expires_at <= now() RETURNING key'''
+INSERT_VALUES: str = '''INSERT INTO message (key, attributes, expires_at)
+SELECT key, attributes, now() + ttl * interval '1 second' FROM (VALUES %s) AS data (key, attributes, ttl)'''
+VALUES_TEMPLATE: str = '(%s, %s::jsonb, %s::float8)'
+# bulk: one statement per action, the rows returned tell which operations were applied (a created key, an updated
+# key, a deleted key with whether it was live)
+BULK_INSERT_VALUES: str = f'''{INSERT_VALUES}
+ON CONFLICT (key) DO UPDATE SET attributes = EXCLUDED.attributes, expires_at = EXCLUDED.expires_at
+WHERE message.expires_at <= now() RETURNING key'''
+BULK_UPDATE_VALUES: str = f'''{UPDATE_FROM_VALUES} RETURNING message.key'''
+BULK_DELETE_FROM_KEYS: str = f'''DELETE FROM message WHERE key = ANY(%(keys)s) RETURNING key, {LIVE}'''
+BULK_PAGE_SIZE: int = 1000
+# resharding copies the expiry as is
+INSERT_VALUES_IF_ABSENT: str = '''INSERT INTO message (key, attributes, expires_at) VALUES %s
+ON CONFLICT (key) DO NOTHING'''
+RESHARD_VALUES_TEMPLATE: str = '(%s, %s::jsonb, %s::timestamptz)'
+# small batches, one reaper at a time (transaction level advisory lock, the other workers skip their turn): short
+# row locks and a bounded WAL rate. Batches are picked by key, `ctid` is not unique across the hash partitions
+REAP_LOCK_ID: int = 0x6D657373  # 'mess'
+REAP_EXPIRED: str = '''WITH reaper AS (SELECT pg_try_advisory_xact_lock(%(lock_id)s) AS locked)
+DELETE FROM message WHERE (SELECT locked FROM reaper) AND expires_at <= now() AND key IN
+(SELECT key FROM message WHERE expires_at <= now() LIMIT %(batch_size)s FOR UPDATE SKIP LOCKED)
+RETURNING 1'''
+# NDJSON through COPY: csv format with quote and delimiter bytes that never appear raw in json text, so every line
+# goes through as is (the text format would escape the backslashes of the json)
+NDJSON_COPY_OPTIONS: str = '''(FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02')'''
+EXPORT: str = f'''COPY (SELECT json_build_object('key', key, 'attributes', attributes,
+'expires_at', extract(epoch FROM expires_at)) FROM message WHERE {LIVE}) TO STDOUT WITH {NDJSON_COPY_OPTIONS}'''
+# the lines are copied in a staging table (dropped at commit) then merged, the last line of a key wins the upsert
+IMPORT_STAGING: str = '''CREATE TEMP TABLE message_import (line bigint GENERATED ALWAYS AS IDENTITY, doc jsonb)
+ON COMMIT DROP'''
+IMPORT_COPY: str = f'''COPY message_import (doc) FROM STDIN WITH {NDJSON_COPY_OPTIONS}'''
+IMPORT_DOCUMENTS: str = '''SELECT DISTINCT ON (doc ->> 'key') doc ->> 'key', coalesce(doc -> 'attributes', '{}'),
+to_timestamp((doc ->> 'expires_at')::float8) FROM message_import WHERE doc IS NOT NULL
+ORDER BY doc ->> 'key', line DESC'''
+IMPORT_INSERT: str = f'''INSERT INTO message (key, attributes, expires_at) {IMPORT_DOCUMENTS}'''
+IMPORT_UPSERT: str = f'''{IMPORT_INSERT}
+ON CONFLICT (key) DO UPDATE SET attributes = EXCLUDED.attributes, expires_at = EXCLUDED.expires_at'''
+# bulk loads stay out of the change feed (see migration 006), for their transaction only
+SKIP_CHANGE_FEED: str = "SET LOCAL api_test.change_feed = 'off'"
+# rows already encoded for COPY (`binary` or `text` format), straight into the table: an existing key fails the copy
+COPY_ROWS: str = '''COPY message (key, attributes, expires_at) FROM STDIN WITH (FORMAT {copy_format})'''
+# idempotency keys: the first request of a key commits a pending row (no status) expiring after the lease, then runs
+# without holding a connection; a concurrent request finds the row pending and polls it until the response is stored
+# (see `wait_for_claim`).
+# The `expires_at` returned by the claim identifies it: a claim left by a request gone is taken over once expired
+IDEMPOTENCY_ENTITY: str = 'idempotency_key'
+IDEMPOTENCY_CLAIM: str = '''INSERT INTO idempotency_key (key, fingerprint, expires_at)
+VALUES (%(key)s, %(fingerprint)s, now() + %(lease)s::float8 * interval '1 second')
+ON CONFLICT (key) DO UPDATE SET fingerprint = EXCLUDED.fingerprint, status = NULL, body = NULL,
+expires_at = EXCLUDED.expires_at WHERE idempotency_key.expires_at <= now() RETURNING expires_at'''
+IDEMPOTENCY_SELECT: str = '''SELECT fingerprint, status, body FROM idempotency_key WHERE key = %(key)s'''
+IDEMPOTENCY_STORE: str = '''UPDATE idempotency_key SET status = %(status)s, body = %(body)s,
+expires_at = now() + %(ttl)s::float8 * interval '1 second'
+WHERE key = %(key)s AND expires_at = %(claimed_until)s AND status IS NULL'''
+IDEMPOTENCY_RELEASE: str = '''DELETE FROM idempotency_key
+WHERE key = %(key)s AND expires_at = %(claimed_until)s AND status IS NULL'''
+IDEMPOTENCY_REAP: str = '''DELETE FROM idempotency_key WHERE key IN (SELECT key FROM idempotency_key
+WHERE expires_at <= now() LIMIT %(batch_size)s FOR UPDATE SKIP LOCKED) RETURNING 1'''
+# change feed: the notifications of the channel carry the numbers of the changes
+CHANGE_CHANNEL: str = 'message_change'
+CHANGE_COLUMNS: str = '''seq, key, operation, extract(epoch FROM changed_at)'''
+CHANGES_FROM_SEQS: str = f'''SELECT {CHANGE_COLUMNS} FROM message_change WHERE seq = ANY(%(seqs)s)'''
+# numbers are taken at insert, not at commit: the `margin` changes numbered below the resumed one are read again, only
+# those whose transaction was still running when it was written (not visible in its snapshot) are kept, others of its
+# own transaction excluded (they were notified before it). See migration 007
+CHANGES_SINCE: str = f'''WITH resumed AS (SELECT txid, snapshot FROM message_change WHERE seq = %(seq)s)
+SELECT {CHANGE_COLUMNS} FROM message_change WHERE seq > %(seq)s - %(margin)s AND (seq > %(seq)s
+OR (seq < %(seq)s AND NOT pg_visible_in_snapshot(txid, (SELECT snapshot FROM resumed))
+AND txid <> (SELECT txid FROM resumed)))
+ORDER BY seq LIMIT %(limit)s'''
+REAP_CHANGES: str = '''DELETE FROM message_change WHERE seq IN (SELECT seq FROM message_change
+WHERE changed_at < now() - %(retention)s::float8 * interval '1 second' ORDER BY seq LIMIT %(batch_size)s)
+RETURNING 1'''
+EXPIRY_LAG: str = '''SELECT extract(epoch FROM now() - min(expires_at)) FROM message WHERE expires_at <= now()'''
+
+POSTGRES_ERRORS = (PostgresConnectionError, PostgresCursorError, PostgresQueryError)
+
+
+def merge_patch_expression(target: str, patch: dict, params: Dict[str, Any]) -> str:
+    """
+    translate a json merge patch (RFC 7396) in a jsonb expression: removed attributes are dropped with `-`, scalar
+    and array values are merged with `||`, nested objects are patched recursively and put back with `jsonb_set`.
+    :param target: sql expression of the patched jsonb document
+    :param patch: json merge patch (object)
+    :param params: query parameters, completed with the values of the expression
+    :return: sql expression of the patched document
+    """
+    def param(value: Any) -> str:
+        name = f'patch_{len(params)}'
+        params[name] = value
+        return f'%({name})s'
+
+    # a patch object replaces anything that is not an object
+    expression = f"(CASE WHEN jsonb_typeof({target}) = 'object' THEN {target} ELSE '{{}}'::jsonb END)"
+    removals = [name for name, value in patch.items() if value is None]
+    if removals:
+        expression = f'({expression} - {param(removals)}::text[])'
+    values = {name: value for name, value in patch.items() if value is not None and not isinstance(value, dict)}
+    if values:
+        expression = f'({expression} || {param(json.dumps(values))}::jsonb)'
+    for name, value in patch.items():
+        if isinstance(value, dict):
+            name_param = f'{param(name)}::text'
+            nested = merge_patch_expression(f'({target} -> {name_param})', value, params)
+            expression = f'jsonb_set({expression}, ARRAY[{name_param}], {nested})'
+    return expression
+
+
+class PostgresMessageBackend(MessageBackend):
+    """
+    Messages stored in the postgres `message` table (jsonb attributes)
+    """
+    name = 'postgres'
+    change_feed = True
+    _dal: Postgres
+
+    def __init__(self, dal: Postgres):
+        self._dal = dal
+
+    @property
+    def dal(self) -> Postgres:
+        return self._dal
+
+    def open(self) -> None:
+        self._dal.open()
+
+    def warm_up(self) -> None:
+        self._dal.warm_up()
+
+    def close(self) -> None:
+        self._dal.close()
+
+    def migrate(self) -> None:
+        self._dal.apply_migration()
+
+    def migration_plan(self) -> List[PlannedMigration]:
+        return self._dal.migration_plan()
+
+    def ping(self) -> bool:
+        try:
+            self._dal.ping_select()
+            return True
+        except POSTGRES_ERRORS:
+            return False
+
+    def get_used_connections(self) -> int:
+        return self._dal.get_used_connections()
+
+    def resize_pool(self, min_connections: int, max_connections: int) -> None:
+        self._dal.resize_pool(min_connections, max_connections)
+
+    def select(self, key: str) -> dict | None:
+        try:
+            result = self._dal.exec_read(ENTITY_NAME, SELECT_FROM_KEY, {'key': key}, statement='select_from_key')
+        except POSTGRES_ERRORS as err:
+            raise StorageBackendError(str(err))
+        if result and result[0][0] == key:
+            return result[0][1]
+        return None
+
+    def create(self, key: str, attributes: dict, ttl: float | None = None) -> None:
+        try:
+            rows = self._dal.exec_write_returning(ENTITY_NAME, INSERT, {'attributes': json.dumps(attributes),
+                                                                        'key': key, 'ttl': ttl}, statement='insert')
+        except POSTGRES_ERRORS as err:
+            raise StorageBackendError(str(err))
+        if not rows:
+            raise StorageBackendError(f'duplicate key {key}')
+
+    def update(self, key: str, attributes: dict, ttl: float | None = None) -> None:
+        self.__write(UPDATE_FROM_KEY, {'attributes': json.dumps(attributes), 'key': key, 'ttl': ttl},
+                     'update_from_key')
+
+    def patch(self, key: str, patch: dict, ttl: float | None = None) -> dict | None:
+        params: Dict[str, Any] = {'key': key, 'names': list(patch), 'ttl': ttl}
+        query = PATCH_FROM_KEY.format(expression=merge_patch_expression('attributes', patch, params))
+        try:
+            rows = self._dal.exec_write_returning(ENTITY_NAME, query, params, statement='patch_from_key')
+        except POSTGRES_ERRORS as err:
+            raise StorageBackendError(str(err))
+        return (rows[0][0] or dict()) if rows else None
+
+    def delete(self, key: str) -> bool:
+        try:
+            return bool(self._dal.exec_write_returning(ENTITY_NAME, DELETE_FROM_KEY, {'key': key},
+                                                       statement='delete_from_key'))
+        except POSTGRES_ERRORS as err:
+            raise StorageBackendError(str(err))
+
+    def scan_keys(self, batch_size: int = 1000) -> Iterator[List[str]]:
+        try:
+            for rows in self._dal.iter_read(ENTITY_NAME, SELECT_KEYS, batch_size=batch_size):
+                yield [row[0] for row in rows]
+        except POSTGRES_ERRORS as err:
+            raise StorageBackendError(str(err))
+
+    def reap(self, batch_size: int) -> int:
+        try:
+            return len(self._dal.exec_write_returning(ENTITY_NAME, REAP_EXPIRED, {'lock_id'   : REAP_LOCK_ID,
+                                                                                  'batch_size': batch_size},
+                                                      statement='reap_expired'))
+        except POSTGRES_ERRORS as err:
+            raise StorageBackendError(str(err))
+
+    def expiry_lag(self) -> float:
+        try:
+            result = self._dal.exec_read(ENTITY_NAME, EXPIRY_LAG, statement='expiry_lag')
+        except POSTGRES_ERRORS as err:
+            raise StorageBackendError(str(err))
+        return float(result[0][0] or 0.0) if result else 0.0
+
+    @contextmanager
+    def claim_idempotency_key(self, key: str, fingerprint: str, ttl: float,
+                              wait: float) -> Iterator[IdempotencyClaim]:
+        # the claim is committed at once: no connection is held while the request runs (its own statements need one)
+        try:
+            claimed_until, response = self.__claim_idempotency_key(key, fingerprint, wait)
+        except POSTGRES_ERRORS as err:
+            raise StorageBackendError(str(err))
+        claim = IdempotencyClaim(response)
+        if response is not None:
+            yield claim
+            return
+        params = {'key': key, 'claimed_until': claimed_until}
+        try:
+            yield claim
+        except BaseException:
+            self.__release_idempotency_key(params)
+            raise
+        try:
+            if claim.stored is None:
+                # no response to keep: a waiting request claims the key
+                self._dal.exec_write(IDEMPOTENCY_ENTITY, IDEMPOTENCY_RELEASE, params, statement='idempotency_release')
+            else:
+                self._dal.exec_write(IDEMPOTENCY_ENTITY, IDEMPOTENCY_STORE,
+                                     {**params, 'status': claim.stored.status, 'body': claim.stored.body, 'ttl': ttl},
+                                     statement='idempotency_store')
+        except POSTGRES_ERRORS as err:
+            raise StorageBackendError(str(err))
+
+    def __claim_idempotency_key(self, key: str, fingerprint: str,
+                                wait: float) -> Tuple[Any, IdempotentResponse | None]:
+        """ :return: the expiry of the claim, or the response stored for the key """
+        params = {'key': key, 'fingerprint': fingerprint, 'lease': IDEMPOTENCY_LEASE}
+
+        def attempt() -> Tuple[Any, IdempotentResponse | None] | None:
+            claimed = self._dal.exec_write_returning(IDEMPOTENCY_ENTITY, IDEMPOTENCY_CLAIM, params,
+                                                     statement='idempotency_claim')
+            if claimed:
+                return claimed[0][0], None
+            rows = self._dal.exec_read(IDEMPOTENCY_ENTITY, IDEMPOTENCY_SELECT, params, statement='idempotency_select')
+            if rows and rows[0][1] is not None:
+                return None, IdempotentResponse(rows[0][0], rows[0][1], rows[0][2])
+            # claimed by a request still running (or released meanwhile): claimed again after a while
+            return None
+
+        return wait_for_claim(attempt, wait)
+
+    def __release_idempotency_key(self, params: dict) -> None:
+        try:
+            self._dal.exec_write(IDEMPOTENCY_ENTITY, IDEMPOTENCY_RELEASE, params, statement='idempotency_release')
+        except POSTGRES_ERRORS:
+            # logged by the adapter, the claim expires after its lease (the error of the request goes on)
+            pass
+
+    def reap_idempotency_keys(self, batch_size: int) -> int:
+        try:
+            return len(self._dal.exec_write_returning(IDEMPOTENCY_ENTITY, IDEMPOTENCY_REAP,
+                                                      {'batch_size': batch_size}, statement='idempotency_reap'))
+        except POSTGRES_ERRORS as err:
+            raise StorageBackendError(str(err))
+
+    def listen_changes(self, timeout: float = 1.0) -> Iterator[List[Change]]:
+        try:
+            for payloads in self._dal.listen(CHANGE_CHANNEL, timeout):
+                if not payloads:
+                    yield []
+                    continue
+                # a single read for the changes notified at once, given back in the notification (commit) order.
+                # Any user can notify the channel: a payload that is not a number is not a change
+                seqs = [int(payload) for payload in payloads if payload.isdigit()]
+                rows = self._dal.exec_read(CHANGE_CHANNEL, CHANGES_FROM_SEQS, {'seqs': seqs},
+                                           statement='changes_from_seqs')
+                found = {row[0]: Change(row[0], row[1], row[2], float(row[3])) for row in rows}
+                yield [found[seq] for seq in seqs if seq in found]
+        except POSTGRES_ERRORS as err:
+            raise StorageBackendError(str(err))
+
+    def changes_since(self, seq: int, limit: int, margin: int = 0) -> List[Change]:
+        try:
+            rows = self._dal.exec_read(CHANGE_CHANNEL, CHANGES_SINCE, {'seq': seq, 'limit': limit, 'margin': margin},
+                                       statement='changes_since')
+        except POSTGRES_ERRORS as err:
+            raise StorageBackendError(str(err))
+        return [Change(row[0], row[1], row[2], float(row[3])) for row in rows]
+
+    def reap_changes(self, batch_size: int, retention: float) -> int:
+        try:
+            params = {'batch_size': batch_size, 'retention': retention}
+            return len(self._dal.exec_write_returning(CHANGE_CHANNEL, REAP_CHANGES, params, statement='reap_changes'))
+        except POSTGRES_ERRORS as err:
+            raise StorageBackendError(str(err))
+
+    def export_ndjson(self, out: BinaryIO) -> int:
+        try:
+            return self._dal.copy_out(ENTITY_NAME, EXPORT, out)
+        except POSTGRES_ERRORS as err:
+            raise StorageBackendError(str(err))
+
+    def import_ndjson(self, source: BinaryIO, upsert: bool = False) -> int:
+        # all or nothing, a line that is not json fails the copy
+        try:
+            return self._dal.copy_in(ENTITY_NAME, IMPORT_COPY, source, before=[SKIP_CHANGE_FEED, IMPORT_STAGING],
+                                     after=IMPORT_UPSERT if upsert else IMPORT_INSERT)
+        except POSTGRES_ERRORS as err:
+            if is_data_error(err):
+                # a line that is not json, an existing key: rejected data, not a storage failure
+                raise InvalidDataError(str(err))
+            raise StorageBackendError(str(err))
+
+    @property
+    def shard_count(self) -> int:
+        return 1
+
+    def copy_messages(self, rows: Dict[int, bytes], copy_format: str) -> int:
+        """
+        store messages already encoded as COPY rows (`key, attributes, expires_at` columns), in a single transaction
+        :param rows: encoded rows by shard index (a single shard: 0)
+        :param copy_format: `binary` or `text` COPY format
+        :return: the number of stored messages
+        """
+        try:
+            return self._dal.copy_in(ENTITY_NAME, COPY_ROWS.format(copy_format=copy_format), io.BytesIO(rows[0]),
+                                     before=[SKIP_CHANGE_FEED])
+        except POSTGRES_ERRORS as err:
+            raise StorageBackendError(str(err))
+
+    def find(self, attributes: dict, limit: int, after: str | None = None) -> List[Tuple[str, dict]]:
+        query = FIND_BY_ATTRIBUTES if after is None else FIND_BY_ATTRIBUTES_AFTER
+        params = {'attributes': json.dumps(attributes), 'limit': limit, 'after': after}
+        try:
+            return [(row[0], row[1]) for row in self._dal.exec_read(ENTITY_NAME, query, params,
+                                                                    statement='find_by_attributes')]
+        except POSTGRES_ERRORS as err:
+            raise StorageBackendError(str(err))
+
+    def select_many(self, keys: List[str]) -> Dict[str, dict]:
+        try:
+            return {row[0]: row[1] for row in self._dal.exec_read(ENTITY_NAME, SELECT_FROM_KEYS, {'keys': keys},
+                                                                  statement='select_from_keys')}
+        except POSTGRES_ERRORS as err:
+            raise StorageBackendError(str(err))
+
+    def create_many(self, messages: Dict[str, dict], ttl: float | None = None) -> None:
+        # the expired messages not reaped yet are dropped first, then a live duplicate fails the whole insert
+        self.__write(DELETE_EXPIRED_FROM_KEYS, {'keys': list(messages)}, 'delete_expired_from_keys')
+        self.__write_values(INSERT_VALUES, messages, ttl, 'insert_values')
+
+    def update_many(self, messages: Dict[str, dict], ttl: float | None = None) -> None:
+        self.__write_values(UPDATE_FROM_VALUES, messages, ttl, 'update_from_values')
+
+    def delete_many(self, keys: List[str]) -> None:
+        self.__write(DELETE_FROM_KEYS, {'keys': keys}, 'delete_from_keys')
+
+    def bulk(self, operations: List[BulkOperation], atomic: bool = True) -> List[str]:
+        groups: Dict[str, Dict[str, BulkOperation]] = {BULK_CREATE: dict(), BULK_UPDATE: dict(), BULK_DELETE: dict()}
+        for operation in operations:
+            groups[operation.action][operation.key] = operation
+        try:
+            # a single transaction and a statement per action (keys are distinct, the order doesn't matter)
+            with self._dal.transaction(ENTITY_NAME) as transaction:
+                created = {row[0] for row in transaction.execute_values(
+                        BULK_INSERT_VALUES, self.__bulk_values(groups[BULK_CREATE]), template=VALUES_TEMPLATE,
+                        fetch=True, page_size=BULK_PAGE_SIZE, statement='bulk_insert_values')}
+                updated = {row[0] for row in transaction.execute_values(
+                        BULK_UPDATE_VALUES, self.__bulk_values(groups[BULK_UPDATE]), template=VALUES_TEMPLATE,
+                        fetch=True, page_size=BULK_PAGE_SIZE, statement='bulk_update_values')}
+                deleted = set()
+                if groups[BULK_DELETE]:
+                    rows = transaction.execute(BULK_DELETE_FROM_KEYS, {'keys': list(groups[BULK_DELETE])},
+                                               statement='bulk_delete_from_keys')
+                    # an expired message not reaped yet is deleted, but reported as not found
+                    deleted = {row[0] for row in rows if row[1]}
+                applied = {BULK_CREATE: created, BULK_UPDATE: updated, BULK_DELETE: deleted}
+                statuses = [bulk_result(operation.action, operation.key in applied[operation.action])
+                            for operation in operations]
+                if atomic and any(status in BULK_FAILURES for status in statuses):
+                    raise BulkAborted(statuses)
+        except BulkAborted as aborted:
+            return aborted.statuses
+        except POSTGRES_ERRORS as err:
+            raise StorageBackendError(str(err))
+        return statuses
+
+    def __write(self, query: str, params: dict, statement: str) -> None:
+        try:
+            self._dal.exec_write(ENTITY_NAME, query, params, statement=statement)
+        except POSTGRES_ERRORS as err:
+            raise StorageBackendError(str(err))
+
+    @staticmethod
+    def __bulk_values(operations: Dict[str, BulkOperation]) -> List[tuple]:
+        return [(key, json.dumps(operation.attributes), operation.ttl) for key, operation in operations.items()]
+
+    def __write_values(self, query: str, messages: Dict[str, dict], ttl: float | None, statement: str) -> None:
+        values = [(key, json.dumps(attributes), ttl) for key, attributes in messages.items()]
+        try:
+            self._dal.exec_values(ENTITY_NAME, query, values, template=VALUES_TEMPLATE, statement=statement)
+        except POSTGRES_ERRORS as err:
+            raise StorageBackendError(str(err))
+
+
+class ShardedPostgresMessageBackend(MessageBackend):
+    """
+    Messages spread over several postgres nodes, each key stored on the shard owning it (see `ShardedPostgres`).
+
+    Single key operations go to one shard, operations on several keys are scattered to the shards in parallel:
+    they are atomic per shard, not across shards.
+    """
+    name = 'postgres'
+    _dal: ShardedPostgres
+    _backends: List[PostgresMessageBackend]
+
+    def __init__(self, dal: ShardedPostgres):
+        self._dal = dal
+        self._backends = [PostgresMessageBackend(shard) for shard in dal.shards]
+
+    @property
+    def dal(self) -> ShardedPostgres:
+        return self._dal
+
+    def open(self) -> None:
+        self._dal.open()
+
+    def warm_up(self) -> None:
+        self._dal.warm_up()
+
+    def close(self) -> None:
+        self._dal.close()
+
+    def migrate(self) -> None:
+        self._dal.apply_migration()
+
+    def migration_plan(self) -> List[PlannedMigration]:
+        return self._dal.migration_plan()
+
+    def ping(self) -> bool:
+        try:
+            self._dal.ping_select()
+            return True
+        except POSTGRES_ERRORS:
+            return False
+
+    def get_used_connections(self) -> int:
+        return self._dal.get_used_connections()
+
+    def resize_pool(self, min_connections: int, max_connections: int) -> None:
+        self._dal.resize_pool(min_connections, max_connections)
+
+    def reap(self, batch_size: int) -> int:
+        results = self._dal.scatter(lambda index, _: self._backends[index].reap(batch_size),
+                                    dict.fromkeys(range(len(self._backends))))
+        return sum(results.values())
+
+    def expiry_lag(self) -> float:
+        results = self._dal.scatter(lambda index, _: self._backends[index].expiry_lag(),
+                                    dict.fromkeys(range(len(self._backends))))
+        return max(results.values())
+
+    def select(self, key: str) -> dict | None:
+        return self.__backend(key).select(key)
+
+    def claim_idempotency_key(self, key: str, fingerprint: str, ttl: float,
+                              wait: float) -> ContextManager[IdempotencyClaim]:
+        # stored on the shard owning the idempotency key
+        return self.__backend(key).claim_idempotency_key(key, fingerprint, ttl, wait)
+
+    def reap_idempotency_keys(self, batch_size: int) -> int:
+        results = self._dal.scatter(lambda index, _: self._backends[index].reap_idempotency_keys(batch_size),
+                                    dict.fromkeys(range(len(self._backends))))
+        return sum(results.values())
+
+    def reap_changes(self, batch_size: int, retention: float) -> int:
+        # each shard numbers its own changes: no global order, the change feed of a sharded storage is not served
+        results = self._dal.scatter(lambda index, _: self._backends[index].reap_changes(batch_size, retention),
+                                    dict.fromkeys(range(len(self._backends))))
+        return sum(results.values())
+
+    def create(self, key: str, attributes: dict, ttl: float | None = None) -> None:
+        self.__backend(key).create(key, attributes, ttl)
+
+    def update(self, key: str, attributes: dict, ttl: float | None = None) -> None:
+        self.__backend(key).update(key, attributes, ttl)
+
+    def patch(self, key: str, patch: dict, ttl: float | None = None) -> dict | None:
+        return self.__backend(key).patch(key, patch, ttl)
+
+    def delete(self, key: str) -> bool:
+        return self.__backend(key).delete(key)
+
+    def scan_keys(self, batch_size: int = 1000) -> Iterator[List[str]]:
+        # one shard after the other
+        for backend in self._backends:
+            yield from backend.scan_keys(batch_size)
+
+    def select_many(self, keys: List[str]) -> Dict[str, dict]:
+        found: Dict[str, dict] = dict()
+        results = self._dal.scatter(lambda index, shard_keys: self._backends[index].select_many(shard_keys),
+                                    self._dal.group_by_shard(keys))
+        for shard_found in results.values():
+            found.update(shard_found)
+        return found
+
+    @property
+    def shard_count(self) -> int:
+        return len(self._backends)
+
+    def copy_messages(self, rows: Dict[int, bytes], copy_format: str) -> int:
+        """
+        store messages already encoded as COPY rows and split by shard (see `ShardedPostgres.shard_index`), the
+        shards are written in parallel
+        """
+        results = self._dal.scatter(lambda index, shard_rows: self._backends[index].copy_messages({0: shard_rows},
+                                                                                                  copy_format),
+                                    rows)
+        return sum(results.values())
+
+    def export_ndjson(self, out: BinaryIO) -> int:
+        # one shard after the other, in the same stream
+        return sum(backend.export_ndjson(out) for backend in self._backends)
+
+    def import_ndjson(self, source: BinaryIO, upsert: bool = False, batch_size: int = 10000) -> int:
+        """
+        the lines are routed to the shard owning their key and imported by batches: a batch is all or nothing on
+        its shard, a failed import keeps the batches already imported
+        :param batch_size: number of lines buffered per shard before they are copied (default = 10000)
+        """
+        imported = 0
+        batches: Dict[int, List[bytes]] = dict()
+        for number, line in enumerate(source, start=1):
+            message = parse_ndjson_line(line, number)
+            if message is None:
+                continue
+            index = self._dal.shard_index(message[0])
+            batch = batches.setdefault(index, [])
+            batch.append(line if line.endswith(b'\n') else line + b'\n')
+            if len(batch) >= batch_size:
+                imported += self._backends[index].import_ndjson(io.BytesIO(b''.join(batch)), upsert)
+                batch.clear()
+        for index, batch in batches.items():
+            if batch:
+                imported += self._backends[index].import_ndjson(io.BytesIO(b''.join(batch)), upsert)
+        return imported
+
+    def find(self, attributes: dict, limit: int, after: str | None = None) -> List[Tuple[str, dict]]:
+        # every shard answers its first `limit` matches, the global page is the first `limit` of their merge
+        results = self._dal.scatter(lambda index, _: self._backends[index].find(attributes, limit, after),
+                                    dict.fromkeys(range(len(self._backends))))
+        return list(heapq.merge(*results.values(), key=lambda match: match[0]))[:limit]
+
+    def create_many(self, messages: Dict[str, dict], ttl: float | None = None) -> None:
+        self._dal.scatter(lambda index, shard_messages: self._backends[index].create_many(shard_messages, ttl),
+                          self.__group_messages(messages))
+
+    def update_many(self, messages: Dict[str, dict], ttl: float | None = None) -> None:
+        self._dal.scatter(lambda index, shard_messages: self._backends[index].update_many(shard_messages, ttl),
+                          self.__group_messages(messages))
+
+    def delete_many(self, keys: List[str]) -> None:
+        self._dal.scatter(lambda index, shard_keys: self._backends[index].delete_many(shard_keys),
+                          self._dal.group_by_shard(keys))
+
+    def bulk(self, operations: List[BulkOperation], atomic: bool = True) -> List[str]:
+        """
+        the operations of each shard run in a transaction of their shard: an atomic bulk must stay on a single shard
+        (the shards commit one by one, an aborted one would leave the others applied)
+        """
+        groups: Dict[int, List[int]] = dict()
+        for index, operation in enumerate(operations):
+            groups.setdefault(self._dal.shard_index(operation.key), []).append(index)
+        if atomic and len(groups) > 1:
+            raise CrossShardBulkError(f'an atomic bulk must only hold keys of a single shard, its keys span '
+                                      f'{len(groups)} shards (send them with `"atomic": false`)')
+        results = self._dal.scatter(lambda shard, indexes: self._backends[shard].bulk(
+                [operations[index] for index in indexes], atomic), groups)
+        statuses: List[str] = [''] * len(operations)
+        for shard, indexes in groups.items():
+            for index, status in zip(indexes, results[shard]):
+                statuses[index] = status
+        return statuses
+
+    def reshard(self, previous: ShardedPostgres, batch_size: int = 1000,
+                dry_run: bool = False) -> Dict[Tuple[str, str], int]:
+        """
+        move the messages stored on the shards of a previous layout to the shard owning them in this one.
+
+        Each batch is first copied to its new shard (a message already written there through the new layout wins),
+        then deleted from its previous shard, so the move can be interrupted and run again.
+        :param previous: shards of the previous layout (the current layout itself to only rebalance misplaced keys)
+        :param batch_size: number of messages scanned per round trip (default = 1000)
+        :param dry_run: only count the messages to move (default = False)
+        :return: number of messages moved (or to move) by (source, destination) shard
+        :raise StorageBackendError: on storage failure, the messages of the pending batch are left on both shards
+        """
+        moved: Dict[Tuple[str, str], int] = dict()
+        try:
+            for source in previous.shards:
+                for rows in source.iter_read(ENTITY_NAME, SELECT_ALL, batch_size=batch_size):
+                    moves: Dict[int, Dict[str, Tuple[dict, Any]]] = dict()
+                    for key, attributes, expiry in rows:
+                        index = self._dal.shard_index(key)
+                        if self._dal.shards[index].target != source.target:
+                            moves.setdefault(index, dict())[key] = (attributes, expiry)
+                    for index, messages in moves.items():
+                        destination = self._dal.shards[index]
+                        if not dry_run:
+                            values = [(key, json.dumps(attributes), expiry)
+                                      for key, (attributes, expiry) in messages.items()]
+                            destination.exec_values(ENTITY_NAME, INSERT_VALUES_IF_ABSENT, values,
+                                                    template=RESHARD_VALUES_TEMPLATE, statement='reshard_insert')
+                            source.exec_write(ENTITY_NAME, DELETE_FROM_KEYS, {'keys': list(messages)},
+                                              statement='reshard_delete')
+                        route = (source.target, destination.target)
+                        moved[route] = moved.get(route, 0) + len(messages)
+        except POSTGRES_ERRORS as err:
+            raise StorageBackendError(str(err))
+        return moved
+
+    def __backend(self, key: str) -> PostgresMessageBackend:
+        return self._backends[self._dal.shard_index(key)]
+
+    def __group_messages(self, messages: Dict[str, dict]) -> Dict[int, Dict[str, dict]]:
+        groups: Dict[int, Dict[str, dict]] = dict()
+        for key, attributes in messages.items():
+            groups.setdefault(self._dal.shard_index(key), dict())[key] = attributes
+        return groups
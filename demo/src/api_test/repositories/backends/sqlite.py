@@ -0,0 +1,383 @@
+import json
+import time
+from contextlib import contextmanager
+from typing import Any, BinaryIO, Dict, Iterator, List, Tuple
+
+from ...adapters.errors.sqlite_errors import SqliteConnectionError, SqliteQueryError
+from ...adapters.sqlite import Sqlite, is_data_error
+from ..errors.repositories_errors import InvalidDataError, StorageBackendError
+from . import (
+    BULK_CREATE,
+    BULK_DELETE,
+    BULK_FAILURES,
+    BULK_UPDATE,
+    IDEMPOTENCY_LEASE,
+    BulkAborted,
+    BulkOperation,
+    IdempotencyClaim,
+    IdempotentResponse,
+    MessageBackend,
+    bulk_result,
+    changed_fields,
+    ndjson_line,
+    parse_ndjson_line,
+    wait_for_claim,
+)
+
+ENTITY_NAME: str = 'message'
+# expires_at: time.time() of expiry, null = never
+SCHEMA: str = '''
+CREATE TABLE IF NOT EXISTS message
+(
+    "key"        TEXT PRIMARY KEY,
+    "attributes" TEXT NOT NULL,
+    "expires_at" REAL
+) WITHOUT ROWID;
+'''
+EXPIRY_SCHEMA: str = '''
+CREATE INDEX IF NOT EXISTS message_expires_at_idx ON message (expires_at) WHERE expires_at IS NOT NULL;
+'''
+# idempotency keys: no row lock in sqlite, the first request of a key inserts a pending row (null status) leased for
+# a while, the concurrent requests poll it until its response is stored, or until the lease ends (claimer gone, see
+# `wait_for_claim`). The `expires_at` of the claim identifies it: a claim taken over is not stored / released again
+IDEMPOTENCY_ENTITY: str = 'idempotency_key'
+IDEMPOTENCY_SCHEMA: str = '''
+CREATE TABLE IF NOT EXISTS idempotency_key
+(
+    "key"         TEXT PRIMARY KEY,
+    "fingerprint" TEXT NOT NULL,
+    "status"      TEXT,
+    "body"        TEXT,
+    "expires_at"  REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idempotency_key_expires_at_idx ON idempotency_key (expires_at);
+'''
+IDEMPOTENCY_CLAIM: str = '''INSERT INTO idempotency_key (key, fingerprint, expires_at)
+VALUES (:key, :fingerprint, :lease)
+ON CONFLICT (key) DO UPDATE SET fingerprint = excluded.fingerprint, status = NULL, body = NULL,
+expires_at = excluded.expires_at WHERE idempotency_key.expires_at <= :now RETURNING expires_at'''
+IDEMPOTENCY_SELECT: str = '''SELECT fingerprint, status, body FROM idempotency_key WHERE key = :key'''
+IDEMPOTENCY_STORE: str = '''UPDATE idempotency_key SET status = :status, body = :body, expires_at = :expires_at
+WHERE key = :key AND expires_at = :claimed_until AND status IS NULL'''
+IDEMPOTENCY_RELEASE: str = '''DELETE FROM idempotency_key
+WHERE key = :key AND expires_at = :claimed_until AND status IS NULL'''
+IDEMPOTENCY_REAP: str = '''DELETE FROM idempotency_key WHERE key IN
+(SELECT key FROM idempotency_key WHERE expires_at <= :now LIMIT :batch_size)'''
+TABLE_COLUMNS: str = '''SELECT name FROM pragma_table_info('message')'''
+ADD_EXPIRY_COLUMN: str = '''ALTER TABLE message ADD COLUMN expires_at REAL'''
+LIVE: str = '''(expires_at IS NULL OR expires_at > :now)'''
+SELECT_FROM_KEY: str = f'''SELECT attributes FROM message WHERE key = :key AND {LIVE}'''
+DELETE_FROM_KEY: str = '''DELETE FROM message WHERE key = :key'''
+# the returned expiry tells whether the deleted message was live (an expression over the deleted row is not
+# reliably evaluated by sqlite on a `WITHOUT ROWID` table)
+DELETE_RETURNING_EXPIRY: str = '''DELETE FROM message WHERE key = :key RETURNING expires_at'''
+DELETE_EXPIRED_FROM_KEY: str = '''DELETE FROM message WHERE key = :key AND expires_at <= :now'''
+UPDATE_FROM_KEY: str = f'''UPDATE message SET attributes = :attributes, expires_at = :expires_at
+WHERE key = :key AND {LIVE}'''
+# json_patch implements the RFC 7396 merge patch
+PATCH_FROM_KEY: str = f'''UPDATE message SET attributes = json_patch(attributes, :patch),
+expires_at = coalesce(:expires_at, expires_at) WHERE key = :key AND {LIVE} RETURNING attributes'''
+INSERT: str = '''INSERT INTO message (key, attributes, expires_at) VALUES (:key, :attributes, :expires_at)'''
+# an expired message not reaped yet is replaced, a live one is left untouched (no row returned)
+INSERT_OR_REPLACE_EXPIRED: str = f'''{INSERT}
+ON CONFLICT (key) DO UPDATE SET attributes = excluded.attributes, expires_at = excluded.expires_at
+WHERE message.expires_at <= :now RETURNING key'''
+UPSERT: str = f'''{INSERT}
+ON CONFLICT (key) DO UPDATE SET attributes = excluded.attributes, expires_at = excluded.expires_at'''
+SELECT_ALL: str = f'''SELECT key, attributes, expires_at FROM message WHERE {LIVE}'''
+SELECT_KEYS: str = '''SELECT key FROM message'''
+FIND_BY_ATTRIBUTES: str = f'''SELECT key, attributes FROM message WHERE {LIVE} AND {{predicates}} ORDER BY key
+LIMIT :limit'''
+REAP_EXPIRED: str = '''DELETE FROM message WHERE key IN
+(SELECT key FROM message WHERE expires_at <= :now LIMIT :batch_size)'''
+EXPIRY_LAG: str = '''SELECT :now - min(expires_at) FROM message WHERE expires_at <= :now'''
+# sqlite limits the number of bound variables of a statement
+MAX_VARIABLES: int = 500
+
+SQLITE_ERRORS = (SqliteConnectionError, SqliteQueryError)
+
+
+def expires_at(now: float, ttl: float | None) -> float | None:
+    return None if ttl is None else now + ttl
+
+
+class SqliteMessageBackend(MessageBackend):
+    """
+    Messages stored in an embedded sqlite database (json text attributes)
+    """
+    name = 'sqlite'
+    _dal: Sqlite
+
+    def __init__(self, dal: Sqlite):
+        self._dal = dal
+
+    def close(self) -> None:
+        self._dal.close()
+
+    def migrate(self) -> None:
+        try:
+            self._dal.exec_script(ENTITY_NAME, SCHEMA)
+            # databases created before the expiry support
+            if 'expires_at' not in {row[0] for row in self._dal.exec_read(ENTITY_NAME, TABLE_COLUMNS)}:
+                self._dal.exec_write(ENTITY_NAME, ADD_EXPIRY_COLUMN)
+            self._dal.exec_script(ENTITY_NAME, EXPIRY_SCHEMA)
+            self._dal.exec_script(IDEMPOTENCY_ENTITY, IDEMPOTENCY_SCHEMA)
+        except SQLITE_ERRORS as err:
+            raise StorageBackendError(str(err))
+
+    def ping(self) -> bool:
+        return self._dal.ping_select()
+
+    def select(self, key: str) -> dict | None:
+        try:
+            result = self._dal.exec_read(ENTITY_NAME, SELECT_FROM_KEY, {'key': key, 'now': time.time()})
+        except SQLITE_ERRORS as err:
+            raise StorageBackendError(str(err))
+        return json.loads(result[0][0]) if result else None
+
+    def create(self, key: str, attributes: dict, ttl: float | None = None) -> None:
+        now = time.time()
+        params = {'attributes': json.dumps(attributes), 'key': key, 'expires_at': expires_at(now, ttl), 'now': now}
+        try:
+            rows = self._dal.exec_write_returning(ENTITY_NAME, INSERT_OR_REPLACE_EXPIRED, params)
+        except SQLITE_ERRORS as err:
+            raise StorageBackendError(str(err))
+        if not rows:
+            raise StorageBackendError(f'duplicate key {key}')
+
+    def update(self, key: str, attributes: dict, ttl: float | None = None) -> None:
+        now = time.time()
+        self.__write(UPDATE_FROM_KEY, {'attributes': json.dumps(attributes), 'key': key,
+                                       'expires_at': expires_at(now, ttl), 'now': now})
+
+    def patch(self, key: str, patch: dict, ttl: float | None = None) -> dict | None:
+        now = time.time()
+        params = {'patch': json.dumps(patch), 'key': key, 'expires_at': expires_at(now, ttl), 'now': now}
+        try:
+            rows = self._dal.exec_write_returning(ENTITY_NAME, PATCH_FROM_KEY, params)
+        except SQLITE_ERRORS as err:
+            raise StorageBackendError(str(err))
+        return changed_fields(json.loads(rows[0][0]), patch) if rows else None
+
+    def delete(self, key: str) -> bool:
+        try:
+            return self._dal.exec_write(ENTITY_NAME, DELETE_FROM_KEY, {'key': key}) > 0
+        except SQLITE_ERRORS as err:
+            raise StorageBackendError(str(err))
+
+    def scan_keys(self, batch_size: int = 1000) -> Iterator[List[str]]:
+        try:
+            for rows in self._dal.iter_read(ENTITY_NAME, SELECT_KEYS, batch_size=batch_size):
+                yield [row[0] for row in rows]
+        except SQLITE_ERRORS as err:
+            raise StorageBackendError(str(err))
+
+    def reap(self, batch_size: int) -> int:
+        try:
+            return self._dal.exec_write(ENTITY_NAME, REAP_EXPIRED, {'now': time.time(), 'batch_size': batch_size})
+        except SQLITE_ERRORS as err:
+            raise StorageBackendError(str(err))
+
+    def expiry_lag(self) -> float:
+        try:
+            lag = self._dal.exec_read(ENTITY_NAME, EXPIRY_LAG, {'now': time.time()})[0][0]
+        except SQLITE_ERRORS as err:
+            raise StorageBackendError(str(err))
+        return lag or 0.0
+
+    @contextmanager
+    def claim_idempotency_key(self, key: str, fingerprint: str, ttl: float,
+                              wait: float) -> Iterator[IdempotencyClaim]:
+        claimed_until, response = self.__claim(key, fingerprint, wait)
+        claim = IdempotencyClaim(response)
+        if response is not None:
+            yield claim
+            return
+        params = {'key': key, 'claimed_until': claimed_until}
+        try:
+            yield claim
+        except BaseException:
+            self.__write(IDEMPOTENCY_RELEASE, params)
+            raise
+        if claim.stored is not None:
+            self.__write(IDEMPOTENCY_STORE, {**params,
+                                             'status'    : claim.stored.status,
+                                             'body'      : claim.stored.body,
+                                             'expires_at': time.time() + ttl})
+        else:
+            self.__write(IDEMPOTENCY_RELEASE, params)
+
+    def reap_idempotency_keys(self, batch_size: int) -> int:
+        try:
+            return self._dal.exec_write(IDEMPOTENCY_ENTITY, IDEMPOTENCY_REAP,
+                                        {'now': time.time(), 'batch_size': batch_size})
+        except SQLITE_ERRORS as err:
+            raise StorageBackendError(str(err))
+
+    def __claim(self, key: str, fingerprint: str, wait: float) -> Tuple[float | None, IdempotentResponse | None]:
+        """ :return: the expiry of the claim, or the response stored for the key """
+
+        def attempt() -> Tuple[float | None, IdempotentResponse | None] | None:
+            now = time.time()
+            params = {'key': key, 'fingerprint': fingerprint, 'lease': now + IDEMPOTENCY_LEASE, 'now': now}
+            claimed = self._dal.exec_write_returning(IDEMPOTENCY_ENTITY, IDEMPOTENCY_CLAIM, params)
+            if claimed:
+                return claimed[0][0], None
+            rows = self._dal.exec_read(IDEMPOTENCY_ENTITY, IDEMPOTENCY_SELECT, {'key': key})
+            if rows and rows[0][1] is not None:
+                return None, IdempotentResponse(*rows[0])
+            # claimed by a request in progress (or just released): wait for its response
+            return None
+
+        try:
+            return wait_for_claim(attempt, wait)
+        except SQLITE_ERRORS as err:
+            raise StorageBackendError(str(err))
+
+    def export_ndjson(self, out: BinaryIO) -> int:
+        exported = 0
+        try:
+            for rows in self._dal.iter_read(ENTITY_NAME, SELECT_ALL, {'now': time.time()}):
+                # the attributes are stored as json text, written as is
+                out.write(b''.join(ndjson_line(key, attributes, expiry) for key, attributes, expiry in rows))
+                exported += len(rows)
+        except SQLITE_ERRORS as err:
+            raise StorageBackendError(str(err))
+        return exported
+
+    def import_ndjson(self, source: BinaryIO, upsert: bool = False) -> int:
+        def messages() -> Iterator[dict]:
+            for number, line in enumerate(source, start=1):
+                message = parse_ndjson_line(line, number)
+                if message is not None:
+                    key, attributes, expiry = message
+                    yield {'key': key, 'attributes': json.dumps(attributes), 'expires_at': expiry}
+
+        try:
+            # all or nothing, the lines are streamed to the statement
+            with self._dal.transaction(ENTITY_NAME) as connection:
+                return connection.executemany(UPSERT if upsert else INSERT, messages()).rowcount
+        except SQLITE_ERRORS as err:
+            if is_data_error(err):
+                # an existing key: rejected data, not a storage failure
+                raise InvalidDataError(str(err))
+            raise StorageBackendError(str(err))
+
+    def find(self, attributes: dict, limit: int, after: str | None = None) -> List[Tuple[str, dict]]:
+        # no containment operator in sqlite: one typed comparison per scalar of the pattern, arrays unsupported
+        params: Dict[str, Any] = {'limit': limit, 'now': time.time()}
+        predicates = self.__predicates(attributes, '$', params)
+        if after is not None:
+            predicates.append('key > :after')
+            params['after'] = after
+        query = FIND_BY_ATTRIBUTES.format(predicates=' AND '.join(predicates or ['1']))
+        try:
+            return [(key, json.loads(value)) for key, value in self._dal.exec_read(ENTITY_NAME, query, params)]
+        except SQLITE_ERRORS as err:
+            raise StorageBackendError(str(err))
+
+    @staticmethod
+    def __predicates(pattern: dict, path: str, params: Dict[str, Any]) -> List[str]:
+        predicates = []
+        for name, value in pattern.items():
+            value_path = f'{path}."{name}"'
+            if isinstance(value, dict):
+                predicates.extend(SqliteMessageBackend.__predicates(value, value_path, params))
+                continue
+            index = len(params)
+            params[f'path_{index}'] = value_path
+            if value is None:
+                predicates.append(f"json_type(attributes, :path_{index}) = 'null'")
+            elif isinstance(value, bool):
+                predicates.append(f"json_type(attributes, :path_{index}) = '{str(value).lower()}'")
+            elif isinstance(value, (int, float)):
+                params[f'value_{index}'] = value
+                predicates.append(f"json_type(attributes, :path_{index}) IN ('integer', 'real') "
+                                  f"AND json_extract(attributes, :path_{index}) = :value_{index}")
+            elif isinstance(value, str):
+                params[f'value_{index}'] = value
+                predicates.append(f"json_type(attributes, :path_{index}) = 'text' "
+                                  f"AND json_extract(attributes, :path_{index}) = :value_{index}")
+            else:
+                raise StorageBackendError(f'unsupported attribute pattern for {value_path} : {value!r}')
+        return predicates
+
+    def select_many(self, keys: List[str]) -> Dict[str, dict]:
+        found = dict()
+        try:
+            for start in range(0, len(keys), MAX_VARIABLES):
+                chunk = keys[start:start + MAX_VARIABLES]
+                query = (f'SELECT key, attributes FROM message WHERE key IN ({", ".join("?" * len(chunk))}) '
+                         f'AND (expires_at IS NULL OR expires_at > ?)')
+                for key, attributes in self._dal.exec_read(ENTITY_NAME, query, (*chunk, time.time())):
+                    found[key] = json.loads(attributes)
+        except SQLITE_ERRORS as err:
+            raise StorageBackendError(str(err))
+        return found
+
+    def create_many(self, messages: Dict[str, dict], ttl: float | None = None) -> None:
+        now = time.time()
+        try:
+            # all or nothing: the expired messages not reaped yet are dropped, then a live duplicate fails the insert
+            with self._dal.transaction(ENTITY_NAME) as connection:
+                connection.executemany(DELETE_EXPIRED_FROM_KEY, [{'key': key, 'now': now} for key in messages])
+                connection.executemany(INSERT, [{'key': key, 'attributes': json.dumps(attributes),
+                                                 'expires_at': expires_at(now, ttl)}
+                                                for key, attributes in messages.items()])
+        except SQLITE_ERRORS as err:
+            raise StorageBackendError(str(err))
+
+    def update_many(self, messages: Dict[str, dict], ttl: float | None = None) -> None:
+        now = time.time()
+        self.__write_many(UPDATE_FROM_KEY, [{'key': key, 'attributes': json.dumps(attributes),
+                                             'expires_at': expires_at(now, ttl), 'now': now}
+                                            for key, attributes in messages.items()])
+
+    def delete_many(self, keys: List[str]) -> None:
+        self.__write_many(DELETE_FROM_KEY, [{'key': key} for key in keys])
+
+    def bulk(self, operations: List[BulkOperation], atomic: bool = True) -> List[str]:
+        now = time.time()
+        statuses: List[str] = [''] * len(operations)
+        try:
+            # a single transaction, the operations grouped by action (keys are distinct, the order doesn't matter)
+            with self._dal.transaction(ENTITY_NAME) as connection:
+                for index, operation in enumerate(operations):
+                    if operation.action != BULK_CREATE:
+                        continue
+                    params = {'attributes': json.dumps(operation.attributes), 'key': operation.key,
+                              'expires_at': expires_at(now, operation.ttl), 'now': now}
+                    # no row returned: a live message has the key
+                    created = connection.execute(INSERT_OR_REPLACE_EXPIRED, params).fetchall()
+                    statuses[index] = bulk_result(BULK_CREATE, bool(created))
+                for index, operation in enumerate(operations):
+                    if operation.action != BULK_UPDATE:
+                        continue
+                    params = {'attributes': json.dumps(operation.attributes), 'key': operation.key,
+                              'expires_at': expires_at(now, operation.ttl), 'now': now}
+                    statuses[index] = bulk_result(BULK_UPDATE, connection.execute(UPDATE_FROM_KEY, params).rowcount > 0)
+                for index, operation in enumerate(operations):
+                    if operation.action != BULK_DELETE:
+                        continue
+                    deleted = connection.execute(DELETE_RETURNING_EXPIRY, {'key': operation.key}).fetchall()
+                    live = bool(deleted) and (deleted[0][0] is None or deleted[0][0] > now)
+                    statuses[index] = bulk_result(BULK_DELETE, live)
+                if atomic and any(status in BULK_FAILURES for status in statuses):
+                    raise BulkAborted(statuses)
+        except BulkAborted as aborted:
+            return aborted.statuses
+        except SQLITE_ERRORS as err:
+            raise StorageBackendError(str(err))
+        return statuses
+
+    def __write(self, query: str, params: dict) -> None:
+        try:
+            self._dal.exec_write(ENTITY_NAME, query, params)
+        except SQLITE_ERRORS as err:
+            raise StorageBackendError(str(err))
+
+    def __write_many(self, query: str, params_list: List[dict]) -> None:
+        try:
+            self._dal.exec_many(ENTITY_NAME, query, params_list)
+        except SQLITE_ERRORS as err:
+            raise StorageBackendError(str(err))
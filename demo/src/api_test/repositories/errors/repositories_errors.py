@@ -2,6 +2,10 @@ class UnknownEntityIdError(Exception):
     pass
 
 
+class SelectEntityError(Exception):
+    pass
+
+
 class DeleteEntityError(Exception):
     pass
 
@@ -10,5 +14,25 @@ class UpdateEntityError(Exception):
     pass
 
 
+class PatchEntityError(Exception):
+    pass
+
+
 class CreateEntityError(Exception):
     pass
+
+
+class FindEntityError(Exception):
+    pass
+
+
+class BulkEntityError(Exception):
+    pass
+
+
+class StorageBackendError(Exception):
+    pass
+
+
+class InvalidDataError(StorageBackendError):
+    """ The storage rejects the data it is given (invalid message, duplicate key...), it did not fail """
@@ -1,31 +1,56 @@
-import json
+from typing import Dict, List
 
 import structlog
+from prometheus_client import Counter
 from structlog.typing import FilteringBoundLogger
 
-from ..adapters.errors.postgres_errors import PostgresQueryError
-from ..adapters.postgres import Postgres
+from ..commons.bloom_filter import CountingBloomFilter
+from ..commons.circuit_breaker import CircuitBreaker
+from ..commons.singleflight import SingleFlight
 from ..decorator.logit import logit
+from .backends import BULK_CREATE, BULK_DELETED, BulkOperation, MessageBackend
 from .errors.repositories_errors import (
+    BulkEntityError,
     CreateEntityError,
     DeleteEntityError,
+    FindEntityError,
+    PatchEntityError,
+    SelectEntityError,
+    StorageBackendError,
     UnknownEntityIdError,
     UpdateEntityError,
 )
 
-ENTITY_NAME: str = 'message'
-SELECT_FROM_KEY: str = '''SELECT key, attributes FROM message WHERE key = %(key)s'''
-DELETE_FROM_KEY: str = '''DELETE FROM message WHERE key = %(key)s'''
-UPDATE_FROM_KEY: str = '''UPDATE message SET attributes = %(attributes)s WHERE key = %(key)s'''
-INSERT: str = '''INSERT INTO message (key, attributes) VALUES (%(key)s, %(attributes)s)'''
+COALESCED_READS = Counter(
+        'message_read_coalesced_total',
+        'Number of message reads served by the read of the same key already in progress',
+)
+KEY_FILTER_LOOKUPS = Counter(
+        'message_key_filter_lookups_total',
+        'Number of message reads checked by the key filter, by result (absent: answered without storage read / '
+        'present: found by the storage read / false_positive: not found by the storage read)',
+        ['result'],
+)
 
 
 class MessageRepository:
     _log: FilteringBoundLogger
-    _dal: Postgres
+    _backend: MessageBackend
+    _reads: SingleFlight[dict] | None
+    _key_filter: CountingBloomFilter | None
 
-    def __init__(self, dal: Postgres):
-        self._dal = dal
+    def __init__(self, backend: MessageBackend, coalesce_reads: bool = True, key_filter: CountingBloomFilter = None):
+        """
+        :param backend: storage of the messages
+        :param coalesce_reads: concurrent reads of the same key share a single storage read (default = True)
+        :param key_filter: filter of the existing keys, a key it reports absent is not read from the storage
+            (default = None, every read goes to the storage). The writes of this repository keep it up to date.
+        """
+        self._backend = backend
+        # a read rejected by a circuit breaker is a rejection for the requests sharing it too (503, not 500)
+        self._reads = SingleFlight(on_coalesced=COALESCED_READS.inc,
+                                   on_shared_error=CircuitBreaker.record_rejection) if coalesce_reads else None
+        self._key_filter = key_filter
         self._log = structlog.get_logger()
 
     @logit
@@ -33,16 +58,51 @@ class MessageRepository:
         """
         get entity by its key.
         :param key: entity's index key.
-        :return: result of query.
+        :return: result of query (shared with the concurrent reads of the key, it must not be modified).
         :raise: UnknownEntityIdError: if the entity doesn't exist.
         """
-        param = {'key': key}
-        result: list = self._dal.exec_read(ENTITY_NAME, SELECT_FROM_KEY, param)
-        if len(result) > 0 and result[0][0] == key:
-            attributes: dict = result[0][1]
-            return {'key': key, 'attributes': attributes}
-        else:
+        if self._key_filter is not None and not self._key_filter.might_contain(key):
+            KEY_FILTER_LOOKUPS.labels('absent').inc()
             raise UnknownEntityIdError(f'Unknown message entity for key : {key}')
+        if self._reads is None:
+            return self.__select(key)
+        # a hot key read by many threads at once costs a single query
+        return self._reads.do(key, lambda: self.__select(key))
+
+    @logit
+    def select_many(self, keys: List[str]) -> Dict[str, dict]:
+        """
+        get entities by their keys, in a single storage operation.
+        :param keys: entities' index keys.
+        :return: the existing entities by key (unknown keys are absent).
+        :raise: SelectEntityError: in case of error during the select operation.
+        """
+        if self._key_filter is not None:
+            keys = [key for key in keys if self._key_filter.might_contain(key)]
+            if not keys:
+                return dict()
+        try:
+            return {key: {'key': key, 'attributes': attributes}
+                    for key, attributes in self._backend.select_many(keys).items()}
+        except StorageBackendError as err:
+            self._log.error(f'Error on select message entities for {len(keys)} keys - {str(err)}')
+            raise SelectEntityError(f'Error on select message entities for {len(keys)} keys - {str(err)}')
+
+    @logit
+    def find(self, attributes: dict, limit: int, after: str | None = None) -> List[dict]:
+        """
+        get the entities containing the attributes, ordered by key.
+        :param attributes: attributes (json containment) the entities must have.
+        :param limit: maximum number of entities.
+        :param after: only the entities whose key is greater (keyset pagination).
+        :return: list of entities.
+        :raise: FindEntityError: in case of error during the search.
+        """
+        try:
+            return [{'key': key, 'attributes': found} for key, found in self._backend.find(attributes, limit, after)]
+        except StorageBackendError as err:
+            self._log.error(f'Error on find message entities with attributes : {attributes} - {str(err)}')
+            raise FindEntityError(f'Error on find message entities with attributes : {attributes} - {str(err)}')
 
     @logit
     def delete(self, key: str) -> None:
@@ -52,46 +112,118 @@ class MessageRepository:
         :raise: DeleteEntityError: in case of error during the delete operation.
         """
         try:
-            param = {'key': key}
-            self._dal.exec_write(ENTITY_NAME, DELETE_FROM_KEY, param)
-        except PostgresQueryError as err:
+            deleted = self._backend.delete(key)
+        except StorageBackendError as err:
             self._log.error(f'Error on delete message entity for key : {key} - {str(err)}')
             raise DeleteEntityError(f'Error on delete message entity for key : {key} - {str(err)}')
+        # only a key actually deleted is removed: removing a key never added would clear the counters of others
+        if deleted and self._key_filter is not None:
+            self._key_filter.remove(key)
 
     @logit
-    def update(self, attributes: dict, key: str) -> None:
+    def update(self, attributes: dict, key: str, ttl: float | None = None) -> None:
         """
         update entity by its key,
         :param attributes: attributes of entity.
         :param key: entity's index key.
+        :param ttl: seconds before the entity expires (None = never).
         :raise: UpdateEntityError: in case of error during the update operation.
         """
         try:
-            param = {'attributes': json.dumps(attributes), 'key': key}
-            self._dal.exec_write(ENTITY_NAME, UPDATE_FROM_KEY, param)
+            self._backend.update(key, attributes, ttl)
         except TypeError as json_err:
             self._log.error(f'Error on update message serialization of attributes for key : {key} - {str(json_err)}')
             raise UpdateEntityError(f'Error on update message serialization of attributes '
                                     f'for key : {key} - {str(json_err)}')
-        except PostgresQueryError as err:
+        except StorageBackendError as err:
             self._log.error(f'Error on update message entity for key : {key} - {str(err)}')
             raise UpdateEntityError(f'Error on update message entity for key : {key} - {str(err)}')
 
     @logit
-    def create(self, attributes: dict, key: str) -> None:
+    def patch(self, patch: dict, key: str, ttl: float | None = None) -> dict:
+        """
+        apply a json merge patch to the attributes of an entity, in a single storage operation.
+        :param patch: json merge patch of the attributes (`null` removes an attribute).
+        :param key: entity's index key.
+        :param ttl: new seconds before the entity expires (None = unchanged).
+        :return: the entity with the new value of the patched attributes only.
+        :raise: UnknownEntityIdError: if the entity doesn't exist.
+        :raise: PatchEntityError: in case of error during the patch operation.
+        """
+        try:
+            changed: dict | None = self._backend.patch(key, patch, ttl)
+        except TypeError as json_err:
+            self._log.error(f'Error on patch message serialization of attributes for key : {key} - {str(json_err)}')
+            raise PatchEntityError(f'Error on patch message serialization of attributes '
+                                   f'for key : {key} - {str(json_err)}')
+        except StorageBackendError as err:
+            self._log.error(f'Error on patch message entity for key : {key} - {str(err)}')
+            raise PatchEntityError(f'Error on patch message entity for key : {key} - {str(err)}')
+        if changed is None:
+            raise UnknownEntityIdError(f'Unknown message entity for key : {key}')
+        return {'key': key, 'attributes': changed}
+
+    @logit
+    def create(self, attributes: dict, key: str, ttl: float | None = None) -> None:
         """
         create entity,
         :param attributes: attributes of entity.
         :param key: entity's index key.
+        :param ttl: seconds before the entity expires (None = never).
         :raise: UpdateEntityError: in case of error during the update operation.
         """
+        ticket = None
+        if self._key_filter is not None:
+            # added before the write (and kept if it fails): a read must not miss a message once it is created
+            ticket = self._key_filter.add(key)
         try:
-            param = {'attributes': json.dumps(attributes), 'key': key}
-            self._dal.exec_write(ENTITY_NAME, INSERT, param)
+            self._backend.create(key, attributes, ttl)
         except TypeError as json_err:
             self._log.error(f'Error on create message serialization of attributes for key : {key} - {str(json_err)}')
             raise CreateEntityError(f'Error on create message serialization of attributes '
                                     f'for key : {key} - {str(json_err)}')
-        except PostgresQueryError as err:
+        except StorageBackendError as err:
             self._log.error(f'Error on create message entity for key : {key} - {str(err)}')
             raise CreateEntityError(f'Error on create message entity for key : {key} - {str(err)}')
+        if ticket is not None:
+            self._key_filter.confirm(key, ticket)
+
+    @logit
+    def bulk(self, operations: List[BulkOperation], atomic: bool = True) -> List[str]:
+        """
+        run create / update / delete operations on distinct entities, in a single storage transaction.
+        :param operations: operations, at most one per key.
+        :param atomic: all or nothing (the failure of an operation aborts the others), best effort otherwise.
+        :return: status of each operation, in order.
+        :raise: BulkEntityError: in case of error during the operations (nothing is applied).
+        :raise: CrossShardBulkError: if the atomic operations span several shards (nothing is applied).
+        """
+        tickets = {}
+        if self._key_filter is not None:
+            for operation in operations:
+                if operation.action == BULK_CREATE:
+                    tickets[operation.key] = self._key_filter.add(operation.key)
+        try:
+            statuses = self._backend.bulk(operations, atomic)
+        except TypeError as json_err:
+            self._log.error(f'Error on bulk message serialization of attributes - {str(json_err)}')
+            raise BulkEntityError(f'Error on bulk message serialization of attributes - {str(json_err)}')
+        except StorageBackendError as err:
+            self._log.error(f'Error on bulk of {len(operations)} message operations - {str(err)}')
+            raise BulkEntityError(f'Error on bulk of {len(operations)} message operations - {str(err)}')
+        if self._key_filter is not None:
+            for operation, status in zip(operations, statuses):
+                if status == BULK_DELETED:
+                    self._key_filter.remove(operation.key)
+                elif operation.key in tickets:
+                    self._key_filter.confirm(operation.key, tickets[operation.key])
+        return statuses
+
+    def __select(self, key: str) -> dict:
+        attributes: dict | None = self._backend.select(key)
+        if self._key_filter is not None:
+            KEY_FILTER_LOOKUPS.labels('present' if attributes is not None else 'false_positive').inc()
+        if attributes is not None:
+            return {'key': key, 'attributes': attributes}
+        else:
+            raise UnknownEntityIdError(f'Unknown message entity for key : {key}')
@@ -0,0 +1,315 @@
+import os
+import queue
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, Iterator, List, Set
+
+import structlog
+from prometheus_client import Counter, Gauge
+from structlog.typing import FilteringBoundLogger
+
+from ..repositories.backends import Change, MessageBackend
+from ..repositories.errors.repositories_errors import StorageBackendError
+
+SUBSCRIBERS = Gauge(
+        'message_change_subscribers',
+        'Number of clients following the change feed',
+        multiprocess_mode='livesum',
+)
+DROPPED = Counter(
+        'message_change_subscribers_dropped_total',
+        'Number of change feed clients dropped, by reason (slow: queue full / storage: the listener failed / error: '
+        'unexpected error of the listener / drain: the worker stops)',
+        ['reason'],
+)
+MISSED_CHANGES: str = 'changes were missed, resume from the last change received'
+
+
+class ChangeFeedUnavailableError(Exception):
+    """ The storage has no change feed """
+
+
+class TooManySubscribersError(Exception):
+    """ The worker already serves its maximum number of change feed clients """
+
+
+class ChangeFeedClosedError(Exception):
+    """ The worker drains before its exit: the client has to come back later (on another worker) """
+
+
+class SubscriberDroppedError(Exception):
+    """ The client missed changes (too slow, or the listener failed): it has to resume from its last change """
+
+
+class Subscription:
+    """ changes waiting for a client, in a bounded queue: the client is dropped instead of growing it """
+    _queue: queue.Queue
+
+    def __init__(self, queue_size: int):
+        self._queue = queue.Queue(maxsize=queue_size)
+        self.dropped = False
+        self._error = MISSED_CHANGES
+
+    def offer(self, changes: List[Change]) -> bool:
+        """ :return False if the queue is full (the changes are then lost for this client) """
+        try:
+            for change in changes:
+                self._queue.put_nowait(change)
+            return True
+        except queue.Full:
+            return False
+
+    def drop(self, error: str = MISSED_CHANGES) -> None:
+        """ :param error: why, told to the client """
+        self._error = error
+        self.dropped = True
+        try:
+            # wakes the client up if it waits for a change
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass
+
+    def get(self, timeout: float) -> Change | None:
+        """
+        :return: the next change, None if none came in `timeout` seconds
+        :raise SubscriberDroppedError: once dropped
+        """
+        if self.dropped:
+            raise SubscriberDroppedError(self._error)
+        try:
+            change = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if change is None and self.dropped:
+            raise SubscriberDroppedError(self._error)
+        return change
+
+    def get_nowait(self) -> Change | None:
+        try:
+            return self._queue.get_nowait()
+        except queue.Empty:
+            return None
+
+
+class ChangeFeedService:
+    """
+    Change feed of the messages, fanned out in the worker: a single listener thread (a single storage connection)
+    hands every committed change to the queue of each subscribed client.
+
+    A client resuming from a change number first reads the changes kept by the storage since then, then follows the
+    live changes. Numbers are taken at insert: the last `resume_margin` numbers before the resumed one are looked at
+    again for the changes committed after it (a client may get again a change committed about the same time as its
+    last one, the number tells). A client too slow to drain its queue is dropped (it resumes from its last change),
+    so a slow client never holds the memory of the worker nor delays the others. When the worker drains, its clients
+    are ended at once (they resume on another worker) instead of holding it until its timeout.
+    """
+    _backend: MessageBackend
+    _subscriptions: Set[Subscription]
+    _log: FilteringBoundLogger
+
+    def __init__(self, storage_backend: MessageBackend, queue_size: int = 1000, max_subscribers: int = 10,
+                 heartbeat_interval: float = 15.0, page_size: int = 1000, retry_interval: float = 1.0,
+                 resume_margin: int = 1000, listen_timeout: float = 5.0):
+        """
+        :param storage_backend: storage of the messages
+        :param queue_size: maximum number of changes waiting for a client (default = 1000)
+        :param max_subscribers: maximum number of clients of a worker, each holds a worker thread (default = 10)
+        :param heartbeat_interval: seconds without change before a heartbeat is sent to a client (default = 15)
+        :param page_size: number of changes read at once when a client resumes (default = 1000)
+        :param retry_interval: seconds before the listener reconnects after a storage failure (default = 1)
+        :param resume_margin: numbers before the resumed change looked at again for late commits (default = 1000)
+        :param listen_timeout: seconds a new client waits for the listener to listen (default = 5)
+        """
+        self._log = structlog.get_logger()
+        self._backend = storage_backend
+        self._queue_size = queue_size
+        self._max_subscribers = max_subscribers
+        self._heartbeat_interval = heartbeat_interval
+        self._page_size = page_size
+        self._retry_interval = retry_interval
+        self._resume_margin = resume_margin
+        self._listen_timeout = listen_timeout
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+        # pid of the process running the listener thread: started in each worker, on its first subscriber
+        self._listener_pid = None
+        # set while the listener listens: the changes committed from then on reach the subscriptions
+        self._listening = threading.Event()
+        # set when the worker drains: no new client
+        self._closed = False
+
+    @property
+    def available(self) -> bool:
+        return self._backend.change_feed
+
+    def subscribe(self) -> Subscription:
+        """
+        :return: a subscription receiving the changes committed from now on
+        :raise ChangeFeedUnavailableError: if the storage has no change feed
+        :raise TooManySubscribersError: if the worker already serves `max_subscribers` clients
+        :raise ChangeFeedClosedError: if the worker drains
+        :raise StorageBackendError: if the listener does not listen within `listen_timeout` seconds
+        """
+        if not self.available:
+            raise ChangeFeedUnavailableError(f'no change feed on the {self._backend.name} storage')
+        with self._lock:
+            if self._closed:
+                raise ChangeFeedClosedError('the worker is shutting down')
+            if len(self._subscriptions) >= self._max_subscribers:
+                raise TooManySubscribersError(f'{self._max_subscribers} change feed clients already served')
+            if self._listener_pid != os.getpid():
+                self._listener_pid = os.getpid()
+                threading.Thread(target=self.__listen, name='change-feed', daemon=True).start()
+            subscription = Subscription(self._queue_size)
+            self._subscriptions.add(subscription)
+        SUBSCRIBERS.inc()
+        if not self._listening.wait(self._listen_timeout):
+            self.unsubscribe(subscription)
+            raise StorageBackendError(f'the change feed listener is not listening after {self._listen_timeout:g}s')
+        return subscription
+
+    def close_all(self) -> None:
+        """ end the streams and polls of the clients, and refuse new ones (the worker drains) """
+        with self._lock:
+            self._closed = True
+        self.__drop_all('drain', 'the worker is shutting down, resume from the last change received')
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            if subscription not in self._subscriptions:
+                return
+            self._subscriptions.discard(subscription)
+        SUBSCRIBERS.dec()
+
+    def stream(self, since: int | None = None) -> Iterator[Change | None]:
+        """
+        follow the changes, until the iterator is closed. The client is subscribed at once, before the iteration.
+        :param since: number of the last change already received (None = the changes committed from now on only)
+        :return: iterator of the changes, None every `heartbeat_interval` seconds without change. It raises
+            `SubscriberDroppedError` once the client missed changes, `StorageBackendError` on storage failure while
+            reading the changes since `since`
+        :raise ChangeFeedUnavailableError: if the storage has no change feed
+        :raise TooManySubscribersError: if the worker already serves `max_subscribers` clients
+        :raise ChangeFeedClosedError: if the worker drains
+        """
+        # subscribed first: the changes committed while the kept ones are read are not missed
+        return self.__follow(self.subscribe(), since)
+
+    def __follow(self, subscription: Subscription, since: int | None) -> Iterator[Change | None]:
+        try:
+            # numbers of the last changes read from the storage, to skip them when they come live. Numbers are
+            # taken in insert order, not in commit order: a number can't tell alone if a change was already read
+            sent: Deque[int] = deque(maxlen=self._queue_size)
+            seen: Set[int] = set()
+            margin = self._resume_margin
+            while since is not None:
+                changes = self._backend.changes_since(since, self._page_size, margin)
+                for change in changes:
+                    if len(sent) == sent.maxlen:
+                        seen.discard(sent[0])
+                    sent.append(change.seq)
+                    seen.add(change.seq)
+                    yield change
+                if len(changes) < self._page_size:
+                    break
+                since, margin = changes[-1].seq, 0
+            while True:
+                change = subscription.get(self._heartbeat_interval)
+                if change is None or change.seq not in seen:
+                    yield change
+        finally:
+            self.unsubscribe(subscription)
+
+    def poll(self, since: int | None, timeout: float, limit: int) -> List[Change]:
+        """
+        long poll of the changes
+        :param since: number of the last change already received (None = the changes committed from now on only)
+        :param timeout: maximum seconds waited for a change when there is none yet
+        :param limit: maximum number of changes
+        :return: the changes since `since` (and those committed late, see `resume_margin`), ordered by number, empty
+            on timeout. The last one is always numbered after `since`: the client resumes from it, never backwards (the
+            late changes alone wait for the next one)
+        :raise ChangeFeedUnavailableError: if the storage has no change feed
+        :raise TooManySubscribersError: if the worker already serves `max_subscribers` clients
+        :raise ChangeFeedClosedError: if the worker drains
+        :raise StorageBackendError: on storage failure
+        """
+        subscription = self.subscribe()
+        try:
+            changes: Dict[int, Change] = dict()
+            if since is not None:
+                # subscribed first: a change committed meanwhile comes both ways, once by number
+                kept = self._backend.changes_since(since, limit, self._resume_margin)
+                if len(kept) == limit and not any(change.seq > since for change in kept):
+                    # a page of late changes only: the kept ones after `since` are read too
+                    kept += self._backend.changes_since(since, limit)
+                changes = {change.seq: change for change in kept}
+            deadline = time.monotonic() + timeout
+            try:
+                while not _after(changes, since) and (remaining := deadline - time.monotonic()) > 0:
+                    change = subscription.get(remaining)
+                    if change is not None:
+                        changes.setdefault(change.seq, change)
+                while len(changes) < limit and (change := subscription.get_nowait()) is not None:
+                    changes.setdefault(change.seq, change)
+            except SubscriberDroppedError:
+                pass
+            if not _after(changes, since):
+                return []
+            ordered = sorted(changes.values(), key=lambda change: change.seq)
+            if since is not None and ordered[limit - 1:limit] and ordered[limit - 1].seq <= since:
+                # too many late changes for the limit: room is kept for the first change after `since`
+                late = [change for change in ordered if change.seq <= since]
+                return late[:limit - 1] + [ordered[len(late)]]
+            return ordered[:limit]
+        finally:
+            self.unsubscribe(subscription)
+
+    def __listen(self) -> None:
+        self._log.debug('Starting change feed listener')
+        try:
+            while True:
+                try:
+                    for changes in self._backend.listen_changes(timeout=1.0):
+                        self._listening.set()
+                        if changes:
+                            self.__dispatch(changes)
+                except StorageBackendError as err:
+                    self._listening.clear()
+                    self._log.warn(f'change feed listener failed : {err}')
+                    # changes may have been missed meanwhile: every client resumes from its last change
+                    self.__drop_all('storage')
+                except Exception as err:
+                    self._listening.clear()
+                    self._log.exception(f'change feed listener error : {err}')
+                    self.__drop_all('error')
+                time.sleep(self._retry_interval)
+        finally:
+            # the next subscriber starts it again
+            self._listening.clear()
+            with self._lock:
+                self._listener_pid = None
+
+    def __dispatch(self, changes: List[Change]) -> None:
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            if not subscription.offer(changes):
+                self._log.info('slow change feed client dropped')
+                DROPPED.labels('slow').inc()
+                subscription.drop()
+                self.unsubscribe(subscription)
+
+    def __drop_all(self, reason: str, error: str = MISSED_CHANGES) -> None:
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            DROPPED.labels(reason).inc()
+            subscription.drop(error)
+            self.unsubscribe(subscription)
+
+
+def _after(changes: Dict[int, Change], since: int | None) -> bool:
+    """ :return True if a change is numbered after `since` (any change when None) """
+    return any(since is None or seq > since for seq in changes)
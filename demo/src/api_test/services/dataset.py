@@ -0,0 +1,241 @@
+import queue
+import threading
+import time
+from typing import BinaryIO, Dict, Iterator
+
+import structlog
+from structlog.typing import FilteringBoundLogger
+
+from ..commons.bloom_filter import CountingBloomFilter
+from ..repositories.backends import MessageBackend
+
+
+class TransferProgress:
+    """
+    Messages and bytes moved by an export / import, logged every `interval` seconds with the throughput
+    """
+    _log: FilteringBoundLogger
+
+    def __init__(self, operation: str, interval: float = 5.0):
+        """
+        :param operation: name of the transfer in the logs (e.g. `export`)
+        :param interval: seconds between two progress logs (default = 5)
+        """
+        self._log = structlog.get_logger()
+        self._operation = operation
+        self._interval = interval
+        self._started = time.monotonic()
+        self._logged = self._started
+        self.messages = 0
+        self.bytes = 0
+
+    def add(self, messages: int, size: int) -> None:
+        self.messages += messages
+        self.bytes += size
+        now = time.monotonic()
+        if now - self._logged >= self._interval:
+            self._logged = now
+            report = self.report()
+            self._log.info(f'{self._operation} in progress : {report["messages"]} message(s), '
+                           f'{report["bytes"] / 2 ** 20:.1f} MiB, {report["messages_per_second"]:.0f} message(s)/s')
+
+    def report(self, messages: int = None) -> Dict[str, float]:
+        """
+        :param messages: final number of messages, when known better than by counting lines
+        :return: messages, bytes, seconds, messages_per_second, bytes_per_second
+        """
+        seconds = time.monotonic() - self._started
+        messages = self.messages if messages is None else messages
+        return {'messages'           : messages,
+                'bytes'              : self.bytes,
+                'seconds'            : round(seconds, 3),
+                'messages_per_second': messages / seconds if seconds > 0 else 0.0,
+                'bytes_per_second'   : self.bytes / seconds if seconds > 0 else 0.0}
+
+
+class _ProgressWriter:
+    """ stream counting the lines written through it """
+
+    def __init__(self, out: BinaryIO, progress: TransferProgress):
+        self._out = out
+        self._progress = progress
+
+    def write(self, data: bytes) -> int:
+        self._out.write(data)
+        self._progress.add(data.count(b'\n'), len(data))
+        return len(data)
+
+
+class _ProgressReader:
+    """
+    stream counting the lines read through it. Lines are cut from blocks read from the source: the `readline` of
+    some request streams is not reliable (falcon's bounded stream counts the asked size as consumed)
+    """
+
+    def __init__(self, source: BinaryIO, progress: TransferProgress, block_size: int = 65536):
+        self._source = source
+        self._progress = progress
+        self._block_size = block_size
+        # data read from the source but not consumed yet: self._buffer[self._position:]
+        self._buffer = b''
+        self._position = 0
+
+    def read(self, size: int = -1) -> bytes:
+        if self._position < len(self._buffer):
+            end = len(self._buffer) if size < 0 else min(self._position + size, len(self._buffer))
+            data, self._position = self._buffer[self._position:end], end
+        else:
+            data = self._source.read(size)
+        self._progress.add(data.count(b'\n'), len(data))
+        return data
+
+    def readline(self) -> bytes:
+        while (end := self._buffer.find(b'\n', self._position)) < 0:
+            block = self._source.read(self._block_size)
+            if not block:
+                break
+            self._buffer, self._position = self._buffer[self._position:] + block, 0
+        end = len(self._buffer) if end < 0 else end + 1
+        line, self._position = self._buffer[self._position:end], end
+        self._progress.add(line.count(b'\n'), len(line))
+        return line
+
+    def __iter__(self) -> Iterator[bytes]:
+        while line := self.readline():
+            yield line
+
+
+class ExportCancelledError(Exception):
+    """ The reader of a streamed export went away """
+
+
+class _QueueWriter:
+    """
+    stream handing the written data to a reader thread by blocks of `chunk_size` bytes, through a bounded queue:
+    the writer waits while the reader is late (constant memory), and fails once the reader cancelled
+    """
+
+    def __init__(self, chunks: queue.Queue, chunk_size: int):
+        self._chunks = chunks
+        self._chunk_size = chunk_size
+        self._buffer = bytearray()
+        self.cancelled = threading.Event()
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        if len(self._buffer) >= self._chunk_size:
+            self.flush()
+        return len(data)
+
+    def flush(self) -> None:
+        if self._buffer:
+            self.put(bytes(self._buffer))
+            self._buffer.clear()
+
+    def put(self, item: object) -> None:
+        while True:
+            if self.cancelled.is_set():
+                raise ExportCancelledError('the export reader went away')
+            try:
+                self._chunks.put(item, timeout=1.0)
+                return
+            except queue.Full:
+                continue
+
+
+class DatasetService:
+    """
+    Bulk export / import of the messages as NDJSON (one `{"key", "attributes", "expires_at"}` document per line),
+    streamed end to end: neither the service nor the storage loads the whole dataset in memory.
+    """
+    _backend: MessageBackend
+    _key_filter: CountingBloomFilter | None
+    _log: FilteringBoundLogger
+
+    def __init__(self, storage_backend: MessageBackend, progress_interval: float = 5.0,
+                 key_filter: CountingBloomFilter = None):
+        """
+        :param storage_backend: storage of the messages
+        :param progress_interval: seconds between two progress logs (default = 5)
+        :param key_filter: filter of the existing keys, invalidated by an import (default = None)
+        """
+        self._log = structlog.get_logger()
+        self._backend = storage_backend
+        self._progress_interval = progress_interval
+        self._key_filter = key_filter
+
+    def export_messages(self, out: BinaryIO) -> Dict[str, float]:
+        """
+        write every live message to the stream
+        :param out: stream receiving the NDJSON lines
+        :return: transfer report (see `TransferProgress.report`)
+        :raise StorageBackendError: on storage failure, the stream is left incomplete
+        """
+        progress = TransferProgress('export', self._progress_interval)
+        exported = self._backend.export_ndjson(_ProgressWriter(out, progress))
+        report = progress.report(exported)
+        self._log.info(f'export done : {report}')
+        return report
+
+    def export_chunks(self, chunk_size: int = 65536, queue_size: int = 16) -> Iterator[bytes]:
+        """
+        stream the export by blocks, for a chunked http response: the storage is read by a thread feeding a
+        bounded queue, the export stops when the iterator is closed before its end
+        :param chunk_size: size of the yielded blocks (default = 64 KiB)
+        :param queue_size: maximum number of blocks waiting for the reader (default = 16)
+        :return: iterator of NDJSON blocks
+        :raise StorageBackendError: on storage failure, after the blocks already exported
+        """
+        chunks: queue.Queue = queue.Queue(maxsize=queue_size)
+        writer = _QueueWriter(chunks, chunk_size)
+        done = object()
+
+        def export() -> None:
+            try:
+                self.export_messages(writer)
+                writer.flush()
+                writer.put(done)
+            except ExportCancelledError:
+                self._log.info('export cancelled by its reader')
+            except Exception as err:
+                self._log.error(f'export failed : {err}')
+                try:
+                    writer.put(err)
+                except ExportCancelledError:
+                    pass
+
+        producer = threading.Thread(target=export, name='export', daemon=True)
+        producer.start()
+        try:
+            while (chunk := chunks.get()) is not done:
+                if isinstance(chunk, Exception):
+                    # raised in the middle of the response: the chunked body is never terminated, so the client
+                    # can tell the export is incomplete
+                    raise chunk
+                yield chunk
+        finally:
+            writer.cancelled.set()
+
+    def import_messages(self, source: BinaryIO, upsert: bool = False) -> Dict[str, float]:
+        """
+        store the messages read from the stream
+        :param source: stream of NDJSON lines
+        :param upsert: replace the existing messages (default = False, an existing message fails the import)
+        :return: transfer report (see `TransferProgress.report`)
+        :raise InvalidDataError: on an invalid line or an existing message
+        :raise StorageBackendError: on storage failure
+        """
+        if self._key_filter is not None:
+            # the imported keys are written behind the filter: every read goes to the storage until it is rebuilt
+            self._key_filter.invalidate()
+        progress = TransferProgress('import', self._progress_interval)
+        try:
+            imported = self._backend.import_ndjson(_ProgressReader(source, progress), upsert)
+        finally:
+            if self._key_filter is not None:
+                # again once committed: a build started during the import missed its keys, yet would mark the
+                # filter ready
+                self._key_filter.invalidate()
+        report = progress.report(imported)
+        self._log.info(f'import done : {report}')
+        return report
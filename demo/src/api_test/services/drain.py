@@ -0,0 +1,115 @@
+import math
+import os
+import signal
+import threading
+import time
+from typing import Callable
+
+import gunicorn.workers.base
+import structlog
+from prometheus_client import Gauge, Histogram
+from structlog.typing import FilteringBoundLogger
+
+DRAIN_SECONDS = Histogram(
+        'worker_drain_duration_seconds',
+        'Time from the SIGTERM of a worker to its exit (grace period, in-flight requests and pool close included)',
+        buckets=(0.5, 1, 2, 5, 10, 15, 20, 30, 45, 60, 90, 120),
+)
+DRAIN_UNFINISHED = Gauge(
+        'worker_drain_unfinished_requests',
+        'Requests still running when the worker stopped waiting for them (last drain)',
+        multiprocess_mode='livemax',
+)
+DRAINING = Gauge(
+        'worker_draining',
+        'Number of workers draining before their exit',
+        multiprocess_mode='livesum',
+)
+
+
+class DrainService:
+    """
+    Graceful drain of a worker on SIGTERM (rolling restart).
+
+    The readiness probe answers 503 at once and the worker stops keeping its connections alive (each response closes
+    its connection, an idle one is closed when its keep-alive ends), but it still accepts connections for
+    `grace_period` seconds: the time for the load balancer to see the probe and route elsewhere. Then it stops
+    accepting, gives its running requests up to `timeout` seconds and closes the storage pools on exit. The gunicorn
+    master waits `grace_period + timeout` seconds (its `graceful_timeout`) before killing a worker.
+    """
+    _worker: gunicorn.workers.base.Worker | None
+    _log: FilteringBoundLogger
+
+    def __init__(self, on_drain: Callable[[], None], on_exit: Callable[[], None], grace_period: float = 5.0,
+                 timeout: float = 25.0):
+        """
+        :param on_drain: called when the drain starts (e.g. turn the readiness down)
+        :param on_exit: called when the worker exits (e.g. close the storage pools)
+        :param grace_period: seconds the worker keeps accepting connections once draining (default = 5)
+        :param timeout: seconds given to the running requests once the worker stops accepting (default = 25)
+        """
+        self._log = structlog.get_logger()
+        self._on_drain = on_drain
+        self._on_exit = on_exit
+        self._grace_period = grace_period
+        self._timeout = timeout
+        self._worker = None
+        # monotonic time of the SIGTERM
+        self._started_at = None
+
+    @property
+    def shutdown_timeout(self) -> float:
+        """ :return seconds the gunicorn master must wait for a draining worker before killing it """
+        return self._grace_period + self._timeout
+
+    @property
+    def draining(self) -> bool:
+        return self._started_at is not None
+
+    def install(self, worker: gunicorn.workers.base.Worker) -> None:
+        """
+        take over the SIGTERM of the worker (from the gunicorn `post_worker_init` hook: after the worker signals
+        are set, before its requests are served)
+        """
+        self._worker = worker
+        signal.signal(signal.SIGTERM, self.__handle_term)
+
+    def start(self) -> None:
+        """ start draining the worker, it exits after the grace period and its running requests """
+        if self._started_at is not None:
+            return
+        self._started_at = time.monotonic()
+        DRAINING.inc()
+        self._log.info(f'Draining worker {os.getpid()}: not ready, exiting in {self._grace_period:g}s')
+        self._on_drain()
+        if self._worker is not None:
+            # read by gunicorn for each response: `Connection: close`
+            self._worker.cfg.set('keepalive', 0)
+        timer = threading.Timer(self._grace_period, self.__stop_accepting)
+        timer.daemon = True
+        timer.start()
+
+    def exit(self) -> None:
+        """ release the worker resources (from the gunicorn `worker_exit` hook, in the worker) """
+        unfinished = 0
+        if self._worker is not None:
+            unfinished = sum(1 for future in getattr(self._worker, 'futures', ()) if not future.done())
+        self._on_exit()
+        if self._started_at is not None:
+            seconds = time.monotonic() - self._started_at
+            DRAIN_SECONDS.observe(seconds)
+            DRAIN_UNFINISHED.set(unfinished)
+            DRAINING.dec()
+            self._log.info(f'Worker {os.getpid()} drained in {seconds:.1f}s ({unfinished} request(s) unfinished)')
+
+    def __handle_term(self, _, __) -> None:
+        # signal handler (main thread of the worker, between two polls): keep it short
+        threading.Thread(target=self.start, name='drain', daemon=True).start()
+
+    def __stop_accepting(self) -> None:
+        if self._worker is None:
+            return
+        self._log.debug(f'Worker {os.getpid()} stops accepting, waiting {self._timeout:g}s for its requests')
+        # the worker waits its `graceful_timeout` for the running requests once it leaves its loop
+        self._worker.cfg.set('graceful_timeout', math.ceil(self._timeout))
+        self._worker.alive = False
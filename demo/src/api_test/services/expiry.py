@@ -0,0 +1,93 @@
+import random
+import time
+from threading import Thread
+
+import structlog
+from prometheus_client import Counter, Gauge
+from structlog.typing import FilteringBoundLogger
+
+from ..repositories.backends import MessageBackend
+from ..repositories.errors.repositories_errors import StorageBackendError
+
+REAPED = Counter(
+        'message_expired_reaped_total',
+        'Number of expired messages deleted by the expiry reaper',
+)
+LAG = Gauge(
+        'message_expiry_lag_seconds',
+        'Seconds since the oldest expired message not deleted yet expired',
+        multiprocess_mode='livemax',
+)
+
+
+class ExpiryReaper(Thread):
+    """
+    Expired messages reaper
+
+    Deletes the expired messages (and the expired idempotency keys, the old changes) by small batches, pausing between
+    two batches so the storage never holds long locks nor writes bursts of WAL, and sleeping while there is nothing to
+    delete. Every worker runs one, the postgres backend lets a single one delete at a time.
+    """
+    _backend: MessageBackend
+    _log: FilteringBoundLogger
+    _interrupt: bool
+
+    @property
+    def interrupt(self) -> bool:
+        return self._interrupt
+
+    @interrupt.setter
+    def interrupt(self, value: bool):
+        self._interrupt = value
+
+    def __init__(self, storage_backend: MessageBackend, batch_size: int = 500, batch_pause: float = 0.1,
+                 idle_interval: float = 10.0, change_retention: float = 86400.0):
+        """
+        :param storage_backend: storage of the messages
+        :param batch_size: maximum number of messages deleted by a batch (default = 500)
+        :param batch_pause: seconds between two batches while expired messages remain (default = 0.1)
+        :param idle_interval: seconds between two checks once every expired message is deleted (default = 10)
+        :param change_retention: seconds the changes of the change feed are kept (default = 1 day)
+        """
+        self._log = structlog.get_logger()
+        Thread.__init__(self, daemon=True)
+
+        self._interrupt = False
+        self._backend = storage_backend
+        self._batch_size = batch_size
+        self._batch_pause = batch_pause
+        self._idle_interval = idle_interval
+        self._change_retention = change_retention
+
+    def run(self):
+        self._log.debug('Starting expiry reaper')
+        # workers started together would otherwise reap in lock step
+        time.sleep(random.uniform(0, self._idle_interval))
+        while not self._interrupt:
+            try:
+                reaped = self.reap_batch()
+            except StorageBackendError as err:
+                self._log.warn(f'expiry reaper batch failed : {err}')
+                reaped = 0
+            time.sleep(self._batch_pause if reaped >= self._batch_size else self._idle_interval)
+        self._log.debug('Interruption detected')
+
+    def reap_batch(self) -> int:
+        """
+        delete one batch of expired messages, one of expired idempotency keys and one of old changes, and update the
+        reaper metrics
+        :return: the size of the largest batch
+        :raise StorageBackendError: on storage failure
+        """
+        reaped = self._backend.reap(self._batch_size)
+        if reaped:
+            REAPED.inc(reaped)
+            self._log.debug(f'{reaped} expired message(s) reaped')
+        LAG.set(self._backend.expiry_lag())
+        keys = self._backend.reap_idempotency_keys(self._batch_size)
+        if keys:
+            self._log.debug(f'{keys} expired idempotency key(s) reaped')
+        changes = self._backend.reap_changes(self._batch_size, self._change_retention)
+        if changes:
+            self._log.debug(f'{changes} old change(s) reaped')
+        return max(reaped, keys, changes)
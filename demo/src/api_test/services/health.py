@@ -1,15 +1,13 @@
 import socket
 import time
-from multiprocessing import Manager
 from threading import Thread
 
 import falcon
-import psutil
 import structlog
 from dynaconf import LazySettings
 from structlog.typing import FilteringBoundLogger
 
-from ..adapters.postgres import Postgres
+from ..repositories.backends import MessageBackend
 
 MEMORY = 'memory'
 CPU = 'cpu'
@@ -19,13 +17,17 @@ POSTGRES_POOL = 'postgres_pool'
 OK = 'OK'
 KO = 'KO'
 STATUS = 'status'
+DRAINING = 'draining'
 
 
 class HealthService(Thread):
     """
     Health probe class
+
+    Probes are run by each worker on its own database pool, so their state is kept in plain per-process dicts
+    (manager proxies inherited through a fork would share the manager socket between workers).
     """
-    _dal: Postgres
+    _backend: MessageBackend
     _log: FilteringBoundLogger
     _interrupt: bool
 
@@ -37,18 +39,15 @@ class HealthService(Thread):
     def interrupt(self, value: bool):
         self._interrupt = value
 
-    def __init__(self, data_access_layer: Postgres, settings: LazySettings):
+    def __init__(self, storage_backend: MessageBackend, settings: LazySettings):
         self._log = structlog.get_logger()
-        Thread.__init__(self)
-
-        manager = Manager()
+        Thread.__init__(self, daemon=True)
 
         self._interrupt = False
-        self._dal = data_access_layer
+        self._backend = storage_backend
         self.cpu_limit = settings.monitoring_cpu_limit
         self.memory_limit = settings.monitoring_memory_limit
         self.dns_host = settings.monitoring_dns_lookup
-        self.postgres_host = settings.db_host_name
         self.postgres_pool_limit = settings.monitoring_db_pool_limit
         self.postgres_pool_max = settings.db_pool_max_connection
 
@@ -63,9 +62,12 @@ class HealthService(Thread):
                 POSTGRES_POOL: self.__check_postgres_pool_probe
         }
 
-        self.__probes__ = manager.dict()
-        self.readiness_checks = manager.dict()
-        self.liveness_checks = manager.dict()
+        # set once the worker drains before its exit: not ready whatever the probes
+        self._draining = False
+        self.__probes__ = dict()
+        # not ready / not alive until the first probes are run
+        self.readiness_checks = {STATUS: falcon.HTTP_503}
+        self.liveness_checks = {STATUS: falcon.HTTP_503}
 
     def run(self):
         self._log.debug('Starting health service')
@@ -78,8 +80,14 @@ class HealthService(Thread):
 
     def get_readiness_checks(self) -> dict:
         """ Returns health readiness checks """
+        if self._draining:
+            return {**self.readiness_checks, DRAINING: 'Draining before shutdown', STATUS: falcon.HTTP_503}
         return self.readiness_checks.copy()
 
+    def start_draining(self) -> None:
+        """ report the worker as not ready from now on (see `DrainService`) """
+        self._draining = True
+
     def get_liveness_checks(self) -> dict:
         """ Returns health liveness checks """
         return self.liveness_checks.copy()
@@ -90,6 +98,8 @@ class HealthService(Thread):
         self.__set_liveness_checks__()
 
     def __set_probes__(self):
+        import psutil  # only needed once the probes run (in the workers)
+
         dns_lookup = None
         try:
             dns_lookup = socket.gethostbyname(self.dns_host)
@@ -99,8 +109,9 @@ class HealthService(Thread):
         self.__probes__[MEMORY] = psutil.virtual_memory().percent
         self.__probes__[CPU] = psutil.cpu_percent()
         self.__probes__[DNS] = OK if dns_lookup is not None else KO
-        self.__probes__[POSTGRES] = OK if self._dal.ping_select() else KO
-        self.__probes__[POSTGRES_POOL] = self._dal.get_used_connections()
+        self.__probes__[POSTGRES] = OK if self._backend.ping() else KO
+        # no pool to measure while the database is out of reach (the pool is opened on first use)
+        self.__probes__[POSTGRES_POOL] = self._backend.get_used_connections() if self.__probes__[POSTGRES] == OK else 0
 
     def __set_readiness_checks__(self):
         check_probes(self.readiness_probes, self.readiness_checks)
@@ -0,0 +1,127 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Tuple
+
+import structlog
+from prometheus_client import Counter
+from structlog.typing import FilteringBoundLogger
+
+from ..repositories.backends import IdempotentResponse, MessageBackend
+
+REPLAYED = Counter(
+        'idempotency_replayed_total',
+        'Number of responses replayed for a repeated idempotency key, by source (cache / storage)',
+        ['source'],
+)
+
+# statuses of the responses not kept: the request may succeed once retried (or corrected, for a bad request)
+NOT_STORED_STATUSES: Tuple[str, ...] = ('400', '5')
+
+
+def request_fingerprint(*parts: str) -> str:
+    """ :return the hash of the parts of a request (method, path, canonical body...) """
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class IdempotencyKeyReusedError(Exception):
+    """ An idempotency key comes back with a different request """
+
+
+class IdempotencyService:
+    """
+    Idempotency keys: the first response of a key (status and body) is stored for `ttl` seconds and replayed to the
+    requests repeating the key (client retries), without running them again.
+
+    Responses are looked up in a bounded in-process LRU first, then in the storage, where the first request of a key
+    holds a claim until its response is stored: its concurrent duplicates wait for it instead of running too, for
+    `wait` seconds at most (a retry storm must not hold the threads of the workers), then give up.
+    Server errors (5xx) and rejected requests (400) are not stored, the next request of the key runs again.
+    """
+    _backend: MessageBackend
+    _cache: OrderedDict
+    _log: FilteringBoundLogger
+
+    def __init__(self, storage_backend: MessageBackend, ttl: float = 86400.0, cache_size: int = 10000,
+                 wait: float = 5.0):
+        """
+        :param storage_backend: storage of the idempotency keys
+        :param ttl: seconds a response is kept (default = 1 day)
+        :param cache_size: maximum number of responses kept in the process (default = 10000, 0 = no cache)
+        :param wait: maximum seconds a request waits for the first request of its key still in progress (default = 5)
+        """
+        self._log = structlog.get_logger()
+        self._backend = storage_backend
+        self._ttl = ttl
+        self._wait = wait
+        self._cache_size = cache_size
+        # (response, time.monotonic() of expiry) by idempotency key, least recently used first
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def resize_cache(self, cache_size: int) -> None:
+        """ :param cache_size: maximum number of responses kept in the process, the least recently used go first """
+        with self._cache_lock:
+            self._cache_size = cache_size
+            while len(self._cache) > max(cache_size, 0):
+                self._cache.popitem(last=False)
+
+    def execute(self, key: str, fingerprint: str,
+                call: Callable[[], Tuple[str, str | None]]) -> Tuple[str, str | None, bool]:
+        """
+        run the request of an idempotency key, or replay the response of its first request
+        :param key: idempotency key
+        :param fingerprint: hash of the request (see `request_fingerprint`)
+        :param call: runs the request, :return its status and body
+        :return: tuple of status, body and whether the response is replayed
+        :raise IdempotencyKeyReusedError: if the key was first used by a different request
+        :raise IdempotencyKeyInProgressError: if the first request of the key is still running after the wait
+        :raise StorageBackendError: on storage failure
+        """
+        cached = self.__cached(key)
+        if cached is not None:
+            REPLAYED.labels('cache').inc()
+            return self.__replay(key, cached, fingerprint)
+
+        with self._backend.claim_idempotency_key(key, fingerprint, self._ttl, self._wait) as claim:
+            if claim.response is not None:
+                REPLAYED.labels('storage').inc()
+                self.__cache(key, claim.response)
+                return self.__replay(key, claim.response, fingerprint)
+            status, body = call()
+            if not status.startswith(NOT_STORED_STATUSES):
+                claim.store(IdempotentResponse(fingerprint, status, body))
+        if claim.stored is not None:
+            self.__cache(key, claim.stored)
+        return status, body, False
+
+    @staticmethod
+    def __replay(key: str, response: IdempotentResponse, fingerprint: str) -> Tuple[str, str | None, bool]:
+        if response.fingerprint != fingerprint:
+            raise IdempotencyKeyReusedError(f'the idempotency key {key} was used by a different request')
+        return response.status, response.body, True
+
+    def __cached(self, key: str) -> IdempotentResponse | None:
+        with self._cache_lock:
+            cached = self._cache.get(key)
+            if cached is None:
+                return None
+            if cached[1] <= time.monotonic():
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return cached[0]
+
+    def __cache(self, key: str, response: IdempotentResponse) -> None:
+        if self._cache_size <= 0:
+            return
+        with self._cache_lock:
+            self._cache[key] = (response, time.monotonic() + self._ttl)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
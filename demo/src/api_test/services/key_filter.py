@@ -0,0 +1,100 @@
+import time
+from threading import Thread
+
+import structlog
+from prometheus_client import Gauge
+from structlog.typing import FilteringBoundLogger
+
+from ..commons.bloom_filter import CountingBloomFilter
+from ..repositories.backends import MessageBackend
+from ..repositories.errors.repositories_errors import StorageBackendError
+
+KEYS = Gauge(
+        'message_key_filter_keys',
+        'Approximate number of keys in the key filter',
+        multiprocess_mode='livemax',
+)
+MEMORY = Gauge(
+        'message_key_filter_memory_bytes',
+        'Shared memory used by the key filter (both buffers)',
+        multiprocess_mode='livemax',
+)
+FALSE_POSITIVE_RATE = Gauge(
+        'message_key_filter_false_positive_rate',
+        'False positive rate of the key filter expected for its number of keys',
+        multiprocess_mode='livemax',
+)
+BUILD_SECONDS = Gauge(
+        'message_key_filter_build_seconds',
+        'Duration of the last build of the key filter',
+        multiprocess_mode='livemax',
+)
+
+
+class KeyFilterBuilder(Thread):
+    """
+    Key filter builder
+
+    Builds the key filter from a scan of the storage keys as soon as the worker starts (the filter answers "maybe
+    present" to every key until then), then rebuilds it every `rebuild_interval` seconds, which purges the deleted
+    and expired keys. Every worker runs one: the filter is shared, a single worker builds it at a time.
+    """
+    _backend: MessageBackend
+    _key_filter: CountingBloomFilter
+    _log: FilteringBoundLogger
+    _interrupt: bool
+
+    @property
+    def interrupt(self) -> bool:
+        return self._interrupt
+
+    @interrupt.setter
+    def interrupt(self, value: bool):
+        self._interrupt = value
+
+    def __init__(self, storage_backend: MessageBackend, key_filter: CountingBloomFilter,
+                 rebuild_interval: float = 3600.0, batch_size: int = 10000, check_interval: float = 1.0):
+        """
+        :param storage_backend: storage of the messages
+        :param key_filter: filter shared by the workers
+        :param rebuild_interval: seconds between two builds (default = 1 hour)
+        :param batch_size: number of keys read at once (default = 10000)
+        :param check_interval: seconds between two checks of the filter state (default = 1)
+        """
+        self._log = structlog.get_logger()
+        Thread.__init__(self, daemon=True)
+
+        self._interrupt = False
+        self._backend = storage_backend
+        self._key_filter = key_filter
+        self._rebuild_interval = rebuild_interval
+        self._batch_size = batch_size
+        self._check_interval = check_interval
+
+    def run(self):
+        self._log.debug('Starting key filter builder')
+        MEMORY.set(self._key_filter.memory_bytes)
+        while not self._interrupt:
+            if not self._key_filter.ready or time.time() - self._key_filter.built_at >= self._rebuild_interval:
+                try:
+                    self.build()
+                except StorageBackendError as err:
+                    self._log.warn(f'key filter build failed : {err}')
+            KEYS.set(self._key_filter.keys)
+            FALSE_POSITIVE_RATE.set(self._key_filter.false_positive_rate())
+            time.sleep(self._check_interval)
+        self._log.debug('Interruption detected')
+
+    def build(self) -> bool:
+        """
+        build the filter from a scan of the storage keys
+        :return: False if another worker is building it already
+        :raise StorageBackendError: on storage failure, the filter is left as is
+        """
+        started = time.monotonic()
+        if not self._key_filter.rebuild(self._backend.scan_keys(self._batch_size)):
+            return False
+        seconds = time.monotonic() - started
+        BUILD_SECONDS.set(seconds)
+        self._log.info(f'key filter built : {self._key_filter.keys} key(s) in {seconds:.1f}s')
+        return True
@@ -1,26 +1,39 @@
+import base64
+import binascii
 from typing import Dict, List, Tuple
 
 import structlog
 from structlog.typing import FilteringBoundLogger
 
+from ..repositories.backends import BULK_FAILURES, BulkOperation
 from ..repositories.errors.repositories_errors import (
+    BulkEntityError,
     CreateEntityError,
     DeleteEntityError,
+    FindEntityError,
+    PatchEntityError,
+    SelectEntityError,
     UnknownEntityIdError,
     UpdateEntityError,
 )
 from ..repositories.message import MessageRepository
 
 ENTITY_ALREADY_EXIST: str = 'entity already exist'
+INVALID_CURSOR: str = 'invalid cursor'
 
 
 class MessageService:
     _log: FilteringBoundLogger
     _repo: MessageRepository
 
-    def __init__(self, repository: MessageRepository):
+    def __init__(self, repository: MessageRepository, default_ttl: float | None = None):
+        """
+        :param repository: message repository
+        :param default_ttl: seconds before a message created / updated without time to live expires (None = never)
+        """
         self._log = structlog.get_logger()
         self._repo = repository
+        self._default_ttl = default_ttl
 
     def read(self, key: str) -> Tuple[List[Dict[str, dict]], List[Dict[str, str]]]:
         """
@@ -34,6 +47,64 @@ class MessageService:
         except UnknownEntityIdError as unknown:
             return [], [{'error_code': {'UNKNOWN': 'entity unknown'}, 'error': str(unknown)}]
 
+    def read_many(self, keys: List[str]) -> Tuple[List[Dict[str, dict]], List[str], List[Dict[str, str]]]:
+        """
+        Read Messages by their keys, in a single storage operation
+        :param keys: messages' keys (a repeated key is read once)
+        :return: tuple of data (in the order of the keys), missing keys and error
+        """
+        keys = list(dict.fromkeys(keys))
+        try:
+            found = self._repo.select_many(keys)
+        except SelectEntityError as select:
+            return [], [], [{'error_code': {'SELECT': 'selection error'}, 'error': str(select)}]
+        return [found[key] for key in keys if key in found], [key for key in keys if key not in found], []
+
+    def bulk(self, operations: List[dict],
+             atomic: bool = True) -> Tuple[List[Dict[str, str]], bool, List[Dict[str, str]]]:
+        """
+        Create / update / delete several Messages in a single transaction, each operation on a different key
+        :param operations: `action` (create / update / delete), `key`, `attributes` and `ttl` (create / update)
+        :param atomic: all or nothing (default = True), otherwise the operations that can be applied are
+        :return: tuple of the status of each operation (action, key and status, in order), whether the bulk was
+            aborted (atomic bulk with a failed operation: nothing applied) and error
+        :raise CrossShardBulkError: if the atomic operations span several shards of the storage (nothing applied)
+        """
+        bulk = [BulkOperation(operation['action'], operation['key'], operation.get('attributes'),
+                              operation.get('ttl') or self._default_ttl)
+                for operation in operations]
+        try:
+            statuses = self._repo.bulk(bulk, atomic)
+        except BulkEntityError as bulk_err:
+            return [], False, [{'error_code': {'BULK': 'bulk error'}, 'error': str(bulk_err)}]
+        results = [{'action': operation.action, 'key': operation.key, 'status': status}
+                   for operation, status in zip(bulk, statuses)]
+        return results, atomic and any(status in BULK_FAILURES for status in statuses), []
+
+    def find(self, attributes: dict, limit: int,
+             cursor: str | None = None) -> Tuple[List[Dict[str, dict]], str | None, List[Dict[str, str]]]:
+        """
+        Find the Messages containing the attributes, by pages ordered by key
+        :param attributes: attributes the messages must contain
+        :param limit: maximum number of messages in the page
+        :param cursor: cursor of the page to read (`next_cursor` of the previous page, None for the first page)
+        :return: tuple of data, cursor of the next page (None on the last page) and error
+        """
+        try:
+            after = base64.b64decode(cursor, altchars=b'-_', validate=True).decode('utf-8') if cursor else None
+        except (UnicodeError, binascii.Error, ValueError) as decode:
+            return [], None, [{'error_code': {'CURSOR': INVALID_CURSOR}, 'error': str(decode)}]
+
+        try:
+            # one more message than asked tells whether there is a next page
+            data = self._repo.find(attributes, limit + 1, after)
+        except FindEntityError as find:
+            return [], None, [{'error_code': {'FIND': 'search error'}, 'error': str(find)}]
+        if len(data) <= limit:
+            return data, None, []
+        data = data[:limit]
+        return data, base64.urlsafe_b64encode(data[-1]['key'].encode('utf-8')).decode('ascii'), []
+
     def delete(self, key: str) -> List[Dict[str, str]]:
         """
         Delete a Message by its key
@@ -49,27 +120,45 @@ class MessageService:
             return [{'error_code': {'DELETE': 'deletion error'}, 'error': str(delete)}]
         return []
 
-    def update(self, attributes: dict, key: str) -> List[Dict[str, str]]:
+    def update(self, attributes: dict, key: str, ttl: float | None = None) -> List[Dict[str, str]]:
         """
         Update a Message by its key
         :param key: message's key
         :param attributes: message's attributes
+        :param ttl: seconds before the message expires (None = the default time to live)
         :return: error dict (if its empty, everything works)
         """
         try:
             message = self._repo.select(key)
-            self._repo.update(attributes, message['key'])
+            self._repo.update(attributes, message['key'], ttl or self._default_ttl)
         except UnknownEntityIdError as unknown:
             return [{'error_code': {'UNKNOWN': 'entity unknown'}, 'error': str(unknown)}]
         except UpdateEntityError as update:
             return [{'error_code': {'UPDATE': 'update error'}, 'error': str(update)}]
         return []
 
-    def create(self, attributes: dict, key: str) -> List[Dict[str, str]]:
+    def patch(self, patch: dict, key: str,
+              ttl: float | None = None) -> Tuple[List[Dict[str, dict]], List[Dict[str, str]]]:
+        """
+        Patch the attributes of a Message by its key (json merge patch, applied by the storage in one operation)
+        :param patch: json merge patch of the message's attributes
+        :param key: message's key
+        :param ttl: new seconds before the message expires (None = unchanged)
+        :return: tuple of data (the patched attributes only) and error (if error is not empty, data will be empty)
+        """
+        try:
+            return [self._repo.patch(patch, key, ttl)], []
+        except UnknownEntityIdError as unknown:
+            return [], [{'error_code': {'UNKNOWN': 'entity unknown'}, 'error': str(unknown)}]
+        except PatchEntityError as patch_err:
+            return [], [{'error_code': {'PATCH': 'patch error'}, 'error': str(patch_err)}]
+
+    def create(self, attributes: dict, key: str, ttl: float | None = None) -> List[Dict[str, str]]:
         """
         Create a Message by its key and attributes
         :param key: message's key
         :param attributes: message's attributes
+        :param ttl: seconds before the message expires (None = the default time to live)
         :return: error dict (if its empty, everything works)
         """
         try:
@@ -77,7 +166,7 @@ class MessageService:
             if 'key' in message:
                 return [{'error_code': {'CREATE': ENTITY_ALREADY_EXIST}, 'error': f'message already {key} exist'}]
         except UnknownEntityIdError:
-            self._repo.create(attributes, key)
+            self._repo.create(attributes, key, ttl or self._default_ttl)
         except CreateEntityError as create:
             return [{'error_code': {'CREATE': 'creation error'}, 'error': str(create)}]
         return []
@@ -0,0 +1,263 @@
+import logging
+import multiprocessing
+import threading
+import time
+from threading import Thread
+from typing import Any, Callable, Dict, List, NamedTuple, Tuple
+
+import structlog
+from dynaconf import LazySettings
+from prometheus_client import Counter, Gauge
+from structlog.typing import FilteringBoundLogger
+
+RELOADS = Counter(
+        'config_reloads_total',
+        'Number of reloads of the runtime configuration, by outcome (applied / unchanged / rejected: invalid / '
+        'failed: a change could not be applied, all rolled back)',
+        ['outcome'],
+)
+CHANGES = Counter(
+        'config_changes_total',
+        'Number of settings changed by a reload, by setting and outcome (applied / restart: needs a restart)',
+        ['setting', 'outcome'],
+)
+GENERATION = Gauge(
+        'config_generation',
+        'Generation of the runtime configuration applied by the workers (the highest across workers)',
+        multiprocess_mode='livemax',
+)
+BEHIND = Gauge(
+        'config_workers_behind',
+        'Number of workers that have not applied the last requested generation of the runtime configuration yet',
+        multiprocess_mode='livesum',
+)
+
+
+class ConfigurationError(ValueError):
+    """ The reloaded configuration is invalid, none of its changes is applied """
+
+
+class Tunable(NamedTuple):
+    """ a setting applied to the running components """
+    # converts and checks the value, raises ValueError / TypeError when invalid
+    parse: Callable[[Any], Any]
+    apply: Callable[[Any], None]
+    # value in use at start
+    current: Callable[[], Any]
+
+
+class ReloadReport(NamedTuple):
+    generation: int
+    # (previous value, new value) by setting applied
+    changes: Dict[str, Tuple[Any, Any]]
+    # settings changed that are only read at start
+    restart_required: List[str]
+
+
+def non_negative_int(value: Any) -> int:
+    if isinstance(value, bool) or int(value) != float(value) or int(value) < 0:
+        raise ValueError(f'{value!r} is not a non negative integer')
+    return int(value)
+
+
+def positive_int(value: Any) -> int:
+    if non_negative_int(value) == 0:
+        raise ValueError(f'{value!r} is not a positive integer')
+    return int(value)
+
+
+def non_negative_float(value: Any) -> float:
+    if isinstance(value, bool) or float(value) < 0:
+        raise ValueError(f'{value!r} is not a non negative number')
+    return float(value)
+
+
+def rate(value: Any) -> float:
+    if not 0 <= non_negative_float(value) <= 1:
+        raise ValueError(f'{value!r} is not a rate between 0 and 1')
+    return float(value)
+
+
+def boolean(value: Any) -> bool:
+    if isinstance(value, bool):
+        return value
+    if str(value).lower() in ('true', 'false'):
+        return str(value).lower() == 'true'
+    raise ValueError(f'{value!r} is not a boolean')
+
+
+def log_level(value: Any) -> str:
+    if not isinstance(logging.getLevelName(str(value).upper()), int):
+        raise ValueError(f'{value!r} is not a log level')
+    return str(value).upper()
+
+
+def text(value: Any) -> str:
+    if not isinstance(value, str) or not value:
+        raise ValueError(f'{value!r} is not a non empty string')
+    return value
+
+
+class RuntimeConfigService(Thread):
+    """
+    Live reconfiguration of the running workers.
+
+    A reload (gunicorn master `HUP`, or `POST /_private/_reload` on any worker) bumps a generation shared by the
+    processes forked after the creation of the service. Each worker notices it, reads the configuration file again,
+    checks every tunable setting and only then applies the changed ones: an invalid file changes nothing, and a change
+    failing to apply rolls back those applied before it. The other settings are only read at start, their changes are
+    logged as needing a restart.
+    """
+    _tunables: Dict[str, Tunable]
+    _values: Dict[str, Any]
+    _snapshot: Dict[str, Any]
+    _log: FilteringBoundLogger
+    _interrupt: bool
+
+    @property
+    def interrupt(self) -> bool:
+        return self._interrupt
+
+    @interrupt.setter
+    def interrupt(self, value: bool):
+        self._interrupt = value
+
+    def __init__(self, settings: LazySettings, load_settings: Callable[[], LazySettings],
+                 tunables: Dict[str, Tunable], validate: Callable[[Dict[str, Any]], None] = None,
+                 check_interval: float = 1.0):
+        """
+        :param settings: configuration read at start
+        :param load_settings: reads the configuration again
+        :param tunables: settings applied to the running components, by name (their current values are taken from
+            the components: a value given on the command line is not a change)
+        :param validate: checks the tunable values together (e.g. a minimum below a maximum), raises ValueError
+        :param check_interval: seconds between two checks of the shared generation (default = 1)
+        """
+        self._log = structlog.get_logger()
+        Thread.__init__(self, daemon=True)
+
+        self._interrupt = False
+        self._load_settings = load_settings
+        self._tunables = tunables
+        self._validate = validate
+        self._check_interval = check_interval
+        # created before the workers are forked: they all share it
+        self._generation = multiprocessing.Value('q', 0)
+        self._applied_generation = 0
+        self._lock = threading.Lock()
+        self._values = {name: tunable.current() for name, tunable in tunables.items()}
+        self._snapshot = self.__snapshot(settings)
+
+    @property
+    def generation(self) -> int:
+        return self._generation.value
+
+    def request_reload(self) -> int:
+        """
+        ask every process to reload the configuration
+        :return: the new generation
+        """
+        with self._generation.get_lock():
+            self._generation.value += 1
+            return self._generation.value
+
+    def reload(self) -> ReloadReport:
+        """
+        read the configuration again and apply its changes to the components of this process
+        :return: the applied changes
+        :raise ConfigurationError: if the configuration is invalid, nothing is applied
+        :raise Exception: the error of a change failing to apply, the changes applied before it are rolled back
+        """
+        with self._lock:
+            generation = self._generation.value
+            try:
+                settings = self._load_settings()
+                snapshot = self.__snapshot(settings)
+                values = self.__read(settings)
+            except ConfigurationError as err:
+                # retried on the next reload request only
+                self._applied_generation = generation
+                BEHIND.set(0)
+                RELOADS.labels('rejected').inc()
+                self._log.error(f'configuration reload rejected, nothing applied : {err}')
+                raise
+            changes = {name: (self._values[name], value) for name, value in values.items()
+                       if value != self._values[name]}
+            # the failing change included: it may be partly applied
+            started: List[str] = []
+            try:
+                for name, (_, value) in changes.items():
+                    started.append(name)
+                    self._tunables[name].apply(value)
+            except Exception:
+                self.__roll_back(changes, started)
+                # retried on the next reload request only, the worker stays behind meanwhile
+                self._applied_generation = generation
+                RELOADS.labels('failed').inc()
+                raise
+            for name, (previous, value) in changes.items():
+                CHANGES.labels(name, 'applied').inc()
+                self._log.info(f'configuration reload : {name} {previous!r} -> {value!r}')
+            restart_required = sorted(name for name in snapshot.keys() | self._snapshot.keys()
+                                      if name not in self._tunables
+                                      and snapshot.get(name) != self._snapshot.get(name))
+            for name in restart_required:
+                CHANGES.labels(name, 'restart').inc()
+                self._log.warn(f'configuration reload : {name} changed, applied on the next restart only')
+            self._values, self._snapshot = values, snapshot
+            self._applied_generation = generation
+            GENERATION.set(generation)
+            BEHIND.set(0)
+            RELOADS.labels('applied' if changes else 'unchanged').inc()
+            return ReloadReport(generation, changes, restart_required)
+
+    def run(self):
+        self._log.debug('Starting runtime configuration watcher')
+        GENERATION.set(self._applied_generation)
+        while not self._interrupt:
+            if self._generation.value != self._applied_generation:
+                # back to 0 once applied or rejected: a worker whose reload failed stays behind
+                BEHIND.set(1)
+                try:
+                    self.reload()
+                except ConfigurationError:
+                    # logged by the reload
+                    pass
+                except Exception as err:
+                    # the watcher goes on: the next reload requests are applied
+                    self._log.exception(f'configuration reload failed, nothing applied : {err}')
+            time.sleep(self._check_interval)
+        self._log.debug('Interruption detected')
+
+    def __roll_back(self, changes: Dict[str, Tuple[Any, Any]], started: List[str]) -> None:
+        """ apply again the previous values of the changes already applied, the last one first """
+        for name in reversed(started):
+            previous = changes[name][0]
+            try:
+                self._tunables[name].apply(previous)
+            except Exception as err:
+                self._log.error(f'configuration reload : cannot roll {name} back to {previous!r} : {err}')
+
+    def __read(self, settings: LazySettings) -> Dict[str, Any]:
+        values: Dict[str, Any] = dict()
+        for name, tunable in self._tunables.items():
+            value = settings.get(name)
+            try:
+                # a tunable without value keeps its current one (e.g. the log level of the command line)
+                values[name] = tunable.parse(value) if value is not None else self._values[name]
+            except (ValueError, TypeError) as err:
+                raise ConfigurationError(f'{name} : {err}')
+        if self._validate is not None:
+            try:
+                self._validate(values)
+            except ValueError as err:
+                raise ConfigurationError(str(err))
+        return values
+
+    @staticmethod
+    def __snapshot(settings: LazySettings) -> Dict[str, Any]:
+        try:
+            return {name.lower(): value for name, value in settings.as_dict().items()}
+        except Exception as err:
+            # the file is read here: syntax error, missing file...
+            raise ConfigurationError(f'cannot read the configuration : {err}')
@@ -0,0 +1,118 @@
+import os
+import random
+import time
+from threading import Thread
+from typing import Callable
+
+import structlog
+from prometheus_client import Counter, Gauge
+from structlog.typing import FilteringBoundLogger
+
+RSS = Gauge(
+        'worker_memory_rss_bytes',
+        'Resident memory of the worker, the pages shared with the master and the other workers included',
+        multiprocess_mode='liveall',
+)
+USS = Gauge(
+        'worker_memory_uss_bytes',
+        'Memory of the worker only (freed by its exit): its private pages, copies on write included',
+        multiprocess_mode='liveall',
+)
+PSS = Gauge(
+        'worker_memory_pss_bytes',
+        'Proportional memory of the worker: private pages plus its share of the shared ones (sums to the node usage)',
+        multiprocess_mode='liveall',
+)
+RECYCLES = Counter(
+        'worker_recycles_total',
+        'Number of workers recycled, by reason (rss: resident memory above the limit)',
+        ['reason'],
+)
+
+
+class WorkerMemoryService(Thread):
+    """
+    Worker memory watcher
+
+    Reports the memory of the worker (RSS, USS and PSS: with a preloaded application most of the RSS is shared with
+    the master, the USS is what the worker really costs) and recycles it once its RSS crosses `rss_limit`. The
+    recycle waits a random delay up to `recycle_jitter` seconds, so workers grown alike are not all replaced at once,
+    then ends the worker gracefully: its running requests finish and the gunicorn master forks a fresh one.
+    """
+    _recycle: Callable[[], None]
+    _log: FilteringBoundLogger
+    _interrupt: bool
+
+    @property
+    def interrupt(self) -> bool:
+        return self._interrupt
+
+    @interrupt.setter
+    def interrupt(self, value: bool):
+        self._interrupt = value
+
+    def __init__(self, recycle: Callable[[], None], rss_limit: int = 0, recycle_jitter: float = 30.0,
+                 check_interval: float = 10.0):
+        """
+        :param recycle: ends the worker gracefully
+        :param rss_limit: resident memory (bytes) above which the worker is recycled (default = 0, never)
+        :param recycle_jitter: maximum seconds waited before the recycle (default = 30)
+        :param check_interval: seconds between two memory reports (default = 10)
+        """
+        self._log = structlog.get_logger()
+        Thread.__init__(self, daemon=True)
+
+        self._interrupt = False
+        self._recycle = recycle
+        self._rss_limit = rss_limit
+        self._recycle_jitter = recycle_jitter
+        self._check_interval = check_interval
+        # monotonic time of the scheduled recycle
+        self._recycle_at = None
+
+    @property
+    def rss_limit(self) -> int:
+        return self._rss_limit
+
+    @rss_limit.setter
+    def rss_limit(self, value: int):
+        self._rss_limit = value
+
+    def run(self):
+        import psutil  # only needed once the watcher runs (in the workers)
+
+        self._log.debug('Starting worker memory watcher')
+        process = psutil.Process()
+        while not self._interrupt:
+            try:
+                self.check(process.memory_full_info())
+            except psutil.Error as err:
+                self._log.warn(f'worker memory check failed : {err}')
+            if self._recycle_at is not None:
+                time.sleep(max(0.0, min(self._check_interval, self._recycle_at - time.monotonic())))
+                if time.monotonic() >= self._recycle_at:
+                    self.__recycle()
+                    break
+            else:
+                time.sleep(self._check_interval)
+        self._log.debug('Interruption detected')
+
+    def check(self, memory) -> None:
+        """
+        report the memory of the worker and schedule its recycle when it is above the limit
+        :param memory: `psutil.Process.memory_full_info()` (PSS on linux only)
+        """
+        RSS.set(memory.rss)
+        USS.set(memory.uss)
+        if hasattr(memory, 'pss'):
+            PSS.set(memory.pss)
+        if self._recycle_at is None and self._rss_limit and memory.rss > self._rss_limit:
+            delay = random.uniform(0, self._recycle_jitter)
+            self._recycle_at = time.monotonic() + delay
+            self._log.warn(f'worker {os.getpid()} resident memory {memory.rss >> 20}MB above the limit '
+                           f'{self._rss_limit >> 20}MB (USS {memory.uss >> 20}MB), recycled in {delay:.1f}s')
+
+    def __recycle(self) -> None:
+        RECYCLES.labels('rss').inc()
+        self._log.info(f'Recycling worker {os.getpid()}')
+        self._recycle()
@@ -0,0 +1,43 @@
+import os
+import tempfile
+import unittest
+
+import falcon
+from falcon import testing
+
+from .. import APITest
+from ..adapters.memory import ShardedMemoryStore
+from ..adapters.sqlite import Sqlite
+from ..handlers.message import MERGE_PATCH_MEDIA_TYPE
+from ..repositories.backends import MessageBackend
+from ..repositories.backends.memory import MemoryMessageBackend
+from ..repositories.backends.sqlite import SqliteMessageBackend
+
+CONFIG_FILE: str = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))), 'config.toml')
+
+
+def bare_app() -> falcon.App:
+    """ :return a falcon app with the media handlers of the api, without its middlewares (metrics of the process) """
+    app = falcon.App(middleware=[], media_type=falcon.MEDIA_JSON)
+    app.req_options.media_handlers[MERGE_PATCH_MEDIA_TYPE] = falcon.media.JSONHandler()
+    return app
+
+
+def api_client(backend: MessageBackend) -> testing.TestClient:
+    """ :return a client of the message routes of the api on the storage backend (like the pipeline benchmark) """
+    api = APITest('CRITICAL', CONFIG_FILE, storage_backend=backend)
+    return testing.TestClient(api.add_message_routes(bare_app()))
+
+
+def memory_backend(_: unittest.TestCase) -> MessageBackend:
+    return MemoryMessageBackend(ShardedMemoryStore())
+
+
+def sqlite_backend(test: unittest.TestCase) -> MessageBackend:
+    """ :return a backend on a sqlite database removed at the end of the test """
+    directory = tempfile.TemporaryDirectory()
+    test.addCleanup(directory.cleanup)
+    backend = SqliteMessageBackend(Sqlite(os.path.join(directory.name, 'api-test.sqlite')))
+    test.addCleanup(backend.close)
+    return backend
@@ -0,0 +1,191 @@
+import os
+import signal
+import threading
+import unittest
+from unittest import mock
+
+from .. import APITest
+from ..commons.bloom_filter import CountingBloomFilter
+from .api import CONFIG_FILE, memory_backend
+
+
+class CountingBloomFilterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.filter = CountingBloomFilter(capacity=1000)
+
+    def test_every_key_possibly_present_before_the_first_build(self):
+        self.assertFalse(self.filter.ready)
+        self.assertTrue(self.filter.might_contain('never-added'))
+
+    def test_added_and_removed_keys(self):
+        self.filter.rebuild([['a', 'b']])
+        self.filter.add('c')
+        self.assertTrue(all(self.filter.might_contain(key) for key in ('a', 'b', 'c')))
+        self.filter.remove('c')
+        self.assertFalse(self.filter.might_contain('c'))
+        self.assertEqual(2, self.filter.keys)
+
+    def test_confirm_after_a_build_started_between_add_and_write(self):
+        self.filter.rebuild([[]])
+        ticket = self.filter.add('key')
+        # the scan runs before the write commits: it misses the key
+        self.filter.rebuild([['other']])
+        self.assertFalse(self.filter.might_contain('key'))
+        self.filter.confirm('key', ticket)
+        self.assertTrue(self.filter.might_contain('key'))
+
+    def test_confirm_during_a_build_started_after_add(self):
+        self.filter.rebuild([[]])
+        ticket = self.filter.add('key')
+
+        def batches():
+            yield ['other']
+            # written once the scan went past it
+            self.filter.confirm('key', ticket)
+            yield ['another']
+
+        self.assertTrue(self.filter.rebuild(batches()))
+        self.assertTrue(self.filter.might_contain('key'))
+
+    def test_confirm_without_build_does_not_count_the_key_twice(self):
+        self.filter.rebuild([[]])
+        ticket = self.filter.add('key')
+        self.filter.confirm('key', ticket)
+        self.filter.remove('key')
+        self.assertFalse(self.filter.might_contain('key'))
+
+    def test_add_during_a_build_goes_to_both_buffers(self):
+        self.filter.rebuild([[]])
+
+        def batches():
+            yield ['other']
+            self.filter.add('key')
+            self.assertTrue(self.filter.might_contain('key'))
+            yield []
+
+        self.filter.rebuild(batches())
+        self.assertTrue(self.filter.might_contain('key'))
+
+    def test_remove_of_a_key_never_added(self):
+        self.filter.rebuild([['a', 'b']])
+        self.assertFalse(self.filter.might_contain('ghost'))
+        self.filter.remove('ghost')
+        self.assertEqual(2, self.filter.keys)
+        self.assertTrue(self.filter.might_contain('a'))
+        self.assertTrue(self.filter.might_contain('b'))
+
+    def test_invalidate_during_a_build(self):
+        self.filter.rebuild([['a']])
+
+        def batches():
+            yield ['b']
+            # keys written behind the filter while it scans
+            self.filter.invalidate()
+            yield ['c']
+
+        self.assertTrue(self.filter.rebuild(batches()))
+        self.assertFalse(self.filter.ready)
+        self.assertTrue(self.filter.might_contain('written-behind'))
+        self.filter.rebuild([['a', 'b', 'c']])
+        self.assertTrue(self.filter.ready)
+        self.assertFalse(self.filter.might_contain('written-behind'))
+
+    def test_build_failing_part_way(self):
+        self.filter.rebuild([['a', 'b']])
+        built_at = self.filter.built_at
+
+        def batches():
+            yield ['c', 'd']
+            raise RuntimeError('scan failed')
+
+        with self.assertRaises(RuntimeError):
+            self.filter.rebuild(batches())
+        # the active buffer is left as is
+        self.assertTrue(self.filter.ready)
+        self.assertEqual(2, self.filter.keys)
+        self.assertEqual(built_at, self.filter.built_at)
+        self.assertTrue(self.filter.might_contain('a'))
+        self.assertFalse(self.filter.might_contain('c'))
+        # no build left running: the writes go to the active buffer only, the next build runs
+        self.filter.add('e')
+        self.assertTrue(self.filter.rebuild([['a', 'b', 'c']]))
+        self.assertTrue(self.filter.might_contain('c'))
+        self.assertFalse(self.filter.might_contain('d'))
+        self.assertFalse(self.filter.might_contain('e'))
+
+    def test_false_positive_rate_at_capacity(self):
+        capacity, error_rate = 10000, 0.01
+        bloom = CountingBloomFilter(capacity, error_rate)
+        bloom.rebuild([[f'key-{index}' for index in range(capacity)]])
+        self.assertTrue(all(bloom.might_contain(f'key-{index}') for index in range(capacity)))
+        tries = 20000
+        false_positives = sum(bloom.might_contain(f'absent-{index}') for index in range(tries))
+        self.assertLess(false_positives / tries, 2 * error_rate)
+        self.assertAlmostEqual(error_rate, bloom.false_positive_rate(), delta=error_rate / 2)
+
+
+class KilledBuilderTest(unittest.TestCase):
+    """ a worker killed while building the filter: the others go on """
+
+    def setUp(self):
+        self.filter = CountingBloomFilter(capacity=1000)
+        self.filter.rebuild([['a', 'b']])
+
+    def build_and_die(self, holding_the_lock: bool):
+        pid = os.fork()
+        if pid == 0:
+            def batches():
+                yield ['c']
+                if holding_the_lock:
+                    # killed in the middle of a batch
+                    self.filter._CountingBloomFilter__locked().__enter__()
+                os.kill(os.getpid(), signal.SIGKILL)
+                yield ['d']
+
+            try:
+                self.filter.rebuild(batches())
+            finally:
+                os._exit(1)
+        _, status = os.waitpid(pid, 0)
+        self.assertTrue(os.WIFSIGNALED(status))
+
+    def run_bounded(self, action):
+        """ :return the result of the action, which must not wait for the killed builder """
+        results = []
+        thread = threading.Thread(target=lambda: results.append(action()), daemon=True)
+        thread.start()
+        thread.join(5)
+        self.assertFalse(thread.is_alive(), 'blocked by the lock of the killed builder')
+        return results[0]
+
+    def test_killed_holding_the_lock(self):
+        self.build_and_die(holding_the_lock=True)
+        self.run_bounded(lambda: self.filter.add('e'))
+        # its update may be half done: every key is possibly present until the next build
+        self.assertFalse(self.filter.ready)
+        self.assertTrue(self.filter.might_contain('never-added'))
+        self.assertTrue(self.run_bounded(lambda: self.filter.rebuild([['a', 'b', 'e']])))
+        self.assertTrue(self.filter.ready)
+        self.assertTrue(all(self.filter.might_contain(key) for key in ('a', 'b', 'e')))
+        self.assertFalse(self.filter.might_contain('c'))
+
+    def test_killed_between_batches(self):
+        self.build_and_die(holding_the_lock=False)
+        # its build is left running: the writes go to both buffers, and another worker takes the build over
+        self.run_bounded(lambda: self.filter.add('e'))
+        self.assertTrue(self.filter.ready)
+        self.assertTrue(self.filter.might_contain('e'))
+        self.assertFalse(self.filter.might_contain('c'))
+        self.assertTrue(self.run_bounded(lambda: self.filter.rebuild([['a', 'b']])))
+        self.assertTrue(self.filter.might_contain('a'))
+        self.assertFalse(self.filter.might_contain('e'))
+
+
+class KeyFilterSettingsTest(unittest.TestCase):
+
+    @mock.patch.dict(os.environ, {'API_KEY_FILTER_ENABLED': 'true'})
+    def test_refused_with_the_memory_storage(self):
+        # a store per worker: the build of a worker would answer for the keys of the others
+        with self.assertRaisesRegex(ValueError, 'key_filter_enabled'):
+            APITest('CRITICAL', CONFIG_FILE, storage_backend=memory_backend(self))
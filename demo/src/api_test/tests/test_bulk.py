@@ -0,0 +1,101 @@
+import unittest
+from typing import Callable
+
+from ..handlers.message import BULK_DEFAULT_MAX_OPERATIONS
+from ..repositories.backends import MessageBackend
+from .api import api_client, memory_backend, sqlite_backend
+
+
+def statuses(result) -> list:
+    return [(operation['key'], operation['status']) for operation in result.json['data']]
+
+
+class BulkTest:
+    """ `POST /messages/_bulk`, run against each storage """
+    backend: Callable[[], MessageBackend]
+
+    def setUp(self):
+        self.storage = self.backend()
+        self.storage.migrate()
+        self.client = api_client(self.storage)
+        self.storage.create('existing', {'x': 1})
+        self.storage.create('removed', {'x': 2})
+
+    def post(self, operations: list, **body):
+        return self.client.simulate_post('/messages/_bulk', json={'operations': operations, **body})
+
+    def test_operations_applied(self):
+        result = self.post([{'action': 'create', 'key': 'new', 'attributes': {'y': 1}},
+                            {'action': 'update', 'key': 'existing', 'attributes': {'x': 3}},
+                            {'action': 'delete', 'key': 'removed'}])
+        self.assertEqual(200, result.status_code, result.text)
+        self.assertFalse(result.json['aborted'])
+        self.assertEqual([('new', 'created'), ('existing', 'updated'), ('removed', 'deleted')], statuses(result))
+        self.assertEqual({'y': 1}, self.storage.select('new'))
+        self.assertEqual({'x': 3}, self.storage.select('existing'))
+        self.assertIsNone(self.storage.select('removed'))
+
+    def test_atomic_bulk_aborted(self):
+        result = self.post([{'action': 'create', 'key': 'new', 'attributes': {}},
+                            {'action': 'create', 'key': 'existing', 'attributes': {}},
+                            {'action': 'update', 'key': 'unknown', 'attributes': {}},
+                            {'action': 'delete', 'key': 'removed'}])
+        self.assertEqual(409, result.status_code, result.text)
+        self.assertTrue(result.json['aborted'])
+        # the failed operations tell why, the others were not applied
+        self.assertEqual([('new', 'aborted'), ('existing', 'conflict'), ('unknown', 'not_found'),
+                          ('removed', 'aborted')], statuses(result))
+        self.assertIsNone(self.storage.select('new'))
+        self.assertEqual({'x': 1}, self.storage.select('existing'))
+        self.assertEqual({'x': 2}, self.storage.select('removed'))
+
+    def test_best_effort_bulk(self):
+        result = self.post([{'action': 'create', 'key': 'new', 'attributes': {}},
+                            {'action': 'create', 'key': 'existing', 'attributes': {}},
+                            {'action': 'delete', 'key': 'unknown'},
+                            {'action': 'delete', 'key': 'removed'}], atomic=False)
+        self.assertEqual(200, result.status_code, result.text)
+        self.assertFalse(result.json['aborted'])
+        self.assertEqual([('new', 'created'), ('existing', 'conflict'), ('unknown', 'not_found'),
+                          ('removed', 'deleted')], statuses(result))
+        self.assertEqual({}, self.storage.select('new'))
+        self.assertEqual({'x': 1}, self.storage.select('existing'))
+        self.assertIsNone(self.storage.select('removed'))
+
+    def test_duplicate_key_rejected(self):
+        result = self.post([{'action': 'update', 'key': 'existing', 'attributes': {'x': 3}},
+                            {'action': 'delete', 'key': 'existing'}])
+        self.assertEqual(400, result.status_code, result.text)
+        self.assertIn('already used', result.json['errors'][0]['error'])
+        self.assertEqual({'x': 1}, self.storage.select('existing'))
+
+    def test_max_operations(self):
+        operations = [{'action': 'delete', 'key': f'key-{index}'} for index in range(BULK_DEFAULT_MAX_OPERATIONS)]
+        result = self.post(operations, atomic=False)
+        self.assertEqual(200, result.status_code, result.text)
+        self.assertEqual(BULK_DEFAULT_MAX_OPERATIONS, len(result.json['data']))
+        result = self.post(operations + [{'action': 'delete', 'key': 'existing'}])
+        self.assertEqual(400, result.status_code, result.text)
+        self.assertIn(f'at most {BULK_DEFAULT_MAX_OPERATIONS} operations', result.json['errors'][0]['error'])
+        self.assertEqual({'x': 1}, self.storage.select('existing'))
+
+    def test_invalid_bulk(self):
+        for body in ({'operations': []},
+                     {'operations': 'create'},
+                     {'operations': [{'action': 'delete', 'key': 'existing'}], 'atomic': 'yes'},
+                     {'operations': [{'action': 'upsert', 'key': 'existing'}]},
+                     {'operations': [{'action': 'delete', 'key': ''}]},
+                     {'operations': [{'action': 'create', 'key': 'new', 'attributes': []}]},
+                     {'operations': [{'action': 'create', 'key': 'new', 'attributes': {}, 'ttl': -1}]}):
+            result = self.client.simulate_post('/messages/_bulk', json=body)
+            self.assertEqual(400, result.status_code, body)
+        self.assertEqual({'x': 1}, self.storage.select('existing'))
+        self.assertIsNone(self.storage.select('new'))
+
+
+class MemoryBulkTest(BulkTest, unittest.TestCase):
+    backend = memory_backend
+
+
+class SqliteBulkTest(BulkTest, unittest.TestCase):
+    backend = sqlite_backend
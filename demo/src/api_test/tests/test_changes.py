@@ -0,0 +1,276 @@
+import queue
+import threading
+import time
+import unittest
+from typing import Iterator, List
+from unittest import mock
+
+from falcon import testing
+
+from ..handlers.changes import ChangesHandler
+from ..repositories.backends import Change
+from ..repositories.errors.repositories_errors import StorageBackendError
+from ..services.changes import (
+    ChangeFeedClosedError,
+    ChangeFeedService,
+    ChangeFeedUnavailableError,
+    SubscriberDroppedError,
+    TooManySubscribersError,
+)
+from .api import bare_app
+
+
+def change(seq: int) -> Change:
+    return Change(seq, f'key-{seq}', 'insert', 1000.0 + seq)
+
+
+def seqs(changes: List[Change | None]) -> List[int | None]:
+    return [item.seq if item is not None else None for item in changes]
+
+
+class FakeChangeBackend:
+    """ stands for a storage with a change feed: the test feeds the listener and keeps the changes """
+    name = 'fake'
+    change_feed = True
+
+    def __init__(self):
+        # changes kept by the storage, and those of them committed late (after a change numbered above them)
+        self.kept: List[Change] = []
+        self.late: set = set()
+        # lists of changes notified at once, or an error raised by the listener
+        self.notifications: queue.Queue = queue.Queue()
+        self.listens = 0
+
+    def notify(self, *changes: Change) -> None:
+        self.kept.extend(changes)
+        self.notifications.put(list(changes))
+
+    def listen_changes(self, timeout: float = 1.0) -> Iterator[List[Change]]:
+        self.listens += 1
+        yield []
+        while True:
+            try:
+                item = self.notifications.get(timeout=timeout)
+            except queue.Empty:
+                yield []
+                continue
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+
+    def changes_since(self, seq: int, limit: int, margin: int = 0) -> List[Change]:
+        changes = [kept for kept in self.kept
+                   if kept.seq > seq or (kept.seq in self.late and seq - margin < kept.seq < seq)]
+        return sorted(changes, key=lambda kept: kept.seq)[:limit]
+
+
+class ChangeFeedServiceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = FakeChangeBackend()
+        self.service = ChangeFeedService(self.backend, queue_size=3, max_subscribers=2, heartbeat_interval=0.05,
+                                         page_size=2, retry_interval=0.01, resume_margin=10, listen_timeout=2)
+
+    def wait_for(self, condition) -> None:
+        deadline = time.monotonic() + 5
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
+    def test_live_changes(self):
+        stream = self.service.stream()
+        self.backend.notify(change(1), change(2))
+        self.assertEqual([1, 2], seqs([next(stream), next(stream)]))
+        # a heartbeat without change
+        self.assertIsNone(next(stream))
+        stream.close()
+        self.assertEqual(0, len(self.service._subscriptions))
+
+    def test_resume_reads_the_kept_changes_by_pages_then_follows(self):
+        self.backend.kept = [change(seq) for seq in range(1, 7)]
+        self.backend.late = {2}
+        stream = self.service.stream(since=3)
+        # committed while the kept changes are read: it comes live too, once only
+        self.backend.notify(change(7))
+        self.backend.notify(change(8))
+        # the late change of the margin first, then pages of 2 (the margin only applies to the resumed number)
+        self.assertEqual([2, 4, 5, 6, 7, 8], seqs([next(stream) for _ in range(6)]))
+        self.assertIsNone(next(stream))
+        stream.close()
+
+    def test_slow_subscriber_dropped(self):
+        slow = self.service.stream()
+        self.service.subscribe()
+        self.assertEqual(2, len(self.service._subscriptions))
+        for seq in range(1, 5):
+            self.backend.notify(change(seq))
+        self.wait_for(lambda: len(self.service._subscriptions) == 0)
+        # the changes queued before the drop are lost too: the client resumes from its last change
+        with self.assertRaises(SubscriberDroppedError):
+            next(slow)
+
+    def test_too_many_subscribers(self):
+        self.service.subscribe()
+        self.service.subscribe()
+        with self.assertRaises(TooManySubscribersError):
+            self.service.subscribe()
+
+    def test_storage_without_change_feed(self):
+        self.backend.change_feed = False
+        with self.assertRaises(ChangeFeedUnavailableError):
+            self.service.subscribe()
+
+    def test_listener_error_drops_the_clients_and_listens_again(self):
+        stream = self.service.stream()
+        self.backend.notifications.put(ValueError("invalid literal for int() with base 10: 'x'"))
+        with self.assertRaises(SubscriberDroppedError):
+            while True:
+                next(stream)
+        self.wait_for(lambda: self.backend.listens == 2)
+        stream = self.service.stream()
+        self.backend.notify(change(1))
+        self.assertEqual(1, next(stream).seq)
+        stream.close()
+
+    def test_listener_storage_failure(self):
+        stream = self.service.stream()
+        self.backend.notifications.put(StorageBackendError('connection lost'))
+        with self.assertRaises(SubscriberDroppedError):
+            while True:
+                next(stream)
+        self.wait_for(lambda: self.backend.listens == 2)
+
+    def test_listener_ended_is_started_again(self):
+        self.service.subscribe()
+        # ends the thread (SystemExit is not an Exception)
+        with mock.patch.object(threading, 'excepthook'):
+            self.backend.notifications.put(SystemExit())
+            self.wait_for(lambda: self.service._listener_pid is None)
+        self.service._subscriptions.clear()
+        stream = self.service.stream()
+        self.assertEqual(2, self.backend.listens)
+        self.backend.notify(change(1))
+        self.assertEqual(1, next(stream).seq)
+        stream.close()
+
+    def test_poll_live_changes(self):
+        threading.Timer(0.05, self.backend.notify, (change(1), change(2))).start()
+        self.assertEqual([1, 2], seqs(self.service.poll(None, timeout=5, limit=10)))
+
+    def test_poll_kept_changes_at_once(self):
+        self.backend.kept = [change(seq) for seq in range(1, 6)]
+        self.backend.late = {1}
+        started = time.monotonic()
+        self.assertEqual([1, 4, 5], seqs(self.service.poll(3, timeout=5, limit=10)))
+        self.assertLess(time.monotonic() - started, 1)
+
+    def test_poll_late_changes_only_waits_for_a_later_one(self):
+        # a late change numbered before `since`, nothing after it: answering it would send the client backwards
+        self.backend.kept = [change(1), change(2), change(3)]
+        self.backend.late = {1}
+        started = time.monotonic()
+        self.assertEqual([], self.service.poll(3, timeout=0.2, limit=10))
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+        threading.Timer(0.05, self.backend.notify, (change(4),)).start()
+        self.assertEqual([1, 4], seqs(self.service.poll(3, timeout=5, limit=10)))
+
+    def test_poll_live_late_change_waits_for_a_later_one(self):
+        self.backend.kept = [change(1), change(3)]
+
+        def commit():
+            # committed late: numbered before `since`, then a new change
+            self.backend.notify(change(2))
+            time.sleep(0.05)
+            self.backend.notify(change(4))
+
+        threading.Timer(0.05, commit).start()
+        self.assertEqual([2, 4], seqs(self.service.poll(3, timeout=5, limit=10)))
+
+    def test_poll_limit_keeps_a_change_after_since(self):
+        self.backend.kept = [change(seq) for seq in range(1, 8)]
+        self.backend.late = {1, 2, 3}
+        polled = self.service.poll(4, timeout=5, limit=3)
+        self.assertEqual([1, 2, 5], seqs(polled))
+        self.assertGreater(polled[-1].seq, 4)
+
+    def test_poll_timeout(self):
+        self.assertEqual([], self.service.poll(None, timeout=0.05, limit=10))
+        self.assertEqual(0, len(self.service._subscriptions))
+
+    def test_close_all_ends_the_clients(self):
+        self.service._heartbeat_interval = 5
+        stream = self.service.stream()
+        threading.Timer(0.05, self.service.close_all).start()
+        started = time.monotonic()
+        # woken up while it waits for a change, well before its heartbeat
+        with self.assertRaisesRegex(SubscriberDroppedError, 'shutting down'):
+            next(stream)
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(0, len(self.service._subscriptions))
+        with self.assertRaises(ChangeFeedClosedError):
+            self.service.subscribe()
+
+    def test_close_all_answers_the_polls(self):
+        threading.Timer(0.05, self.service.close_all).start()
+        started = time.monotonic()
+        self.assertEqual([], self.service.poll(None, timeout=5, limit=10))
+        self.assertLess(time.monotonic() - started, 1)
+
+
+class ChangesHandlerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = FakeChangeBackend()
+        self.service = ChangeFeedService(self.backend, max_subscribers=1, heartbeat_interval=0.05)
+        app = bare_app()
+        app.add_route('/messages/_changes', ChangesHandler(self.service))
+        self.client = testing.TestClient(app)
+
+    def get(self, **params):
+        return self.client.simulate_get('/messages/_changes', params={'format': 'ndjson', **params})
+
+    def test_changes(self):
+        self.backend.kept = [change(1), change(2)]
+        result = self.get(since='0')
+        self.assertEqual(200, result.status_code, result.text)
+        self.assertEqual(['{"seq": 1, "key": "key-1", "operation": "insert", "changed_at": 1001.0}',
+                          '{"seq": 2, "key": "key-2", "operation": "insert", "changed_at": 1002.0}'],
+                         result.text.splitlines())
+
+    def test_no_change_before_the_timeout(self):
+        self.assertEqual(204, self.get(timeout='0.05').status_code)
+
+    def test_invalid_parameters(self):
+        for params in ({'since': '-1'}, {'since': 'last'}, {'format': 'xml'}, {'timeout': '61'}, {'limit': '0'},
+                       {'limit': '1001'}):
+            self.assertEqual(400, self.get(**params).status_code, params)
+
+    def test_storage_without_change_feed(self):
+        self.backend.change_feed = False
+        self.assertEqual(501, self.get(timeout='0').status_code)
+
+    def test_too_many_clients(self):
+        self.service.subscribe()
+        result = self.get(timeout='0')
+        self.assertEqual(503, result.status_code)
+        self.assertEqual('5', result.headers['Retry-After'])
+
+    def test_worker_draining(self):
+        self.service.close_all()
+        result = self.get(timeout='0')
+        self.assertEqual(503, result.status_code)
+        self.assertEqual('5', result.headers['Retry-After'])
+
+    def test_sse_stream(self):
+        self.backend.kept = [change(1)]
+        # the simulated request reads the stream to its end: a listener failure drops the client
+        threading.Timer(0.2, self.backend.notifications.put, (StorageBackendError('connection lost'),)).start()
+        result = self.client.simulate_get('/messages/_changes', headers={'Accept': 'text/event-stream',
+                                                                         'Last-Event-ID': '0'})
+        self.assertEqual(200, result.status_code)
+        self.assertEqual('text/event-stream', result.headers['Content-Type'])
+        events = result.text.split('\n\n')
+        self.assertEqual('retry: 1000', events[0])
+        self.assertTrue(events[1].startswith('id: 1\nevent: change\ndata: {"seq": 1'), events[1])
+        self.assertIn(': keep-alive', events)
+        self.assertTrue(events[-2].startswith('event: dropped'), events[-2])
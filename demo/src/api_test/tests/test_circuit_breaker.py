@@ -0,0 +1,229 @@
+import threading
+import time
+import unittest
+from contextlib import ExitStack
+from unittest import mock
+
+from ..commons import circuit_breaker
+from ..commons.circuit_breaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitOpenError,
+)
+from ..commons.singleflight import SingleFlight
+
+
+class FakeClock:
+    """ stands for the `time` module of the circuit breaker """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+class StorageError(Exception):
+    pass
+
+
+def is_failure(error: BaseException) -> bool:
+    return isinstance(error, StorageError)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(circuit_breaker, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        CircuitBreaker.clear_rejection()
+        self.breaker = CircuitBreaker('test', window_size=10, minimum_calls=4, failure_rate_threshold=0.5,
+                                      slow_call_duration=2.0, slow_call_rate_threshold=0.5, open_duration=10.0,
+                                      half_open_probes=2)
+
+    def succeed(self, seconds: float = 0.0, timed: bool = True) -> None:
+        with self.breaker.call(is_failure, timed=timed):
+            self.clock.advance(seconds)
+
+    def fail(self, error: Exception = None) -> None:
+        with self.assertRaises(type(error) if error else StorageError):
+            with self.breaker.call(is_failure):
+                raise error or StorageError('down')
+
+    def open(self) -> None:
+        for _ in range(4):
+            self.fail()
+        self.assertEqual(OPEN, self.breaker.state)
+
+    def test_closed_until_minimum_calls(self):
+        for _ in range(3):
+            self.fail()
+        self.assertEqual(CLOSED, self.breaker.state)
+
+    def test_opens_at_failure_rate(self):
+        self.succeed()
+        self.succeed()
+        self.fail()
+        self.assertEqual(CLOSED, self.breaker.state)
+        self.fail()
+        self.assertEqual(OPEN, self.breaker.state)
+
+    def test_errors_of_the_caller_are_not_failures(self):
+        for _ in range(10):
+            self.fail(ValueError('bad request'))
+        self.assertEqual(CLOSED, self.breaker.state)
+
+    def test_opens_at_slow_call_rate(self):
+        self.succeed()
+        self.succeed()
+        self.succeed(seconds=2.0)
+        self.assertEqual(CLOSED, self.breaker.state)
+        self.succeed(seconds=3.0)
+        self.assertEqual(OPEN, self.breaker.state)
+
+    def test_untimed_calls_are_never_slow(self):
+        for _ in range(10):
+            self.succeed(seconds=5.0, timed=False)
+        self.assertEqual(CLOSED, self.breaker.state)
+
+    def test_window_keeps_the_last_calls(self):
+        for _ in range(6):
+            self.succeed()
+        for _ in range(4):
+            self.fail()
+        self.assertEqual(CLOSED, self.breaker.state)
+        # the oldest success leaves the window: 5 failures out of 10
+        self.fail()
+        self.assertEqual(OPEN, self.breaker.state)
+
+    def test_open_rejects_the_calls(self):
+        self.open()
+        self.clock.advance(4.0)
+        self.assertEqual(6.0, self.breaker.retry_after())
+        with self.assertRaises(CircuitOpenError) as rejected:
+            self.succeed()
+        self.assertEqual(6.0, rejected.exception.retry_after)
+        self.assertIs(rejected.exception, CircuitBreaker.rejection())
+        CircuitBreaker.clear_rejection()
+        self.assertIsNone(CircuitBreaker.rejection())
+
+    def test_rejection_is_kept_per_thread(self):
+        self.open()
+        with self.assertRaises(CircuitOpenError):
+            self.succeed()
+        rejections = []
+        thread = threading.Thread(target=lambda: rejections.append(CircuitBreaker.rejection()))
+        thread.start()
+        thread.join()
+        self.assertEqual([None], rejections)
+
+    def test_half_open_after_open_duration(self):
+        self.open()
+        self.clock.advance(10.0)
+        self.assertEqual(HALF_OPEN, self.breaker.state)
+        self.assertEqual(0.0, self.breaker.retry_after())
+
+    def test_half_open_closes_after_successful_probes(self):
+        self.open()
+        self.clock.advance(10.0)
+        self.succeed()
+        self.assertEqual(HALF_OPEN, self.breaker.state)
+        self.succeed()
+        self.assertEqual(CLOSED, self.breaker.state)
+        # the window starts over: the failures before the opening are gone
+        for _ in range(3):
+            self.fail()
+        self.assertEqual(CLOSED, self.breaker.state)
+
+    def test_half_open_reopens_on_failed_probe(self):
+        self.open()
+        self.clock.advance(10.0)
+        self.succeed()
+        self.fail()
+        self.assertEqual(OPEN, self.breaker.state)
+        self.assertEqual(10.0, self.breaker.retry_after())
+
+    def test_half_open_reopens_on_slow_probe(self):
+        self.open()
+        self.clock.advance(10.0)
+        self.succeed(seconds=2.0)
+        self.assertEqual(OPEN, self.breaker.state)
+
+    def test_half_open_limits_concurrent_probes(self):
+        self.open()
+        self.clock.advance(10.0)
+        with ExitStack() as probes:
+            probes.enter_context(self.breaker.call(is_failure))
+            probes.enter_context(self.breaker.call(is_failure))
+            with self.assertRaises(CircuitOpenError) as rejected:
+                self.succeed()
+            self.assertEqual(1.0, rejected.exception.retry_after)
+        # the probes are done (and succeeded): closed
+        self.assertEqual(CLOSED, self.breaker.state)
+
+    def test_probe_slot_released_by_a_probe_finishing(self):
+        self.open()
+        self.clock.advance(10.0)
+        with ExitStack() as probes:
+            probes.enter_context(self.breaker.call(is_failure))
+            self.succeed()
+            # one probe running, one done: a slot is free again
+            self.succeed()
+        self.assertEqual(CLOSED, self.breaker.state)
+
+    def test_call_started_before_the_opening_does_not_count(self):
+        with self.breaker.call(is_failure):
+            self.open()
+            self.clock.advance(10.0)
+        self.assertEqual(HALF_OPEN, self.breaker.state)
+
+    def test_record_rejection_of_a_chained_error(self):
+        self.open()
+        try:
+            try:
+                self.succeed()
+            except CircuitOpenError:
+                raise StorageError('unavailable')
+        except StorageError as error:
+            chained = error
+        CircuitBreaker.clear_rejection()
+        CircuitBreaker.record_rejection(StorageError('other'))
+        self.assertIsNone(CircuitBreaker.rejection())
+        CircuitBreaker.record_rejection(chained)
+        self.assertIs(chained.__context__, CircuitBreaker.rejection())
+
+    def test_rejection_shared_with_coalesced_callers(self):
+        self.open()
+        waiting = threading.Event()
+        flights = SingleFlight(on_coalesced=waiting.set, on_shared_error=CircuitBreaker.record_rejection)
+
+        def rejected_read():
+            # the coalesced caller waits for this call
+            waiting.wait(5)
+            try:
+                self.succeed()
+            except CircuitOpenError:
+                raise StorageError('unavailable')
+
+        rejections = []
+
+        def coalesced_read():
+            with self.assertRaises(StorageError):
+                flights.do('key', rejected_read)
+            rejections.append(CircuitBreaker.rejection())
+
+        leader = threading.Thread(target=coalesced_read)
+        leader.start()
+        while not flights._flights:
+            time.sleep(0.001)
+        coalesced_read()
+        leader.join()
+        self.assertEqual(2, len(rejections))
+        self.assertTrue(all(isinstance(rejection, CircuitOpenError) for rejection in rejections))
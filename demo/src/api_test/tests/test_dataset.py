@@ -0,0 +1,66 @@
+import json
+import unittest
+from typing import Callable
+from unittest import mock
+
+from falcon import testing
+
+from ..handlers.dataset import ImportHandler
+from ..repositories.backends import MessageBackend
+from ..repositories.errors.repositories_errors import StorageBackendError
+from ..services.dataset import DatasetService
+from .api import bare_app, memory_backend, sqlite_backend
+
+NDJSON_HEADERS: dict = {'Content-Type': 'application/x-ndjson'}
+
+
+def ndjson(*messages: dict) -> bytes:
+    return b''.join(json.dumps(message).encode('utf-8') + b'\n' for message in messages)
+
+
+class ImportTest:
+    """ `POST /_private/_import`, run against each storage """
+    backend: Callable[[], MessageBackend]
+
+    def setUp(self):
+        self.storage = self.backend()
+        self.storage.migrate()
+        app = bare_app()
+        app.add_route('/_private/_import', ImportHandler(DatasetService(self.storage)))
+        self.client = testing.TestClient(app)
+
+    def post(self, body: bytes, upsert: bool = False):
+        return self.client.simulate_post('/_private/_import', body=body, headers=NDJSON_HEADERS,
+                                         params={'upsert': 'true'} if upsert else None)
+
+    def test_import(self):
+        result = self.post(ndjson({'key': 'a', 'attributes': {'x': 1}}, {'key': 'b', 'attributes': {}}))
+        self.assertEqual(200, result.status_code, result.text)
+        self.assertEqual({'x': 1}, self.storage.select('a'))
+        self.assertEqual({}, self.storage.select('b'))
+
+    def test_invalid_line(self):
+        result = self.post(ndjson({'key': 'a', 'attributes': {}}) + b'not json\n')
+        self.assertEqual(400, result.status_code, result.text)
+        self.assertIn('line 2', result.json['errors'][0]['error'])
+
+    def test_existing_key(self):
+        self.storage.create('a', {'x': 1})
+        result = self.post(ndjson({'key': 'a', 'attributes': {'x': 2}}))
+        self.assertEqual(400, result.status_code, result.text)
+        self.assertEqual({'x': 1}, self.storage.select('a'))
+        self.assertEqual(200, self.post(ndjson({'key': 'a', 'attributes': {'x': 2}}), upsert=True).status_code)
+        self.assertEqual({'x': 2}, self.storage.select('a'))
+
+    def test_storage_failure_is_a_server_error(self):
+        with mock.patch.object(self.storage, 'import_ndjson', side_effect=StorageBackendError('database down')):
+            result = self.post(ndjson({'key': 'a', 'attributes': {}}))
+        self.assertEqual(500, result.status_code, result.text)
+
+
+class MemoryImportTest(ImportTest, unittest.TestCase):
+    backend = memory_backend
+
+
+class SqliteImportTest(ImportTest, unittest.TestCase):
+    backend = sqlite_backend
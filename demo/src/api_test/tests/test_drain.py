@@ -0,0 +1,110 @@
+import os
+import signal
+import threading
+import time
+import unittest
+from unittest import mock
+
+from ..services import drain
+from ..services.drain import DrainService
+
+
+class StubConfig:
+    """ stands for the gunicorn settings of a worker """
+
+    def __init__(self):
+        self.settings = {'keepalive': 2, 'graceful_timeout': 30}
+
+    def set(self, name: str, value) -> None:
+        self.settings[name] = value
+
+
+class StubFuture:
+
+    def __init__(self, done: bool):
+        self._done = done
+
+    def done(self) -> bool:
+        return self._done
+
+
+class StubWorker:
+    """ stands for a gunicorn (gthread) worker """
+
+    def __init__(self):
+        self.cfg = StubConfig()
+        self.alive = True
+        self.futures = [StubFuture(True), StubFuture(False), StubFuture(False)]
+
+
+class DrainServiceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = {name: mock.MagicMock() for name in ('DRAIN_SECONDS', 'DRAIN_UNFINISHED', 'DRAINING')}
+        for name, metric in self.metrics.items():
+            patcher = mock.patch.object(drain, name, metric)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.drained, self.exited = threading.Event(), threading.Event()
+        self.worker = StubWorker()
+        self.service = DrainService(self.drained.set, self.exited.set, grace_period=0.1, timeout=2.4)
+
+    def install(self) -> None:
+        handler = signal.getsignal(signal.SIGTERM)
+        self.addCleanup(signal.signal, signal.SIGTERM, handler)
+        self.service.install(self.worker)
+
+    def wait_until_stopped(self) -> None:
+        deadline = time.monotonic() + 5
+        while self.worker.alive and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def test_start(self):
+        self.install()
+        self.service.start()
+        # not ready and no more keep-alive at once, still accepting during the grace period
+        self.assertTrue(self.service.draining)
+        self.assertTrue(self.drained.is_set())
+        self.assertEqual(0, self.worker.cfg.settings['keepalive'])
+        self.assertTrue(self.worker.alive)
+        self.metrics['DRAINING'].inc.assert_called_once_with()
+        self.wait_until_stopped()
+        self.assertFalse(self.worker.alive)
+        # the running requests get the timeout, rounded up to gunicorn's whole seconds
+        self.assertEqual(3, self.worker.cfg.settings['graceful_timeout'])
+
+    def test_started_once(self):
+        self.install()
+        self.service.start()
+        self.service.start()
+        self.metrics['DRAINING'].inc.assert_called_once_with()
+
+    def test_sigterm_starts_the_drain(self):
+        self.install()
+        os.kill(os.getpid(), signal.SIGTERM)
+        self.assertTrue(self.drained.wait(5))
+        self.wait_until_stopped()
+        self.assertFalse(self.worker.alive)
+
+    def test_exit_after_a_drain(self):
+        self.install()
+        self.service.start()
+        self.wait_until_stopped()
+        self.service.exit()
+        self.assertTrue(self.exited.is_set())
+        self.metrics['DRAIN_UNFINISHED'].set.assert_called_once_with(2)
+        self.metrics['DRAINING'].dec.assert_called_once_with()
+        seconds, = self.metrics['DRAIN_SECONDS'].observe.call_args.args
+        self.assertGreaterEqual(seconds, 0.1)
+
+    def test_exit_without_drain(self):
+        self.install()
+        self.service.exit()
+        # e.g. the master stopping the worker with SIGQUIT: resources released, no drain recorded
+        self.assertTrue(self.exited.is_set())
+        self.metrics['DRAIN_SECONDS'].observe.assert_not_called()
+        self.metrics['DRAIN_UNFINISHED'].set.assert_not_called()
+        self.metrics['DRAINING'].dec.assert_not_called()
+
+    def test_shutdown_timeout(self):
+        self.assertEqual(2.5, self.service.shutdown_timeout)
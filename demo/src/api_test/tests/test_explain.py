@@ -0,0 +1,45 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from ..adapters.explain import ExplainSampler, SlowQuery, redact_plan
+
+PLAN: list = [{'Plan': {'Node Type': 'Index Scan', 'Index Cond': "(key = 'secret')"}}]
+
+
+def slow_query(statement: str) -> SlowQuery:
+    return SlowQuery({}, 'main', 'message', statement, 'SELECT 1', None, None, 1.5, 'tracking')
+
+
+class ExplainSamplerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sampler = ExplainSampler(sample_rate=1.0, min_interval=0)
+
+    def wait_for(self, condition) -> None:
+        deadline = time.monotonic() + 5
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
+    def test_unexpected_error_keeps_explaining(self):
+        explain = mock.Mock(side_effect=[TypeError("can't adapt type 'dict'"), (PLAN, 0.1)])
+        with mock.patch.object(ExplainSampler, '_ExplainSampler__explain', explain):
+            self.assertTrue(self.sampler.sample(slow_query('failing')))
+            self.assertTrue(self.sampler.sample(slow_query('explained')))
+            self.wait_for(lambda: len(self.sampler.captured()) == 1)
+        self.assertEqual('explained', self.sampler.captured()[0]['statement'])
+
+    def test_explainer_ended_is_started_again(self):
+        # ends the thread (SystemExit is not an Exception)
+        explain = mock.Mock(side_effect=[SystemExit(), (PLAN, 0.1)])
+        with mock.patch.object(ExplainSampler, '_ExplainSampler__explain', explain), \
+                mock.patch.object(threading, 'excepthook'):
+            self.sampler.sample(slow_query('failing'))
+            self.wait_for(lambda: self.sampler._explainer_pid is None)
+            self.assertTrue(self.sampler.sample(slow_query('explained')))
+            self.wait_for(lambda: len(self.sampler.captured()) == 1)
+
+    def test_redact_plan(self):
+        self.assertEqual([{'Plan': {'Node Type': 'Index Scan', 'Index Cond': '?'}}], redact_plan(PLAN))
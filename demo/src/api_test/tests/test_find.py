@@ -0,0 +1,123 @@
+import unittest
+from typing import Callable
+
+from ..handlers.message import (
+    FIND_MAX_LIMIT,
+    parse_attribute_params,
+    parse_attribute_value,
+)
+from ..repositories.backends import MessageBackend
+from .api import api_client, memory_backend, sqlite_backend
+
+
+class ParseAttributeParamsTest(unittest.TestCase):
+
+    def test_scalars(self):
+        self.assertEqual(5, parse_attribute_value('5'))
+        self.assertEqual(1.5, parse_attribute_value('1.5'))
+        self.assertIs(True, parse_attribute_value('true'))
+        self.assertIsNone(parse_attribute_value('null'))
+        # a quoted value is the string, whatever it looks like
+        self.assertEqual('5', parse_attribute_value('"5"'))
+        self.assertEqual('hello', parse_attribute_value('hello'))
+        # only scalars are searched: an object or array stays the raw string
+        self.assertEqual('{"a": 1}', parse_attribute_value('{"a": 1}'))
+        self.assertEqual('[1]', parse_attribute_value('[1]'))
+
+    def test_nested_attributes_merged(self):
+        params = {'attr.a.b': '1', 'attr.a.c': 'x', 'attr.d': 'true', 'limit': '10', 'cursor': 'abc'}
+        self.assertEqual({'a': {'b': 1, 'c': 'x'}, 'd': True}, parse_attribute_params(params))
+
+    def test_no_attribute(self):
+        self.assertEqual({}, parse_attribute_params({'limit': '10'}))
+
+    def test_repeated_attribute(self):
+        with self.assertRaisesRegex(ValueError, 'repeated'):
+            parse_attribute_params({'attr.a': ['1', '2']})
+
+    def test_conflicting_attributes(self):
+        for params in ({'attr.a': '1', 'attr.a.b': '2'}, {'attr.a.b': '2', 'attr.a': '1'}):
+            with self.assertRaisesRegex(ValueError, 'conflicts'):
+                parse_attribute_params(params)
+
+
+class FindTest:
+    """ `GET /messages?attr.<name>=<value>`, run against each storage """
+    backend: Callable[[], MessageBackend]
+
+    def setUp(self):
+        self.storage = self.backend()
+        self.storage.migrate()
+        self.client = api_client(self.storage)
+        for index in range(7):
+            self.storage.create(f'key-{index}', {'group': 'even' if index % 2 == 0 else 'odd', 'rank': index,
+                                                 'meta': {'tag': 'x', 'flag': index < 3}})
+
+    def find(self, **params):
+        return self.client.simulate_get('/messages', params=params)
+
+    def keys(self, result) -> list:
+        self.assertEqual(200, result.status_code, result.text)
+        return [message['key'] for message in result.json['data']]
+
+    def test_scalar_attributes(self):
+        self.assertEqual(['key-0', 'key-2', 'key-4', 'key-6'], self.keys(self.find(**{'attr.group': 'even'})))
+        self.assertEqual(['key-3'], self.keys(self.find(**{'attr.rank': '3'})))
+        # a quoted number is a string: no message has it
+        self.assertEqual([], self.keys(self.find(**{'attr.rank': '"3"'})))
+
+    def test_nested_attributes(self):
+        self.assertEqual(['key-1'], self.keys(self.find(**{'attr.group': 'odd', 'attr.meta.flag': 'true'})))
+        self.assertEqual(['key-0', 'key-2'], self.keys(self.find(**{'attr.group': 'even', 'attr.meta.tag': 'x',
+                                                                    'attr.meta.flag': 'true'})))
+
+    def test_pages(self):
+        keys, cursor, pages = [], None, 0
+        while True:
+            params = {'attr.meta.tag': 'x', 'limit': '3'}
+            if cursor is not None:
+                params['cursor'] = cursor
+            result = self.find(**params)
+            page = self.keys(result)
+            self.assertLessEqual(len(page), 3)
+            keys.extend(page)
+            pages += 1
+            cursor = result.json['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual([f'key-{index}' for index in range(7)], keys)
+        self.assertEqual(3, pages)
+
+    def test_cursor_skips_the_messages_created_before_it(self):
+        result = self.find(**{'attr.group': 'odd', 'limit': '2'})
+        self.assertEqual(['key-1', 'key-3'], self.keys(result))
+        # keyset paging: a message created before the cursor is not seen, the next ones are
+        self.storage.create('key-0a', {'group': 'odd'})
+        self.storage.create('key-4a', {'group': 'odd'})
+        result = self.find(**{'attr.group': 'odd', 'limit': '2', 'cursor': result.json['next_cursor']})
+        self.assertEqual(['key-4a', 'key-5'], self.keys(result))
+
+    def test_last_page_exactly_full(self):
+        result = self.find(**{'attr.group': 'odd', 'limit': '3'})
+        self.assertEqual(['key-1', 'key-3', 'key-5'], self.keys(result))
+        self.assertIsNone(result.json['next_cursor'])
+
+    def test_limit_bounds(self):
+        self.assertEqual(['key-0'], self.keys(self.find(**{'attr.group': 'even', 'limit': '1'})))
+        self.assertEqual(4, len(self.keys(self.find(**{'attr.group': 'even', 'limit': str(FIND_MAX_LIMIT)}))))
+        for limit in ('0', str(FIND_MAX_LIMIT + 1), '-1', 'ten'):
+            self.assertEqual(400, self.find(**{'attr.group': 'even', 'limit': limit}).status_code, limit)
+
+    def test_invalid_search(self):
+        self.assertEqual(400, self.find(limit='10').status_code)
+        self.assertEqual(400, self.find(**{'attr.group': 'even', 'cursor': 'not a cursor!'}).status_code)
+        self.assertEqual(400, self.client.simulate_get('/messages',
+                                                       query_string='attr.rank=1&attr.rank=2').status_code)
+
+
+class MemoryFindTest(FindTest, unittest.TestCase):
+    backend = memory_backend
+
+
+class SqliteFindTest(FindTest, unittest.TestCase):
+    backend = sqlite_backend
@@ -0,0 +1,116 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from ..adapters.memory import ShardedMemoryStore
+from ..adapters.sqlite import Sqlite
+from ..repositories.backends import IdempotencyKeyInProgressError, IdempotentResponse
+from ..repositories.backends import sqlite as sqlite_backend
+from ..repositories.backends.memory import MemoryMessageBackend
+from ..repositories.backends.sqlite import SqliteMessageBackend
+
+RESPONSE = IdempotentResponse('fingerprint', '201', '{}')
+
+
+class IdempotencyClaimTest:
+    """ claims of the idempotency keys, run against each storage """
+
+    def backend(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.storage = self.backend()
+
+    def test_response_replayed(self):
+        with self.storage.claim_idempotency_key('key', 'fingerprint', 60, wait=1) as claim:
+            self.assertIsNone(claim.response)
+            claim.store(RESPONSE)
+        with self.storage.claim_idempotency_key('key', 'fingerprint', 60, wait=1) as claim:
+            self.assertEqual(RESPONSE, claim.response)
+
+    def test_duplicate_waits_for_the_response(self):
+        claimed, stored = threading.Event(), threading.Event()
+
+        def first_request():
+            with self.storage.claim_idempotency_key('key', 'fingerprint', 60, wait=1) as claim:
+                claimed.set()
+                stored.wait(5)
+                claim.store(RESPONSE)
+
+        thread = threading.Thread(target=first_request)
+        thread.start()
+        claimed.wait(5)
+        threading.Timer(0.05, stored.set).start()
+        with self.storage.claim_idempotency_key('key', 'fingerprint', 60, wait=5) as claim:
+            self.assertEqual(RESPONSE, claim.response)
+        thread.join()
+
+    def test_duplicate_gives_up_after_the_wait(self):
+        claimed, done = threading.Event(), threading.Event()
+
+        def first_request():
+            with self.storage.claim_idempotency_key('key', 'fingerprint', 60, wait=1):
+                claimed.set()
+                done.wait(5)
+
+        thread = threading.Thread(target=first_request)
+        thread.start()
+        claimed.wait(5)
+        started = time.monotonic()
+        try:
+            with self.assertRaises(IdempotencyKeyInProgressError):
+                with self.storage.claim_idempotency_key('key', 'fingerprint', 60, wait=0.1):
+                    pass
+            self.assertLess(time.monotonic() - started, 1.0)
+        finally:
+            done.set()
+            thread.join()
+        # the claim released without response: the next request runs
+        with self.storage.claim_idempotency_key('key', 'fingerprint', 60, wait=0.1) as claim:
+            self.assertIsNone(claim.response)
+
+
+class MemoryIdempotencyClaimTest(IdempotencyClaimTest, unittest.TestCase):
+
+    def backend(self):
+        return MemoryMessageBackend(ShardedMemoryStore())
+
+
+class SqliteIdempotencyClaimTest(IdempotencyClaimTest, unittest.TestCase):
+
+    def backend(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        storage = SqliteMessageBackend(Sqlite(os.path.join(directory.name, 'test.sqlite')))
+        self.addCleanup(storage.close)
+        storage.migrate()
+        return storage
+
+    def test_claim_taken_over_is_not_stored_by_its_first_owner(self):
+        # the lease of the first request runs out while it runs: the second one takes the key over
+        with mock.patch.object(sqlite_backend, 'IDEMPOTENCY_LEASE', 0.0):
+            stale = self.storage.claim_idempotency_key('key', 'fingerprint', 60, wait=1)
+            stale_claim = stale.__enter__()
+        with self.storage.claim_idempotency_key('key', 'fingerprint', 60, wait=1) as claim:
+            self.assertIsNone(claim.response)
+            # the first request ends meanwhile: neither its response nor its release touch the new claim
+            stale_claim.store(IdempotentResponse('fingerprint', '201', '"stale"'))
+            stale.__exit__(None, None, None)
+            claim.store(RESPONSE)
+        with self.storage.claim_idempotency_key('key', 'fingerprint', 60, wait=1) as claim:
+            self.assertEqual(RESPONSE, claim.response)
+
+    def test_release_of_a_claim_taken_over(self):
+        with mock.patch.object(sqlite_backend, 'IDEMPOTENCY_LEASE', 0.0):
+            stale = self.storage.claim_idempotency_key('key', 'fingerprint', 60, wait=1)
+            stale.__enter__()
+        with self.storage.claim_idempotency_key('key', 'fingerprint', 60, wait=1) as claim:
+            stale.__exit__(None, None, None)
+            # the pending claim of the second request is still there: a duplicate waits for it
+            with self.assertRaises(IdempotencyKeyInProgressError):
+                with self.storage.claim_idempotency_key('key', 'fingerprint', 60, wait=0.05):
+                    pass
+            claim.store(RESPONSE)
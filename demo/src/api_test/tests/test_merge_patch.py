@@ -0,0 +1,96 @@
+import unittest
+from typing import Callable
+
+from ..repositories.backends import MessageBackend
+from ..repositories.backends.postgres import merge_patch_expression
+from .api import api_client, memory_backend, sqlite_backend
+
+MERGE_PATCH_HEADERS: dict = {'Content-Type': 'application/merge-patch+json'}
+ATTRIBUTES: dict = {'title': 'hello', 'author': {'given': 'john', 'family': 'doe'}, 'tags': ['a', 'b'], 'count': 1}
+
+
+class MergePatchTest:
+    """ `PATCH /message/{key}`: RFC 7396 merge patch semantics, run against each storage """
+    backend: Callable[[], MessageBackend]
+
+    def setUp(self):
+        self.storage = self.backend()
+        self.storage.migrate()
+        self.client = api_client(self.storage)
+        self.storage.create('key', ATTRIBUTES)
+
+    def patch(self, patch, key: str = 'key'):
+        return self.client.simulate_patch(f'/message/{key}', json=patch, headers=MERGE_PATCH_HEADERS)
+
+    def assertPatched(self, patch, expected: dict):
+        result = self.patch(patch)
+        self.assertEqual(200, result.status_code, result.text)
+        self.assertEqual(expected, self.storage.select('key'))
+        # only the top level attributes of the patch are sent back, a removed one as null
+        self.assertEqual({name: expected.get(name) for name in patch}, result.json['data'][0]['attributes'])
+
+    def test_value_replaced_and_added(self):
+        self.assertPatched({'title': 'goodbye', 'pages': 10}, {**ATTRIBUTES, 'title': 'goodbye', 'pages': 10})
+
+    def test_null_removes_an_attribute(self):
+        expected = dict(ATTRIBUTES)
+        del expected['count']
+        self.assertPatched({'count': None, 'missing': None}, expected)
+
+    def test_nested_objects_merged(self):
+        self.assertPatched({'author': {'family': None, 'middle': {'initial': 'k'}}},
+                           {**ATTRIBUTES, 'author': {'given': 'john', 'middle': {'initial': 'k'}}})
+
+    def test_object_replaces_a_value_that_is_not_an_object(self):
+        # the nulls of the new object are removals too, they are not stored
+        self.assertPatched({'title': {'text': 'hello', 'lang': None}, 'tags': {'first': 'a'}},
+                           {**ATTRIBUTES, 'title': {'text': 'hello'}, 'tags': {'first': 'a'}})
+
+    def test_arrays_replaced(self):
+        self.assertPatched({'tags': ['c']}, {**ATTRIBUTES, 'tags': ['c']})
+
+    def test_empty_patch(self):
+        self.assertPatched({}, ATTRIBUTES)
+
+    def test_patch_that_is_not_an_object_rejected(self):
+        for patch in (['title'], 'title', 1):
+            self.assertEqual(400, self.patch(patch).status_code)
+        self.assertEqual(ATTRIBUTES, self.storage.select('key'))
+
+    def test_unknown_message(self):
+        self.assertEqual(404, self.patch({'title': 'goodbye'}, key='unknown').status_code)
+
+
+class MemoryMergePatchTest(MergePatchTest, unittest.TestCase):
+    backend = memory_backend
+
+
+class SqliteMergePatchTest(MergePatchTest, unittest.TestCase):
+    backend = sqlite_backend
+
+
+class MergePatchExpressionTest(unittest.TestCase):
+    """ jsonb expression of the postgres storage (evaluated by postgres only) """
+
+    def test_removals_then_values(self):
+        params = dict()
+        expression = merge_patch_expression('attributes', {'a': None, 'b': 1, 'c': [1]}, params)
+        self.assertEqual("(((CASE WHEN jsonb_typeof(attributes) = 'object' THEN attributes ELSE '{}'::jsonb END)"
+                         " - %(patch_0)s::text[]) || %(patch_1)s::jsonb)", expression)
+        self.assertEqual({'patch_0': ['a'], 'patch_1': '{"b": 1, "c": [1]}'}, params)
+
+    def test_nested_object_set_from_the_nested_target(self):
+        params = {'key': 'k'}
+        expression = merge_patch_expression('attributes', {'n': {'x': None}}, params)
+        self.assertEqual("jsonb_set((CASE WHEN jsonb_typeof(attributes) = 'object' THEN attributes "
+                         "ELSE '{}'::jsonb END), ARRAY[%(patch_1)s::text], "
+                         "((CASE WHEN jsonb_typeof((attributes -> %(patch_1)s::text)) = 'object' "
+                         "THEN (attributes -> %(patch_1)s::text) ELSE '{}'::jsonb END) - %(patch_2)s::text[]))",
+                         expression)
+        self.assertEqual({'key': 'k', 'patch_1': 'n', 'patch_2': ['x']}, params)
+
+    def test_empty_patch_keeps_the_document(self):
+        params = dict()
+        self.assertEqual("(CASE WHEN jsonb_typeof(attributes) = 'object' THEN attributes ELSE '{}'::jsonb END)",
+                         merge_patch_expression('attributes', {}, params))
+        self.assertEqual({}, params)
@@ -0,0 +1,46 @@
+import io
+import unittest
+from unittest import mock
+
+import psycopg2
+
+from ..adapters import postgres
+from ..adapters.errors.postgres_errors import PostgresQueryError
+from ..adapters.postgres import Postgres
+
+
+class ReaderGoneError(Exception):
+    pass
+
+
+class PostgresCopyOutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = mock.MagicMock()
+        self.conn = self.pool.getconn.return_value
+        self.cursor = self.conn.cursor.return_value.__enter__.return_value
+        patcher = mock.patch.object(postgres, 'ResizablePool', return_value=self.pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.dal = Postgres('localhost', 5432, 'database', 'user', 'password')
+
+    def test_stream_failure_discards_the_connection(self):
+        self.cursor.copy_expert.side_effect = ReaderGoneError('the export reader went away')
+        with self.assertRaises(ReaderGoneError):
+            self.dal.copy_out('message', 'COPY message TO STDOUT', io.BytesIO())
+        # left in the middle of the copy: closed, never rolled back nor pooled again
+        self.conn.rollback.assert_not_called()
+        self.conn.commit.assert_not_called()
+        self.pool.putconn.assert_called_once_with(self.conn, close=True)
+
+    def test_copy_failure_keeps_the_connection(self):
+        self.cursor.copy_expert.side_effect = psycopg2.ProgrammingError('syntax error')
+        with self.assertRaises(PostgresQueryError):
+            self.dal.copy_out('message', 'COPY message TO STDOUT', io.BytesIO())
+        self.conn.rollback.assert_called()
+        self.pool.putconn.assert_called_once_with(self.conn, close=False)
+
+    def test_copy_done(self):
+        self.cursor.rowcount = 3
+        self.assertEqual(3, self.dal.copy_out('message', 'COPY message TO STDOUT', io.BytesIO()))
+        self.pool.putconn.assert_called_once_with(self.conn, close=False)
@@ -0,0 +1,151 @@
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+import unittest
+from functools import partial
+
+from .. import services
+from ..services.runtime_config import (
+    ConfigurationError,
+    RuntimeConfigService,
+    Tunable,
+    positive_int,
+)
+
+# run in a fresh interpreter: prometheus_client reads PROMETHEUS_MULTIPROC_DIR when it is imported
+SCRAPE_AFTER_RELOAD = textwrap.dedent("""
+    import os
+    import sys
+
+    from prometheus_client import CollectorRegistry, generate_latest, multiprocess
+
+    from api_test.services.runtime_config import RuntimeConfigService, Tunable, positive_int
+
+
+    class Settings:
+        def get(self, name):
+            return 2
+
+        def as_dict(self):
+            return {'pool_size': 2}
+
+
+    failures = []
+
+
+    def apply(value):
+        if value == 1:
+            # rolled back to the value at start
+            return
+        if sys.argv[1] == 'recovered' and not failures:
+            # a later reload request of the master, the last check of the worker watcher is the one applying it
+            failures.append(value)
+            service.request_reload()
+            raise RuntimeError('apply failed')
+        # the last check of the worker watcher
+        service.interrupt = True
+        if sys.argv[1] == 'failing':
+            failures.append(value)
+            raise RuntimeError('apply failed')
+
+
+    # the master: it imports the metrics and requests the reloads, never applies one
+    service = RuntimeConfigService(Settings(), Settings, {'pool_size': Tunable(positive_int, apply, lambda: 1)},
+                                   check_interval=0)
+    service.request_reload()
+    service.request_reload()
+    worker = os.fork()
+    if worker == 0:
+        status = 1
+        try:
+            service.run()
+            # the watcher outlives a failed reload
+            status = 0
+        finally:
+            os._exit(status)
+    _, status = os.waitpid(worker, 0)
+    assert os.waitstatus_to_exitcode(status) == 0, 'the worker watcher stopped on a failed reload'
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    print(generate_latest(registry).decode())
+""")
+
+
+class RuntimeConfigMetricsTest(unittest.TestCase):
+
+    def scrape(self, outcome: str) -> str:
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=directory,
+                       PYTHONPATH=os.path.dirname(os.path.dirname(os.path.dirname(services.__file__))))
+            result = subprocess.run([sys.executable, '-c', SCRAPE_AFTER_RELOAD, outcome], env=env,
+                                    capture_output=True, text=True, timeout=60)
+        self.assertEqual(0, result.returncode, result.stderr)
+        return result.stdout
+
+    def test_generation_applied_by_a_worker(self):
+        metrics = self.scrape('applied')
+        self.assertIn('config_generation 2.0', metrics)
+        self.assertIn('config_workers_behind 0.0', metrics)
+        self.assertIn('config_reloads_total{outcome="applied"} 1.0', metrics)
+
+    def test_worker_behind_when_its_reload_fails(self):
+        metrics = self.scrape('failing')
+        self.assertIn('config_generation 0.0', metrics)
+        self.assertIn('config_workers_behind 1.0', metrics)
+        self.assertIn('config_reloads_total{outcome="failed"} 1.0', metrics)
+
+    def test_later_reload_applied_after_a_failed_one(self):
+        metrics = self.scrape('recovered')
+        self.assertIn('config_generation 3.0', metrics)
+        self.assertIn('config_workers_behind 0.0', metrics)
+        self.assertIn('config_reloads_total{outcome="failed"} 1.0', metrics)
+        self.assertIn('config_reloads_total{outcome="applied"} 1.0', metrics)
+
+
+class Settings:
+    """ configuration file read by the reloads """
+
+    def __init__(self, values: dict):
+        self.values = values
+
+    def get(self, name):
+        return self.values.get(name)
+
+    def as_dict(self):
+        return dict(self.values)
+
+
+class RuntimeConfigReloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.settings = Settings({'pool_size': 1, 'cache_size': 10})
+        self.live = {'pool_size': 1, 'cache_size': 10}
+        self.failing = set()
+        tunables = {name: Tunable(positive_int, partial(self.apply, name), partial(self.live.get, name))
+                    for name in self.live}
+        self.service = RuntimeConfigService(self.settings, lambda: self.settings, tunables)
+
+    def apply(self, name: str, value: int) -> None:
+        self.live[name] = value
+        if (name, value) in self.failing:
+            raise RuntimeError(f'cannot apply {name}')
+
+    def test_failed_change_rolls_the_applied_ones_back(self):
+        self.settings.values = {'pool_size': 2, 'cache_size': 20}
+        self.failing.add(('cache_size', 20))
+        with self.assertRaises(RuntimeError):
+            self.service.reload()
+        self.assertEqual({'pool_size': 1, 'cache_size': 10}, self.live)
+        # still changes for the next reload
+        self.failing.clear()
+        report = self.service.reload()
+        self.assertEqual({'pool_size': (1, 2), 'cache_size': (10, 20)}, report.changes)
+        self.assertEqual({'pool_size': 2, 'cache_size': 20}, self.live)
+
+    def test_invalid_configuration_changes_nothing(self):
+        self.settings.values = {'pool_size': 2, 'cache_size': 0}
+        with self.assertRaises(ConfigurationError):
+            self.service.reload()
+        self.assertEqual({'pool_size': 1, 'cache_size': 10}, self.live)
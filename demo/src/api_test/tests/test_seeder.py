@@ -0,0 +1,137 @@
+import io
+import json
+import random
+import struct
+import unittest
+
+from ..adapters.memory import ShardedMemoryStore
+from ..commons.jump_hash import jump_hash, stable_hash
+from ..loadgen.seeder import (
+    BINARY_FORMAT,
+    COPY_BINARY_HEADER,
+    COPY_BINARY_TRAILER,
+    NDJSON_FORMAT,
+    SYMBOLS,
+    TEXT_FORMAT,
+    SeedSpec,
+    encode_row,
+    generate,
+    generate_chunk,
+    parse_size_distribution,
+    seed_key,
+)
+from ..repositories.backends import parse_ndjson_line
+from ..repositories.backends.memory import MemoryMessageBackend
+
+ATTRIBUTES: str = '{"property_1": "abc", "property_2": "d-_"}'
+
+
+def spec(**fields) -> SeedSpec:
+    return SeedSpec(**{'count': 25, 'seed': 42, 'size_distribution': 'uniform:1:40', 'properties': 3,
+                       'chunk_size': 10, 'shards': 1, 'data_format': NDJSON_FORMAT, **fields})
+
+
+def decode_binary_rows(data: bytes) -> list:
+    """ :return the (key, attributes, expiry) of the rows of a COPY binary stream """
+    assert data.startswith(COPY_BINARY_HEADER) and data.endswith(COPY_BINARY_TRAILER)
+    rows, position, end = [], len(COPY_BINARY_HEADER), len(data) - len(COPY_BINARY_TRAILER)
+    while position < end:
+        fields, = struct.unpack_from('!h', data, position)
+        position += 2
+        row = []
+        for _ in range(fields):
+            size, = struct.unpack_from('!i', data, position)
+            position += 4
+            row.append(None if size < 0 else data[position:position + size])
+            position += max(size, 0)
+        rows.append(row)
+    return rows
+
+
+class SizeDistributionTest(unittest.TestCase):
+
+    def test_distributions(self):
+        rng = random.Random(1)
+        self.assertEqual([7] * 5, parse_size_distribution('fixed:7')(rng, 5))
+        self.assertTrue(all(3 <= size <= 5 for size in parse_size_distribution('uniform:3:5')(rng, 100)))
+        self.assertTrue(set(parse_size_distribution('choice:16=0.7,256=0.3')(rng, 100)) <= {16, 256})
+        # sizes are clamped to at least one character
+        self.assertTrue(all(size >= 1 for size in parse_size_distribution('normal:2:10')(rng, 100)))
+        self.assertTrue(all(size >= 1 for size in parse_size_distribution('lognormal:64:1.5')(rng, 100)))
+
+    def test_invalid_distributions(self):
+        for text in ('', 'gaussian:1:2', 'fixed:', 'fixed:ten', 'uniform:10:5', 'normal:1', 'lognormal:0:1',
+                     'choice:16', 'choice:16=heavy'):
+            with self.assertRaisesRegex(ValueError, 'invalid attribute size distribution', msg=text):
+                parse_size_distribution(text)
+
+
+class EncodeRowTest(unittest.TestCase):
+
+    def test_text(self):
+        self.assertEqual(f'key\t{ATTRIBUTES}\t\\N\n'.encode('ascii'), encode_row('key', ATTRIBUTES, TEXT_FORMAT))
+
+    def test_ndjson(self):
+        line = encode_row('key', ATTRIBUTES, NDJSON_FORMAT)
+        self.assertTrue(line.endswith(b'\n'))
+        self.assertEqual(('key', json.loads(ATTRIBUTES), None), parse_ndjson_line(line, 1))
+
+    def test_binary(self):
+        data = COPY_BINARY_HEADER + encode_row('key', ATTRIBUTES, BINARY_FORMAT) + COPY_BINARY_TRAILER
+        # key, jsonb (version 1 then the json text), null expiry
+        self.assertEqual([[b'key', b'\x01' + ATTRIBUTES.encode('ascii'), None]], decode_binary_rows(data))
+
+
+class GenerateChunkTest(unittest.TestCase):
+
+    def test_chunk(self):
+        chunk = generate_chunk(spec(), 2)
+        self.assertEqual([seed_key(42, index) for index in range(20, 25)], chunk.keys)
+        lines = chunk.data[0].splitlines(keepends=True)
+        self.assertEqual(5, len(lines))
+        for key, line in zip(chunk.keys, lines):
+            parsed_key, attributes, expires_at = parse_ndjson_line(line, 1)
+            self.assertEqual(key, parsed_key)
+            self.assertIsNone(expires_at)
+            self.assertEqual(['property_1', 'property_2', 'property_3'], list(attributes))
+            for value in attributes.values():
+                self.assertTrue(1 <= len(value) <= 40)
+                self.assertTrue(set(value.encode('ascii')) <= set(SYMBOLS))
+
+    def test_same_rows_in_every_format(self):
+        ndjson = [parse_ndjson_line(line, 1) for line in generate_chunk(spec(), 0).data[0].splitlines()]
+        text = [line.split(b'\t') for line in generate_chunk(spec(data_format=TEXT_FORMAT), 0).data[0].splitlines()]
+        binary = decode_binary_rows(generate_chunk(spec(data_format=BINARY_FORMAT), 0).data[0])
+        self.assertEqual(len(ndjson), len(text))
+        self.assertEqual(len(ndjson), len(binary))
+        for (key, attributes, _), text_row, binary_row in zip(ndjson, text, binary):
+            self.assertEqual([key.encode('ascii'), json.dumps(attributes).encode('ascii'), b'\\N'], text_row)
+            self.assertEqual([key.encode('ascii'), b'\x01' + json.dumps(attributes).encode('ascii'), None],
+                             binary_row)
+
+    def test_rows_split_by_shard(self):
+        for data_format in (NDJSON_FORMAT, BINARY_FORMAT):
+            chunk = generate_chunk(spec(shards=4, data_format=data_format), 0)
+            self.assertTrue(set(chunk.data) <= set(range(4)))
+            for shard, data in chunk.data.items():
+                keys = ([row[0].decode('ascii') for row in decode_binary_rows(data)] if data_format == BINARY_FORMAT
+                        else [parse_ndjson_line(line, 1)[0] for line in data.splitlines()])
+                self.assertTrue(all(jump_hash(stable_hash(key), 4) == shard for key in keys))
+            self.assertEqual(10, sum(len(decode_binary_rows(data)) if data_format == BINARY_FORMAT
+                                     else len(data.splitlines()) for data in chunk.data.values()))
+
+    def test_reproducible(self):
+        self.assertEqual(generate_chunk(spec(), 1), generate_chunk(spec(), 1))
+        self.assertNotEqual(generate_chunk(spec(), 1).data, generate_chunk(spec(seed=43), 1).data)
+
+    def test_same_output_whatever_the_number_of_processes(self):
+        expected = list(generate(spec(), 1))
+        self.assertEqual(3, len(expected))
+        for processes in (2, 3):
+            self.assertEqual(expected, list(generate(spec(), processes)), processes)
+
+    def test_ndjson_chunks_imported(self):
+        storage = MemoryMessageBackend(ShardedMemoryStore())
+        for chunk in generate(spec(), 2):
+            self.assertEqual(len(chunk.keys), storage.import_ndjson(io.BytesIO(chunk.data[0])))
+        self.assertEqual(25, len(storage.select_many([seed_key(42, index) for index in range(25)])))
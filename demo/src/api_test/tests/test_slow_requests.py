@@ -0,0 +1,76 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from ..commons.slow_requests import SLOW_REQUESTS_FILE_PREFIX, SlowRequestLog
+from ..commons.tracking import RequestTrace
+
+ROUTE: str = '/message/{key}'
+
+
+class SlowRequestLogTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def log(self, window: float) -> SlowRequestLog:
+        return SlowRequestLog(per_route=2, window=window, directory=self.directory, flush_interval=0)
+
+    def record(self, log: SlowRequestLog, tracking_id: str, seconds: float) -> None:
+        log.record(ROUTE, 'GET', '/message/key', '200', RequestTrace(tracking_id), seconds, None, 10)
+
+    def idle_worker(self, log: SlowRequestLog) -> None:
+        """ hand the file of this worker over to another one, which dumps nothing more """
+        log.flush()
+        os.replace(os.path.join(self.directory, f'{SLOW_REQUESTS_FILE_PREFIX}{os.getpid()}.json'),
+                   os.path.join(self.directory, f'{SLOW_REQUESTS_FILE_PREFIX}0.json'))
+
+    @staticmethod
+    def tracking_ids(records: dict) -> list:
+        return [record['tracking_id'] for record in records.get(ROUTE, [])]
+
+    def test_slowest_kept(self):
+        log = self.log(window=60)
+        for tracking_id, seconds in (('a', 0.1), ('b', 0.3), ('c', 0.2)):
+            self.record(log, tracking_id, seconds)
+        self.assertEqual(['b', 'c'], self.tracking_ids(log.records()))
+        self.assertEqual(['b', 'c'], self.tracking_ids(log.merged()))
+
+    def test_workers_merged(self):
+        other = self.log(window=60)
+        self.record(other, 'other', 0.2)
+        self.idle_worker(other)
+        log = self.log(window=60)
+        self.record(log, 'mine', 0.1)
+        self.assertEqual(['other', 'mine'], self.tracking_ids(log.merged()))
+
+    def test_idle_worker_records_leave_after_two_windows(self):
+        other = self.log(window=0.2)
+        self.record(other, 'other', 0.5)
+        self.idle_worker(other)
+        log = self.log(window=0.2)
+        self.record(log, 'mine', 0.1)
+        self.assertEqual(['other', 'mine'], self.tracking_ids(log.merged()))
+        time.sleep(0.45)
+        self.record(log, 'recent', 0.1)
+        self.assertEqual(['recent'], self.tracking_ids(log.merged()))
+
+    def test_expired_window_of_a_file_dropped(self):
+        now = time.time()
+        windows = [{'expires_at': now + 60, 'routes': {ROUTE: [{'tracking_id': 'current', 'duration_ms': 1}]}},
+                   {'expires_at': now - 1, 'routes': {ROUTE: [{'tracking_id': 'expired', 'duration_ms': 2}]}}]
+        with open(os.path.join(self.directory, f'{SLOW_REQUESTS_FILE_PREFIX}0.json'), 'w') as file:
+            json.dump({'windows': windows}, file)
+        self.assertEqual(['current'], self.tracking_ids(self.log(window=60).merged()))
+
+    def test_idle_for_more_than_a_window(self):
+        log = self.log(window=0.1)
+        self.record(log, 'old', 0.5)
+        time.sleep(0.25)
+        # rotated once, on the next request: the window of the old request ended more than a window ago
+        self.record(log, 'recent', 0.1)
+        self.assertEqual(['recent'], self.tracking_ids(log.records()))